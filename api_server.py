@@ -1,16 +1,12 @@
 #Version 1.01
 
-import logging
-
-logging.basicConfig(
-    level=logging.DEBUG, format="%(asctime)s - %(levelname)s - %(message)s"
-)
-from flask import Flask, request, jsonify, send_from_directory, make_response
+from flask import Flask, Response, g, request, jsonify, send_from_directory, make_response
 from flask_cors import CORS
 import subprocess
 import json
 import os
 import sys
+from contextlib import ExitStack
 from pathlib import Path
 import pandas as pd
 import fitz  # Für PDFs
@@ -18,16 +14,24 @@ from docx import Document  # Für Word
 import openpyxl  # Für Excel
 
 # Import from your existing backend
-from scripts.generate_insights import PromptRenderer
-from scripts.api_calls import generate_response
 import scripts.constants as const
-from scripts.utils import load_ifo_data, extract_metrics_from_excel, read_text_file
-from scripts.utils import prepare_chart_data
-from scripts.utils import (
-    extract_text_from_pdf,
-    extract_text_from_docx,
-    extract_text_from_excel,
+from scripts import log, metrics, precompute, profiling, uploads
+from scripts.admission import AdmissionController, AdmissionRejected, client_address, request_lane
+from scripts.analysis import (
+    SEGMENT_MAPPING,
+    iter_analysis,
+    normalize_request,
+    request_key,
+    run_analysis,
 )
+from scripts.analytics import load_analytics
+from scripts.cache import get_cache
+from scripts.cancellation import CancelToken, RequestCancelled, watch_disconnect
+from scripts.singleflight import SingleFlight
+
+# Log records and sampled prompts/responses are written by background threads
+log.setup()
+logger = log.get_logger("api")
 
 app = Flask(__name__)
 
@@ -39,8 +43,66 @@ CORS(
     supports_credentials=True,
 )
 
-# Increase max content length for file uploads
-app.config["MAX_CONTENT_LENGTH"] = 16 * 1024 * 1024  # 16MB
+# Limit a single request body; larger files are sent as chunked uploads
+app.config["MAX_CONTENT_LENGTH"] = const.UPLOAD_MAX_REQUEST_SIZE
+
+inflight_analyses = SingleFlight(const.SINGLEFLIGHT_DIR)
+admission = AdmissionController()
+
+# Builds the default analyses in the background at worker start and on data changes
+precompute.start()
+
+
+def _client_id():
+    """Identify the caller for per-client concurrency caps"""
+    return client_address(request.remote_addr, request.headers.get("X-Forwarded-For"))
+
+
+def _request_lane(data):
+    """Admission lane from X-Request-Priority or the payload; higher lanes need X-Priority-Token"""
+    return request_lane(
+        request.headers.get("X-Request-Priority") or data.get("priority"),
+        request.headers.get("X-Priority-Token"),
+    )
+
+
+def _request_timeout(data):
+    """Deadline in seconds from X-Request-Timeout or the payload, capped by REQUEST_DEADLINE"""
+    value = request.headers.get("X-Request-Timeout") or data.get("timeout")
+    try:
+        timeout = float(value) if value else const.REQUEST_DEADLINE
+    except (TypeError, ValueError):
+        timeout = const.REQUEST_DEADLINE
+    return min(timeout, const.REQUEST_DEADLINE) if timeout > 0 else const.REQUEST_DEADLINE
+
+
+@app.before_request
+def assign_request_id():
+    """Tag log records and stored payloads of this request with X-Request-Id (or a new ID)"""
+    g.request_id = log.new_request_id(request.headers.get("X-Request-Id"))
+
+
+@app.before_request
+def start_profile():
+    """Profile /api/analyze and /api/upload if X-Profile carries the token or the request is sampled"""
+    if profiling.ENABLED and request.path in const.PROFILE_ROUTES:
+        g.profile = profiling.start_request(request.path, request.headers.get("X-Profile"))
+
+
+@app.after_request
+def tag_profile(response):
+    if g.get("request_id"):
+        response.headers["X-Request-Id"] = g.request_id
+    profile = g.get("profile")
+    if profile is not None:
+        profile.status = response.status_code
+        response.headers["X-Profile-Id"] = profile.id
+    return response
+
+
+@app.teardown_request
+def finish_profile(error=None):
+    profiling.finish_request(g.pop("profile", None))
 
 
 # Add a test endpoint to verify CORS is working
@@ -50,13 +112,39 @@ def cors_test():
     return response
 
 
+@app.route("/api/metrics", methods=["GET"])
+def metrics_endpoint():
+    """Prometheus metrics of this worker process"""
+    if request.args.get("format") == "json":
+        return jsonify(
+            {
+                "pid": os.getpid(),
+                "metrics": metrics.snapshot(),
+                "cache": get_cache().stats(),
+                "admission": admission.stats(),
+            }
+        )
+    response = make_response(metrics.render_prometheus())
+    response.headers["Content-Type"] = "text/plain; version=0.0.4"
+    return response
+
+
 @app.route("/")
 def api_root():
     return jsonify(
         {
             "message": "FinAI Backend API",
             "status": "running",
-            "endpoints": ["/api/cors-test", "/api/upload", "/api/analyze"],
+            "endpoints": [
+                "/api/cors-test",
+                "/api/upload",
+                "/api/upload/sessions",
+                "/api/analyze",
+                "/api/analyze/stream",
+                "/api/analytics",
+                "/api/metrics",
+                "/api/profiles",
+            ],
         }
     )
 
@@ -66,327 +154,66 @@ def analyze():
     """Main endpoint to process data from the frontend tool and return analysis"""
     try:
         data = request.json
-        segment = data.get("segment", "FinSum")  # Default to FinSum if not provided
-
-        # Map frontend segment names to backend segment codes
-        segment_mapping = {
-            "Retail": "PB",  # Assuming Retail maps to Private Bank
-            "Corporate": "CB",
-            "Investment": "IB",
-            "Total": "FinSum",
-        }
-
-        # Convert frontend segment name to backend segment code
-        segment_code = segment_mapping.get(segment, "FinSum")
-
-        # Get selected KPIs and convert to macro_kpis format
-        selected_kpis = data.get("kpis", [])
-
-        macro_kpis = []
-        include_ifo = False
-        include_pmi = False
-
-        if "Ifo" in selected_kpis:
-            macro_kpis.append("ifo")
-            include_ifo = True
-        if "PMI" in selected_kpis:
-            macro_kpis.append("pmi")
-            include_pmi = True
-
-        # Get user comments
-        user_comments = data.get("comments", "")
-
-        # Process uploaded files
-        main_documents = data.get("mainDocuments", [])
-        additional_documents = data.get("additionalDocuments", [])
-
-        uploaded_texts = []
-        all_filenames = main_documents + additional_documents
-
-        for filename in all_filenames:
-            if not filename or not isinstance(filename, str):
-                continue
-            path = os.path.join(const.PROJECT_ROOT, "uploads", filename)
-            if os.path.exists(path):
-                try:
-                    if filename.endswith((".txt", ".csv")):
-                        with open(path, "r", encoding="utf-8") as f:
-                            content = f.read()
-
-                    elif filename.endswith(".pdf"):
-                        content = extract_text_from_pdf(path)
-
-                    elif filename.endswith(".docx"):
-                        content = extract_text_from_docx(path)
-
-                    elif filename.endswith(".xlsx"):
-                        content = extract_text_from_excel(path)
-
-                    else:
-                        content = f"[Dateityp {filename} wird nicht unterstützt]"
-
-                    uploaded_texts.append(
-                        f"Inhalt von {filename}:\n{content[:3000]}"
-                    )  # Zeichenlimit pro Datei
-
-                    print(f"Erkannte Datei: {filename}, Textbeginn: {content[:100]}")
-
-                except Exception as e:
-                    print(f"Fehler beim Lesen von {filename}: {e}")
-
-        # Load data based on selection
-        segment_name = const.SEGMENTS[segment_code]
-
-        # Load IFO data if needed
-        df_ifo = None
-        if "ifo" in macro_kpis:
-            try:
-                ifo_path = os.path.join(
-                    const.PROJECT_ROOT, "data", "202504_ifo_gsk_prepared.csv"
-                )
-                df_ifo = load_ifo_data(ifo_path)
-            except Exception as e:
-                print(f"Error loading IFO data: {e}")
-                pass  # Continue without IFO data if loading fails
-
-        # Load PMI data if needed
-        df_pmi = None
-        if "pmi" in macro_kpis:
-            try:
-                pmi_path = os.path.join(
-                    const.PROJECT_ROOT, "data", "global_composite_pmi.csv"
-                )
-                df_pmi = pd.read_csv(pmi_path)
-
-                # Process month strings to dates
-                # Assuming month column is in format like "Jan 2023"
-                df_pmi["Date"] = pd.to_datetime(df_pmi["Month"], format="%m/%Y")
-                df_pmi.set_index("Date", inplace=True)
-
-            except Exception as e:
-                print(f"Error loading PMI data: {e}")
-                # Continue without PMI data if loading fails
-
-        # Set PMI path if needed
-        pmi_pdf_path = None
-        if "pmi" in macro_kpis:
-            pmi_pdf_path = os.path.join(const.PROJECT_ROOT, "data", "202502_pmi.pdf")
-
-        # Load bank data
-        try:
-            excel_path = os.path.join(
-                const.PROJECT_ROOT, "data", "FDS-Q4-2024-13032025.xlsb"
-            )
-            bank_data_all_dict = extract_metrics_from_excel(excel_path)
-
-            # Set default if segment not found
-            if segment_name not in bank_data_all_dict:
-                bank_data_dict = {}
-            else:
-                bank_data_dict = bank_data_all_dict[segment_name]
-        except Exception as e:
-            print(f"Error extracting bank data: {e}")
-            bank_data_all_dict = {}
-            bank_data_dict = {}
-
-        try:
-            example = read_text_file(
-                os.path.join(const.PROJECT_ROOT, "data", "examples.txt")
-            )
-        except Exception as e:
-            print(f"Error reading example text: {e}")
-            example = ""
-
-        df_gross_carrying_amount, df_allowance_for_credit_losses = (
-            extract_asset_quality_metrics(
-                os.path.join(const.PROJECT_ROOT, "data", "FDS-Q4-2024-13032025.xlsb")
+        params = normalize_request(data)
+
+        # Default views (no comments or documents) come from the precomputed snapshot
+        snapshot = precompute.lookup(params)
+        if snapshot is not None:
+            return jsonify(
+                {
+                    "success": True,
+                    "message": "Analysis completed successfully",
+                    "result": snapshot["result"],
+                    "coalesced": False,
+                    "precomputed": True,
+                }
             )
-            if segment == "total_bank"
-            else (None, None)
-        )
-
-        # Prepare context
-        context = {
-            "segment": segment_name,
-            "domain": "Banking",
-            "product_type": "Loans",
-            "bank_data": bank_data_dict,
-            "gross_carrying_amount": df_gross_carrying_amount,
-            "allowance_for_credit_losses": df_allowance_for_credit_losses,
-            "ifo_data": df_ifo.to_string(index=True) if df_ifo is not None else None,
-            "pmi_data": (
-                "Please find the PMI data in the PDF report."
-                if pmi_pdf_path is not None
-                else None
-            ),
-            "user_comments": user_comments,
-            "example": example,
-            "uploaded_documents_text": "\n\n".join(uploaded_texts),
-        }
 
-        context["uploaded_documents_text"] = "\n\n".join(uploaded_texts)
+        lane = _request_lane(data)
+        client = _client_id()
+        token = CancelToken(_request_timeout(data))
 
-        # Generate response
-        try:
-            renderer = PromptRenderer(template_dir=Path("prompts"))
-            prompt = renderer.render_instruction_prompt(context)
-            print("\n--- FINALER PROMPT ---")
-            print(prompt)
-            ai_response = generate_response(prompt, pmi_pdf_path)
-        except Exception as e:
-            ai_response = f"Error generating analysis: {str(e)}"
+        def admitted_analysis(shared_token):
+            with admission.admit(lane=lane, client=client, token=shared_token):
+                return run_analysis(params, token=shared_token)
 
-        # Generate chart data for provision_for_credit_losses_bps_avg_loans
-        try:
-            chart_data = prepare_chart_data(
-                bank_data_all_dict,
-                segment_name,
-                "provision_for_credit_losses_bps_avg_loans",
-                df_ifo=df_ifo,
-                include_ifo=include_ifo,
+        # Identical concurrent requests share one computation (and one admission slot);
+        # it is abandoned only once all of them disconnected or ran out of time
+        with watch_disconnect(request.environ, token):
+            analysis_result, coalesced = inflight_analyses.do(
+                request_key(params), admitted_analysis, token=token
             )
-        except Exception as e:
-            print(f"Error preparing IFO chart: {e}")
-            # Provide a minimal fallback chart structure
-            chart_data = {
-                "labels": [],
-                "datasets": [
-                    {
-                        "label": "Provision for Credit Losses (bps of Avg Loans)",
-                        "data": [],
-                        "borderColor": "#4285F4",
-                        "backgroundColor": "rgba(66, 133, 244, 0.2)",
-                    }
-                ],
-            }
-
-        # Prepare PMI chart data with the same time periods as the main chart
-        pmi_chart_data = None
-        if include_pmi and df_pmi is not None:
-            try:
-                # Use the same periods from the main chart
-                periods = chart_data.get("labels", [])
-
-                # Create PMI chart dataset
-                pmi_values = []
-
-                for period in periods:
-                    try:
-                        period_str = str(period).strip().upper()
-
-                        # Extract year and quarter
-                        if "FY" in period_str:
-                            # Handle fiscal year format
-                            year_str = (
-                                period_str.replace("FY", "").replace("_", "").strip()
-                            )
-                            year = int(year_str)
-
-                            # Get average PMI value for the year
-                            yearly_pmi = df_pmi[df_pmi.index.year == year][
-                                "Composite_PMI"
-                            ].mean()
-                            pmi_values.append(
-                                float(yearly_pmi) if not pd.isna(yearly_pmi) else None
-                            )
-
-                        elif "Q" in period_str:
-                            # Handle quarterly format
-                            if "_" in period_str:
-                                parts = period_str.split("_")
-                                quarter_part = parts[0] if len(parts) > 0 else ""
-                                year_part = parts[1] if len(parts) > 1 else ""
-                            else:
-                                # Extract using character types
-                                quarter_part = "".join(
-                                    [
-                                        c
-                                        for c in period_str
-                                        if c.isalpha() or c.isspace()
-                                    ]
-                                )
-                                year_part = "".join(
-                                    [c for c in period_str if c.isdigit()]
-                                )
-
-                            quarter = int(quarter_part.replace("Q", ""))
-                            year = int(year_part)
-
-                            # Calculate months for this quarter
-                            start_month = (quarter - 1) * 3 + 1
-                            end_month = quarter * 3
-
-                            # Filter PMI data for this quarter
-                            quarter_pmi = df_pmi[
-                                (df_pmi.index.year == year)
-                                & (df_pmi.index.month >= start_month)
-                                & (df_pmi.index.month <= end_month)
-                            ]["Composite_PMI"].mean()
-
-                            pmi_values.append(
-                                float(quarter_pmi) if not pd.isna(quarter_pmi) else None
-                            )
-                        else:
-                            pmi_values.append(None)
-
-                    except Exception as e:
-                        print(f"Error processing PMI value for period {period}: {e}")
-                        pmi_values.append(None)
-
-                # Create PMI chart data structure
-                pmi_chart_data = {
-                    "labels": periods,
-                    "datasets": [
-                        {
-                            "label": "Provision for Credit Losses (bps of Avg Loans)",
-                            "data": chart_data["datasets"][0][
-                                "data"
-                            ],  # kopiere aus Hauptchart
-                            "borderColor": "#4285F4",
-                            "backgroundColor": "rgba(66, 133, 244, 0.2)",
-                        },
-                        {
-                            "label": "Global Composite PMI",
-                            "data": pmi_values,
-                            "borderColor": "#EA4335",
-                            "backgroundColor": "rgba(234, 67, 53, 0.2)",
-                            "yAxisID": "y1",
-                        },
-                    ],
-                }
-
-            except Exception as e:
-                print(f"Error preparing PMI chart: {e}")
-                pmi_chart_data = None
-
-        # Process the response into an easy-to-use format for the frontend
-        analysis_result = {
-            "variance_analysis": {"title": "Variance Analysis", "content": ai_response},
-            "trend_analysis": {
-                "title": "Trend Analysis",
-                "summary": "The AI has analyzed trends based on the provided data and macro indicators.",
-            },
-            "chart": chart_data,  # IFO and PCL chart data
-            "pmi_chart": pmi_chart_data,  # Add PMI chart data to the response
-            "ifo_chart": include_ifo,  # Flag to indicate IFO was selected
-            "pmi_chart_selected": include_pmi,  # Flag to indicate PMI was selected
-        }
 
         response = jsonify(
             {
                 "success": True,
                 "message": "Analysis completed successfully",
                 "result": analysis_result,
+                "coalesced": coalesced,
+                "precomputed": False,
             }
         )
         return response
 
+    except AdmissionRejected as e:
+        response = jsonify({"success": False, "message": str(e), "reason": e.reason})
+        response.headers["Retry-After"] = str(e.retry_after)
+        return response, 429
+
+    except RequestCancelled as e:
+        # 499 follows the nginx convention for requests closed by the client
+        logger.info("Analysis stopped: %s", e)
+        status = 504 if e.reason == "deadline" else 499
+        response = jsonify(
+            {"success": False, "message": str(e), "reason": e.reason, "stage": e.stage}
+        )
+        return response, status
+
     except Exception as e:
         import traceback
 
         error_traceback = traceback.format_exc()
-        print("❌ Fehler im /api/analyze-Endpunkt:")
-        print(error_traceback)
+        logger.error("❌ Fehler im /api/analyze-Endpunkt:\n%s", error_traceback)
 
         response = jsonify(
             {
@@ -398,11 +225,152 @@ def analyze():
         return response, 500
 
 
+@app.route("/api/analyze/stream", methods=["POST"])
+def analyze_stream():
+    """
+    Same analysis as /api/analyze, streamed as NDJSON: the charts first, then each
+    section of the commentary as soon as it is generated, then the full result
+    """
+    # Held until the streamed response is closed
+    resources = ExitStack()
+    try:
+        data = request.json
+        params = normalize_request(data)
+        token = CancelToken(_request_timeout(data))
+
+        # Admission happens before streaming starts so rejections are still a 429
+        resources.enter_context(
+            admission.admit(lane=_request_lane(data), client=_client_id(), token=token)
+        )
+        resources.enter_context(watch_disconnect(request.environ, token))
+
+    except AdmissionRejected as e:
+        response = jsonify({"success": False, "message": str(e), "reason": e.reason})
+        response.headers["Retry-After"] = str(e.retry_after)
+        return response, 429
+
+    except RequestCancelled as e:
+        status = 504 if e.reason == "deadline" else 499
+        response = jsonify({"success": False, "message": str(e), "reason": e.reason})
+        return response, status
+
+    except Exception as e:
+        resources.close()
+        response = jsonify(
+            {"success": False, "message": f"Error processing request: {str(e)}"}
+        )
+        return response, 500
+
+    state = {"finished": False}
+
+    def events():
+        try:
+            for event in iter_analysis(params, token):
+                yield app.json.dumps(event) + "\n"
+        except RequestCancelled as e:
+            logger.info("Analysis stream stopped: %s", e)
+            yield app.json.dumps(
+                {"event": "error", "message": str(e), "reason": e.reason, "stage": e.stage}
+            ) + "\n"
+        except Exception as e:
+            logger.exception("❌ Fehler im /api/analyze/stream-Endpunkt: %s", e)
+            yield app.json.dumps(
+                {"event": "error", "message": f"Error processing request: {str(e)}"}
+            ) + "\n"
+        state["finished"] = True
+
+    def close():
+        # Runs when the response is closed, also if the client went away mid-stream
+        if not state["finished"]:
+            token.cancel("disconnected")
+        resources.close()
+
+    response = Response(events(), mimetype="application/x-ndjson")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"  # Let proxies pass lines through
+    response.call_on_close(close)
+    return response
+
+
+@app.route("/api/analytics", methods=["GET"])
+def analytics_endpoint():
+    """Lead-lag correlations, turning points and threshold crossings of bank KPIs and macro indicators"""
+    try:
+        result = load_analytics()
+
+        # Optional ?segment= filter, accepts frontend names (Corporate) and codes (CB)
+        segment = request.args.get("segment")
+        if segment:
+            code = SEGMENT_MAPPING.get(segment, segment)
+            segment_name = const.SEGMENTS.get(code, code)
+            if segment_name not in result["correlations"]:
+                response = jsonify({"success": False, "message": f"Unknown segment: {segment}"})
+                return response, 404
+            result = {
+                **result,
+                "correlations": {segment_name: result["correlations"][segment_name]},
+                "turning_points": {
+                    "bank": {
+                        segment_name: result["turning_points"]["bank"].get(segment_name, {})
+                    },
+                    "macro": result["turning_points"]["macro"],
+                },
+            }
+
+        response = jsonify({"success": True, "analytics": result})
+        return response
+
+    except Exception as e:
+        response = jsonify(
+            {"success": False, "message": f"Error computing analytics: {str(e)}"}
+        )
+        return response, 500
+
+
+@app.route("/api/profiles", methods=["GET"])
+def list_profiles():
+    """Stored request profiles of this node, newest first"""
+    if not profiling.authorized(request.headers.get("X-Profile")):
+        return jsonify({"success": False, "message": "Profiling token required"}), 403
+    return jsonify({"success": True, "profiles": profiling.list_profiles()})
+
+
+@app.route("/api/profiles/<profile_id>", methods=["GET"])
+def get_profile(profile_id):
+    """Stage timings and allocations of a profile; ?format=folded returns the stack samples for flame graphs"""
+    if not profiling.authorized(request.headers.get("X-Profile")):
+        return jsonify({"success": False, "message": "Profiling token required"}), 403
+    if request.args.get("format") == "folded":
+        folded = profiling.load_folded(profile_id)
+        if folded is not None:
+            response = make_response(folded)
+            response.headers["Content-Type"] = "text/plain; charset=utf-8"
+            return response
+    else:
+        summary = profiling.load_profile(profile_id)
+        if summary is not None:
+            return jsonify({"success": True, "profile": summary})
+    return jsonify({"success": False, "message": f"Unknown profile: {profile_id}"}), 404
+
+
 @app.route("/api/upload", methods=["POST"])
 def upload_file():
     """Endpoint to handle file uploads"""
 
     try:
+        # Reject oversize bodies before the form data is parsed
+        if (
+            request.content_length is not None
+            and request.content_length > const.UPLOAD_MAX_REQUEST_SIZE
+        ):
+            response = jsonify(
+                {
+                    "success": False,
+                    "message": "File too large, use /api/upload/sessions for chunked uploads",
+                }
+            )
+            return response, 413
+
         if "file" not in request.files:
             response = jsonify({"success": False, "message": "No file part"})
             return response, 400
@@ -412,24 +380,28 @@ def upload_file():
             response = jsonify({"success": False, "message": "No selected file"})
             return response, 400
 
-        # Create upload directory if it doesn't exist
-        upload_dir = os.path.join(const.PROJECT_ROOT, "uploads")
-        os.makedirs(upload_dir, exist_ok=True)
-
-        # Save the file
-        file_path = os.path.join(upload_dir, file.filename)
-        file.save(file_path)
+        # Stream to disk under the content hash; identical files are stored once
+        with profiling.stage("store"):
+            stored = uploads.store_stream(file.stream, file.filename)
 
         response = jsonify(
             {
                 "success": True,
                 "message": "File uploaded successfully",
-                "filename": file.filename,
-                "path": file_path,
+                "filename": stored["filename"],
+                "storedName": stored["stored_name"],
+                "sha256": stored["sha256"],
+                "size": stored["size"],
+                "deduplicated": stored["deduplicated"],
+                "path": stored["path"],
             }
         )
         return response
 
+    except uploads.UploadError as e:
+        response = jsonify({"success": False, "message": str(e)})
+        return response, e.status
+
     except Exception as e:
         response = jsonify(
             {"success": False, "message": f"Error uploading file: {str(e)}"}
@@ -437,5 +409,99 @@ def upload_file():
         return response, 500
 
 
+def _upload_session_response(session, status=200):
+    """Serialize chunked upload state for the client"""
+    payload = {
+        "success": True,
+        "uploadId": session["upload_id"],
+        "filename": session["filename"],
+        "size": session["size"],
+        "offset": session["offset"],
+        "chunkSize": session.get("chunk_size", const.UPLOAD_CHUNK_SIZE),
+        "complete": session.get("complete", False),
+    }
+    if payload["complete"]:
+        payload.update(
+            {
+                "message": "File uploaded successfully",
+                "storedName": session["stored_name"],
+                "sha256": session["sha256"],
+                "deduplicated": session["deduplicated"],
+                "path": session["path"],
+            }
+        )
+    response = jsonify(payload)
+    response.headers["Upload-Offset"] = str(session["offset"])
+    return response, status
+
+
+def _upload_error_response(error):
+    payload = {"success": False, "message": str(error)}
+    if error.offset is not None:
+        payload["offset"] = error.offset
+    response = jsonify(payload)
+    if error.offset is not None:
+        response.headers["Upload-Offset"] = str(error.offset)
+    return response, error.status
+
+
+@app.route("/api/upload/sessions", methods=["POST"])
+def create_upload_session():
+    """Start a chunked, resumable upload. Body: {"filename", "size", "sha256"?}"""
+    try:
+        data = request.get_json(silent=True) or {}
+        session = uploads.create_session(
+            data.get("filename", ""), data.get("size"), data.get("sha256")
+        )
+        return _upload_session_response(session, 201)
+
+    except uploads.UploadError as e:
+        return _upload_error_response(e)
+
+    except Exception as e:
+        response = jsonify(
+            {"success": False, "message": f"Error creating upload: {str(e)}"}
+        )
+        return response, 500
+
+
+@app.route("/api/upload/sessions/<upload_id>", methods=["GET", "PUT", "DELETE"])
+def upload_session(upload_id):
+    """
+    GET returns the offset to resume from, PUT appends the raw request body at
+    the offset given in the Upload-Offset header, DELETE aborts the upload.
+    The file is stored once the last chunk has been received.
+    """
+    try:
+        if request.method == "GET":
+            return _upload_session_response(uploads.get_session(upload_id))
+
+        if request.method == "DELETE":
+            uploads.abort_session(upload_id)
+            return jsonify({"success": True, "message": "Upload aborted"})
+
+        try:
+            offset = int(request.headers.get("Upload-Offset", ""))
+        except ValueError:
+            response = jsonify(
+                {"success": False, "message": "Upload-Offset header required"}
+            )
+            return response, 400
+
+        session = uploads.append_chunk(
+            upload_id, offset, request.stream, request.content_length
+        )
+        return _upload_session_response(session)
+
+    except uploads.UploadError as e:
+        return _upload_error_response(e)
+
+    except Exception as e:
+        response = jsonify(
+            {"success": False, "message": f"Error uploading chunk: {str(e)}"}
+        )
+        return response, 500
+
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000, debug=True)
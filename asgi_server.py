@@ -0,0 +1,523 @@
+"""
+Asyncio variant of api_server.py, served by gunicorn with uvicorn workers:
+
+    gunicorn asgi_server:app --config gunicorn_asgi_config.py
+
+Same routes and responses as the Flask app. A pending analysis waits for the
+model on the event loop instead of pinning a worker thread, so one process
+holds hundreds of them; parsing runs in worker processes and blocking file
+and cache access in a thread pool.
+"""
+
+import asyncio
+import io
+import os
+import traceback
+from contextlib import AsyncExitStack
+
+from quart import Quart, Response, g, jsonify, make_response, request
+from quart_cors import cors
+
+import scripts.constants as const
+from scripts import async_io, log, metrics, precompute, profiling, uploads
+from scripts.admission import AdmissionController, AdmissionRejected, client_address, request_lane
+from scripts.analysis import (
+    SEGMENT_MAPPING,
+    aiter_analysis,
+    normalize_request,
+    request_key,
+    run_analysis_async,
+)
+from scripts.analytics import load_analytics
+from scripts.async_io import run_io
+from scripts.cache import get_cache
+from scripts.cancellation import CancelToken, RequestCancelled
+from scripts.singleflight import AsyncSingleFlight
+
+# Log records and sampled prompts/responses are written by background threads
+log.setup()
+logger = log.get_logger("api")
+
+app = Quart(__name__)
+app = cors(app, allow_origin="https://armin-bc.github.io", allow_credentials=True)
+
+# Limit a single request body; larger files are sent as chunked uploads
+app.config["MAX_CONTENT_LENGTH"] = const.UPLOAD_MAX_REQUEST_SIZE
+# Quart cuts off responses after 60s by default; analyses are bounded by their deadline
+app.config["RESPONSE_TIMEOUT"] = const.REQUEST_DEADLINE + 30
+
+inflight_analyses = AsyncSingleFlight()
+admission = AdmissionController(
+    max_active=const.ASYNC_MAX_ACTIVE_ANALYSES, max_queue=dict(const.ASYNC_MAX_QUEUE)
+)
+
+
+@app.before_serving
+async def startup():
+    # Builds the default analyses in the background at worker start and on data changes
+    precompute.start()
+
+
+@app.after_serving
+async def shutdown():
+    precompute.stop()
+    async_io.shutdown()
+
+
+def _client_id():
+    """Identify the caller for per-client concurrency caps"""
+    return client_address(request.remote_addr, request.headers.get("X-Forwarded-For"))
+
+
+def _request_lane(data):
+    """Admission lane from X-Request-Priority or the payload; higher lanes need X-Priority-Token"""
+    return request_lane(
+        request.headers.get("X-Request-Priority") or data.get("priority"),
+        request.headers.get("X-Priority-Token"),
+    )
+
+
+def _request_timeout(data):
+    """Deadline in seconds from X-Request-Timeout or the payload, capped by REQUEST_DEADLINE"""
+    value = request.headers.get("X-Request-Timeout") or data.get("timeout")
+    try:
+        timeout = float(value) if value else const.REQUEST_DEADLINE
+    except (TypeError, ValueError):
+        timeout = const.REQUEST_DEADLINE
+    return min(timeout, const.REQUEST_DEADLINE) if timeout > 0 else const.REQUEST_DEADLINE
+
+
+@app.before_request
+async def assign_request_id():
+    """Tag log records and stored payloads of this request with X-Request-Id (or a new ID)"""
+    g.request_id = log.new_request_id(request.headers.get("X-Request-Id"))
+
+
+@app.before_request
+async def start_profile():
+    """Profile /api/analyze and /api/upload if X-Profile carries the token or the request is sampled"""
+    if profiling.ENABLED and request.path in const.PROFILE_ROUTES:
+        g.profile = profiling.start_request(request.path, request.headers.get("X-Profile"))
+
+
+@app.after_request
+async def tag_profile(response):
+    if g.get("request_id"):
+        response.headers["X-Request-Id"] = g.request_id
+    profile = g.get("profile")
+    if profile is not None:
+        profile.status = response.status_code
+        response.headers["X-Profile-Id"] = profile.id
+    return response
+
+
+@app.teardown_request
+async def finish_profile(error=None):
+    await profiling.finish_request_async(g.pop("profile", None))
+
+
+def _rejected_response(e):
+    response = jsonify({"success": False, "message": str(e), "reason": e.reason})
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response, 429
+
+
+@app.route("/api/cors-test", methods=["GET"])
+async def cors_test():
+    return jsonify({"message": "CORS test successful", "status": "ok"})
+
+
+@app.route("/api/metrics", methods=["GET"])
+async def metrics_endpoint():
+    """Prometheus metrics of this process"""
+    if request.args.get("format") == "json":
+        return jsonify(
+            {
+                "pid": os.getpid(),
+                "metrics": metrics.snapshot(),
+                "cache": await run_io(get_cache().stats),
+                "admission": admission.stats(),
+            }
+        )
+    response = await make_response(metrics.render_prometheus())
+    response.headers["Content-Type"] = "text/plain; version=0.0.4"
+    return response
+
+
+@app.route("/")
+async def api_root():
+    return jsonify(
+        {
+            "message": "FinAI Backend API (async)",
+            "status": "running",
+            "endpoints": [
+                "/api/cors-test",
+                "/api/upload",
+                "/api/upload/sessions",
+                "/api/analyze",
+                "/api/analyze/stream",
+                "/api/analytics",
+                "/api/metrics",
+                "/api/profiles",
+            ],
+        }
+    )
+
+
+@app.route("/api/analyze", methods=["POST"])
+async def analyze():
+    """Main endpoint to process data from the frontend tool and return analysis"""
+    token = None
+    try:
+        data = await request.get_json()
+        # Resolves and fetches the documents, which may wait for the shared storage
+        params = await run_io(normalize_request, data)
+
+        # Default views (no comments or documents) come from the precomputed snapshot
+        snapshot = await run_io(precompute.lookup, params)
+        if snapshot is not None:
+            return jsonify(
+                {
+                    "success": True,
+                    "message": "Analysis completed successfully",
+                    "result": snapshot["result"],
+                    "coalesced": False,
+                    "precomputed": True,
+                }
+            )
+
+        lane = _request_lane(data)
+        client = _client_id()
+        token = CancelToken(_request_timeout(data))
+
+        async def admitted_analysis(shared_token):
+            async with admission.admit_async(lane=lane, client=client, token=shared_token):
+                return await run_analysis_async(params, token=shared_token)
+
+        # A client disconnect cancels this handler; the shared computation keeps
+        # running as long as another identical request waits for it
+        analysis_result, coalesced = await inflight_analyses.do(
+            request_key(params), admitted_analysis, token=token
+        )
+
+        return jsonify(
+            {
+                "success": True,
+                "message": "Analysis completed successfully",
+                "result": analysis_result,
+                "coalesced": coalesced,
+                "precomputed": False,
+            }
+        )
+
+    except AdmissionRejected as e:
+        return _rejected_response(e)
+
+    except RequestCancelled as e:
+        # 499 follows the nginx convention for requests closed by the client
+        logger.info("Analysis stopped: %s", e)
+        status = 504 if e.reason == "deadline" else 499
+        response = jsonify(
+            {"success": False, "message": str(e), "reason": e.reason, "stage": e.stage}
+        )
+        return response, status
+
+    except asyncio.CancelledError:
+        if token is not None:
+            token.cancel("disconnected")
+        raise
+
+    except Exception as e:
+        error_traceback = traceback.format_exc()
+        logger.error("❌ Fehler im /api/analyze-Endpunkt:\n%s", error_traceback)
+
+        response = jsonify(
+            {
+                "success": False,
+                "message": f"Error processing request: {str(e)}",
+                "traceback": error_traceback,
+            }
+        )
+        return response, 500
+
+
+@app.route("/api/analyze/stream", methods=["POST"])
+async def analyze_stream():
+    """
+    Same analysis as /api/analyze, streamed as NDJSON: the charts first, then each
+    section of the commentary as soon as it is generated, then the full result
+    """
+    # Held until the streamed response is finished
+    resources = AsyncExitStack()
+    try:
+        data = await request.get_json()
+        params = await run_io(normalize_request, data)
+        token = CancelToken(_request_timeout(data))
+
+        # Admission happens before streaming starts so rejections are still a 429
+        await resources.enter_async_context(
+            admission.admit_async(lane=_request_lane(data), client=_client_id(), token=token)
+        )
+
+    except AdmissionRejected as e:
+        return _rejected_response(e)
+
+    except RequestCancelled as e:
+        status = 504 if e.reason == "deadline" else 499
+        response = jsonify({"success": False, "message": str(e), "reason": e.reason})
+        return response, status
+
+    except Exception as e:
+        await resources.aclose()
+        response = jsonify(
+            {"success": False, "message": f"Error processing request: {str(e)}"}
+        )
+        return response, 500
+
+    request_id = g.request_id
+
+    async def events():
+        # The body is sent from another task; keep the records tagged with this request
+        log.new_request_id(request_id)
+        finished = False
+        try:
+            async for event in aiter_analysis(params, token):
+                yield app.json.dumps(event) + "\n"
+        except RequestCancelled as e:
+            logger.info("Analysis stream stopped: %s", e)
+            yield app.json.dumps(
+                {"event": "error", "message": str(e), "reason": e.reason, "stage": e.stage}
+            ) + "\n"
+        except Exception as e:
+            logger.exception("❌ Fehler im /api/analyze/stream-Endpunkt: %s", e)
+            yield app.json.dumps(
+                {"event": "error", "message": f"Error processing request: {str(e)}"}
+            ) + "\n"
+        else:
+            finished = True
+        finally:
+            # Also runs when the client went away mid-stream and the generator is closed
+            if not finished:
+                token.cancel("disconnected")
+            await resources.aclose()
+
+    response = Response(events(), mimetype="application/x-ndjson")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"  # Let proxies pass lines through
+    return response
+
+
+@app.route("/api/analytics", methods=["GET"])
+async def analytics_endpoint():
+    """Lead-lag correlations, turning points and threshold crossings of bank KPIs and macro indicators"""
+    try:
+        result = await async_io.run_cpu(load_analytics)
+
+        # Optional ?segment= filter, accepts frontend names (Corporate) and codes (CB)
+        segment = request.args.get("segment")
+        if segment:
+            code = SEGMENT_MAPPING.get(segment, segment)
+            segment_name = const.SEGMENTS.get(code, code)
+            if segment_name not in result["correlations"]:
+                response = jsonify({"success": False, "message": f"Unknown segment: {segment}"})
+                return response, 404
+            result = {
+                **result,
+                "correlations": {segment_name: result["correlations"][segment_name]},
+                "turning_points": {
+                    "bank": {
+                        segment_name: result["turning_points"]["bank"].get(segment_name, {})
+                    },
+                    "macro": result["turning_points"]["macro"],
+                },
+            }
+
+        return jsonify({"success": True, "analytics": result})
+
+    except Exception as e:
+        response = jsonify(
+            {"success": False, "message": f"Error computing analytics: {str(e)}"}
+        )
+        return response, 500
+
+
+@app.route("/api/profiles", methods=["GET"])
+async def list_profiles():
+    """Stored request profiles of this node, newest first"""
+    if not profiling.authorized(request.headers.get("X-Profile")):
+        return jsonify({"success": False, "message": "Profiling token required"}), 403
+    return jsonify({"success": True, "profiles": await run_io(profiling.list_profiles)})
+
+
+@app.route("/api/profiles/<profile_id>", methods=["GET"])
+async def get_profile(profile_id):
+    """Stage timings and allocations of a profile; ?format=folded returns the stack samples for flame graphs"""
+    if not profiling.authorized(request.headers.get("X-Profile")):
+        return jsonify({"success": False, "message": "Profiling token required"}), 403
+    if request.args.get("format") == "folded":
+        folded = await run_io(profiling.load_folded, profile_id)
+        if folded is not None:
+            response = await make_response(folded)
+            response.headers["Content-Type"] = "text/plain; charset=utf-8"
+            return response
+    else:
+        summary = await run_io(profiling.load_profile, profile_id)
+        if summary is not None:
+            return jsonify({"success": True, "profile": summary})
+    return jsonify({"success": False, "message": f"Unknown profile: {profile_id}"}), 404
+
+
+@app.route("/api/upload", methods=["POST"])
+async def upload_file():
+    """Endpoint to handle file uploads"""
+    try:
+        # Reject oversize bodies before the form data is parsed
+        if (
+            request.content_length is not None
+            and request.content_length > const.UPLOAD_MAX_REQUEST_SIZE
+        ):
+            response = jsonify(
+                {
+                    "success": False,
+                    "message": "File too large, use /api/upload/sessions for chunked uploads",
+                }
+            )
+            return response, 413
+
+        files = await request.files
+        if "file" not in files:
+            response = jsonify({"success": False, "message": "No file part"})
+            return response, 400
+
+        file = files["file"]
+        if file.filename == "":
+            response = jsonify({"success": False, "message": "No selected file"})
+            return response, 400
+
+        # Hashing and writing to disk run in the I/O pool, not on the event loop
+        with profiling.stage("store"):
+            stored = await run_io(uploads.store_stream, file.stream, file.filename)
+
+        return jsonify(
+            {
+                "success": True,
+                "message": "File uploaded successfully",
+                "filename": stored["filename"],
+                "storedName": stored["stored_name"],
+                "sha256": stored["sha256"],
+                "size": stored["size"],
+                "deduplicated": stored["deduplicated"],
+                "path": stored["path"],
+            }
+        )
+
+    except uploads.UploadError as e:
+        response = jsonify({"success": False, "message": str(e)})
+        return response, e.status
+
+    except Exception as e:
+        response = jsonify(
+            {"success": False, "message": f"Error uploading file: {str(e)}"}
+        )
+        return response, 500
+
+
+def _upload_session_response(session, status=200):
+    """Serialize chunked upload state for the client"""
+    payload = {
+        "success": True,
+        "uploadId": session["upload_id"],
+        "filename": session["filename"],
+        "size": session["size"],
+        "offset": session["offset"],
+        "chunkSize": session.get("chunk_size", const.UPLOAD_CHUNK_SIZE),
+        "complete": session.get("complete", False),
+    }
+    if payload["complete"]:
+        payload.update(
+            {
+                "message": "File uploaded successfully",
+                "storedName": session["stored_name"],
+                "sha256": session["sha256"],
+                "deduplicated": session["deduplicated"],
+                "path": session["path"],
+            }
+        )
+    response = jsonify(payload)
+    response.headers["Upload-Offset"] = str(session["offset"])
+    return response, status
+
+
+def _upload_error_response(error):
+    payload = {"success": False, "message": str(error)}
+    if error.offset is not None:
+        payload["offset"] = error.offset
+    response = jsonify(payload)
+    if error.offset is not None:
+        response.headers["Upload-Offset"] = str(error.offset)
+    return response, error.status
+
+
+@app.route("/api/upload/sessions", methods=["POST"])
+async def create_upload_session():
+    """Start a chunked, resumable upload. Body: {"filename", "size", "sha256"?}"""
+    try:
+        data = await request.get_json(silent=True) or {}
+        session = await run_io(
+            uploads.create_session, data.get("filename", ""), data.get("size"), data.get("sha256")
+        )
+        return _upload_session_response(session, 201)
+
+    except uploads.UploadError as e:
+        return _upload_error_response(e)
+
+    except Exception as e:
+        response = jsonify(
+            {"success": False, "message": f"Error creating upload: {str(e)}"}
+        )
+        return response, 500
+
+
+@app.route("/api/upload/sessions/<upload_id>", methods=["GET", "PUT", "DELETE"])
+async def upload_session(upload_id):
+    """
+    GET returns the offset to resume from, PUT appends the raw request body at
+    the offset given in the Upload-Offset header, DELETE aborts the upload.
+    The file is stored once the last chunk has been received.
+    """
+    try:
+        if request.method == "GET":
+            return _upload_session_response(await run_io(uploads.get_session, upload_id))
+
+        if request.method == "DELETE":
+            await run_io(uploads.abort_session, upload_id)
+            return jsonify({"success": True, "message": "Upload aborted"})
+
+        try:
+            offset = int(request.headers.get("Upload-Offset", ""))
+        except ValueError:
+            response = jsonify(
+                {"success": False, "message": "Upload-Offset header required"}
+            )
+            return response, 400
+
+        # A chunk is at most UPLOAD_MAX_REQUEST_SIZE, so it is received in memory
+        # and written in the I/O pool
+        body = await request.get_data(cache=False)
+        session = await run_io(
+            uploads.append_chunk, upload_id, offset, io.BytesIO(body), len(body)
+        )
+        return _upload_session_response(session)
+
+    except uploads.UploadError as e:
+        return _upload_error_response(e)
+
+    except Exception as e:
+        response = jsonify(
+            {"success": False, "message": f"Error uploading chunk: {str(e)}"}
+        )
+        return response, 500
+
+
+if __name__ == "__main__":
+    app.run(host="0.0.0.0", port=5000, debug=True)
@@ -0,0 +1,15 @@
+"""
+Test defaults: the fake model backend and a per-process cache, so the suite
+runs without API keys, network or state left in .cache/. Set before any
+scripts module reads its configuration.
+"""
+
+import os
+
+os.environ.setdefault("FINAI_MODEL_BACKEND", "fake")
+os.environ.setdefault("FINAI_CACHE_BACKEND", "memory")
+os.environ.setdefault("FINAI_RESPONSE_CACHE_TTL", "0")
+os.environ.setdefault("FINAI_PRECOMPUTE", "0")
+os.environ.setdefault("FINAI_TELEMETRY", "0")
+os.environ.setdefault("FINAI_LOG_PAYLOAD_SAMPLE_RATE", "0")
+os.environ.setdefault("FINAI_HEDGE", "0")
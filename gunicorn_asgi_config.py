@@ -0,0 +1,9 @@
+bind = "0.0.0.0:10000"
+# One event loop holds all pending analyses; parsing runs in its own worker processes
+workers = 1
+worker_class = "uvicorn.workers.UvicornWorker"
+backlog = 2048  # Hundreds of concurrent connections per worker
+keepalive = 75
+forwarded_allow_ips = "*"
+secure_scheme_headers = {"X-Forwarded-Proto": "https"}
+timeout = 600  # Longer timeout for file uploads
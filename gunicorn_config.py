@@ -1,5 +1,9 @@
-bind = "0.0.0.0:10000"
-workers = 2
-forwarded_allow_ips = "*"
-secure_scheme_headers = {"X-Forwarded-Proto": "https"}
-timeout = 600  # Longer timeout for file uploads
+bind = "0.0.0.0:10000"
+workers = 2
+# Threads let each worker queue analyses and answer 429s while busy;
+# concurrency of the analyses themselves is capped by the admission controller
+worker_class = "gthread"
+threads = 16
+forwarded_allow_ips = "*"
+secure_scheme_headers = {"X-Forwarded-Proto": "https"}
+timeout = 600  # Longer timeout for file uploads
@@ -2,9 +2,12 @@ import os
 from dotenv import load_dotenv
 from pathlib import Path
 import argparse
+import sys
 
 from scripts.generate_insights import PromptRenderer
 from scripts.api_calls import generate_response
+from scripts import log
+from scripts.pmi_report import format_pmi_report, load_pmi_report
 import scripts.constants as const
 from scripts.utils import extract_asset_quality_metrics, load_pmi_time_series, load_ifo_data, extract_metrics_from_excel, read_text_file
 
@@ -12,11 +15,13 @@ load_dotenv()
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Run KPI prompt generation")
+    # A single run needs --segment and --macro_kpis; --batch takes the matrix options below
+    single_run = "--batch" not in sys.argv
     parser.add_argument(
         "--segment",
         choices=["FinSum", "IB", "PB", "CB"],
         default="FinSum",
-        required=True,
+        required=single_run,
         help="Select a bank segment"
     )
     parser.add_argument(
@@ -24,7 +29,7 @@ def parse_args():
         choices=["ifo", "pmi"],
         nargs="+",
         default=["ifo"],
-        required=True,
+        required=single_run,
         help="Select one or more macroeconomic indicators to include (e.g., --macro_kpis ifo pmi)"
     )
     parser.add_argument(
@@ -33,10 +38,67 @@ def parse_args():
         required=False,
         help="Insert additional user comments to enrich the analysis"
     )
+
+    batch = parser.add_argument_group("batch mode")
+    batch.add_argument(
+        "--batch",
+        action="store_true",
+        help="Generate reports for every combination of --segments, --macro_sets and --comment_files"
+    )
+    batch.add_argument(
+        "--segments",
+        choices=list(const.SEGMENTS),
+        nargs="+",
+        default=list(const.SEGMENTS),
+        help="Bank segments of the batch (default: all)"
+    )
+    batch.add_argument(
+        "--macro_sets",
+        nargs="+",
+        default=["ifo,pmi"],
+        help="Macro indicator sets, comma-separated (e.g. --macro_sets ifo,pmi ifo none)"
+    )
+    batch.add_argument(
+        "--comment_files",
+        nargs="+",
+        default=None,
+        help="Text files with user comments, one variant each; 'none' adds a variant without comments"
+    )
+    batch.add_argument(
+        "--output_dir",
+        default=const.BATCH_OUTPUT_DIR,
+        help="Directory for the JSON/Markdown reports and manifest.json"
+    )
+    batch.add_argument(
+        "--concurrency",
+        type=int,
+        default=const.BATCH_CONCURRENCY,
+        help="Model calls in flight"
+    )
+    batch.add_argument(
+        "--force",
+        action="store_true",
+        help="Regenerate items that are already complete"
+    )
     return parser.parse_args()
 
 if __name__ == "__main__":
     args = parse_args()
+    log.setup()
+
+    if args.batch:
+        from scripts.batch import print_report, run_batch
+
+        report = run_batch(
+            args.segments,
+            args.macro_sets,
+            args.comment_files,
+            output_dir=args.output_dir,
+            concurrency=args.concurrency,
+            force=args.force,
+        )
+        print_report(report)
+        sys.exit(1 if report["failed"] else 0)
 
     segment = const.SEGMENTS[args.segment]
     macro_kpis = args.macro_kpis
@@ -45,6 +107,10 @@ if __name__ == "__main__":
     # Load Data
     df_ifo = load_ifo_data(csv_path=os.path.join(const.PROJECT_ROOT, "data", "202504_ifo_gsk_prepared.csv"), start_date="2020-01-01") if "ifo" in macro_kpis else None
     pmi_pdf_path = os.path.join(const.PROJECT_ROOT, "data", "202502_pmi.pdf") if "pmi" in macro_kpis else None
+    # Extracted report figures replace the PDF attachment unless FINAI_PMI_ATTACH_PDF=1
+    pmi_report = format_pmi_report(load_pmi_report(pmi_pdf_path)) if pmi_pdf_path and not const.PMI_ATTACH_PDF else None
+    if pmi_report is not None:
+        pmi_pdf_path = None
     df_pmi_ts = load_pmi_time_series(os.path.join(const.PROJECT_ROOT, "data", "global_composite_pmi.csv")) if "pmi" in macro_kpis else None
     bank_data_all_dict = extract_metrics_from_excel(os.path.join(const.PROJECT_ROOT, "data", "FDS-Q4-2024-13032025.xlsb"))
     bank_data_dict = bank_data_all_dict.get(segment, {})
@@ -61,7 +127,7 @@ if __name__ == "__main__":
         "gross_carrying_amount" : df_gross_carrying_amount,
         "allowance_for_credit_losses" : df_allowance_for_credit_losses,
         "ifo_data": df_ifo.to_string(index=True) if df_ifo is not None else None,
-        "pmi_data": "Please find the PMI data in the PDF report." if pmi_pdf_path is not None else None,
+        "pmi_data": pmi_report or ("Please find the PMI data in the PDF report." if pmi_pdf_path is not None else None),
         "pmi_time_series" : df_pmi_ts,
         "user_comments": user_comments,
         "example": example
@@ -69,12 +135,14 @@ if __name__ == "__main__":
 
     # Generate response
     renderer = PromptRenderer(template_dir=Path("prompts"))
-    prompt = renderer.render_instruction_prompt(context)
+    prompt_prefix, prompt = renderer.render_instruction_parts(context)
 
     print("\n--- PROMPT ---\n")
-    print(prompt)
+    print(prompt_prefix + prompt)
 
-    response = generate_response(prompt, pmi_pdf_path)
+    response = generate_response(prompt, pmi_pdf_path, prefix=prompt_prefix)
 
     print("\n--- RESPONSE ---\n")
-    print(response)
\ No newline at end of file
+    print(response)
+    with open("response.json", "w", encoding="utf-8") as f:
+        f.write(response)
\ No newline at end of file
@@ -0,0 +1,281 @@
+import asyncio
+import hmac
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Callable, Deque, Dict, Optional
+
+import scripts.constants as const
+from scripts import metrics
+from scripts.cancellation import CancelToken
+
+QUEUE_DEPTH = metrics.gauge(
+    "finai_admission_queue_depth", "Analysis requests waiting for a slot, by lane"
+)
+ACTIVE = metrics.gauge("finai_admission_active", "Analysis requests currently running")
+QUEUE_WAIT = metrics.histogram(
+    "finai_admission_wait_seconds", "Time spent waiting for an analysis slot, by lane"
+)
+REJECTED = metrics.counter(
+    "finai_admission_rejected_total", "Analysis requests rejected with 429, by lane and reason"
+)
+
+LANES = ("interactive", "batch")  # Highest priority first
+
+
+def client_address(remote_addr: Optional[str], forwarded_for: Optional[str] = None) -> str:
+    """
+    Key of the per-client cap: the peer address, or behind TRUSTED_PROXIES proxies
+    the X-Forwarded-For hop appended by the outermost of them. Entries further left
+    are set by the client and ignored.
+    """
+    if const.TRUSTED_PROXIES > 0 and forwarded_for:
+        hops = [hop.strip() for hop in forwarded_for.split(",") if hop.strip()]
+        if len(hops) >= const.TRUSTED_PROXIES:
+            return hops[-const.TRUSTED_PROXIES]
+    return remote_addr or "anonymous"
+
+
+def request_lane(requested: Optional[str], priority_token: Optional[str] = None) -> str:
+    """
+    Admission lane of a request. Any request may ask for a lower lane than
+    ADMISSION_DEFAULT_LANE; a higher one needs X-Priority-Token to match PRIORITY_TOKEN.
+    """
+    default = const.ADMISSION_DEFAULT_LANE
+    lane = (requested or default).lower()
+    if lane not in LANES:
+        return default
+    if LANES.index(lane) < LANES.index(default):
+        authenticated = bool(const.PRIORITY_TOKEN) and hmac.compare_digest(
+            priority_token or "", const.PRIORITY_TOKEN
+        )
+        return lane if authenticated else default
+    return lane
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be queued; maps to 429 with Retry-After."""
+
+    def __init__(self, message: str, retry_after: int, reason: str):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class _Ticket:
+    __slots__ = ("lane", "client", "granted", "wake")
+
+    def __init__(self, lane: str, client: str, wake: Optional[Callable[[], None]] = None):
+        self.lane = lane
+        self.client = client
+        self.granted = False
+        self.wake = wake  # Notifies an asyncio waiter, which does not wait on the condition
+
+
+class AdmissionController:
+    """
+    Bounded admission in front of the analysis pipeline (per worker process).
+
+    At most max_active analyses run at once; further requests wait in a FIFO
+    lane. Free slots always go to the interactive lane first, the batch lane
+    only gets them while no interactive request is waiting. Requests are
+    rejected immediately when their lane is full, when a client already has
+    max_per_client requests admitted or waiting, or when no slot frees up
+    within max_wait.
+    """
+
+    def __init__(
+        self,
+        max_active: int = None,
+        max_queue: Dict[str, int] = None,
+        max_per_client: int = None,
+        max_wait: float = None,
+    ):
+        self.max_active = max_active or const.ADMISSION_MAX_ACTIVE
+        self.max_queue = max_queue or dict(const.ADMISSION_MAX_QUEUE)
+        self.max_per_client = max_per_client or const.ADMISSION_MAX_PER_CLIENT
+        self.max_wait = max_wait or const.ADMISSION_MAX_WAIT
+        self._cond = threading.Condition()
+        self._queues: Dict[str, Deque[_Ticket]] = {lane: deque() for lane in LANES}
+        self._active = 0
+        self._per_client: Dict[str, int] = {}
+        self._durations: Deque[float] = deque(maxlen=50)
+
+    def _retry_after(self, lane: str) -> int:
+        """Estimate when a retry could succeed from recent analysis durations."""
+        average = (
+            sum(self._durations) / len(self._durations)
+            if self._durations
+            else const.ADMISSION_DEFAULT_DURATION
+        )
+        ahead = len(self._queues["interactive"]) + (
+            len(self._queues["batch"]) if lane == "batch" else 0
+        )
+        return max(1, int(average * (ahead + 1) / self.max_active))
+
+    def _grant(self):
+        """Hand free slots to waiting tickets, interactive lane first."""
+        while self._active < self.max_active:
+            lane = next((lane for lane in LANES if self._queues[lane]), None)
+            if lane is None:
+                break
+            ticket = self._queues[lane].popleft()
+            ticket.granted = True
+            self._active += 1
+            if ticket.wake is not None:
+                ticket.wake()
+        self._update_gauges()
+
+    def _update_gauges(self):
+        for lane in LANES:
+            QUEUE_DEPTH.set(len(self._queues[lane]), lane=lane)
+        ACTIVE.set(self._active)
+
+    def _enqueue(self, ticket: _Ticket):
+        """Queue a ticket or reject it; called with the condition held."""
+        lane, client = ticket.lane, ticket.client
+        if self._per_client.get(client, 0) >= self.max_per_client:
+            REJECTED.inc(lane=lane, reason="client_limit")
+            raise AdmissionRejected(
+                "Too many concurrent analyses for this client",
+                self._retry_after(lane),
+                "client_limit",
+            )
+        if len(self._queues[lane]) >= self.max_queue[lane]:
+            REJECTED.inc(lane=lane, reason="queue_full")
+            raise AdmissionRejected(
+                "Analysis queue is full", self._retry_after(lane), "queue_full"
+            )
+
+        self._per_client[client] = self._per_client.get(client, 0) + 1
+        self._queues[lane].append(ticket)
+        self._grant()
+
+    def _give_up(self, ticket: _Ticket, token: Optional[CancelToken]):
+        """Leave the queue after a timeout or cancellation; called with the condition held."""
+        self._queues[ticket.lane].remove(ticket)
+        self._release_client(ticket.client)
+        self._update_gauges()
+        if token is not None:
+            token.check("admission")
+        REJECTED.inc(lane=ticket.lane, reason="timeout")
+        raise AdmissionRejected(
+            "Timed out waiting for an analysis slot",
+            self._retry_after(ticket.lane),
+            "timeout",
+        )
+
+    def _release(self, ticket: _Ticket, started: Optional[float]):
+        with self._cond:
+            if started is not None:
+                self._durations.append(time.monotonic() - started)
+            self._active -= 1
+            self._release_client(ticket.client)
+            self._grant()
+            self._cond.notify_all()
+
+    @contextmanager
+    def admit(self, lane: str = "interactive", client: str = "anonymous", token: CancelToken = None):
+        """
+        Wait for an analysis slot and hold it for the duration of the block.
+
+        A cancelled request leaves the queue right away instead of taking a slot.
+
+        Raises:
+            AdmissionRejected: If the lane or the client's quota is full, or the wait timed out
+            RequestCancelled: If the token was cancelled while waiting
+        """
+        lane = lane if lane in LANES else "interactive"
+        ticket = _Ticket(lane, client)
+        queued_at = time.monotonic()
+
+        with self._cond:
+            self._enqueue(ticket)
+
+            deadline = queued_at + self.max_wait
+            while not ticket.granted:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or (token is not None and token.cancelled):
+                    self._give_up(ticket, token)
+                # Cancellation is not signalled through the condition, so poll for it
+                if token is not None:
+                    remaining = min(remaining, const.CANCEL_POLL_INTERVAL)
+                self._cond.wait(remaining)
+
+        QUEUE_WAIT.observe(time.monotonic() - queued_at, lane=lane)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(ticket, started)
+
+    @asynccontextmanager
+    async def admit_async(
+        self, lane: str = "interactive", client: str = "anonymous", token: CancelToken = None
+    ):
+        """
+        admit() for the asyncio server: the request waits on the event loop instead
+        of blocking a thread. Sync and async requests share the same slots and lanes.
+
+        Raises:
+            AdmissionRejected: If the lane or the client's quota is full, or the wait timed out
+            RequestCancelled: If the token was cancelled while waiting
+        """
+        lane = lane if lane in LANES else "interactive"
+        loop = asyncio.get_running_loop()
+        granted = asyncio.Event()
+        ticket = _Ticket(lane, client, wake=lambda: loop.call_soon_threadsafe(granted.set))
+        queued_at = time.monotonic()
+
+        with self._cond:
+            self._enqueue(ticket)
+
+        deadline = queued_at + self.max_wait
+        try:
+            while True:
+                with self._cond:
+                    if ticket.granted:
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or (token is not None and token.cancelled):
+                        self._give_up(ticket, token)
+                if token is not None:
+                    remaining = min(remaining, const.CANCEL_POLL_INTERVAL)
+                try:
+                    await asyncio.wait_for(granted.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+        except asyncio.CancelledError:
+            # The client went away while queued; a slot granted meanwhile goes to the next request
+            with self._cond:
+                if not ticket.granted:
+                    self._queues[lane].remove(ticket)
+                    self._release_client(client)
+                    self._update_gauges()
+            if ticket.granted:
+                self._release(ticket, None)
+            raise
+
+        QUEUE_WAIT.observe(time.monotonic() - queued_at, lane=lane)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(ticket, started)
+
+    def _release_client(self, client: str):
+        count = self._per_client.get(client, 0) - 1
+        if count > 0:
+            self._per_client[client] = count
+        else:
+            self._per_client.pop(client, None)
+
+    def stats(self) -> Dict:
+        with self._cond:
+            return {
+                "active": self._active,
+                "max_active": self.max_active,
+                "queued": {lane: len(queue) for lane, queue in self._queues.items()},
+                "max_queue": dict(self.max_queue),
+            }
@@ -0,0 +1,919 @@
+import asyncio
+import hashlib
+import json
+import re
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import AsyncIterator, Dict, Iterator, List, Tuple
+
+import pandas as pd
+
+import scripts.constants as const
+from scripts import log, profiling, telemetry, uploads
+from scripts.analytics import load_analytics, summarize_for_prompt
+from scripts.api_calls import Attachments, generate_response, generate_response_async
+from scripts.async_io import run_cpu, run_io
+from scripts.cancellation import CancelToken, RequestCancelled, check
+from scripts.generate_insights import PromptRenderer
+from scripts.pmi_report import format_pmi_report, is_complete, load_pmi_report
+from scripts.retrieval import build_query, estimate_tokens, file_hash, select_document_excerpts
+from scripts.spreadsheets import merge_kpis, split_documents, summarize_tables, uploaded_kpis
+from scripts.utils import (
+    extract_asset_quality_metrics,
+    extract_metrics_from_excel,
+    load_credit_quality,
+    load_ifo_data,
+    load_pmi_data,
+    prepare_chart_data,
+    read_text_file,
+    summarize_ifo_data,
+)
+
+logger = log.get_logger("analysis")
+
+_section_pool = ThreadPoolExecutor(
+    max_workers=const.SECTION_MAX_WORKERS, thread_name_prefix="analysis-section"
+)
+
+# Map frontend segment names to backend segment codes
+SEGMENT_MAPPING = {
+    "Retail": "PB",  # Assuming Retail maps to Private Bank
+    "Corporate": "CB",
+    "Investment": "IB",
+    "Total": "FinSum",
+}
+
+
+def normalize_request(data: Dict) -> Dict:
+    """
+    Convert an /api/analyze payload into the parameters of run_analysis.
+
+    Args:
+        data (Dict): Request JSON from the frontend
+
+    Returns:
+        Dict: segment, segment_code, macro_kpis, include_ifo, include_pmi,
+            user_comments and documents as (filename, path) pairs
+    """
+    segment = data.get("segment", "FinSum")  # Default to FinSum if not provided
+
+    # Convert frontend segment name to backend segment code
+    segment_code = SEGMENT_MAPPING.get(segment, "FinSum")
+
+    # Get selected KPIs and convert to macro_kpis format
+    selected_kpis = data.get("kpis", [])
+
+    macro_kpis = []
+    include_ifo = False
+    include_pmi = False
+
+    if "Ifo" in selected_kpis:
+        macro_kpis.append("ifo")
+        include_ifo = True
+    if "PMI" in selected_kpis:
+        macro_kpis.append("pmi")
+        include_pmi = True
+
+    # Get user comments
+    user_comments = data.get("comments", "")
+
+    # Process uploaded files
+    main_documents = data.get("mainDocuments", [])
+    additional_documents = data.get("additionalDocuments", [])
+
+    documents = []
+    all_filenames = [
+        filename
+        for filename in main_documents + additional_documents
+        if filename and isinstance(filename, str)
+    ]
+
+    # Local copies of all documents are fetched in parallel (shared storage)
+    paths = uploads.resolve_uploads(all_filenames)
+    for filename in all_filenames:
+        path = paths.get(filename)
+        if path is not None:
+            documents.append((filename, path))
+        else:
+            logger.warning("Datei nicht gefunden: %s", filename)
+
+    return {
+        "segment": segment,
+        "segment_code": segment_code,
+        "macro_kpis": macro_kpis,
+        "include_ifo": include_ifo,
+        "include_pmi": include_pmi,
+        "user_comments": user_comments,
+        "documents": documents,
+    }
+
+
+def params_for(segment_code: str, macro_kpis: List[str]) -> Dict:
+    """Parameters in the format of normalize_request for a segment code and indicators, without comments or documents."""
+    return {
+        "segment": segment_code,
+        "segment_code": segment_code,
+        "macro_kpis": list(macro_kpis),
+        "include_ifo": "ifo" in macro_kpis,
+        "include_pmi": "pmi" in macro_kpis,
+        "user_comments": "",
+        "documents": [],
+    }
+
+
+def request_key(params: Dict) -> str:
+    """
+    Canonical hash of a normalized request: segment code, sorted indicators,
+    whitespace-normalized comments and the content hashes of the documents.
+    """
+    canonical = {
+        "segment_code": params["segment_code"],
+        "macro_kpis": sorted(params["macro_kpis"]),
+        "user_comments": re.sub(r"\s+", " ", params["user_comments"] or "").strip(),
+        "documents": sorted(file_hash(path) for _, path in params["documents"]),
+    }
+    payload = json.dumps(canonical, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def prepare_pmi_chart_data(chart_data: Dict, df_pmi: pd.DataFrame) -> Dict:
+    """
+    Prepare PMI chart data with the same time periods as the main chart.
+
+    Args:
+        chart_data (Dict): Main chart from prepare_chart_data
+        df_pmi (pd.DataFrame): Monthly PMI data with datetime index
+
+    Returns:
+        Dict: Chart data with the PCL series and quarterly/yearly PMI averages, or None
+    """
+    try:
+        # Use the same periods from the main chart
+        periods = chart_data.get("labels", [])
+
+        # Create PMI chart dataset
+        pmi_values = []
+
+        for period in periods:
+            try:
+                period_str = str(period).strip().upper()
+
+                # Extract year and quarter
+                if "FY" in period_str:
+                    # Handle fiscal year format
+                    year_str = (
+                        period_str.replace("FY", "").replace("_", "").strip()
+                    )
+                    year = int(year_str)
+
+                    # Get average PMI value for the year
+                    yearly_pmi = df_pmi[df_pmi.index.year == year][
+                        "Composite_PMI"
+                    ].mean()
+                    pmi_values.append(
+                        float(yearly_pmi) if not pd.isna(yearly_pmi) else None
+                    )
+
+                elif "Q" in period_str:
+                    # Handle quarterly format
+                    if "_" in period_str:
+                        parts = period_str.split("_")
+                        quarter_part = parts[0] if len(parts) > 0 else ""
+                        year_part = parts[1] if len(parts) > 1 else ""
+                    else:
+                        # Extract using character types
+                        quarter_part = "".join(
+                            [
+                                c
+                                for c in period_str
+                                if c.isalpha() or c.isspace()
+                            ]
+                        )
+                        year_part = "".join(
+                            [c for c in period_str if c.isdigit()]
+                        )
+
+                    quarter = int(quarter_part.replace("Q", ""))
+                    year = int(year_part)
+
+                    # Calculate months for this quarter
+                    start_month = (quarter - 1) * 3 + 1
+                    end_month = quarter * 3
+
+                    # Filter PMI data for this quarter
+                    quarter_pmi = df_pmi[
+                        (df_pmi.index.year == year)
+                        & (df_pmi.index.month >= start_month)
+                        & (df_pmi.index.month <= end_month)
+                    ]["Composite_PMI"].mean()
+
+                    pmi_values.append(
+                        float(quarter_pmi) if not pd.isna(quarter_pmi) else None
+                    )
+                else:
+                    pmi_values.append(None)
+
+            except Exception as e:
+                logger.error("Error processing PMI value for period %s: %s", period, e)
+                pmi_values.append(None)
+
+        # Create PMI chart data structure
+        return {
+            "labels": periods,
+            "datasets": [
+                {
+                    "label": "Provision for Credit Losses (bps of Avg Loans)",
+                    "data": chart_data["datasets"][0][
+                        "data"
+                    ],  # kopiere aus Hauptchart
+                    "borderColor": "#4285F4",
+                    "backgroundColor": "rgba(66, 133, 244, 0.2)",
+                },
+                {
+                    "label": "Global Composite PMI",
+                    "data": pmi_values,
+                    "borderColor": "#EA4335",
+                    "backgroundColor": "rgba(234, 67, 53, 0.2)",
+                    "yAxisID": "y1",
+                },
+            ],
+        }
+
+    except Exception as e:
+        logger.error("Error preparing PMI chart: %s", e)
+        return None
+
+
+def prepare_credit_quality_chart(credit_quality: Dict) -> Dict:
+    """
+    Prepare the credit-quality chart from the derived metrics of one segment.
+
+    Args:
+        credit_quality (Dict): metric → period → value from load_credit_quality
+
+    Returns:
+        Dict: Stage 2/3 coverage and Stage 2 share where stage data exists, otherwise
+            the allowance coverage of the segment; None without derived metrics
+    """
+    series = [
+        ("acl_coverage_pct_stage_2", "ACL Coverage Stage 2 (%)", "#FBBC05", None),
+        ("acl_coverage_pct_stage_3", "ACL Coverage Stage 3 (%)", "#EA4335", None),
+        ("gca_stage_share_pct_stage_2", "Stage 2 Share of GCA (%)", "#34A853", "y1"),
+    ]
+    if not any(credit_quality.get(key) for key, _, _, _ in series):
+        series = [("allowance_coverage_pct", "Allowance Coverage of Loans (%)", "#FBBC05", None)]
+    if not any(credit_quality.get(key) for key, _, _, _ in series):
+        return None
+
+    labels = list(credit_quality.get(series[0][0], {}))
+    datasets = []
+    for key, label, color, axis in series:
+        values = credit_quality.get(key, {})
+        dataset = {
+            "label": label,
+            "data": [float(values[p]) if p in values else None for p in labels],
+            "borderColor": color,
+        }
+        if axis:
+            dataset["yAxisID"] = axis
+        datasets.append(dataset)
+    return {"labels": labels, "datasets": datasets}
+
+
+def load_inputs(params: Dict, token: CancelToken = None) -> Dict:
+    """
+    Load bank data, macro indicators and document excerpts for an analysis.
+
+    Args:
+        params (Dict): Normalized request from normalize_request
+        token (CancelToken, optional): Stops loading between stages once cancelled
+
+    Returns:
+        Dict: Prompt context plus the data frames needed for the charts
+    """
+    segment_code = params["segment_code"]
+    macro_kpis = params["macro_kpis"]
+    user_comments = params["user_comments"]
+    documents = params["documents"]
+
+    # Load data based on selection
+    segment_name = const.SEGMENTS[segment_code]
+
+    # Select the document passages most relevant to this analysis
+    query_terms = build_query(
+        segment_name, list(const.KPI_LABELS), macro_kpis, user_comments
+    )
+    # Spreadsheets with numeric tables are summarized, their KPIs merged into the bank data
+    with profiling.stage("documents"):
+        tables, text_documents = split_documents(documents, token=token)
+        uploaded_texts = [summarize_tables(filename, parsed) for filename, parsed in tables]
+        uploaded_texts += select_document_excerpts(
+            text_documents, query_terms, _document_budget(len(text_documents)), token=token
+        )
+
+    # Load IFO data if needed
+    check(token, "macro_data")
+    df_ifo = None
+    if "ifo" in macro_kpis:
+        try:
+            with profiling.stage("ifo_data"):
+                df_ifo = load_ifo_data(const.IFO_DATA_PATH)
+        except Exception as e:
+            logger.error("Error loading IFO data: %s", e)
+            pass  # Continue without IFO data if loading fails
+
+    # Load PMI data if needed
+    df_pmi = None
+    if "pmi" in macro_kpis:
+        try:
+            with profiling.stage("pmi_data"):
+                df_pmi = load_pmi_data(const.PMI_DATA_PATH)
+        except Exception as e:
+            logger.error("Error loading PMI data: %s", e)
+            # Continue without PMI data if loading fails
+
+    # Precomputed lead-lag statistics instead of leaving the model to eyeball the tables
+    macro_analytics = None
+    if macro_kpis:
+        try:
+            with profiling.stage("analytics"):
+                macro_analytics = summarize_for_prompt(load_analytics(), segment_name, macro_kpis)
+        except Exception as e:
+            logger.error("Error computing macro analytics: %s", e)
+
+    # PMI report figures are extracted locally; the PDF is only attached on opt-in
+    # or if the extraction fails or finds too little
+    pmi_pdf_path = None
+    pmi_report = None
+    if "pmi" in macro_kpis:
+        if not const.PMI_ATTACH_PDF:
+            try:
+                with profiling.stage("pmi_report"):
+                    report = load_pmi_report(const.PMI_PDF_PATH)
+                if is_complete(report):
+                    pmi_report = format_pmi_report(report)
+                else:
+                    logger.warning(
+                        "PMI report extraction incomplete (%d tables, %d passages), attaching the PDF",
+                        len(report.get("tables", [])),
+                        len(report.get("passages", [])),
+                    )
+            except Exception as e:
+                logger.error("Error extracting PMI report: %s", e)
+        if pmi_report is None:
+            pmi_pdf_path = const.PMI_PDF_PATH
+
+    # Load bank data
+    check(token, "bank_data")
+    try:
+        with profiling.stage("bank_data"):
+            bank_data_all_dict = extract_metrics_from_excel(const.BANK_DATA_PATH)
+
+        # Set default if segment not found
+        if segment_name not in bank_data_all_dict:
+            bank_data_dict = {}
+        else:
+            bank_data_dict = bank_data_all_dict[segment_name]
+    except Exception as e:
+        logger.error("Error extracting bank data: %s", e)
+        bank_data_all_dict = {}
+        bank_data_dict = {}
+
+    # Uploaded KPIs are shown to the model on their own; the charts only use
+    # them for periods the FDS workbook does not report
+    uploaded = uploaded_kpis([parsed for _, parsed in tables], segment_name)
+    if uploaded:
+        bank_data_all_dict = {
+            **bank_data_all_dict,
+            segment_name: merge_kpis(bank_data_dict, uploaded),
+        }
+
+    try:
+        example = read_text_file(const.EXAMPLES_PATH)
+    except Exception as e:
+        logger.error("Error reading example text: %s", e)
+        example = ""
+
+    # Stage tables are only reported for the group
+    with profiling.stage("asset_quality"):
+        df_gross_carrying_amount, df_allowance_for_credit_losses = (
+            extract_asset_quality_metrics(const.BANK_DATA_PATH)
+            if segment_name == const.ASSET_QUALITY_SEGMENT
+            else (None, None)
+        )
+
+    # Coverage, stage mix and migration proxies, derived once per file version
+    try:
+        with profiling.stage("credit_quality"):
+            credit_quality = load_credit_quality(const.BANK_DATA_PATH).get(segment_name, {})
+    except Exception as e:
+        logger.error("Error deriving credit-quality metrics: %s", e)
+        credit_quality = {}
+
+    # Prepare context
+    context = {
+        "segment": segment_name,
+        "domain": "Banking",
+        "product_type": "Loans",
+        "bank_data": bank_data_dict,
+        "uploaded_kpis": uploaded,
+        "gross_carrying_amount": df_gross_carrying_amount,
+        "allowance_for_credit_losses": df_allowance_for_credit_losses,
+        "credit_quality": {
+            metric: dict(list(values.items())[-const.CREDIT_QUALITY_PROMPT_QUARTERS:])
+            for metric, values in credit_quality.items()
+            if values
+        },
+        "ifo_data": (
+            summarize_ifo_data(df_ifo, const.IFO_PROMPT_QUARTERS) if df_ifo is not None else None
+        ),
+        "pmi_data": pmi_report or (
+            "Please find the PMI data in the PDF report."
+            if pmi_pdf_path is not None
+            else None
+        ),
+        "macro_analytics": macro_analytics,
+        "user_comments": user_comments,
+        "example": example,
+        "uploaded_documents_text": "\n\n".join(uploaded_texts),
+    }
+
+    return {
+        "context": context,
+        "segment_name": segment_name,
+        "bank_data_all": bank_data_all_dict,
+        "credit_quality": credit_quality,
+        "df_ifo": df_ifo,
+        "df_pmi": df_pmi,
+        "pmi_pdf_path": pmi_pdf_path,
+        # Recorded with the telemetry of every model call of the request
+        "tags": {
+            "segment": segment_code,
+            "indicators": "+".join(sorted(macro_kpis)) or "none",
+            "document_tokens": estimate_tokens(context["uploaded_documents_text"]),
+        },
+    }
+
+
+def _document_budget(documents: int) -> int:
+    """Token budget of the document excerpts; with ADAPTIVE_BUDGET bounded by the observed prompt sizes."""
+    default = min(const.RETRIEVAL_TOKEN_BUDGET, const.RETRIEVAL_TOKENS_PER_DOCUMENT * documents)
+    request_types = (
+        [section["key"] for section in const.ANALYSIS_SECTIONS]
+        if const.SECTIONED_ANALYSIS
+        else ["analysis"]
+    )
+    return telemetry.document_budget(const.MODEL, request_types, default)
+
+
+def _tags(inputs: Dict, request_type: str) -> Dict:
+    return {**inputs.get("tags", {}), "request_type": request_type}
+
+
+def build_charts(params: Dict, inputs: Dict) -> Dict:
+    """Build the chart payloads; they only depend on the data, not on the commentary."""
+    include_ifo = params["include_ifo"]
+    include_pmi = params["include_pmi"]
+
+    # Generate chart data for provision_for_credit_losses_bps_avg_loans
+    try:
+        chart_data = prepare_chart_data(
+            inputs["bank_data_all"],
+            inputs["segment_name"],
+            "provision_for_credit_losses_bps_avg_loans",
+            df_ifo=inputs["df_ifo"],
+            include_ifo=include_ifo,
+        )
+    except Exception as e:
+        logger.error("Error preparing IFO chart: %s", e)
+        # Provide a minimal fallback chart structure
+        chart_data = {
+            "labels": [],
+            "datasets": [
+                {
+                    "label": "Provision for Credit Losses (bps of Avg Loans)",
+                    "data": [],
+                    "borderColor": "#4285F4",
+                    "backgroundColor": "rgba(66, 133, 244, 0.2)",
+                }
+            ],
+        }
+
+    # Prepare PMI chart data with the same time periods as the main chart
+    pmi_chart_data = None
+    if include_pmi and inputs["df_pmi"] is not None:
+        pmi_chart_data = prepare_pmi_chart_data(chart_data, inputs["df_pmi"])
+
+    return {
+        "chart": chart_data,  # IFO and PCL chart data
+        "credit_quality_chart": prepare_credit_quality_chart(inputs["credit_quality"]),
+        "pmi_chart": pmi_chart_data,  # Add PMI chart data to the response
+        "ifo_chart": include_ifo,  # Flag to indicate IFO was selected
+        "pmi_chart_selected": include_pmi,  # Flag to indicate PMI was selected
+    }
+
+
+_renderer = None
+
+
+def get_renderer() -> PromptRenderer:
+    """
+    Process-wide prompt renderer. Compiled templates are reused across requests;
+    Jinja recompiles a template when its file changes.
+    """
+    global _renderer
+    if _renderer is None:
+        _renderer = PromptRenderer(template_dir=Path("prompts"))
+    return _renderer
+
+
+def active_sections(context: Dict) -> List[Dict]:
+    """Sections to generate; macro sections are skipped without macro indicators."""
+    has_macro = bool(context.get("ifo_data") or context.get("pmi_data"))
+    return [s for s in const.ANALYSIS_SECTIONS if has_macro or not s["requires_macro"]]
+
+
+def generate_section(
+    section: Dict,
+    inputs: Dict,
+    renderer: PromptRenderer,
+    token: CancelToken = None,
+    attachments: Attachments = None,
+) -> Dict:
+    """
+    Generate one section of the commentary with its own template and token limit.
+    The sections of an analysis share its attachments, so the PMI report is
+    uploaded once.
+
+    Returns:
+        Dict: key, title, content and model_stats of the section
+    """
+    model_stats = {}
+    try:
+        prompt_prefix, prompt = renderer.render_section_parts(
+            section["template"], inputs["context"]
+        )
+        content = generate_response(
+            prompt,
+            inputs["pmi_pdf_path"] if section["macro_input"] else None,
+            stats=model_stats,
+            prefix=prompt_prefix,
+            token=token,
+            max_tokens=section["max_tokens"],
+            tags=_tags(inputs, section["key"]),
+            attachments=attachments,
+        )
+    except RequestCancelled:
+        raise
+    except Exception as e:
+        content = f"Error generating {section['title']}: {str(e)}"
+    return _section_result(section, content, model_stats)
+
+
+async def generate_section_async(
+    section: Dict,
+    inputs: Dict,
+    renderer: PromptRenderer,
+    token: CancelToken = None,
+    attachments: Attachments = None,
+) -> Dict:
+    """generate_section for the asyncio server."""
+    model_stats = {}
+    try:
+        prompt_prefix, prompt = renderer.render_section_parts(
+            section["template"], inputs["context"]
+        )
+        content = await generate_response_async(
+            prompt,
+            inputs["pmi_pdf_path"] if section["macro_input"] else None,
+            stats=model_stats,
+            prefix=prompt_prefix,
+            token=token,
+            max_tokens=section["max_tokens"],
+            tags=_tags(inputs, section["key"]),
+            attachments=attachments,
+        )
+    except RequestCancelled:
+        raise
+    except Exception as e:
+        content = f"Error generating {section['title']}: {str(e)}"
+    return _section_result(section, content, model_stats)
+
+
+def _section_result(section: Dict, content: str, model_stats: Dict) -> Dict:
+    return {
+        "key": section["key"],
+        "title": section["title"],
+        "content": content.strip(),
+        "model_stats": model_stats,
+    }
+
+
+def merge_sections(sections: Dict[str, Dict]) -> Tuple[str, str]:
+    """Combine generated sections into the variance analysis text and the outlook."""
+    variance = "\n\n".join(
+        f"### {sections[key]['title']}\n\n{sections[key]['content']}"
+        for key in const.VARIANCE_SECTIONS
+        if key in sections
+    )
+    outlook = sections["outlook"]["content"] if "outlook" in sections else None
+    return variance, outlook
+
+
+_DEFAULT_TREND_SUMMARY = "The AI has analyzed trends based on the provided data and macro indicators."
+
+
+def _analysis_result(charts: Dict, ai_response: str, model_stats: Dict, completed: Dict = None) -> Dict:
+    """
+    Assemble the analysis for the frontend, from the monolithic response or,
+    if completed is given, from the generated sections.
+    """
+    trend_summary = _DEFAULT_TREND_SUMMARY
+    sections = []
+    if completed is not None:
+        ai_response, outlook = merge_sections(completed)
+        trend_summary = outlook or _DEFAULT_TREND_SUMMARY
+        sections = [
+            {k: completed[s["key"]][k] for k in ("key", "title", "content")}
+            for s in const.ANALYSIS_SECTIONS
+            if s["key"] in completed
+        ]
+        model_stats = {key: section["model_stats"] for key, section in completed.items()}
+
+    # Process the response into an easy-to-use format for the frontend
+    return {
+        "variance_analysis": {"title": "Variance Analysis", "content": ai_response},
+        "trend_analysis": {"title": "Trend Analysis", "summary": trend_summary},
+        "sections": sections,  # Individually generated parts of the commentary
+        **charts,
+        "model_stats": model_stats,  # Attempts, hedging and latency of the model calls
+    }
+
+
+def render_prompts(inputs: Dict, renderer: PromptRenderer) -> List[Dict]:
+    """
+    Render every prompt of an analysis without calling the model, for the batch
+    mode that renders all prompts before it starts generating.
+
+    Returns:
+        List[Dict]: key, title, prefix, prompt, pmi_pdf_path, max_tokens and tags per
+            model call; a single "analysis" part unless SECTIONED_ANALYSIS is set
+    """
+    if not const.SECTIONED_ANALYSIS:
+        prompt_prefix, prompt = renderer.render_instruction_parts(inputs["context"])
+        return [
+            {
+                "key": "analysis",
+                "title": "Variance Analysis",
+                "prefix": prompt_prefix,
+                "prompt": prompt,
+                "pmi_pdf_path": inputs["pmi_pdf_path"],
+                "max_tokens": 8192,
+                "tags": _tags(inputs, "analysis"),
+            }
+        ]
+    parts = []
+    for section in active_sections(inputs["context"]):
+        prompt_prefix, prompt = renderer.render_section_parts(
+            section["template"], inputs["context"]
+        )
+        parts.append(
+            {
+                "key": section["key"],
+                "title": section["title"],
+                "prefix": prompt_prefix,
+                "prompt": prompt,
+                "pmi_pdf_path": inputs["pmi_pdf_path"] if section["macro_input"] else None,
+                "max_tokens": section["max_tokens"],
+                "tags": _tags(inputs, section["key"]),
+            }
+        )
+    return parts
+
+
+def _generate_part(part: Dict, token: CancelToken = None, attachments: Attachments = None) -> Dict:
+    model_stats = {}
+    content = generate_response(
+        part["prompt"],
+        part["pmi_pdf_path"],
+        stats=model_stats,
+        prefix=part["prefix"],
+        token=token,
+        max_tokens=part["max_tokens"],
+        tags=part.get("tags"),
+        attachments=attachments,
+    )
+    return {
+        "key": part["key"],
+        "title": part["title"],
+        "content": content.strip(),
+        "model_stats": model_stats,
+    }
+
+
+def generate_parts(parts: List[Dict], token: CancelToken = None) -> List[Dict]:
+    """
+    Generate the parts of render_prompts concurrently on the section pool.
+
+    Raises:
+        Exception: The first failure of any part; nothing is returned partially
+    """
+    attachments = Attachments(token)
+    try:
+        futures = [
+            _section_pool.submit(log.bind(_generate_part), part, token, attachments) for part in parts
+        ]
+        return [future.result() for future in futures]
+    finally:
+        attachments.release()
+
+
+def assemble_result(charts: Dict, generated: List[Dict]) -> Dict:
+    """
+    Analysis result from the parts of render_prompts once they are generated.
+
+    Args:
+        charts (Dict): Chart payloads from build_charts
+        generated (List[Dict]): key, title, content and model_stats per rendered part
+    """
+    if len(generated) == 1 and generated[0]["key"] == "analysis":
+        return _analysis_result(charts, generated[0]["content"], generated[0]["model_stats"])
+    completed = {part["key"]: _section_result(part, part["content"], part["model_stats"]) for part in generated}
+    return _analysis_result(charts, None, {}, completed)
+
+
+def iter_analysis(params: Dict, token: CancelToken = None) -> Iterator[Dict]:
+    """
+    Run the analysis and yield its parts as soon as they are available.
+
+    Events (dicts with an "event" key):
+        charts: The chart payloads, available before any model call
+        section: One generated section (key, title, content, model_stats);
+            sections run concurrently and arrive in completion order
+        result: The complete analysis in the format of run_analysis
+
+    Args:
+        params (Dict): Normalized request from normalize_request
+        token (CancelToken, optional): Stops the pipeline between stages once cancelled
+
+    Raises:
+        RequestCancelled: If the token was cancelled before the analysis finished
+    """
+    with profiling.stage("inputs"):
+        inputs = load_inputs(params, token)
+
+    check(token, "charts")
+    with profiling.stage("charts"):
+        charts = build_charts(params, inputs)
+    yield {"event": "charts", **charts}
+
+    check(token, "prompt")
+    renderer = get_renderer()
+
+    if not const.SECTIONED_ANALYSIS:
+        model_stats = {}
+        try:
+            prompt_prefix, prompt = renderer.render_instruction_parts(inputs["context"])
+            with profiling.stage("generation"):
+                ai_response = generate_response(
+                    prompt,
+                    inputs["pmi_pdf_path"],
+                    stats=model_stats,
+                    prefix=prompt_prefix,
+                    token=token,
+                    tags=_tags(inputs, "analysis"),
+                )
+        except RequestCancelled:
+            raise
+        except Exception as e:
+            ai_response = f"Error generating analysis: {str(e)}"
+        yield {"event": "result", "result": _analysis_result(charts, ai_response, model_stats)}
+    else:
+        # Each section is a separate, smaller model call; total latency is that
+        # of the slowest section instead of one long generation
+        attachments = Attachments(token)
+        futures = {
+            _section_pool.submit(
+                log.bind(generate_section), section, inputs, renderer, token, attachments
+            ): section
+            for section in active_sections(inputs["context"])
+        }
+        completed = {}
+        pending = set(futures)
+        try:
+            with profiling.stage("sections"):
+                while pending:
+                    done, pending = wait(
+                        pending, timeout=const.CANCEL_POLL_INTERVAL, return_when=FIRST_COMPLETED
+                    )
+                    for future in done:
+                        section = future.result()
+                        completed[section["key"]] = section
+                        yield {"event": "section", **section}
+                    if pending:
+                        check(token, "sections")
+        finally:
+            # Sections not started yet are dropped if the consumer went away
+            for future in pending:
+                future.cancel()
+            attachments.release()
+
+        yield {"event": "result", "result": _analysis_result(charts, None, {}, completed)}
+
+
+async def aiter_analysis(params: Dict, token: CancelToken = None) -> AsyncIterator[Dict]:
+    """
+    iter_analysis for the asyncio server, yielding the same events. The data files
+    are parsed in a worker process, uploaded documents in-process so that a
+    cancelled request stops between them. The model calls of all sections are
+    awaited concurrently on the event loop.
+
+    Raises:
+        RequestCancelled: If the token was cancelled before the analysis finished
+    """
+    check(token, "inputs")
+    with profiling.stage("inputs"):
+        if params["documents"]:
+            # Document parsing stops between documents once the request is cancelled;
+            # the token cannot cross the process boundary, so it runs in-process
+            inputs = await run_io(load_inputs, params, token)
+        else:
+            inputs = await run_cpu(load_inputs, params)
+
+    check(token, "charts")
+    with profiling.stage("charts"):
+        charts = await run_io(build_charts, params, inputs)
+    yield {"event": "charts", **charts}
+
+    check(token, "prompt")
+    renderer = get_renderer()
+
+    if not const.SECTIONED_ANALYSIS:
+        model_stats = {}
+        try:
+            prompt_prefix, prompt = renderer.render_instruction_parts(inputs["context"])
+            with profiling.stage("generation"):
+                ai_response = await generate_response_async(
+                    prompt,
+                    inputs["pmi_pdf_path"],
+                    stats=model_stats,
+                    prefix=prompt_prefix,
+                    token=token,
+                    tags=_tags(inputs, "analysis"),
+                )
+        except RequestCancelled:
+            raise
+        except Exception as e:
+            ai_response = f"Error generating analysis: {str(e)}"
+        yield {"event": "result", "result": _analysis_result(charts, ai_response, model_stats)}
+        return
+
+    attachments = Attachments(token)
+    tasks = [
+        asyncio.ensure_future(generate_section_async(section, inputs, renderer, token, attachments))
+        for section in active_sections(inputs["context"])
+    ]
+    completed = {}
+    try:
+        with profiling.stage("sections"):
+            for next_section in asyncio.as_completed(tasks):
+                section = await next_section
+                completed[section["key"]] = section
+                yield {"event": "section", **section}
+    finally:
+        # Aborts the model calls still running if the consumer went away
+        for task in tasks:
+            task.cancel()
+        attachments.release()
+
+    yield {"event": "result", "result": _analysis_result(charts, None, {}, completed)}
+
+
+def run_analysis(params: Dict, token: CancelToken = None) -> Dict:
+    """
+    Load the data, generate the AI commentary and build the chart payloads.
+
+    Args:
+        params (Dict): Normalized request from normalize_request
+        token (CancelToken, optional): Stops the pipeline between stages once cancelled
+
+    Returns:
+        Dict: Analysis result in the format returned to the frontend
+
+    Raises:
+        RequestCancelled: If the token was cancelled before the analysis finished
+    """
+    result = None
+    for event in iter_analysis(params, token):
+        if event["event"] == "result":
+            result = event["result"]
+    return result
+
+
+async def run_analysis_async(params: Dict, token: CancelToken = None) -> Dict:
+    """run_analysis for the asyncio server."""
+    result = None
+    async for event in aiter_analysis(params, token):
+        if event["event"] == "result":
+            result = event["result"]
+    return result
@@ -0,0 +1,355 @@
+import hashlib
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+import scripts.constants as const
+from scripts.cache import file_version, get_cache
+from scripts.utils import (
+    extract_metrics_from_excel,
+    load_ifo_data,
+    load_pmi_data,
+    parse_kpi_value,
+    quarter_period,
+)
+
+ANALYTICS_VERSION = 2
+
+
+def bank_kpi_frame(bank_data: Dict) -> pd.DataFrame:
+    """
+    Quarterly bank KPIs as one frame: PeriodIndex (quarters) × (segment, kpi) columns.
+    Fiscal-year and comparison columns are skipped.
+    """
+    series = {}
+    for segment, kpis in bank_data.items():
+        for kpi, values in kpis.items():
+            points = {}
+            for period, value in values.items():
+                quarter = quarter_period(period)
+                if quarter is not None:
+                    points[quarter] = parse_kpi_value(value)
+            if points:
+                series[(segment, kpi)] = pd.Series(points, dtype=float)
+    if not series:
+        return pd.DataFrame()
+    return pd.DataFrame(series).sort_index()
+
+
+def macro_indicator_frame(df_ifo: pd.DataFrame = None, df_pmi: pd.DataFrame = None) -> pd.DataFrame:
+    """Monthly macro indicators with 'source:name' columns and a monthly PeriodIndex."""
+    frames = []
+    if df_ifo is not None and not df_ifo.empty:
+        ifo = df_ifo.select_dtypes("number").add_prefix("ifo:")
+        ifo.index = pd.DatetimeIndex(ifo.index).to_period("M")
+        frames.append(ifo)
+    if df_pmi is not None and not df_pmi.empty:
+        pmi = df_pmi[["Composite_PMI"]].rename(columns={"Composite_PMI": "pmi:composite"})
+        pmi.index = pd.DatetimeIndex(pmi.index).to_period("M")
+        frames.append(pmi)
+    if not frames:
+        return pd.DataFrame()
+    monthly = pd.concat(frames, axis=1).sort_index()
+    return monthly.groupby(level=0).mean()
+
+
+def _pairwise_corr(x: np.ndarray, y: np.ndarray, min_obs: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Pearson correlation of every column of x with every column of y over the
+    time axis, ignoring pairs where either value is missing.
+
+    Args:
+        x (np.ndarray): (..., T, nx)
+        y (np.ndarray): (..., T, ny), broadcastable against x on the leading axes
+        min_obs (int): Pairs with fewer joint observations are NaN
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Correlations and observation counts, (..., nx, ny)
+    """
+    xb = x[..., :, :, None]
+    yb = y[..., :, None, :]
+    valid = ~np.isnan(xb) & ~np.isnan(yb)
+    xv = np.where(valid, xb, 0.0)
+    yv = np.where(valid, yb, 0.0)
+
+    n = valid.sum(axis=-3)
+    sx, sy = xv.sum(axis=-3), yv.sum(axis=-3)
+    sxx, syy, sxy = (xv * xv).sum(axis=-3), (yv * yv).sum(axis=-3), (xv * yv).sum(axis=-3)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cov = sxy - sx * sy / n
+        var = (sxx - sx * sx / n) * (syy - sy * sy / n)
+        corr = cov / np.sqrt(var)
+    corr[(n < min_obs) | ~(var > 1e-12)] = np.nan
+    return corr, n
+
+
+def turning_points(values: np.ndarray, labels: List[str]) -> List[List[Dict]]:
+    """Local peaks and troughs of each column (sign changes of the first difference)."""
+    if len(values) < 3:
+        return [[] for _ in range(values.shape[1])]
+    direction = np.sign(np.diff(values, axis=0))
+    before, after = direction[:-1], direction[1:]
+    peaks = (before > 0) & (after < 0)
+    troughs = (before < 0) & (after > 0)
+    result = [[] for _ in range(values.shape[1])]
+    for t, column in zip(*np.nonzero(peaks | troughs)):
+        result[column].append(
+            {"period": labels[t + 1], "type": "peak" if peaks[t, column] else "trough"}
+        )
+    return result
+
+
+def threshold_crossings(monthly: pd.DataFrame, thresholds: Dict[str, float]) -> Dict[str, List[Dict]]:
+    """Months in which an indicator crossed its threshold, with direction."""
+    columns = [c for c in thresholds if c in monthly.columns]
+    if not columns:
+        return {}
+    values = monthly[columns].to_numpy(dtype=float)
+    limits = np.array([thresholds[c] for c in columns])
+    above = values >= limits
+    known = ~np.isnan(values)
+    crossed = (above[1:] != above[:-1]) & known[1:] & known[:-1]
+    labels = [str(p) for p in monthly.index]
+    result = {c: [] for c in columns}
+    for t, column in zip(*np.nonzero(crossed)):
+        name = columns[column]
+        result[name].append(
+            {
+                "period": labels[t + 1],
+                "direction": "up" if above[t + 1, column] else "down",
+                "threshold": thresholds[name],
+            }
+        )
+    return result
+
+
+def _round(value, digits: int = 3) -> Optional[float]:
+    return None if value is None or np.isnan(value) else round(float(value), digits)
+
+
+def compute_lead_lag(bank_data: Dict, df_ifo: pd.DataFrame = None, df_pmi: pd.DataFrame = None) -> Dict:
+    """
+    Lead-lag statistics for every segment × KPI × macro indicator.
+
+    Macro indicators are averaged per quarter and aligned with the quarterly bank
+    KPIs; correlations for all lags, pairs and rolling windows are computed on
+    stacked arrays in one pass. A positive lag k correlates the KPI in quarter t
+    with the indicator in quarter t - k, i.e. the indicator leads.
+
+    Args:
+        bank_data (Dict): segment → KPI → period → value, from extract_metrics_from_excel
+        df_ifo (pd.DataFrame, optional): Monthly IFO data from load_ifo_data
+        df_pmi (pd.DataFrame, optional): Monthly PMI data from load_pmi_data
+
+    Returns:
+        Dict: JSON-serializable correlations, turning points and threshold crossings
+    """
+    bank = bank_kpi_frame(bank_data)
+    monthly = macro_indicator_frame(df_ifo, df_pmi)
+    if bank.empty or monthly.empty:
+        return {"version": ANALYTICS_VERSION, "periods": [], "indicators": [], "correlations": {}}
+
+    max_lag = const.ANALYTICS_MAX_LAG
+    quarters = pd.period_range(bank.index.min(), bank.index.max(), freq="Q")
+    bank = bank.reindex(quarters)
+    quarterly_macro = monthly.groupby(monthly.index.asfreq("Q")).mean()
+    extended = pd.period_range(quarters[0] - max_lag, quarters[-1] + max_lag, freq="Q")
+    macro_ext = quarterly_macro.reindex(extended)
+
+    x = bank.to_numpy(dtype=float)  # (T, n_bank)
+    y_ext = macro_ext.to_numpy(dtype=float)  # (T + 2 * max_lag, n_macro)
+    lags = np.arange(-max_lag, max_lag + 1)
+    # Indicator value in quarter t - lag for every lag and t: (n_lags, T, n_macro)
+    rows = np.arange(len(quarters))[None, :] + max_lag - lags[:, None]
+    y_lagged = y_ext[rows]
+
+    corr, counts = _pairwise_corr(x, y_lagged, const.ANALYTICS_MIN_OBSERVATIONS)
+
+    window = const.ANALYTICS_ROLLING_WINDOW
+    rolling = None
+    if len(quarters) >= window:
+        # (n_windows, window, n) at lag 0
+        x_windows = np.swapaxes(sliding_window_view(x, window, axis=0), -1, -2)
+        y_windows = np.swapaxes(
+            sliding_window_view(y_lagged[max_lag], window, axis=0), -1, -2
+        )
+        rolling, _ = _pairwise_corr(x_windows, y_windows, window)
+
+    # Best lag per pair by absolute correlation (NaN-safe)
+    abs_corr = np.where(np.isnan(corr), -1.0, np.abs(corr))
+    best = abs_corr.argmax(axis=0)  # (n_bank, n_macro)
+
+    period_labels = [str(p) for p in quarters]
+    window_labels = period_labels[window - 1:]
+    indicators = list(macro_ext.columns)
+
+    correlations: Dict = {}
+    for i, (segment, kpi) in enumerate(bank.columns):
+        by_indicator = {}
+        for j, indicator in enumerate(indicators):
+            b = best[i, j]
+            best_corr = corr[b, i, j]
+            by_indicator[indicator] = {
+                "observations": int(counts[b, i, j]),
+                "lag0": _round(corr[max_lag, i, j]),
+                "best_lag": int(lags[b]) if not np.isnan(best_corr) else None,
+                "best_corr": _round(best_corr),
+                "by_lag": {int(lag): _round(corr[k, i, j]) for k, lag in enumerate(lags)},
+                "rolling": (
+                    {label: _round(rolling[w, i, j]) for w, label in enumerate(window_labels)}
+                    if rolling is not None
+                    else {}
+                ),
+            }
+        correlations.setdefault(segment, {})[kpi] = by_indicator
+
+    bank_turns = turning_points(x, period_labels)
+    macro_turns = turning_points(y_ext, [str(p) for p in extended])
+
+    turning = {"bank": {}, "macro": dict(zip(indicators, macro_turns))}
+    for (segment, kpi), points in zip(bank.columns, bank_turns):
+        turning["bank"].setdefault(segment, {})[kpi] = points
+
+    recent = monthly[monthly.index >= quarters[0].asfreq("M", "start") - 3 * max_lag]
+    latest = {}
+    for indicator in indicators:
+        values = monthly[indicator].dropna()
+        if not values.empty:
+            threshold = const.ANALYTICS_THRESHOLDS.get(indicator)
+            latest[indicator] = {
+                "period": str(values.index[-1]),
+                "value": _round(values.iloc[-1]),
+                "above_threshold": (
+                    bool(values.iloc[-1] >= threshold) if threshold is not None else None
+                ),
+            }
+
+    return {
+        "version": ANALYTICS_VERSION,
+        "periods": period_labels,
+        "lags": [int(lag) for lag in lags],
+        "indicators": indicators,
+        "correlations": correlations,
+        "turning_points": turning,
+        "threshold_crossings": threshold_crossings(recent, const.ANALYTICS_THRESHOLDS),
+        "latest": latest,
+    }
+
+
+def load_analytics(
+    bank_path: str = None, ifo_path: str = None, pmi_path: str = None
+) -> Dict:
+    """
+    Lead-lag analytics for the configured data files, cached until one of the
+    files (or the analytics settings) changes.
+    """
+    bank_path = bank_path or const.BANK_DATA_PATH
+    ifo_path = ifo_path or const.IFO_DATA_PATH
+    pmi_path = pmi_path or const.PMI_DATA_PATH
+    settings = (
+        ANALYTICS_VERSION,
+        const.ANALYTICS_MAX_LAG,
+        const.ANALYTICS_MIN_OBSERVATIONS,
+        const.ANALYTICS_ROLLING_WINDOW,
+        sorted(const.ANALYTICS_THRESHOLDS.items()),
+    )
+    parts = repr((settings, [file_version(p) for p in (bank_path, ifo_path, pmi_path)]))
+    key = hashlib.sha256(parts.encode("utf-8")).hexdigest()
+
+    return get_cache().get_or_compute(
+        "analytics",
+        key,
+        lambda: compute_lead_lag(
+            extract_metrics_from_excel(bank_path),
+            load_ifo_data(ifo_path),
+            load_pmi_data(pmi_path),
+        ),
+    )
+
+
+def _indicator_label(indicator: str) -> str:
+    source, name = indicator.split(":", 1)
+    if source == "pmi":
+        return "PMI composite"
+    return "IFO " + name.replace("_saison_bereinigt", "").replace("_", " ")
+
+
+def _lag_text(lag: int) -> str:
+    if lag > 0:
+        return f"indicator leads by {lag}Q"
+    if lag < 0:
+        return f"KPI leads by {-lag}Q"
+    return "same quarter"
+
+
+def summarize_for_prompt(analytics: Dict, segment_name: str, macro_kpis: List[str]) -> Optional[str]:
+    """
+    Compact text summary of the analytics for one segment and the selected
+    indicator sources ('ifo', 'pmi'), for use in the prompt.
+    """
+    segment = analytics.get("correlations", {}).get(segment_name)
+    if not segment or not macro_kpis:
+        return None
+    periods = analytics["periods"]
+    selected = [i for i in analytics["indicators"] if i.split(":", 1)[0] in macro_kpis]
+    if not selected:
+        return None
+
+    lines = [
+        f"Correlations of quarterly KPIs with quarterly indicator averages, {periods[0]}–{periods[-1]} "
+        f"(lags up to ±{max(analytics['lags'])}Q; r at the strongest lag, r at lag 0 in brackets):"
+    ]
+    for kpi, by_indicator in segment.items():
+        ranked = sorted(
+            (i for i in selected if by_indicator[i]["best_corr"] is not None),
+            key=lambda i: abs(by_indicator[i]["best_corr"]),
+            reverse=True,
+        )[: const.ANALYTICS_PROMPT_TOP]
+        if not ranked:
+            continue
+        lines.append(f"- {kpi.replace('_', ' ')}:")
+        for indicator in ranked:
+            stats = by_indicator[indicator]
+            lag0 = f"{stats['lag0']:+.2f}" if stats["lag0"] is not None else "n/a"
+            rolling = [v for v in stats["rolling"].values() if v is not None]
+            trend = f", last {const.ANALYTICS_ROLLING_WINDOW}Q rolling r {rolling[-1]:+.2f}" if rolling else ""
+            lines.append(
+                f"  - {_indicator_label(indicator)}: r {stats['best_corr']:+.2f} "
+                f"({_lag_text(stats['best_lag'])}) [{lag0}]{trend}, n={stats['observations']}"
+            )
+
+    turns = analytics.get("turning_points", {})
+    bank_turns = turns.get("bank", {}).get(segment_name, {})
+    turn_lines = []
+    for kpi, points in bank_turns.items():
+        if points:
+            last = points[-1]
+            turn_lines.append(f"{kpi.replace('_', ' ')}: last {last['type']} {last['period']}")
+    for indicator in selected:
+        points = turns.get("macro", {}).get(indicator, [])
+        if points and indicator in const.ANALYTICS_THRESHOLDS:
+            last = points[-1]
+            turn_lines.append(f"{_indicator_label(indicator)}: last {last['type']} {last['period']}")
+    if turn_lines:
+        lines.append("Turning points: " + "; ".join(turn_lines))
+
+    for indicator in selected:
+        crossings = analytics.get("threshold_crossings", {}).get(indicator, [])
+        latest = analytics.get("latest", {}).get(indicator)
+        if indicator not in const.ANALYTICS_THRESHOLDS or latest is None:
+            continue
+        threshold = const.ANALYTICS_THRESHOLDS[indicator]
+        text = (
+            f"{_indicator_label(indicator)} latest {latest['value']} ({latest['period']}), "
+            f"{'above' if latest['above_threshold'] else 'below'} {threshold}"
+        )
+        if crossings:
+            text += "; crossings: " + ", ".join(
+                f"{c['direction']} {c['period']}" for c in crossings[-4:]
+            )
+        lines.append(text)
+
+    return "\n".join(lines)
@@ -1,61 +1,936 @@
+import asyncio
+import hashlib
 import os
+import random
+import threading
 import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from datetime import timedelta
+from typing import Dict, Optional
+
 from dotenv import load_dotenv
-import google.generativeai as genai
 
 import scripts.constants as const
+from scripts import log, metrics, telemetry
+from scripts.async_io import run_io, sleep
+from scripts.cache import file_version, get_cache
+from scripts.cancellation import CancelToken, RequestCancelled, check
+from scripts.prompt_cache import PrefixCache
 
 # Load API Key
 load_dotenv()
-api_key = os.getenv("GOOGLE_API_KEY")
-if not api_key:
-    raise ValueError(
-        "API key not found. Please set 'GOOGLE_API_KEY' in your .env file."
-    )
+
+logger = log.get_logger("model")
+
+
+class GeminiBackend:
+    """Model calls through the Google Generative AI SDK."""
+
+    def __init__(self, model_name: str):
+        import google.generativeai as genai
+
+        self.genai = genai
+        self.model_name = model_name
+        self.model = genai.GenerativeModel(model_name)
+        self._cached_models = {}
+
+    def upload_file(self, path: str):
+        return self.genai.upload_file(path=path, display_name="PMI_PDF")
+
+    def delete_file(self, uploaded):
+        self.genai.delete_file(uploaded.name)
+
+    def create_cached_context(self, prefix: str, ttl: int):
+        from google.generativeai import caching
+
+        cached = caching.CachedContent.create(
+            model=f"models/{self.model_name}",
+            display_name="finai-instruction-prefix",
+            contents=[prefix],
+            ttl=timedelta(seconds=ttl),
+        )
+        self._cached_models[cached.name] = self.genai.GenerativeModel.from_cached_content(
+            cached_content=cached
+        )
+        return cached.name
+
+    def delete_cached_context(self, handle):
+        from google.generativeai import caching
+
+        self._cached_models.pop(handle, None)
+        caching.CachedContent.get(handle).delete()
+
+    def generate(self, content, generation_config: Dict, cached_context=None, timeout=None) -> Dict:
+        """Streams the response to time its first token. Returns the reply (see _reply)."""
+        model = self.model
+        if cached_context is not None:
+            model = self._cached_models[cached_context]
+        request_options = {"timeout": timeout} if timeout else None
+        started = time.monotonic()
+        response = model.generate_content(
+            content, generation_config=generation_config, request_options=request_options, stream=True
+        )
+        ttft, parts = None, []
+        for chunk in response:
+            text = _chunk_text(chunk)
+            if text and ttft is None:
+                ttft = time.monotonic() - started
+            parts.append(text)
+        return _reply("".join(parts), response, ttft)
+
+    async def agenerate(self, content, generation_config: Dict, cached_context=None, timeout=None) -> Dict:
+        model = self.model
+        if cached_context is not None:
+            model = self._cached_models[cached_context]
+        request_options = {"timeout": timeout} if timeout else None
+        started = time.monotonic()
+        response = await model.generate_content_async(
+            content, generation_config=generation_config, request_options=request_options, stream=True
+        )
+        ttft, parts = None, []
+        async for chunk in response:
+            text = _chunk_text(chunk)
+            if text and ttft is None:
+                ttft = time.monotonic() - started
+            parts.append(text)
+        return _reply("".join(parts), response, ttft)
+
+
+def _chunk_text(chunk) -> str:
+    try:
+        return chunk.text
+    except ValueError:  # A chunk without text, e.g. the one carrying only the finish reason
+        return ""
+
+
+def _reply(text: str, response, ttft: Optional[float]) -> Dict:
+    """
+    Text and usage of a streamed Gemini response.
+
+    Returns:
+        Dict: text, ttft (seconds), prompt_tokens (including cached_tokens),
+            cached_tokens, output_tokens and finish_reason (e.g. STOP, MAX_TOKENS)
+
+    Raises:
+        ValueError: If the response has no text (e.g. blocked)
+    """
+    candidates = getattr(response, "candidates", None) or []
+    finish_reason = getattr(candidates[0].finish_reason, "name", None) if candidates else None
+    if not text:
+        raise ValueError(f"Empty model response (finish reason {finish_reason})")
+    usage = getattr(response, "usage_metadata", None)
+    return {
+        "text": text,
+        "ttft": ttft,
+        "prompt_tokens": getattr(usage, "prompt_token_count", None),
+        "cached_tokens": getattr(usage, "cached_content_token_count", None),
+        "output_tokens": getattr(usage, "candidates_token_count", None),
+        "finish_reason": finish_reason,
+    }
+
+
+class FakeBackend:
+    """
+    Local stand-in for the model API, used for tests and benchmarks.
+    Latency, tail latency and error rate are configured in constants.
+    """
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self.cached_contexts = {}
+
+    def upload_file(self, path: str):
+        return path
+
+    def delete_file(self, uploaded):
+        pass
+
+    def create_cached_context(self, prefix: str, ttl: int):
+        handle = f"cachedContents/fake-{len(self.cached_contexts) + 1}"
+        self.cached_contexts[handle] = prefix
+        return handle
+
+    def delete_cached_context(self, handle):
+        self.cached_contexts.pop(handle, None)
+
+    def _latency(self, cached_context) -> float:
+        if cached_context is not None and cached_context not in self.cached_contexts:
+            raise KeyError(f"Cached content {cached_context} not found")
+        if random.random() < const.FAKE_MODEL_SLOW_RATE:
+            return const.FAKE_MODEL_SLOW_LATENCY
+        return const.FAKE_MODEL_LATENCY
+
+    def _plan(self, content, generation_config: Dict, cached_context):
+        """Reply and latency of a call; an answer cut off by max_output_tokens ends early."""
+        latency = self._latency(cached_context)
+        longest = max(1, const.FAKE_MODEL_OUTPUT_TOKENS)
+        wanted = random.randint(max(1, longest // 2), longest)
+        output = min(wanted, generation_config.get("max_output_tokens") or wanted)
+        ttft = latency * const.FAKE_MODEL_TTFT_SHARE
+        prompt = content[0] if content else ""
+        cached = self.cached_contexts.get(cached_context, "")
+        reply = {
+            "text": (
+                f"[{self.model_name}] Generated analysis for a prompt of {len(prompt)} "
+                f"characters ({len(cached)} cached) and {len(content) - 1} attachment(s)."
+            ),
+            "ttft": ttft,
+            # About four characters per token
+            "prompt_tokens": (len(prompt) + len(cached)) // 4,
+            "cached_tokens": len(cached) // 4,
+            "output_tokens": output,
+            "finish_reason": "MAX_TOKENS" if output < wanted else "STOP",
+        }
+        return reply, ttft + (latency - ttft) * output / wanted
+
+    def generate(self, content, generation_config: Dict, cached_context=None, timeout=None) -> Dict:
+        reply, latency = self._plan(content, generation_config, cached_context)
+        if timeout and latency > timeout:
+            time.sleep(timeout)
+            raise TimeoutError("Fake backend request timed out")
+        time.sleep(latency)
+        self._fail_randomly()
+        return reply
+
+    async def agenerate(self, content, generation_config: Dict, cached_context=None, timeout=None) -> Dict:
+        reply, latency = self._plan(content, generation_config, cached_context)
+        if timeout and latency > timeout:
+            await asyncio.sleep(timeout)
+            raise TimeoutError("Fake backend request timed out")
+        await asyncio.sleep(latency)
+        self._fail_randomly()
+        return reply
+
+    def _fail_randomly(self):
+        if random.random() < const.FAKE_MODEL_ERROR_RATE:
+            raise RuntimeError("Fake backend error")
+
+
+def _create_backend(model_name: str):
+    if const.MODEL_BACKEND == "fake":
+        return FakeBackend(model_name)
+
+    api_key = os.getenv("GOOGLE_API_KEY")
+    if not api_key:
+        raise ValueError(
+            "API key not found. Please set 'GOOGLE_API_KEY' in your .env file."
+        )
+    import google.generativeai as genai
+
+    genai.configure(api_key=api_key)
+    return GeminiBackend(model_name)
+
 
 # Configuration
-genai.configure(api_key=api_key)
-model = genai.GenerativeModel(const.MODEL)
+model = _create_backend(const.MODEL)
+fallback_model = (
+    _create_backend(const.FALLBACK_MODEL)
+    if const.HEDGE_USE_FALLBACK_MODEL and const.FALLBACK_MODEL != const.MODEL
+    else model
+)
 
+# Deletes uploads of cancelled requests off the event loop
+_cleanup_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="model-cleanup")
+# Model requests of all analyses, hedges included. Requests abandoned by cancellation
+# keep their thread until they time out, so the pool has room beyond the live calls
+_call_pool = ThreadPoolExecutor(
+    max_workers=const.MODEL_CALL_MAX_WORKERS, thread_name_prefix="model-call"
+)
+_latencies = deque(maxlen=const.HEDGE_LATENCY_WINDOW)
+_latencies_lock = threading.Lock()
+prefix_cache = PrefixCache()
 
-def call_gemini_with_retry(prompt: str, pmi_pdf_path=None, max_tokens=8192) -> str:
-    if not prompt or not prompt.strip():
-        raise ValueError("Prompt must not be empty!")
-    content = [prompt]
+MODEL_CALLS = metrics.counter(
+    "finai_model_calls_total", "Model requests by role (primary/hedge) and outcome"
+)
+MODEL_LATENCY = metrics.histogram(
+    "finai_model_latency_seconds", "Latency of successful model requests by role"
+)
+HEDGES_FIRED = metrics.counter(
+    "finai_model_hedges_total", "Hedge requests issued after the hedge delay"
+)
+HEDGE_WINS = metrics.counter(
+    "finai_model_hedge_wins_total", "Responses won by the hedge request"
+)
+MODEL_CALL_THREADS = metrics.gauge(
+    "finai_model_call_threads", "Model-call pool threads running a request, including requests abandoned by cancellation"
+)
+BUDGET_RETRIES = metrics.counter(
+    "finai_model_budget_retries_total", "Answers cut off by the adaptive output budget and requested again"
+)
+
+
+class Attachments:
+    """
+    Files attached to the model calls of one analysis. Each file is uploaded on
+    first use and the handle is shared by all sections. release() deletes the
+    uploads once the analysis is done. A cancelled token deletes them as well.
+    Uploads still running on the event loop are deleted when they complete.
+    """
+
+    def __init__(self, token: CancelToken = None):
+        self._uploads = {}  # path -> Future (threads) or Task (event loop) of the handle
+        self._lock = threading.Lock()
+        self._released = False
+        self._settled = set()  # Tasks whose deletion was scheduled
+        if token is not None:
+            token.on_cancel(self.release)
+
+    def get(self, path: str, token: CancelToken = None):
+        """Handle of the uploaded file; the first caller uploads, the others wait for it."""
+        with self._lock:
+            future = self._uploads.get(path)
+            owner = future is None
+            if owner:
+                future = self._uploads[path] = Future()
+        if owner:
+            try:
+                check(token, "model_upload")
+                future.set_result(model.upload_file(path))
+            except BaseException as e:
+                with self._lock:
+                    self._uploads.pop(path, None)  # The next section tries again
+                future.set_exception(e)
+        _wait_first([future], token=token)
+        return future.result()
+
+    async def aget(self, path: str, token: CancelToken = None):
+        """get() for the asyncio server."""
+        check(token, "model_upload")
+        task = self._uploads.get(path)
+        if task is None or (task.done() and (task.cancelled() or task.exception() is not None)):
+            task = self._uploads[path] = asyncio.ensure_future(run_io(model.upload_file, path))
+            task.add_done_callback(self._uploaded)
+        # A cancelled section must not cancel the upload the others wait for
+        return await asyncio.shield(task)
+
+    def release(self):
+        """Delete the uploads in the background."""
+        with self._lock:
+            self._released = True
+            uploads, self._uploads = list(self._uploads.values()), {}
+        # Tasks still running are deleted by _uploaded once they complete
+        uploads = [u for u in uploads if isinstance(u, Future) or (u.done() and self._settle(u))]
+        if uploads:
+            _cleanup_pool.submit(self._delete, uploads)
+
+    def _settle(self, task) -> bool:
+        """True for the first caller only, so a task is deleted once."""
+        with self._lock:
+            if task in self._settled:
+                return False
+            self._settled.add(task)
+            return True
+
+    def _uploaded(self, task):
+        """Done-callback of an upload task: deletes it if the analysis was released meanwhile."""
+        with self._lock:
+            released = self._released
+        if released and self._settle(task):
+            _cleanup_pool.submit(self._delete, [task])
+
+    @staticmethod
+    def _delete(uploads):
+        for upload in uploads:
+            try:
+                if isinstance(upload, Future):
+                    handle = upload.result(timeout=const.MODEL_CALL_TIMEOUT)
+                else:
+                    failed = upload.cancelled() or upload.exception() is not None
+                    handle = None if failed else upload.result()
+                if handle is not None:
+                    model.delete_file(handle)
+            except Exception as e:
+                logger.warning("Uploaded attachment could not be deleted: %s", e)
+
+
+def hedge_delay() -> float:
+    """Delay before hedging: the configured percentile of recent primary latencies."""
+    with _latencies_lock:
+        samples = sorted(_latencies)
+    if len(samples) < const.HEDGE_MIN_SAMPLES:
+        return const.HEDGE_DEFAULT_DELAY
+    rank = int(round(const.HEDGE_PERCENTILE / 100 * (len(samples) - 1)))
+    return min(max(samples[rank], const.HEDGE_MIN_DELAY), const.HEDGE_MAX_DELAY)
+
+
+def _request_content(backend, request: Dict):
+    """Content to send and the provider-side cached prefix, registering it if needed."""
+    prefix = request.get("prefix")
+    cached_context = prefix_cache.get(backend, prefix) if prefix else None
+    if cached_context is not None:
+        # The provider already holds the prefix; only the suffix is sent
+        content = [request["prompt"]] + request["attachments"]
+    else:
+        content = [(prefix or "") + request["prompt"]] + request["attachments"]
+    return content, cached_context
+
+
+def _record_failure(backend, role: str, request: Dict, cached_context, error: Exception):
+    MODEL_CALLS.inc(role=role, outcome="error")
+    if cached_context is not None and "not found" in str(error).lower():
+        # The provider dropped the cached prefix; register it anew on the next attempt
+        prefix_cache.invalidate(backend, request.get("prefix"))
+
+
+def _record_success(role: str, latency: float):
+    MODEL_CALLS.inc(role=role, outcome="ok")
+    MODEL_LATENCY.observe(latency, role=role)
+    if role == "primary":
+        with _latencies_lock:
+            _latencies.append(latency)
+
+
+def _timed_generate(backend, role: str, request: Dict, generation_config: Dict):
+    content, cached_context = _request_content(backend, request)
+    started = time.monotonic()
+    try:
+        reply = backend.generate(
+            content,
+            generation_config,
+            cached_context=cached_context,
+            timeout=request.get("timeout"),
+        )
+    except Exception as e:
+        _record_failure(backend, role, request, cached_context, e)
+        raise
+    latency = time.monotonic() - started
+    _record_success(role, latency)
+    return reply, latency
+
+
+async def _timed_generate_async(backend, role: str, request: Dict, generation_config: Dict):
+    # Registering the prefix is a blocking provider call on a cache miss
+    content, cached_context = await run_io(_request_content, backend, request)
+    started = time.monotonic()
+    try:
+        reply = await backend.agenerate(
+            content,
+            generation_config,
+            cached_context=cached_context,
+            timeout=request.get("timeout"),
+        )
+    except Exception as e:
+        await run_io(_record_failure, backend, role, request, cached_context, e)
+        raise
+    latency = time.monotonic() - started
+    _record_success(role, latency)
+    return reply, latency
+
+
+def _start_call(fn, *args) -> Future:
+    """
+    Run a model request on the shared model-call pool. A request that was sent
+    cannot be aborted, so a cancelled analysis leaves it running until its
+    timeout; a request still queued is dropped when its future is cancelled.
+    """
+
+    def run():
+        MODEL_CALL_THREADS.inc()
+        try:
+            return fn(*args)
+        finally:
+            MODEL_CALL_THREADS.dec()
+
+    return _call_pool.submit(log.bind(run))
+
+
+def _attempt_timeout(token: Optional[CancelToken]) -> float:
+    """Timeout of one model request: MODEL_CALL_TIMEOUT, less if the deadline comes first."""
+    remaining = token.remaining() if token is not None else None
+    return const.MODEL_CALL_TIMEOUT if remaining is None else min(remaining, const.MODEL_CALL_TIMEOUT)
 
-    if pmi_pdf_path:
-        pmi_pdf = genai.upload_file(path=pmi_pdf_path, display_name="PMI_PDF")
-        content.append(pmi_pdf)
 
+def _wait_first(futures, timeout: float = None, token: CancelToken = None):
+    """
+    wait(return_when=FIRST_COMPLETED) that gives up on the futures once the token
+    is cancelled. Requests already sent cannot be aborted; they run until their
+    own timeout (at most MODEL_CALL_TIMEOUT) and their results are discarded.
+
+    Raises:
+        RequestCancelled: If the token was cancelled before a future completed
+    """
+    if token is None:
+        return wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+    end = time.monotonic() + timeout if timeout is not None else None
+    while True:
+        step = const.CANCEL_POLL_INTERVAL
+        if end is not None:
+            step = min(step, max(0.0, end - time.monotonic()))
+        done, pending = wait(futures, timeout=step, return_when=FIRST_COMPLETED)
+        if done:
+            return done, pending
+        if token.cancelled:
+            for future in pending:
+                future.cancel()
+            token.check("model_call")
+        if end is not None and time.monotonic() >= end:
+            return done, pending
+
+
+async def _wait_first_async(tasks, timeout: float = None, token: CancelToken = None):
+    """
+    _wait_first for asyncio tasks. Once the token is cancelled the pending tasks
+    are cancelled as well, which aborts the model requests in flight.
+
+    Raises:
+        RequestCancelled: If the token was cancelled before a task completed
+    """
+    if token is None:
+        return await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+    end = time.monotonic() + timeout if timeout is not None else None
+    while True:
+        step = const.CANCEL_POLL_INTERVAL
+        if end is not None:
+            step = min(step, max(0.0, end - time.monotonic()))
+        done, pending = await asyncio.wait(
+            tasks, timeout=step, return_when=asyncio.FIRST_COMPLETED
+        )
+        if done:
+            return done, pending
+        if token.cancelled:
+            for task in pending:
+                task.cancel()
+            token.check("model_call")
+        if end is not None and time.monotonic() >= end:
+            return done, pending
+
+
+def _generate_hedged(
+    request: Dict, generation_config: Dict, stats: Dict, token: CancelToken = None
+) -> Dict:
+    """
+    Run the primary request and, if it has not answered within the hedge delay,
+    a second one (on the fallback model if configured). The first successful
+    response wins; the other request is cancelled if it has not started yet,
+    otherwise its result is discarded.
+    """
+    delay = hedge_delay()
+    stats["hedge_delay"] = round(delay, 3)
+    started = time.monotonic()
+    primary = _start_call(_timed_generate, model, "primary", request, generation_config)
+    roles = {primary: "primary"}
+
+    done, _ = _wait_first([primary], delay, token)
+    if not done:
+        hedge = _start_call(_timed_generate, fallback_model, "hedge", request, generation_config)
+        roles[hedge] = "hedge"
+        stats["hedges"] = stats.get("hedges", 0) + 1
+        HEDGES_FIRED.inc(model=fallback_model.model_name)
+        logger.info("Primary call slower than %.1fs, sending hedge request ...", delay)
+
+    pending = set(roles)
+    error = None
+    while pending:
+        done, pending = _wait_first(pending, token=token)
+        for future in done:
+            if future.exception() is not None:
+                error = error or future.exception()
+                continue
+            reply, _ = future.result()
+            for other in pending:
+                other.cancel()
+            stats["winner"] = roles[future]
+            stats["model"] = (fallback_model if roles[future] == "hedge" else model).model_name
+            stats["latency"] = round(time.monotonic() - started, 3)
+            if roles[future] == "hedge":
+                HEDGE_WINS.inc(model=fallback_model.model_name)
+            return reply
+    raise error
+
+
+async def _generate_hedged_async(
+    request: Dict, generation_config: Dict, stats: Dict, token: CancelToken = None
+) -> Dict:
+    """_generate_hedged on the event loop; the losing request is cancelled outright."""
+    delay = hedge_delay()
+    stats["hedge_delay"] = round(delay, 3)
+    started = time.monotonic()
+    primary = asyncio.ensure_future(
+        _timed_generate_async(model, "primary", request, generation_config)
+    )
+    roles = {primary: "primary"}
+    try:
+        done, _ = await _wait_first_async([primary], delay, token)
+        if not done:
+            hedge = asyncio.ensure_future(
+                _timed_generate_async(fallback_model, "hedge", request, generation_config)
+            )
+            roles[hedge] = "hedge"
+            stats["hedges"] = stats.get("hedges", 0) + 1
+            HEDGES_FIRED.inc(model=fallback_model.model_name)
+            logger.info("Primary call slower than %.1fs, sending hedge request ...", delay)
+
+        pending = set(roles)
+        error = None
+        while pending:
+            done, pending = await _wait_first_async(pending, token=token)
+            for task in done:
+                if task.exception() is not None:
+                    error = error or task.exception()
+                    continue
+                reply, _ = task.result()
+                stats["winner"] = roles[task]
+                stats["model"] = (fallback_model if roles[task] == "hedge" else model).model_name
+                stats["latency"] = round(time.monotonic() - started, 3)
+                if roles[task] == "hedge":
+                    HEDGE_WINS.inc(model=fallback_model.model_name)
+                return reply
+        raise error
+    finally:
+        for task in roles:
+            task.cancel()
+
+
+def _generation_config(max_tokens: int) -> Dict:
+    return {
+        "temperature": 1,
+        "top_p": 0.95,
+        "top_k": 40,
+        "max_output_tokens": max_tokens,
+        "response_mime_type": "text/plain",
+    }
+
+
+def _generate_with_retries(
+    request: Dict, generation_config: Dict, stats: Dict, token: CancelToken = None
+) -> Dict:
     for attempt in range(1, const.MAX_RETRIES + 1):
+        check(token, "model_call")
+        stats["attempts"] = attempt
+        request["timeout"] = _attempt_timeout(token)
         try:
-            print(f"Call AI (Attempt {attempt}/{const.MAX_RETRIES}) ...")
-
-            response = model.generate_content(
-                content,
-                generation_config={
-                    "temperature": 1,
-                    "top_p": 0.95,
-                    "top_k": 40,
-                    "max_output_tokens": max_tokens,
-                    "response_mime_type": "text/plain",
-                },
+            logger.debug("Call AI (Attempt %d/%d) ...", attempt, const.MAX_RETRIES)
+
+            if const.HEDGE_ENABLED:
+                return _generate_hedged(request, generation_config, stats, token)
+
+            if token is None:
+                reply, latency = _timed_generate(
+                    model, "primary", request, generation_config
+                )
+            else:
+                # Run aside so a cancelled request stops waiting right away
+                future = _start_call(_timed_generate, model, "primary", request, generation_config)
+                _wait_first([future], token=token)
+                reply, latency = future.result()
+            stats.update(
+                {"winner": "primary", "model": model.model_name, "latency": round(latency, 3)}
             )
-            return response.text
+            return reply
 
+        except RequestCancelled:
+            raise
         except Exception as e:
-            print(
-                f"Error at AI call (Attempt {attempt}/{const.MAX_RETRIES}): {type(e).__name__}: {e}"
+            logger.warning(
+                "Error at AI call (Attempt %d/%d): %s: %s",
+                attempt, const.MAX_RETRIES, type(e).__name__, e,
             )
-            if attempt < const.MAX_RETRIES:
+            if attempt >= const.MAX_RETRIES:
+                raise
+            if token is None:
                 time.sleep(const.RETRY_DELAY)
-            else:
+            elif token.wait(const.RETRY_DELAY):
+                token.check("model_retry")
+
+
+async def _generate_with_retries_async(
+    request: Dict, generation_config: Dict, stats: Dict, token: CancelToken = None
+) -> Dict:
+    for attempt in range(1, const.MAX_RETRIES + 1):
+        check(token, "model_call")
+        stats["attempts"] = attempt
+        request["timeout"] = _attempt_timeout(token)
+        try:
+            logger.debug("Call AI (Attempt %d/%d) ...", attempt, const.MAX_RETRIES)
+
+            if const.HEDGE_ENABLED:
+                return await _generate_hedged_async(request, generation_config, stats, token)
+
+            task = asyncio.ensure_future(
+                _timed_generate_async(model, "primary", request, generation_config)
+            )
+            try:
+                await _wait_first_async([task], token=token)
+            finally:
+                task.cancel()  # No-op once the task is done
+            reply, latency = task.result()
+            stats.update(
+                {"winner": "primary", "model": model.model_name, "latency": round(latency, 3)}
+            )
+            return reply
+
+        except RequestCancelled:
+            raise
+        except Exception as e:
+            logger.warning(
+                "Error at AI call (Attempt %d/%d): %s: %s",
+                attempt, const.MAX_RETRIES, type(e).__name__, e,
+            )
+            if attempt >= const.MAX_RETRIES:
                 raise
+            await sleep(const.RETRY_DELAY, token, "model_retry")
+
 
+def _truncated_by_budget(reply: Dict, budget: int, max_tokens: int, stats: Dict, request_type: str) -> bool:
+    """True if the adaptive budget cut the answer short, so it is requested again with max_tokens."""
+    if reply.get("finish_reason") != "MAX_TOKENS" or budget >= max_tokens:
+        return False
+    stats["budget_retry"] = True
+    BUDGET_RETRIES.inc(request_type=request_type or "other")
+    logger.info("Answer cut off at the adaptive budget of %d tokens, repeating with %d", budget, max_tokens)
+    return True
 
-def generate_response(prompt: str, pmi_pdf_path=None) -> str:
-    print("Request: Generating response...")
-    raw_response = call_gemini_with_retry(prompt, pmi_pdf_path)
-    with open("response.json", "w", encoding="utf-8") as f:
-        f.write(raw_response)
+
+def _usage_stats(reply: Dict, budget: int) -> Dict:
+    return {
+        "ttft": round(reply["ttft"], 3) if reply.get("ttft") is not None else None,
+        "prompt_tokens": reply.get("prompt_tokens"),
+        "cached_tokens": reply.get("cached_tokens"),
+        "output_tokens": reply.get("output_tokens"),
+        "finish_reason": reply.get("finish_reason"),
+        "max_output_tokens": budget,
+    }
+
+
+def _record_call(request: Dict, tags: Optional[Dict], stats: Dict, started: float, outcome: str, error=None):
+    telemetry.record_call(
+        {
+            **(tags or {}),
+            "model": stats.get("model") or model.model_name,
+            "prompt_chars": len(request.get("prefix") or "") + len(request["prompt"]),
+            "latency": time.monotonic() - started,
+            "attempts": stats.get("attempts"),
+            "hedges": stats.get("hedges"),
+            "budget_retry": int(bool(stats.get("budget_retry"))),
+            "outcome": outcome,
+            "error": f"{type(error).__name__}: {error}"[:500] if error is not None else None,
+            **{
+                key: stats.get(key)
+                for key in ("ttft", "prompt_tokens", "cached_tokens", "output_tokens", "finish_reason", "max_output_tokens")
+            },
+        }
+    )
+
+
+def call_gemini_with_retry(
+    prompt: str,
+    pmi_pdf_path=None,
+    max_tokens=8192,
+    stats: Optional[Dict] = None,
+    prefix: Optional[str] = None,
+    token: CancelToken = None,
+    tags: Optional[Dict] = None,
+    attachments: Optional[Attachments] = None,
+) -> str:
+    """
+    Call the model with retries; with hedging enabled, slow calls are hedged.
+
+    Args:
+        prompt (str): Rendered prompt, or only its dynamic suffix if prefix is given
+        pmi_pdf_path (str, optional): PDF attached to the request
+        max_tokens (int): Maximum output tokens; with ADAPTIVE_BUDGET the observed
+            budget of the request type, if lower, and max_tokens only for an answer
+            cut off by it
+        stats (Dict, optional): Filled with per-request statistics
+            (attempts, hedges, winner, model, latency, hedge_delay, ttft,
+            prompt/cached/output tokens, finish_reason, max_output_tokens)
+        prefix (str, optional): Static prompt prefix, registered once as a cached
+            context with the provider and sent in full only if caching is unavailable
+        token (CancelToken, optional): Bounds each call by the remaining request time;
+            no further attempts are made once it is cancelled
+        tags (Dict, optional): request_type, segment, indicators and document_tokens
+            of the call, recorded with its telemetry
+        attachments (Attachments, optional): Uploads shared with the other calls of
+            the analysis; without it pmi_pdf_path is uploaded for this call alone
+
+    Returns:
+        str: Model response text
+
+    Raises:
+        RequestCancelled: If the token was cancelled before a response arrived
+    """
+    if not prompt or not prompt.strip():
+        raise ValueError("Prompt must not be empty!")
+    stats = stats if stats is not None else {}
+    stats.update({"hedging": const.HEDGE_ENABLED, "hedges": 0})
+    request = {"prompt": prompt, "prefix": prefix, "attachments": []}
+    started = time.monotonic()
+
+    try:
+        if pmi_pdf_path and attachments is not None:
+            request["attachments"].append(attachments.get(pmi_pdf_path, token))
+        elif pmi_pdf_path:
+            check(token, "model_upload")
+            pmi_pdf = model.upload_file(pmi_pdf_path)
+            request["attachments"].append(pmi_pdf)
+            if token is not None:
+                # Do not leave the upload behind at the provider if nobody waits for it
+                token.on_cancel(lambda: model.delete_file(pmi_pdf))
+
+        request_type = (tags or {}).get("request_type")
+        budget = telemetry.output_budget(model.model_name, request_type, max_tokens)
+        stats["max_output_tokens"] = budget
+        reply = _generate_with_retries(request, _generation_config(budget), stats, token)
+        if _truncated_by_budget(reply, budget, max_tokens, stats, request_type):
+            attempts, budget = stats["attempts"], max_tokens
+            reply = _generate_with_retries(request, _generation_config(budget), stats, token)
+            stats["attempts"] += attempts
+        stats.update(_usage_stats(reply, budget))
+    except RequestCancelled as e:
+        _record_call(request, tags, stats, started, "cancelled", e)
+        raise
+    except Exception as e:
+        _record_call(request, tags, stats, started, "error", e)
+        raise
+    _record_call(request, tags, stats, started, "ok")
+    return reply["text"]
+
+
+async def call_gemini_with_retry_async(
+    prompt: str,
+    pmi_pdf_path=None,
+    max_tokens=8192,
+    stats: Optional[Dict] = None,
+    prefix: Optional[str] = None,
+    token: CancelToken = None,
+    tags: Optional[Dict] = None,
+    attachments: Optional[Attachments] = None,
+) -> str:
+    """
+    call_gemini_with_retry for the asyncio server. Waiting for the model holds no
+    thread, and a cancelled token aborts the request in flight instead of
+    letting it run to its timeout. Arguments and statistics are the same.
+
+    Raises:
+        RequestCancelled: If the token was cancelled before a response arrived
+    """
+    if not prompt or not prompt.strip():
+        raise ValueError("Prompt must not be empty!")
+    stats = stats if stats is not None else {}
+    stats.update({"hedging": const.HEDGE_ENABLED, "hedges": 0})
+    request = {"prompt": prompt, "prefix": prefix, "attachments": []}
+    started = time.monotonic()
+
+    try:
+        if pmi_pdf_path and attachments is not None:
+            request["attachments"].append(await attachments.aget(pmi_pdf_path, token))
+        elif pmi_pdf_path:
+            check(token, "model_upload")
+            pmi_pdf = await run_io(model.upload_file, pmi_pdf_path)
+            request["attachments"].append(pmi_pdf)
+            if token is not None:
+                # The callback may run on the event loop, so delete in the background
+                token.on_cancel(lambda: _cleanup_pool.submit(model.delete_file, pmi_pdf))
+
+        request_type = (tags or {}).get("request_type")
+        budget = telemetry.output_budget(model.model_name, request_type, max_tokens)
+        stats["max_output_tokens"] = budget
+        reply = await _generate_with_retries_async(request, _generation_config(budget), stats, token)
+        if _truncated_by_budget(reply, budget, max_tokens, stats, request_type):
+            attempts, budget = stats["attempts"], max_tokens
+            reply = await _generate_with_retries_async(request, _generation_config(budget), stats, token)
+            stats["attempts"] += attempts
+        stats.update(_usage_stats(reply, budget))
+    except (RequestCancelled, asyncio.CancelledError) as e:
+        _record_call(request, tags, stats, started, "cancelled", e)
+        raise
+    except Exception as e:
+        _record_call(request, tags, stats, started, "error", e)
+        raise
+    _record_call(request, tags, stats, started, "ok")
+    return reply["text"]
+
+
+def _response_cache_key(
+    prompt: str, pmi_pdf_path=None, prefix: Optional[str] = None, max_tokens: int = 8192
+) -> str:
+    hasher = hashlib.sha256()
+    for part in (model.model_name, str(max_tokens), prefix or "", prompt):
+        hasher.update(part.encode("utf-8"))
+        hasher.update(b"\0")
+    if pmi_pdf_path:
+        hasher.update(file_version(pmi_pdf_path).encode("utf-8"))
+    return hasher.hexdigest()
+
+
+def generate_response(
+    prompt: str,
+    pmi_pdf_path=None,
+    stats: Optional[Dict] = None,
+    prefix: Optional[str] = None,
+    token: CancelToken = None,
+    max_tokens: int = 8192,
+    tags: Optional[Dict] = None,
+    attachments: Optional[Attachments] = None,
+) -> str:
+    logger.debug("Request: Generating response...")
+    prefix_cache.purge_expired()
+    log.log_payload("prompt", prefix, prompt)
+
+    cache_key = None
+    if const.RESPONSE_CACHE_TTL > 0:
+        cache_key = _response_cache_key(prompt, pmi_pdf_path, prefix, max_tokens)
+        raw_response = get_cache().get("model-response", cache_key)
+        if raw_response is not None:
+            if stats is not None:
+                stats.update({"cached": True, "attempts": 0})
+            return raw_response
+
+    raw_response = call_gemini_with_retry(
+        prompt,
+        pmi_pdf_path,
+        max_tokens,
+        stats=stats,
+        prefix=prefix,
+        token=token,
+        tags=tags,
+        attachments=attachments,
+    )
+    if cache_key is not None:
+        get_cache().set("model-response", cache_key, raw_response, const.RESPONSE_CACHE_TTL)
+    log.log_payload("response", raw_response)
+    return raw_response
+
+
+async def generate_response_async(
+    prompt: str,
+    pmi_pdf_path=None,
+    stats: Optional[Dict] = None,
+    prefix: Optional[str] = None,
+    token: CancelToken = None,
+    max_tokens: int = 8192,
+    tags: Optional[Dict] = None,
+    attachments: Optional[Attachments] = None,
+) -> str:
+    """generate_response for the asyncio server; cache and file access run in the I/O pool."""
+    logger.debug("Request: Generating response...")
+    await run_io(prefix_cache.purge_expired)
+    log.log_payload("prompt", prefix, prompt)
+
+    cache_key = None
+    if const.RESPONSE_CACHE_TTL > 0:
+        cache_key = _response_cache_key(prompt, pmi_pdf_path, prefix, max_tokens)
+        raw_response = await run_io(get_cache().get, "model-response", cache_key)
+        if raw_response is not None:
+            if stats is not None:
+                stats.update({"cached": True, "attempts": 0})
+            return raw_response
+
+    raw_response = await call_gemini_with_retry_async(
+        prompt,
+        pmi_pdf_path,
+        max_tokens,
+        stats=stats,
+        prefix=prefix,
+        token=token,
+        tags=tags,
+        attachments=attachments,
+    )
+    if cache_key is not None:
+        await run_io(
+            get_cache().set, "model-response", cache_key, raw_response, const.RESPONSE_CACHE_TTL
+        )
+    log.log_payload("response", raw_response)
     return raw_response
@@ -0,0 +1,79 @@
+import asyncio
+import functools
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+import scripts.constants as const
+from scripts import log
+from scripts.cancellation import CancelToken
+
+# Blocking calls (files, cache backends, SDK calls without an async variant)
+_io_pool = ThreadPoolExecutor(
+    max_workers=const.ASYNC_IO_WORKERS, thread_name_prefix="async-io"
+)
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+
+def _get_parse_pool():
+    """Worker processes for CPU-bound parsing, started on first use."""
+    global _parse_pool
+    if _parse_pool is None:
+        with _parse_pool_lock:
+            if _parse_pool is None:
+                # spawn: forking a process that runs an event loop and threads is unsafe.
+                # The server worker must not be daemonic (gunicorn workers are not)
+                _parse_pool = ProcessPoolExecutor(
+                    max_workers=const.ASYNC_PARSE_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+    return _parse_pool
+
+
+async def run_io(fn: Callable, *args, **kwargs) -> Any:
+    """Run a blocking call in the I/O thread pool without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_io_pool, functools.partial(log.bind(fn), *args, **kwargs))
+
+
+async def run_cpu(fn: Callable, *args) -> Any:
+    """
+    Run CPU-bound work (spreadsheet, CSV and PDF parsing) in a worker process so it
+    neither blocks the event loop nor competes for the GIL. fn and its arguments
+    must be picklable. With ASYNC_PARSE_WORKERS=0 the work runs in the I/O pool.
+    """
+    if const.ASYNC_PARSE_WORKERS <= 0:
+        return await run_io(fn, *args)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_parse_pool(), fn, *args)
+
+
+async def sleep(seconds: float, token: Optional[CancelToken] = None, stage: str = "sleep"):
+    """
+    asyncio.sleep that ends early once the token is cancelled.
+
+    Raises:
+        RequestCancelled: If the token was cancelled while sleeping
+    """
+    if token is None:
+        await asyncio.sleep(seconds)
+        return
+    end = time.monotonic() + seconds
+    while True:
+        token.check(stage)
+        remaining = end - time.monotonic()
+        if remaining <= 0:
+            return
+        await asyncio.sleep(min(remaining, const.CANCEL_POLL_INTERVAL))
+
+
+def shutdown():
+    """Stop the worker processes (called when the server shuts down)."""
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is not None:
+            _parse_pool.shutdown(wait=False, cancel_futures=True)
+            _parse_pool = None
@@ -0,0 +1,386 @@
+"""
+Offline report generation for a matrix of segments x macro indicator sets x
+comment files (python main.py --batch).
+
+The data is loaded once per segment and indicator set, all prompts are rendered
+before the first model call, and the model calls then run on one event loop with
+at most BATCH_CONCURRENCY in flight. Every finished item is written to the output
+directory as JSON (the API result) and Markdown and recorded in the manifest;
+a rerun skips items whose rendered prompts have not changed since.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import re
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import scripts.constants as const
+from scripts import async_io
+from scripts.analysis import (
+    assemble_result,
+    build_charts,
+    get_renderer,
+    load_inputs,
+    params_for,
+    render_prompts,
+)
+from scripts.api_calls import Attachments, generate_response_async
+from scripts.retrieval import file_hash
+from scripts.utils import read_text_file
+
+
+def _label(value: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_-]+", "-", value).strip("-") or "none"
+
+
+def parse_macro_set(value: str) -> List[str]:
+    """'ifo,pmi' -> ['ifo', 'pmi']; 'none' or '' selects no macro indicator."""
+    macro_kpis = [kpi.strip().lower() for kpi in value.split(",") if kpi.strip()]
+    if macro_kpis == ["none"]:
+        return []
+    unknown = [kpi for kpi in macro_kpis if kpi not in ("ifo", "pmi")]
+    if unknown:
+        raise ValueError(f"Unknown macro indicator(s): {', '.join(unknown)}")
+    return sorted(set(macro_kpis))
+
+
+def build_matrix(
+    segments: List[str], macro_sets: List[str], comment_files: Optional[List[str]]
+) -> List[Dict]:
+    """
+    All combinations of segment codes, macro indicator sets and comment files.
+
+    Args:
+        segments (List[str]): Segment codes (keys of SEGMENTS)
+        macro_sets (List[str]): Comma-separated indicator sets, e.g. "ifo,pmi" or "none"
+        comment_files (List[str], optional): Text files with user comments; "none"
+            or an empty list adds a variant without comments
+
+    Returns:
+        List[Dict]: id, segment_code, macro_kpis and comment_file per item
+    """
+    comment_files = comment_files or ["none"]
+    items = []
+    seen = set()
+    for segment_code in segments:
+        for macro_set in macro_sets:
+            macro_kpis = parse_macro_set(macro_set)
+            for comment_file in comment_files:
+                comment_file = None if comment_file == "none" else comment_file
+                item_id = "_".join(
+                    [
+                        segment_code,
+                        "-".join(macro_kpis) or "none",
+                        _label(Path(comment_file).stem) if comment_file else "none",
+                    ]
+                )
+                if item_id in seen:
+                    continue
+                seen.add(item_id)
+                items.append(
+                    {
+                        "id": item_id,
+                        "segment_code": segment_code,
+                        "macro_kpis": macro_kpis,
+                        "comment_file": comment_file,
+                    }
+                )
+    return items
+
+
+def _fingerprint(parts: List[Dict]) -> str:
+    """Hash of everything sent to the model; a changed data file or template changes it."""
+    canonical = [
+        {
+            "model": const.MODEL,
+            "prefix": part["prefix"],
+            "prompt": part["prompt"],
+            "pmi_pdf": file_hash(part["pmi_pdf_path"]) if part["pmi_pdf_path"] else None,
+            "max_tokens": part["max_tokens"],
+        }
+        for part in parts
+    ]
+    payload = json.dumps(canonical, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def prepare(items: List[Dict]) -> Dict[str, Dict]:
+    """
+    Load the shared data once per segment and indicator set and render the prompts
+    of every item. Comments only enter the prompt, so items that differ in their
+    comment file share the loaded data and the charts.
+
+    Returns:
+        Dict[str, Dict]: Per item id the charts, rendered parts and their fingerprint
+    """
+    renderer = get_renderer()
+    shared = {}
+    comments = {}
+    prepared = {}
+    for item in items:
+        group = (item["segment_code"], tuple(item["macro_kpis"]))
+        if group not in shared:
+            params = params_for(*group)
+            inputs = load_inputs(params)
+            shared[group] = (inputs, build_charts(params, inputs))
+        inputs, charts = shared[group]
+
+        comment_file = item["comment_file"]
+        if comment_file and comment_file not in comments:
+            comments[comment_file] = read_text_file(comment_file)
+        context = {**inputs["context"], "user_comments": comments.get(comment_file, "")}
+
+        parts = render_prompts({**inputs, "context": context}, renderer)
+        prepared[item["id"]] = {
+            "charts": charts,
+            "parts": parts,
+            "fingerprint": _fingerprint(parts),
+        }
+    return prepared
+
+
+def load_manifest(output_dir: str) -> Dict:
+    try:
+        with open(os.path.join(output_dir, const.BATCH_MANIFEST), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"items": {}, "runs": []}
+
+
+def _write_json(path: str, data: Dict):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False, default=str)
+    os.replace(tmp_path, path)
+
+
+def is_complete(manifest: Dict, output_dir: str, item_id: str, fingerprint: str) -> bool:
+    """An item is done if it was generated from the same prompts and its report still exists."""
+    entry = manifest["items"].get(item_id)
+    return (
+        entry is not None
+        and entry.get("status") == "done"
+        and entry.get("fingerprint") == fingerprint
+        and os.path.exists(os.path.join(output_dir, entry["json"]))
+    )
+
+
+def to_markdown(item: Dict, result: Dict) -> str:
+    """Readable report of one item: the generated sections or the monolithic analysis."""
+    segment_name = const.SEGMENTS[item["segment_code"]]
+    macro = ", ".join(kpi.upper() for kpi in item["macro_kpis"]) or "none"
+    lines = [
+        f"# {segment_name} ({item['segment_code']})",
+        "",
+        f"- Macro indicators: {macro}",
+        f"- Comments: {item['comment_file'] or 'none'}",
+        "",
+    ]
+    if result["sections"]:
+        for section in result["sections"]:
+            lines += [f"## {section['title']}", "", section["content"], ""]
+    else:
+        lines += [
+            f"## {result['variance_analysis']['title']}",
+            "",
+            result["variance_analysis"]["content"],
+            "",
+            f"## {result['trend_analysis']['title']}",
+            "",
+            result["trend_analysis"]["summary"],
+            "",
+        ]
+    return "\n".join(lines)
+
+
+async def _generate_part(part: Dict, semaphore: asyncio.Semaphore, attachments: Attachments) -> Dict:
+    model_stats = {}
+    async with semaphore:
+        content = await generate_response_async(
+            part["prompt"],
+            part["pmi_pdf_path"],
+            stats=model_stats,
+            prefix=part["prefix"],
+            max_tokens=part["max_tokens"],
+            tags=part.get("tags"),
+            attachments=attachments,
+        )
+    return {
+        "key": part["key"],
+        "title": part["title"],
+        "content": content.strip(),
+        "model_stats": model_stats,
+    }
+
+
+async def _run_item(
+    item: Dict, prepared: Dict, semaphore: asyncio.Semaphore, attachments: Attachments
+) -> Dict:
+    """Generate all parts of one item; any failed part fails the item so a rerun retries it."""
+    started = time.monotonic()
+    outcomes = await asyncio.gather(
+        *(_generate_part(part, semaphore, attachments) for part in prepared["parts"]),
+        return_exceptions=True,
+    )
+    errors = [outcome for outcome in outcomes if isinstance(outcome, BaseException)]
+    if errors:
+        raise errors[0]
+    return {
+        "result": assemble_result(prepared["charts"], outcomes),
+        "seconds": round(time.monotonic() - started, 2),
+        "model_calls": len(outcomes),
+    }
+
+
+def _percentile(values: List[float], percentile: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(percentile / 100 * (len(values) - 1))))]
+
+
+async def _run(
+    items: List[Dict], prepared: Dict[str, Dict], manifest: Dict, output_dir: str, concurrency: int
+) -> Dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    # The PMI report is uploaded once for the whole batch
+    attachments = Attachments()
+    stats = {"done": 0, "failed": 0, "model_calls": 0, "latencies": []}
+
+    def record(item_id: str, entry: Dict):
+        manifest["items"][item_id] = entry
+        # Rewritten after every item so an interrupted batch resumes where it stopped
+        _write_json(os.path.join(output_dir, const.BATCH_MANIFEST), manifest)
+
+    async def one(item: Dict):
+        item_prepared = prepared[item["id"]]
+        entry = {
+            "segment_code": item["segment_code"],
+            "macro_kpis": item["macro_kpis"],
+            "comment_file": item["comment_file"],
+            "fingerprint": item_prepared["fingerprint"],
+            "json": f"{item['id']}.json",
+            "markdown": f"{item['id']}.md",
+        }
+        try:
+            outcome = await _run_item(item, item_prepared, semaphore, attachments)
+        except Exception as e:
+            stats["failed"] += 1
+            print(f"[{item['id']}] failed: {e}")
+            record(item["id"], {**entry, "status": "failed", "error": str(e), "finished_at": time.time()})
+            return
+
+        _write_json(
+            os.path.join(output_dir, entry["json"]),
+            {"item": item, "fingerprint": entry["fingerprint"], **outcome},
+        )
+        with open(os.path.join(output_dir, entry["markdown"]), "w", encoding="utf-8") as f:
+            f.write(to_markdown(item, outcome["result"]))
+        stats["done"] += 1
+        stats["model_calls"] += outcome["model_calls"]
+        stats["latencies"].append(outcome["seconds"])
+        print(f"[{item['id']}] done in {outcome['seconds']:.1f}s")
+        record(
+            item["id"],
+            {**entry, "status": "done", "seconds": outcome["seconds"], "finished_at": time.time()},
+        )
+
+    try:
+        await asyncio.gather(*(one(item) for item in items))
+    finally:
+        attachments.release()
+    return stats
+
+
+def run_batch(
+    segments: List[str],
+    macro_sets: List[str],
+    comment_files: Optional[List[str]] = None,
+    output_dir: str = const.BATCH_OUTPUT_DIR,
+    concurrency: int = const.BATCH_CONCURRENCY,
+    force: bool = False,
+) -> Dict:
+    """
+    Generate the reports of the whole matrix and record the run in the manifest.
+
+    Args:
+        segments (List[str]): Segment codes
+        macro_sets (List[str]): Comma-separated indicator sets ("ifo,pmi", "ifo", "none")
+        comment_files (List[str], optional): Comment files; "none" for no comments
+        output_dir (str): Directory for the reports and manifest.json
+        concurrency (int): Model calls in flight
+        force (bool): Regenerate items that are already complete
+
+    Returns:
+        Dict: Throughput report of this run
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    items = build_matrix(segments, macro_sets, comment_files)
+    manifest = load_manifest(output_dir)
+    started_at = time.time()
+    started = time.monotonic()
+
+    prepared = prepare(items)
+    prepare_seconds = time.monotonic() - started
+
+    pending = [
+        item
+        for item in items
+        if force or not is_complete(manifest, output_dir, item["id"], prepared[item["id"]]["fingerprint"])
+    ]
+    skipped = len(items) - len(pending)
+    print(
+        f"{len(items)} items, {skipped} already complete, {len(pending)} to generate "
+        f"(data and prompts prepared in {prepare_seconds:.1f}s)"
+    )
+
+    generation_started = time.monotonic()
+    try:
+        stats = asyncio.run(_run(pending, prepared, manifest, output_dir, max(1, concurrency)))
+    finally:
+        async_io.shutdown()
+    generation_seconds = time.monotonic() - generation_started
+    total_seconds = time.monotonic() - started
+
+    report = {
+        "started_at": started_at,
+        "items": len(items),
+        "skipped": skipped,
+        "generated": stats["done"],
+        "failed": stats["failed"],
+        "model_calls": stats["model_calls"],
+        "concurrency": concurrency,
+        "prepare_seconds": round(prepare_seconds, 2),
+        "generation_seconds": round(generation_seconds, 2),
+        "total_seconds": round(total_seconds, 2),
+        "items_per_minute": round(60 * stats["done"] / total_seconds, 2) if total_seconds else 0.0,
+        "model_calls_per_second": (
+            round(stats["model_calls"] / generation_seconds, 2) if generation_seconds else 0.0
+        ),
+        "item_seconds_p50": _percentile(stats["latencies"], 50),
+        "item_seconds_p95": _percentile(stats["latencies"], 95),
+    }
+    manifest["runs"].append(report)
+    _write_json(os.path.join(output_dir, const.BATCH_MANIFEST), manifest)
+    return report
+
+
+def print_report(report: Dict):
+    print("\n--- BATCH ---\n")
+    print(
+        f"Items: {report['items']} ({report['generated']} generated, "
+        f"{report['skipped']} skipped, {report['failed']} failed)"
+    )
+    print(
+        f"Time: {report['total_seconds']}s total, {report['prepare_seconds']}s data and prompts, "
+        f"{report['generation_seconds']}s generation"
+    )
+    print(
+        f"Throughput: {report['items_per_minute']} items/min, "
+        f"{report['model_calls_per_second']} model calls/s at concurrency {report['concurrency']}"
+    )
+    print(f"Item latency: p50 {report['item_seconds_p50']}s, p95 {report['item_seconds_p95']}s")
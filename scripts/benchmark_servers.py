@@ -0,0 +1,187 @@
+"""
+Compare the sync (api_server.py) and async (asgi_server.py) gunicorn deployments under load.
+
+Both servers are started locally with the fake model backend, then hit with
+batches of concurrent /api/analyze requests. Every request uses a distinct
+comment and client ID, so neither single-flight nor the response cache can
+answer it. Example:
+
+    python -m scripts.benchmark_servers --concurrency 16 64 256 --latency 2
+"""
+
+import argparse
+import http.client
+import json
+import os
+import socket
+import subprocess
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import scripts.constants as const
+
+SERVERS = {
+    "sync": ["gunicorn", "api_server:app", "--config", "gunicorn_config.py", "--bind"],
+    "async": ["gunicorn", "asgi_server:app", "--config", "gunicorn_asgi_config.py", "--bind"],
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the sync and async API servers")
+    parser.add_argument("--servers", nargs="+", choices=list(SERVERS), default=list(SERVERS))
+    parser.add_argument(
+        "--concurrency", type=int, nargs="+", default=[16, 64, 256],
+        help="Concurrent requests per run",
+    )
+    parser.add_argument(
+        "--requests", type=int, default=None,
+        help="Requests per run (default: twice the concurrency)",
+    )
+    parser.add_argument(
+        "--latency", type=float, default=2.0, help="Latency of the fake model in seconds"
+    )
+    parser.add_argument(
+        "--segment", default="Corporate", help="Frontend segment name sent with each request"
+    )
+    parser.add_argument(
+        "--env", nargs="*", default=[], metavar="KEY=VALUE",
+        help="Extra environment for both servers, e.g. FINAI_MAX_ACTIVE_ANALYSES=16",
+    )
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    return parser.parse_args()
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _request(port: int, method: str, path: str, body: Dict = None, headers: Dict = None, timeout: float = 600):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=timeout)
+    try:
+        payload = json.dumps(body).encode("utf-8") if body is not None else None
+        conn.request(
+            method, path, body=payload,
+            headers={"Content-Type": "application/json", **(headers or {})},
+        )
+        response = conn.getresponse()
+        return response.status, response.read()
+    finally:
+        conn.close()
+
+
+def start_server(name: str, port: int, env: Dict) -> subprocess.Popen:
+    process = subprocess.Popen(
+        SERVERS[name] + [f"127.0.0.1:{port}"],
+        cwd=const.PROJECT_ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{name} server exited with code {process.returncode}")
+        try:
+            status, _ = _request(port, "GET", "/api/cors-test", timeout=2)
+            if status == 200:
+                return process
+        except OSError:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"{name} server did not start within 60s")
+
+
+def _percentile(values: List[float], percentile: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(percentile / 100 * (len(values) - 1))))]
+
+
+def run_load(port: int, concurrency: int, total: int, segment: str) -> Dict:
+    """Send total requests with at most concurrency in flight and collect the outcomes."""
+    run_id = uuid.uuid4().hex[:8]
+
+    def one(i: int):
+        started = time.monotonic()
+        try:
+            status, _ = _request(
+                port, "POST", "/api/analyze",
+                body={"segment": segment, "kpis": ["Ifo", "PMI"], "comments": f"benchmark {run_id} {i}"},
+                headers={"X-Client-Id": f"benchmark-{run_id}-{i}"},
+            )
+        except OSError:
+            status = 0
+        return status, time.monotonic() - started
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(one, range(total)))
+    elapsed = time.monotonic() - started
+
+    latencies = [latency for status, latency in outcomes if status == 200]
+    statuses = {}
+    for status, _ in outcomes:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "ok": len(latencies),
+        "statuses": statuses,
+        "elapsed": round(elapsed, 2),
+        "throughput": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50": round(_percentile(latencies, 50), 2),
+        "p95": round(_percentile(latencies, 95), 2),
+        "p99": round(_percentile(latencies, 99), 2),
+    }
+
+
+def benchmark(args) -> Dict[str, List[Dict]]:
+    env = {
+        **os.environ,
+        "FINAI_MODEL_BACKEND": "fake",
+        "FINAI_FAKE_LATENCY": str(args.latency),
+        "FINAI_RESPONSE_CACHE_TTL": "0",
+    }
+    for item in args.env:
+        key, _, value = item.partition("=")
+        env[key] = value
+
+    results = {}
+    for name in args.servers:
+        port = _free_port()
+        print(f"Starting {name} server on port {port} ...")
+        process = start_server(name, port, env)
+        try:
+            # Warm up the data caches so the runs measure serving, not the first parse
+            run_load(port, 1, 1, args.segment)
+            results[name] = []
+            for concurrency in args.concurrency:
+                total = args.requests or 2 * concurrency
+                result = run_load(port, concurrency, total, args.segment)
+                results[name].append(result)
+                print(
+                    f"{name:>5} c={concurrency:<4} ok={result['ok']}/{total} "
+                    f"{result['throughput']:.2f} req/s  p50={result['p50']}s "
+                    f"p95={result['p95']}s  p99={result['p99']}s  statuses={result['statuses']}"
+                )
+        finally:
+            process.terminate()
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+    return results
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = benchmark(args)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"settings": vars(args), "results": results}, f, indent=2)
@@ -0,0 +1,470 @@
+import functools
+import hashlib
+import hmac
+import inspect
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+import scripts.constants as const
+from scripts import log, metrics
+
+CACHE_REQUESTS = metrics.counter(
+    "finai_cache_requests_total", "Cache lookups by namespace and result (hit/miss)"
+)
+CACHE_EVICTIONS = metrics.counter(
+    "finai_cache_evictions_total", "Entries evicted to stay within the size limit"
+)
+CACHE_ERRORS = metrics.counter(
+    "finai_cache_errors_total", "Cache backend errors (the value is then computed)"
+)
+
+logger = log.get_logger("cache")
+
+_MISSING = object()
+
+# Serialized values start with a format byte
+_PICKLE = b"P"
+_PICKLE_ZLIB = b"Z"
+_SIGNED = b"S"  # Followed by the HMAC-SHA256 of the rest
+_SIGNATURE_BYTES = 32
+
+
+def _signature(data: bytes) -> bytes:
+    return hmac.new(const.CACHE_SECRET.encode("utf-8"), data, hashlib.sha256).digest()
+
+
+def serialize(value: Any) -> bytes:
+    """
+    Encode a value in a compact binary format. DataFrames and NumPy arrays are
+    pickled with protocol 5 (raw column buffers, no text conversion); payloads
+    above CACHE_COMPRESS_MIN_BYTES are zlib-compressed. With CACHE_SECRET the
+    result is signed, so values written by anyone without the key are rejected.
+    """
+    payload = pickle.dumps(value, protocol=5)
+    data = _PICKLE + payload
+    if len(payload) >= const.CACHE_COMPRESS_MIN_BYTES:
+        compressed = zlib.compress(payload, 3)
+        if len(compressed) < len(payload):
+            data = _PICKLE_ZLIB + compressed
+    if const.CACHE_SECRET:
+        return _SIGNED + _signature(data) + data
+    return data
+
+
+def deserialize(data: bytes) -> Any:
+    """
+    Decode a serialized value. The signature is checked before anything is
+    unpickled; with CACHE_SECRET unsigned values are rejected.
+    """
+    if data[:1] == _SIGNED:
+        if not const.CACHE_SECRET:
+            raise ValueError("Signed cache value but FINAI_CACHE_SECRET is not set")
+        signature, data = data[1 : 1 + _SIGNATURE_BYTES], data[1 + _SIGNATURE_BYTES :]
+        if not hmac.compare_digest(signature, _signature(data)):
+            raise ValueError("Cache value signature mismatch")
+    elif const.CACHE_SECRET:
+        raise ValueError("Unsigned cache value")
+    if data[:1] == _PICKLE_ZLIB:
+        return pickle.loads(zlib.decompress(data[1:]))
+    if data[:1] == _PICKLE:
+        return pickle.loads(data[1:])
+    raise ValueError("Unknown cache serialization format")
+
+
+class CacheBackend:
+    """
+    Byte-level key/value store with TTLs. Values are serialized by Cache, so every
+    backend returns independent copies and reports sizes in bytes.
+    """
+
+    name = "base"
+
+    def get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: bytes, ttl: Optional[float]):
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def stats(self) -> Dict:
+        return {}
+
+
+class MemoryBackend(CacheBackend):
+    """In-process LRU, bounded by entry count and total bytes."""
+
+    name = "memory"
+
+    def __init__(self, max_bytes: int = None, max_entries: int = None):
+        self.max_bytes = max_bytes or const.CACHE_MEMORY_MAX_BYTES
+        self.max_entries = max_entries or const.CACHE_MEMORY_MAX_ENTRIES
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.time():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes, ttl: Optional[float]):
+        if len(value) > self.max_bytes:
+            return
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (expires_at, value)
+            self._bytes += len(value)
+            while self._entries and (
+                self._bytes > self.max_bytes or len(self._entries) > self.max_entries
+            ):
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                CACHE_EVICTIONS.inc(backend=self.name)
+
+    def delete(self, key: str):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _remove(self, key: str):
+        _, value = self._entries.pop(key)
+        self._bytes -= len(value)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes}
+
+
+class SQLiteBackend(CacheBackend):
+    """
+    Cache file shared by all worker processes on the node. Entries are evicted
+    least recently used first once the stored bytes exceed max_bytes. Triggers
+    keep the total size in cache_size, and reads refresh an entry's access time
+    at most once per CACHE_SQLITE_TOUCH_INTERVAL, so hits rarely write.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str = None, max_bytes: int = None):
+        self.path = path or const.CACHE_SQLITE_PATH
+        self.max_bytes = max_bytes or const.CACHE_SQLITE_MAX_BYTES
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL,"
+                " expires_at REAL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed_at)"
+            )
+            # Running total, seeded once from files created before it existed
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache_size (id INTEGER PRIMARY KEY CHECK (id = 0),"
+                " bytes INTEGER NOT NULL)"
+            )
+            conn.execute(
+                "INSERT OR IGNORE INTO cache_size (id, bytes)"
+                " SELECT 0, COALESCE(SUM(size), 0) FROM entries"
+            )
+            conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS entries_size_insert AFTER INSERT ON entries"
+                " BEGIN UPDATE cache_size SET bytes = bytes + new.size WHERE id = 0; END"
+            )
+            conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS entries_size_update AFTER UPDATE OF size ON entries"
+                " BEGIN UPDATE cache_size SET bytes = bytes + new.size - old.size WHERE id = 0; END"
+            )
+            conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS entries_size_delete AFTER DELETE ON entries"
+                " BEGIN UPDATE cache_size SET bytes = bytes - old.size WHERE id = 0; END"
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[bytes]:
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT value, expires_at, accessed_at FROM entries WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        value, expires_at, accessed_at = row
+        now = time.time()
+        if expires_at is not None and expires_at <= now:
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            return None
+        if now - accessed_at >= const.CACHE_SQLITE_TOUCH_INTERVAL:
+            conn.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key))
+        return bytes(value)
+
+    def set(self, key: str, value: bytes, ttl: Optional[float]):
+        if len(value) > self.max_bytes:
+            return
+        now = time.time()
+        conn = self._connect()
+        # An upsert rather than INSERT OR REPLACE, whose implicit delete skips the size trigger
+        conn.execute(
+            "INSERT INTO entries (key, value, size, expires_at, accessed_at)"
+            " VALUES (?, ?, ?, ?, ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value,"
+            " size = excluded.size, expires_at = excluded.expires_at, accessed_at = excluded.accessed_at",
+            (key, sqlite3.Binary(value), len(value), now + ttl if ttl else None, now),
+        )
+        self._evict(conn, now)
+
+    def _total(self, conn: sqlite3.Connection) -> int:
+        return conn.execute("SELECT bytes FROM cache_size WHERE id = 0").fetchone()[0]
+
+    def _evict(self, conn: sqlite3.Connection, now: float):
+        if self._total(conn) <= self.max_bytes:
+            return
+        conn.execute("DELETE FROM entries WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+        total = self._total(conn)
+        if total <= self.max_bytes:
+            return
+        # Trim to 90% so eviction does not run on every insert
+        target = int(self.max_bytes * 0.9)
+        evicted = 0
+        for key, size in conn.execute(
+            "SELECT key, size FROM entries ORDER BY accessed_at"
+        ).fetchall():
+            if total <= target:
+                break
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+            evicted += 1
+        CACHE_EVICTIONS.inc(evicted, backend=self.name)
+
+    def delete(self, key: str):
+        self._connect().execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def clear(self):
+        self._connect().execute("DELETE FROM entries")
+
+    def stats(self) -> Dict:
+        conn = self._connect()
+        entries = conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        return {"entries": entries, "bytes": self._total(conn)}
+
+
+class RedisBackend(CacheBackend):
+    """
+    Backend for any Redis-protocol server (Redis, Valkey, a local stand-in).
+    Size limits and LRU eviction are enforced by the server (maxmemory policy).
+    Anyone who can write to the server could plant pickles, so values must be
+    signed with CACHE_SECRET.
+    """
+
+    name = "redis"
+
+    def __init__(self, url: str = None, prefix: str = "finai:"):
+        if not const.CACHE_SECRET:
+            raise ValueError("The redis cache backend requires FINAI_CACHE_SECRET to sign cached values.")
+        try:
+            import redis
+        except ImportError:
+            raise ImportError(
+                "The redis cache backend requires the 'redis' package (pip install redis)."
+            )
+        self.client = redis.Redis.from_url(url or const.CACHE_REDIS_URL)
+        self.prefix = prefix
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.client.get(self.prefix + key)
+
+    def set(self, key: str, value: bytes, ttl: Optional[float]):
+        self.client.set(self.prefix + key, value, ex=int(ttl) if ttl else None)
+
+    def delete(self, key: str):
+        self.client.delete(self.prefix + key)
+
+    def clear(self):
+        for key in self.client.scan_iter(match=self.prefix + "*"):
+            self.client.delete(key)
+
+    def stats(self) -> Dict:
+        info = self.client.info("stats")
+        return {"evicted_keys": info.get("evicted_keys"), "bytes": self.client.info("memory").get("used_memory")}
+
+
+class Cache:
+    """
+    Namespaced cache on top of a backend. Backend failures never fail a request;
+    they are counted and the value is computed instead.
+    """
+
+    def __init__(self, backend: CacheBackend, default_ttl: float = None):
+        self.backend = backend
+        self.default_ttl = default_ttl if default_ttl is not None else const.CACHE_DEFAULT_TTL
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()  # Guards hits and misses
+
+    @staticmethod
+    def _key(namespace: str, key: str) -> str:
+        return f"{namespace}:{key}"
+
+    def get(self, namespace: str, key: str, default=None):
+        try:
+            data = self.backend.get(self._key(namespace, key))
+            value = deserialize(data) if data is not None else _MISSING
+        except Exception as e:
+            CACHE_ERRORS.inc(backend=self.backend.name)
+            logger.warning("Cache read failed (%s): %s", namespace, e)
+            value = _MISSING
+
+        if value is _MISSING:
+            with self._lock:
+                self.misses += 1
+            CACHE_REQUESTS.inc(namespace=namespace, result="miss")
+            return default
+        with self._lock:
+            self.hits += 1
+        CACHE_REQUESTS.inc(namespace=namespace, result="hit")
+        return value
+
+    def set(self, namespace: str, key: str, value: Any, ttl: float = None):
+        try:
+            self.backend.set(
+                self._key(namespace, key),
+                serialize(value),
+                ttl if ttl is not None else self.default_ttl,
+            )
+        except Exception as e:
+            CACHE_ERRORS.inc(backend=self.backend.name)
+            logger.warning("Cache write failed (%s): %s", namespace, e)
+
+    def delete(self, namespace: str, key: str):
+        try:
+            self.backend.delete(self._key(namespace, key))
+        except Exception as e:
+            CACHE_ERRORS.inc(backend=self.backend.name)
+            logger.warning("Cache delete failed (%s): %s", namespace, e)
+
+    def get_or_compute(self, namespace: str, key: str, compute: Callable[[], Any], ttl: float = None):
+        value = self.get(namespace, key, _MISSING)
+        if value is _MISSING:
+            value = compute()
+            self.set(namespace, key, value, ttl)
+        return value
+
+    def stats(self) -> Dict:
+        try:
+            backend_stats = self.backend.stats()
+        except Exception as e:
+            backend_stats = {"error": str(e)}
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        return {
+            "backend": self.backend.name,
+            "hits": hits,
+            "misses": misses,
+            **backend_stats,
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def create_backend(name: str = None) -> CacheBackend:
+    name = name or const.CACHE_BACKEND
+    if name == "memory":
+        return MemoryBackend()
+    if name == "sqlite":
+        return SQLiteBackend()
+    if name == "redis":
+        return RedisBackend()
+    raise ValueError(f"Unknown cache backend: {name}")
+
+
+def get_cache() -> Cache:
+    """Process-wide cache using the backend configured in FINAI_CACHE_BACKEND."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = Cache(create_backend())
+    return _cache
+
+
+def file_version(path) -> str:
+    """Cache key component that changes whenever the file is modified."""
+    stat = os.stat(path)
+    return f"{os.path.abspath(path)}:{stat.st_mtime_ns}:{stat.st_size}"
+
+
+def _is_failure(value: Any) -> bool:
+    """Loaders signal a failure with None (or a tuple of Nones); such results are retried."""
+    if isinstance(value, tuple):
+        return all(item is None for item in value)
+    return value is None
+
+
+def cached_file_loader(namespace: str, ttl: float = None):
+    """
+    Cache the result of a loader whose first argument is a file path; the key
+    includes the file's modification time and size plus all other arguments.
+    Failure results are returned but not cached.
+    """
+
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            path, *rest = bound.arguments.values()
+            parts = repr((file_version(path), rest))
+            key = hashlib.sha256(parts.encode("utf-8")).hexdigest()
+            cache = get_cache()
+            value = cache.get(namespace, key, _MISSING)
+            if value is _MISSING:
+                value = func(*args, **kwargs)
+                if not _is_failure(value):
+                    cache.set(namespace, key, value, ttl)
+            return value
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,193 @@
+import select
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, List, Optional
+
+import scripts.constants as const
+from scripts import log, metrics
+
+CANCELLED_STAGES = metrics.counter(
+    "finai_cancelled_stages_total",
+    "Pipeline stages stopped early, by stage and reason (disconnected/deadline)",
+)
+
+logger = log.get_logger("requests")
+
+
+class RequestCancelled(Exception):
+    """Raised inside the pipeline once the request was cancelled or timed out."""
+
+    def __init__(self, reason: str, stage: str = None):
+        super().__init__(f"Request {reason}" + (f" during {stage}" if stage else ""))
+        self.reason = reason
+        self.stage = stage
+
+
+class CancelToken:
+    """
+    Request-scoped deadline and cancellation flag, passed explicitly through the
+    pipeline. Stages call check() between units of work; blocking waits use
+    wait() or remaining() so they return as soon as the request is cancelled.
+    """
+
+    def __init__(self, timeout: Optional[float] = None):
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self.reason = None
+        self._event = threading.Event()
+        self._callbacks: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    def cancel(self, reason: str = "cancelled"):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.warning("Error releasing resources of cancelled request: %s", e)
+
+    @property
+    def cancelled(self) -> bool:
+        if not self._event.is_set() and self.deadline is not None:
+            if time.monotonic() >= self.deadline:
+                self.cancel("deadline")
+        return self._event.is_set()
+
+    def remaining(self) -> Optional[float]:
+        """Seconds until the deadline (None without deadline)."""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def check(self, stage: str):
+        """Raise RequestCancelled if the request was cancelled or its deadline passed."""
+        if self.cancelled:
+            CANCELLED_STAGES.inc(stage=stage, reason=self.reason)
+            raise RequestCancelled(self.reason, stage)
+
+    def wait(self, seconds: float) -> bool:
+        """Sleep up to seconds; returns True if the request got cancelled meanwhile."""
+        remaining = self.remaining()
+        if remaining is not None and remaining < seconds:
+            self._event.wait(remaining)
+            return self.cancelled
+        return self._event.wait(seconds) or self.cancelled
+
+    def on_cancel(self, callback: Callable[[], None]):
+        """Run callback when the request is cancelled (immediately if it already is)."""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+
+class SharedCancelToken(CancelToken):
+    """
+    Token for work shared by several requests (single-flight): it is cancelled
+    only once every attached request has been cancelled.
+    """
+
+    def __init__(self, tokens: List[CancelToken] = None):
+        super().__init__()
+        self._tokens: List[CancelToken] = []
+        for token in tokens or []:
+            self.attach(token)
+
+    def attach(self, token: Optional[CancelToken]):
+        # A waiter without a token never gives up, so neither may the shared work
+        token = token if token is not None else CancelToken()
+        self._tokens.append(token)
+        deadlines = [t.deadline for t in self._tokens]
+        self.deadline = None if None in deadlines else max(deadlines)
+
+    @property
+    def cancelled(self) -> bool:
+        if not self._event.is_set() and self._tokens and all(t.cancelled for t in self._tokens):
+            reasons = {t.reason for t in self._tokens}
+            self.cancel(reasons.pop() if len(reasons) == 1 else "cancelled")
+        return self._event.is_set()
+
+    def wait(self, seconds: float) -> bool:
+        # Attached tokens are polled, so sleep in short steps
+        end = time.monotonic() + seconds
+        while time.monotonic() < end:
+            if self.cancelled:
+                return True
+            self._event.wait(min(const.CANCEL_POLL_INTERVAL, end - time.monotonic()))
+        return self.cancelled
+
+
+def check(token: Optional[CancelToken], stage: str):
+    """token.check(stage) for optional tokens."""
+    if token is not None:
+        token.check(stage)
+
+
+class _DisconnectWatcher:
+    """One background thread per process polling the sockets of running requests."""
+
+    def __init__(self):
+        self._watched = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add(self, sock: socket.socket, token: CancelToken) -> int:
+        with self._lock:
+            handle = id(token)
+            self._watched[handle] = (sock, token)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="disconnect-watcher", daemon=True
+                )
+                self._thread.start()
+            return handle
+
+    def remove(self, handle: int):
+        with self._lock:
+            self._watched.pop(handle, None)
+
+    @staticmethod
+    def _is_closed(sock: socket.socket) -> bool:
+        try:
+            readable, _, _ = select.select([sock], [], [], 0)
+            if not readable:
+                return False
+            # Readable with no data means the peer closed the connection;
+            # pipelined request bytes are left in the buffer by MSG_PEEK
+            return sock.recv(1, socket.MSG_PEEK) == b""
+        except (OSError, ValueError):
+            return True
+
+    def _run(self):
+        while True:
+            time.sleep(const.DISCONNECT_POLL_INTERVAL)
+            with self._lock:
+                watched = list(self._watched.values())
+            for sock, token in watched:
+                if not token.cancelled and self._is_closed(sock):
+                    logger.info("Client disconnected, cancelling request")
+                    token.cancel("disconnected")
+
+
+_watcher = _DisconnectWatcher()
+
+
+@contextmanager
+def watch_disconnect(environ, token: CancelToken):
+    """Cancel token when the client of this WSGI request closes its connection."""
+    sock = environ.get("gunicorn.socket") or environ.get("werkzeug.socket")
+    if sock is None or getattr(sock, "recv", None) is None:
+        yield token
+        return
+    handle = _watcher.add(sock, token)
+    try:
+        yield token
+    finally:
+        _watcher.remove(handle)
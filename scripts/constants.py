@@ -4,10 +4,39 @@ import os
 FILE_DIR = os.path.dirname(os.path.abspath(__file__))
 PROJECT_ROOT = os.path.dirname(FILE_DIR)
 
+# Data files
+DATA_DIR = os.path.join(PROJECT_ROOT, "data")
+BANK_DATA_PATH = os.path.join(DATA_DIR, "FDS-Q4-2024-13032025.xlsb")
+IFO_DATA_PATH = os.path.join(DATA_DIR, "202504_ifo_gsk_prepared.csv")
+PMI_DATA_PATH = os.path.join(DATA_DIR, "global_composite_pmi.csv")
+PMI_PDF_PATH = os.path.join(DATA_DIR, "202502_pmi.pdf")
+EXAMPLES_PATH = os.path.join(DATA_DIR, "examples.txt")
+
 # Model
 MODEL = "gemini-2.5-flash-preview-04-17"
+FALLBACK_MODEL = os.getenv("FINAI_FALLBACK_MODEL", "gemini-2.0-flash")
+MODEL_BACKEND = os.getenv("FINAI_MODEL_BACKEND", "gemini")  # "gemini" or "fake"
 MAX_RETRIES = 5
 RETRY_DELAY = 3
+MODEL_CALL_TIMEOUT = 180  # Seconds per model request, whatever the deadline of the analysis
+
+# Hedged model requests: fire a second request if the first is slower than usual
+HEDGE_ENABLED = os.getenv("FINAI_HEDGE", "0") == "1"
+HEDGE_USE_FALLBACK_MODEL = os.getenv("FINAI_HEDGE_FALLBACK", "1") == "1"
+HEDGE_PERCENTILE = float(os.getenv("FINAI_HEDGE_PERCENTILE", "95"))
+HEDGE_DEFAULT_DELAY = 20.0  # Seconds, used until enough latencies were observed
+HEDGE_MIN_DELAY = 2.0
+HEDGE_MAX_DELAY = 120.0
+HEDGE_MIN_SAMPLES = 20
+HEDGE_LATENCY_WINDOW = 500  # Recent successful calls used for the percentile
+
+# Local stand-in for the model API (FINAI_MODEL_BACKEND=fake)
+FAKE_MODEL_LATENCY = float(os.getenv("FINAI_FAKE_LATENCY", "0.5"))
+FAKE_MODEL_SLOW_LATENCY = float(os.getenv("FINAI_FAKE_SLOW_LATENCY", "10"))
+FAKE_MODEL_SLOW_RATE = float(os.getenv("FINAI_FAKE_SLOW_RATE", "0"))
+FAKE_MODEL_ERROR_RATE = float(os.getenv("FINAI_FAKE_ERROR_RATE", "0"))
+FAKE_MODEL_OUTPUT_TOKENS = int(os.getenv("FINAI_FAKE_OUTPUT_TOKENS", "600"))  # Longest answer; lengths vary down to half
+FAKE_MODEL_TTFT_SHARE = 0.3  # Share of the latency until the first token
 
 # KPI Lables and Segments
 KPI_LABELS = {
@@ -35,3 +64,202 @@ SEGMENTS = {
     "IB": "investment_bank",
     "PB": "private_bank",
 }
+# The Asset Quality sheet (stage tables) only reports the group
+ASSET_QUALITY_SEGMENT = "total_bank"
+
+# Uploads
+UPLOAD_DIR = os.path.join(PROJECT_ROOT, "uploads")
+UPLOAD_PARTIAL_DIR = os.path.join(UPLOAD_DIR, ".partial")
+UPLOAD_MAX_REQUEST_SIZE = 16 * 1024 * 1024  # Single request body (form upload or one chunk)
+UPLOAD_MAX_FILE_SIZE = 512 * 1024 * 1024  # Whole file assembled from chunks
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # Chunk size suggested to clients
+UPLOAD_BUFFER_SIZE = 1024 * 1024  # Read buffer while streaming to disk
+UPLOAD_SESSION_TTL = 24 * 60 * 60  # Seconds without a chunk until an unfinished upload is discarded
+
+# Storage of completed uploads and their extraction results, shared by all nodes with "s3"
+STORAGE_BACKEND = os.getenv("FINAI_STORAGE_BACKEND", "local")  # local (UPLOAD_DIR) or s3
+STORAGE_S3_BUCKET = os.getenv("FINAI_STORAGE_S3_BUCKET", "")
+STORAGE_S3_PREFIX = os.getenv("FINAI_STORAGE_S3_PREFIX", "finai/")
+STORAGE_S3_ENDPOINT = os.getenv("FINAI_STORAGE_S3_ENDPOINT") or None  # MinIO or a local stand-in; None for AWS
+STORAGE_S3_REGION = os.getenv("FINAI_STORAGE_S3_REGION") or None
+# Local copies of s3 objects; the least recently used are removed first
+STORAGE_CACHE_DIR = os.path.join(PROJECT_ROOT, ".cache", "storage")
+STORAGE_CACHE_MAX_BYTES = int(os.getenv("FINAI_STORAGE_CACHE_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+STORAGE_PREFETCH_WORKERS = 8  # Parallel downloads of the documents of one request
+
+# Retrieval over uploaded documents
+RETRIEVAL_CHUNK_CHARS = 800  # Target chunk size when splitting pages/paragraphs
+RETRIEVAL_TOKEN_BUDGET = 1500  # Total tokens of document excerpts per prompt
+RETRIEVAL_TOKENS_PER_DOCUMENT = 750  # Never more than the former 3000 characters per file
+RETRIEVAL_CHARS_PER_TOKEN = 4
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Base query terms for selecting document excerpts (English and German reports)
+RETRIEVAL_QUERY_TERMS = [
+    "credit loss provision allowance impairment risk default",
+    "loans lending interest rate margin outlook economy",
+    "kredit risikovorsorge wertberichtigung ausfall zins darlehen konjunktur",
+]
+MACRO_QUERY_TERMS = {
+    "ifo": "ifo business climate expectations geschäftsklima erwartungen lage",
+    "pmi": "pmi purchasing managers composite manufacturing services einkaufsmanager",
+}
+
+# Uploaded spreadsheets (.xlsx/.csv) parsed into tables instead of text
+SPREADSHEET_HEADER_SCAN_ROWS = 30  # Leading rows searched for the header
+SPREADSHEET_MIN_PERIODS = 2  # Period cells a header row needs
+SPREADSHEET_MAX_ROWS = 5000  # Rows kept per sheet; reading stops there
+SPREADSHEET_SUMMARY_ROWS = 20  # Rows per table in the prompt
+SPREADSHEET_SUMMARY_PERIODS = 6  # Most recent periods per row in the prompt
+
+# PMI report: figures extracted from the PDF instead of attaching it to every model call
+PMI_ATTACH_PDF = os.getenv("FINAI_PMI_ATTACH_PDF", "0") == "1"  # Opt-in: attach the PDF as before
+PMI_REPORT_MAX_PASSAGES = 4  # Commentary sentences with index values in the prompt
+PMI_REPORT_MIN_TABLES = 1  # Fewer extracted index tables attach the PDF instead
+PMI_REPORT_MIN_PASSAGES = 1  # Fewer commentary passages attach the PDF instead
+
+# Provider-side caching of the static prompt prefix
+PROMPT_CACHE_ENABLED = os.getenv("FINAI_PROMPT_CACHE", "1") == "1"
+PROMPT_CACHE_TTL = 60 * 60  # Seconds a cached prefix lives at the provider
+PROMPT_CACHE_REFRESH_MARGIN = 120  # Re-register this long before expiry
+PROMPT_CACHE_RETRY_AFTER = 15 * 60  # Back-off after the provider rejected a prefix
+
+# Coalescing of identical concurrent analyses (shared by workers via file locks)
+SINGLEFLIGHT_DIR = os.path.join(PROJECT_ROOT, ".cache", "singleflight")
+SINGLEFLIGHT_RESULT_TTL = 60  # Seconds a finished result is visible to waiting workers
+SINGLEFLIGHT_WAIT_TIMEOUT = 600  # Matches the gunicorn timeout
+SINGLEFLIGHT_POLL_INTERVAL = 0.2
+
+# Cache shared by data loaders, extractors and model responses
+CACHE_BACKEND = os.getenv("FINAI_CACHE_BACKEND", "sqlite")  # "memory", "sqlite" or "redis"
+CACHE_DEFAULT_TTL = 24 * 60 * 60
+CACHE_COMPRESS_MIN_BYTES = 4096
+CACHE_MEMORY_MAX_BYTES = 128 * 1024 * 1024
+CACHE_MEMORY_MAX_ENTRIES = 1024
+CACHE_SQLITE_PATH = os.path.join(PROJECT_ROOT, ".cache", "finai-cache.sqlite")
+CACHE_SQLITE_MAX_BYTES = 512 * 1024 * 1024
+CACHE_SQLITE_TOUCH_INTERVAL = 60  # Seconds before a read refreshes an entry's LRU time again
+CACHE_REDIS_URL = os.getenv("FINAI_REDIS_URL", "redis://localhost:6379/0")
+CACHE_SECRET = os.getenv("FINAI_CACHE_SECRET", "")  # HMAC key of cached values; required for redis
+RESPONSE_CACHE_TTL = int(os.getenv("FINAI_RESPONSE_CACHE_TTL", "0"))  # Opt-in; 0 disables
+
+# Admission control for /api/analyze (per worker process)
+ADMISSION_MAX_ACTIVE = int(os.getenv("FINAI_MAX_ACTIVE_ANALYSES", "2"))
+ADMISSION_MAX_QUEUE = {"interactive": 8, "batch": 4}  # Waiting requests per lane
+ADMISSION_MAX_PER_CLIENT = 3  # Admitted plus waiting requests per client
+ADMISSION_MAX_WAIT = 300  # Seconds before a queued request gives up with 429
+ADMISSION_DEFAULT_DURATION = 30  # Assumed analysis duration for Retry-After
+ADMISSION_DEFAULT_LANE = os.getenv("FINAI_DEFAULT_LANE", "interactive")  # Lane of unauthenticated requests
+PRIORITY_TOKEN = os.getenv("FINAI_PRIORITY_TOKEN", "")  # X-Priority-Token value that may pick a higher lane
+TRUSTED_PROXIES = int(os.getenv("FINAI_TRUSTED_PROXIES", "0"))  # Proxies in front that append to X-Forwarded-For
+
+# Request deadlines and cancellation
+REQUEST_DEADLINE = 540  # Seconds, below the gunicorn timeout
+CANCEL_POLL_INTERVAL = 0.25
+DISCONNECT_POLL_INTERVAL = 0.5
+
+# Section-wise generation
+SECTIONED_ANALYSIS = os.getenv("FINAI_SECTIONED", "1") == "1"
+# "requires_macro" skips the section if no macro indicator is selected;
+# "macro_input" sections get the PMI report attached
+ANALYSIS_SECTIONS = [
+    {"key": "kpi", "title": "KPI Interpretation", "template": "section_kpi.jinja2", "max_tokens": 2048, "requires_macro": False, "macro_input": False},
+    {"key": "macro", "title": "Macroeconomic Environment", "template": "section_macro.jinja2", "max_tokens": 1536, "requires_macro": True, "macro_input": True},
+    {"key": "linkage", "title": "Macro and Bank Linkage", "template": "section_linkage.jinja2", "max_tokens": 2048, "requires_macro": True, "macro_input": True},
+    {"key": "outlook", "title": "Outlook", "template": "section_outlook.jinja2", "max_tokens": 1024, "requires_macro": False, "macro_input": True},
+]
+# Sections merged into variance_analysis; the outlook becomes trend_analysis
+VARIANCE_SECTIONS = ["kpi", "macro", "linkage"]
+# A thread per section of every admitted analysis and of the precompute scheduler;
+# the model requests themselves run on the model-call pool
+SECTION_MAX_WORKERS = (ADMISSION_MAX_ACTIVE + 1) * len(ANALYSIS_SECTIONS)
+# Threads for model requests: a primary and a hedge per section, and as many again
+# for requests abandoned by cancellation, which run until MODEL_CALL_TIMEOUT
+MODEL_CALL_MAX_WORKERS = int(os.getenv("FINAI_MODEL_CALL_WORKERS", str(4 * SECTION_MAX_WORKERS)))
+
+# Lead-lag analytics
+ANALYTICS_MAX_LAG = 4  # Quarters; positive lags mean the indicator leads the bank KPI
+ANALYTICS_MIN_OBSERVATIONS = 5
+ANALYTICS_ROLLING_WINDOW = 4  # Quarters
+ANALYTICS_PROMPT_TOP = 3  # Strongest indicators per KPI in the prompt summary
+ANALYTICS_THRESHOLDS = {
+    "pmi:composite": 50,
+    "ifo:geschaeftsklima_salden_saison_bereinigt": 0,
+    "ifo:geschaeftserwartungen_salden_saison_bereinigt": 0,
+}
+
+# Macro indicators in the prompts
+IFO_PROMPT_QUARTERS = 8  # Quarterly IFO means in the prompt, followed by the latest month
+
+# Derived credit-quality metrics
+CREDIT_QUALITY_PROMPT_QUARTERS = 5  # Most recent quarters shown in the prompt
+
+# Async server (asgi_server.py): pending model calls wait on the event loop, not in threads
+ASYNC_MAX_ACTIVE_ANALYSES = int(os.getenv("FINAI_ASYNC_MAX_ACTIVE", "256"))
+ASYNC_MAX_QUEUE = {"interactive": 512, "batch": 256}  # Waiting requests per lane
+ASYNC_IO_WORKERS = 32  # Threads for blocking file, cache and SDK calls
+ASYNC_PARSE_WORKERS = int(os.getenv("FINAI_ASYNC_PARSE_WORKERS", "2"))  # Processes for parsing; 0 uses threads
+
+# On-demand request profiling (nothing runs unless a request is selected)
+PROFILE_TOKEN = os.getenv("FINAI_PROFILE_TOKEN", "")  # X-Profile header value that profiles a request
+PROFILE_SAMPLE_RATE = float(os.getenv("FINAI_PROFILE_SAMPLE_RATE", "0"))  # Share of requests profiled
+PROFILE_INTERVAL = 0.005  # Seconds between stack samples
+PROFILE_TRACEMALLOC_FRAMES = 1  # Frames kept per allocation; more is slower
+PROFILE_TOP_ALLOCATIONS = 20  # Allocation sites listed per profile
+PROFILE_DIR = os.path.join(PROJECT_ROOT, ".cache", "profiles")
+PROFILE_MAX_COUNT = 50  # Stored profiles; the oldest are removed first
+PROFILE_RETENTION = 7 * 24 * 60 * 60  # Seconds
+# Pool threads sampled together with the request thread
+PROFILE_THREAD_PREFIXES = ("analysis-section", "model-call", "async-io")
+PROFILE_ROUTES = ("/api/analyze", "/api/upload")
+
+# Batch report generation (python main.py --batch)
+BATCH_OUTPUT_DIR = os.path.join(PROJECT_ROOT, "reports")
+BATCH_CONCURRENCY = int(os.getenv("FINAI_BATCH_CONCURRENCY", "4"))  # Model calls in flight
+BATCH_MANIFEST = "manifest.json"
+
+# Pregenerated default analyses: every segment x macro set without comments or documents
+PRECOMPUTE_ENABLED = os.getenv("FINAI_PRECOMPUTE", "0") == "1"  # Paid model calls on every data change
+PRECOMPUTE_MACRO_SETS = [["ifo"], ["pmi"], ["ifo", "pmi"]]
+PRECOMPUTE_POLL_INTERVAL = 30  # Seconds between checks of the data files and templates
+PRECOMPUTE_RETRY_INTERVAL = 15 * 60  # Seconds before a failed generation is retried
+PRECOMPUTE_DIR = os.path.join(PROJECT_ROOT, ".cache", "precomputed")
+TEMPLATE_DIR = os.path.join(PROJECT_ROOT, "prompts")
+
+# Logging: records go through a queue to a background thread; levels per category
+LOG_LEVEL = os.getenv("FINAI_LOG_LEVEL", "INFO")
+# Category overrides, e.g. FINAI_LOG_LEVELS="data=DEBUG,model=WARNING"
+LOG_LEVELS = dict(
+    item.strip().split("=", 1)
+    for item in os.getenv("FINAI_LOG_LEVELS", "").split(",")
+    if "=" in item
+)
+LOG_FORMAT = "%(asctime)s - %(levelname)s - %(name)s [%(request_id)s] - %(message)s"
+LOG_QUEUE_SIZE = 10000  # Records waiting for output; further records are dropped
+# Prompts and responses: a sample of requests, written compressed in the background
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("FINAI_LOG_PAYLOAD_SAMPLE_RATE", "0.05"))  # Share of requests
+LOG_PAYLOAD_DIR = os.path.join(PROJECT_ROOT, ".cache", "payloads")
+LOG_PAYLOAD_QUEUE_SIZE = 256  # Payloads waiting for the writer; further payloads are dropped
+LOG_PAYLOAD_MAX_CHARS = 500_000  # Longer payloads are truncated
+LOG_PAYLOAD_FLUSH_INTERVAL = 2.0  # Seconds between writes of buffered payloads
+LOG_PAYLOAD_FILE_SIZE = 8 * 1024 * 1024  # Bytes per file before the writer starts a new one
+LOG_PAYLOAD_MAX_BYTES = 256 * 1024 * 1024  # All files; the oldest are removed first
+
+# Model-call telemetry: tokens, time to first token, latency, attempts and finish reason per call
+TELEMETRY_ENABLED = os.getenv("FINAI_TELEMETRY", "1") == "1"
+TELEMETRY_PATH = os.path.join(PROJECT_ROOT, ".cache", "telemetry.sqlite")
+TELEMETRY_QUEUE_SIZE = 1000  # Records waiting for the writer; further records are dropped
+TELEMETRY_FLUSH_INTERVAL = 1.0  # Seconds between writes
+TELEMETRY_RETENTION = 30 * 24 * 60 * 60  # Seconds
+# Adaptive budgets per request type (the analysis or a section) from the recorded calls
+ADAPTIVE_BUDGET = os.getenv("FINAI_ADAPTIVE_BUDGET", "0") == "1"
+ADAPTIVE_REFRESH_INTERVAL = 60  # Seconds between recomputations
+ADAPTIVE_WINDOW = 200  # Most recent calls per model and request type
+ADAPTIVE_MIN_SAMPLES = 30  # Fewer calls keep the configured limits
+ADAPTIVE_OUTPUT_PERCENTILE = 99
+ADAPTIVE_OUTPUT_HEADROOM = 1.25  # max_output_tokens = percentile x headroom, at most the configured limit
+ADAPTIVE_MIN_OUTPUT_TOKENS = 512
+# Document excerpts fill the largest prompt of a request up to this size (90th percentile without documents)
+ADAPTIVE_PROMPT_TOKENS = int(os.getenv("FINAI_ADAPTIVE_PROMPT_TOKENS", "32000"))
+ADAPTIVE_MIN_DOCUMENT_TOKENS = 300
@@ -1,7 +1,7 @@
 import os
 from jinja2 import Environment, FileSystemLoader
 from pathlib import Path
-from typing import Dict
+from typing import Dict, Tuple
 
 class PromptRenderer:
     def __init__(self, template_dir: Path):
@@ -11,9 +11,31 @@ class PromptRenderer:
             lstrip_blocks=True
         )
         self.templates = {
-            "instruction_prompt": self.env.get_template("instruction.jinja2")
+            "instruction_prompt": self.env.get_template("instruction.jinja2"),
+            "instruction_prefix": self.env.get_template("instruction_prefix.jinja2"),
+            "instruction_suffix": self.env.get_template("instruction_suffix.jinja2"),
+            "section_prefix": self.env.get_template("section_prefix.jinja2"),
         }
 
     def render_instruction_prompt(self, context: Dict) -> str:
         """Renders the full role and task instruction"""
-        return self.templates["instruction_prompt"].render(context)
\ No newline at end of file
+        return self.templates["instruction_prompt"].render(context)
+
+    def render_instruction_parts(self, context: Dict) -> Tuple[str, str]:
+        """
+        Renders the instruction as a stable prefix (role, task, rules, example) and
+        the request-specific suffix (segment data, macro tables, comments, documents).
+        The prefix only depends on the example text, so it can be cached by the provider.
+        """
+        prefix = self.templates["instruction_prefix"].render(example=context.get("example"))
+        suffix = self.templates["instruction_suffix"].render(context)
+        return prefix, suffix
+
+    def render_section_parts(self, template_name: str, context: Dict) -> Tuple[str, str]:
+        """
+        Renders one analysis section as the shared section prefix (identical for all
+        sections, so it is cached once) and the section-specific task and input.
+        """
+        prefix = self.templates["section_prefix"].render(example=context.get("example"))
+        suffix = self.env.get_template(template_name).render(context)
+        return prefix, suffix
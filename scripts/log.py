@@ -0,0 +1,281 @@
+"""
+Logging for the servers and the analysis pipeline.
+
+Records are put on a queue and written by a background thread, so a request
+never waits for log output. Loggers are per category ("finai.<category>"),
+each with its own level (LOG_LEVELS). Every record carries the ID of the
+request it belongs to.
+
+Prompts and model responses are too large for the log: for a sample of
+requests (LOG_PAYLOAD_SAMPLE_RATE) they are handed to a writer thread that
+appends them gzip-compressed to size-capped files under LOG_PAYLOAD_DIR,
+keyed by request ID. Read them back with
+
+    python -m scripts.log <request id>
+"""
+
+import atexit
+import contextvars
+import gzip
+import hashlib
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import uuid
+from typing import Callable, Dict, Iterator, Optional
+
+import scripts.constants as const
+from scripts import metrics
+
+LOG_RECORDS_DROPPED = metrics.counter(
+    "finai_log_records_dropped_total", "Log records dropped because the log queue was full"
+)
+LOG_PAYLOADS = metrics.counter(
+    "finai_log_payloads_total", "Sampled prompts and responses by kind and result (written/dropped/failed)"
+)
+
+_request_id: contextvars.ContextVar = contextvars.ContextVar("finai_request_id", default=None)
+_listener = None
+_writer = None
+_lock = threading.Lock()
+
+
+def get_logger(category: str) -> logging.Logger:
+    """Logger of a category (api, analysis, model, data, cache, storage, requests, telemetry, profiling)."""
+    return logging.getLogger(f"finai.{category}")
+
+
+def new_request_id(header_value: Optional[str] = None) -> str:
+    """Set the ID of the current request: the caller's X-Request-Id if usable, else a new one."""
+    request_id = (header_value or "").strip()[:64]
+    if not request_id or not request_id.replace("-", "").replace("_", "").isalnum():
+        request_id = uuid.uuid4().hex
+    _request_id.set(request_id)
+    return request_id
+
+
+def request_id() -> Optional[str]:
+    return _request_id.get()
+
+
+def bind(fn: Callable) -> Callable:
+    """fn with the current request ID, for work handed to a thread pool."""
+    current = _request_id.get()
+    if current is None:
+        return fn
+
+    def bound(*args, **kwargs):
+        token = _request_id.set(current)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _request_id.reset(token)
+
+    return bound
+
+
+class _RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = _request_id.get() or "-"
+        return True
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Never blocks: records that do not fit in the queue are counted and dropped."""
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc()
+
+
+def setup():
+    """Route all logging through the queue (idempotent; called by the servers and main.py)."""
+    global _listener
+    with _lock:
+        if _listener is not None:
+            return
+        output = logging.StreamHandler(sys.stdout)
+        output.setFormatter(logging.Formatter(const.LOG_FORMAT))
+        records = queue.Queue(const.LOG_QUEUE_SIZE)
+        handler = _QueueHandler(records)
+        handler.addFilter(_RequestIdFilter())
+
+        root = logging.getLogger()
+        root.handlers = [handler]
+        root.setLevel(const.LOG_LEVEL.upper())
+        for category, level in const.LOG_LEVELS.items():
+            get_logger(category).setLevel(level.upper())
+
+        _listener = logging.handlers.QueueListener(records, output)
+        _listener.start()
+        atexit.register(shutdown)
+
+
+def shutdown():
+    """Write out the queued records and payloads."""
+    global _listener, _writer
+    with _lock:
+        if _writer is not None:
+            _writer.stop()
+            _writer = None
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def _sampled() -> bool:
+    rate = const.LOG_PAYLOAD_SAMPLE_RATE
+    if rate <= 0:
+        return False
+    if rate >= 1:
+        return True
+    current = _request_id.get()
+    if current is None:
+        return random.random() < rate
+    # Same decision for every payload of a request, so prompt and response stay together
+    digest = hashlib.sha256(current.encode("utf-8")).digest()
+    return int.from_bytes(digest[:4], "big") / 2**32 < rate
+
+
+def log_payload(kind: str, *parts: Optional[str], **fields):
+    """
+    Keep a prompt or response of a sampled request. Returns immediately; the
+    payload is written in the background or dropped if the writer is behind.
+
+    Args:
+        kind (str): "prompt" or "response"
+        *parts (str): Joined to the payload (only if sampled), truncated to LOG_PAYLOAD_MAX_CHARS
+        **fields: Stored with the payload (e.g. the section key)
+    """
+    global _writer
+    if not _sampled():
+        return
+    text = "".join(part for part in parts if part)
+    if not text:
+        return
+    if _writer is None:
+        with _lock:
+            if _writer is None:
+                _writer = _PayloadWriter()
+                _writer.start()
+    record = {
+        "request_id": _request_id.get(),
+        "kind": kind,
+        "time": time.time(),
+        "characters": len(text),
+        "text": text[: const.LOG_PAYLOAD_MAX_CHARS],
+        **fields,
+    }
+    try:
+        _writer.queue.put_nowait(record)
+    except queue.Full:
+        LOG_PAYLOADS.inc(kind=kind, result="dropped")
+
+
+class _PayloadWriter(threading.Thread):
+    """
+    Appends batches of payloads as gzip members to this process' current file
+    (JSON lines), starts a new file past LOG_PAYLOAD_FILE_SIZE and removes the
+    oldest files of all workers once LOG_PAYLOAD_MAX_BYTES is exceeded.
+    """
+
+    def __init__(self):
+        super().__init__(name="log-payloads", daemon=True)
+        self.queue = queue.Queue(const.LOG_PAYLOAD_QUEUE_SIZE)
+        self._stop_event = threading.Event()
+        self._path = None
+
+    def stop(self):
+        self._stop_event.set()
+        self.join(timeout=10)
+
+    def run(self):
+        while True:
+            stopping = self._stop_event.wait(const.LOG_PAYLOAD_FLUSH_INTERVAL)
+            batch = []
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if batch:
+                self._write(batch)
+            if stopping:
+                return
+
+    def _write(self, batch):
+        try:
+            os.makedirs(const.LOG_PAYLOAD_DIR, exist_ok=True)
+            if self._path is None or not os.path.exists(self._path) or (
+                os.path.getsize(self._path) >= const.LOG_PAYLOAD_FILE_SIZE
+            ):
+                name = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{uuid.uuid4().hex[:6]}.jsonl.gz"
+                self._path = os.path.join(const.LOG_PAYLOAD_DIR, name)
+                _prune()
+            lines = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in batch)
+            with gzip.open(self._path, "ab") as f:
+                f.write(lines.encode("utf-8"))
+            result = "written"
+        except Exception as e:
+            get_logger("logging").warning("Payloads could not be written: %s", e)
+            result = "failed"
+        for record in batch:
+            LOG_PAYLOADS.inc(kind=record["kind"], result=result)
+
+
+def _payload_files() -> list:
+    """Payload files, oldest first."""
+    try:
+        names = [n for n in os.listdir(const.LOG_PAYLOAD_DIR) if n.endswith(".jsonl.gz")]
+    except OSError:
+        return []
+    paths = [os.path.join(const.LOG_PAYLOAD_DIR, name) for name in names]
+    return sorted(paths, key=lambda p: os.path.getmtime(p) if os.path.exists(p) else 0)
+
+
+def _prune():
+    files = _payload_files()
+    sizes = {path: os.path.getsize(path) for path in files if os.path.exists(path)}
+    total = sum(sizes.values())
+    for path in files:
+        if total <= const.LOG_PAYLOAD_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+            total -= sizes.get(path, 0)
+        except OSError:
+            pass
+
+
+def iter_payloads(request_id: str = None, kind: str = None) -> Iterator[Dict]:
+    """Stored payloads, oldest first, optionally of one request and kind."""
+    for path in _payload_files():
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    record = json.loads(line)
+                    if request_id and record.get("request_id") != request_id:
+                        continue
+                    if kind and record.get("kind") != kind:
+                        continue
+                    yield record
+        except (OSError, EOFError, ValueError):
+            continue  # Removed meanwhile or cut off by a crash
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        sys.exit("Usage: python -m scripts.log <request id> [prompt|response]")
+    for payload in iter_payloads(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None):
+        stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(payload["time"]))
+        extra = {k: v for k, v in payload.items() if k not in ("request_id", "kind", "time", "text")}
+        print(f"--- {payload['kind']} {stamp} {json.dumps(extra, ensure_ascii=False)} ---")
+        print(payload["text"])
@@ -0,0 +1,158 @@
+import threading
+from bisect import bisect_left
+from typing import Dict, Tuple
+
+# Process-local registry; each gunicorn worker reports its own values.
+
+_lock = threading.Lock()
+_registry: Dict[str, "_Metric"] = {}
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _label_key(labels: Dict[str, str]) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key, extra: Dict[str, str] = None) -> str:
+    pairs = list(key) + sorted((extra or {}).items())
+    if not pairs:
+        return ""
+    body = ",".join(
+        '{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"'))
+        for k, v in pairs
+    )
+    return "{" + body + "}"
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with _lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return "\n".join(lines)
+
+    def snapshot(self) -> Dict:
+        with _lock:
+            return {
+                ",".join(f"{k}={v}" for k, v in key) or "": value
+                for key, value in self._values.items()
+            }
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with _lock:
+            self._values[_label_key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        with _lock:
+            state = self._values.get(key)
+            if state is None:
+                state = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+                self._values[key] = state
+            state["counts"][bisect_left(self.buckets, value)] += 1
+            state["sum"] += value
+            state["count"] += 1
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with _lock:
+            items = [(k, dict(v, counts=list(v["counts"]))) for k, v in self._values.items()]
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state["counts"]):
+                cumulative += count
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(key, {'le': str(bound)})} {cumulative}"
+                )
+            lines.append(
+                f"{self.name}_bucket{_format_labels(key, {'le': '+Inf'})} {state['count']}"
+            )
+            lines.append(f"{self.name}_sum{_format_labels(key)} {state['sum']}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {state['count']}")
+        return "\n".join(lines)
+
+    def snapshot(self) -> Dict:
+        with _lock:
+            return {
+                ",".join(f"{k}={v}" for k, v in key) or "": {
+                    "count": state["count"],
+                    "sum": state["sum"],
+                }
+                for key, state in self._values.items()
+            }
+
+
+def _get_or_create(cls, name: str, help_text: str, **kwargs):
+    with _lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = cls(name, help_text, **kwargs)
+            _registry[name] = metric
+        elif not isinstance(metric, cls):
+            raise ValueError(f"Metric {name} already registered as {metric.kind}")
+        return metric
+
+
+def counter(name: str, help_text: str) -> Counter:
+    return _get_or_create(Counter, name, help_text)
+
+
+def gauge(name: str, help_text: str) -> Gauge:
+    return _get_or_create(Gauge, name, help_text)
+
+
+def histogram(name: str, help_text: str, buckets=DEFAULT_BUCKETS) -> Histogram:
+    return _get_or_create(Histogram, name, help_text, buckets=buckets)
+
+
+def render_prometheus() -> str:
+    """All registered metrics in the Prometheus text exposition format."""
+    with _lock:
+        metrics = list(_registry.values())
+    return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+def snapshot() -> Dict[str, Dict]:
+    """All registered metrics as a JSON-serializable dictionary."""
+    with _lock:
+        metrics = list(_registry.values())
+    return {metric.name: metric.snapshot() for metric in metrics}
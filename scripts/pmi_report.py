@@ -0,0 +1,233 @@
+import re
+from typing import Dict, List, Optional, Tuple
+
+import fitz
+
+import scripts.constants as const
+from scripts.retrieval import file_hash
+from scripts.storage import cached_extract
+
+REPORT_VERSION = 1
+
+_PERIOD = re.compile(r"^[A-Z][a-z]{2}-\d{2}$")  # Dec-24
+_NUMBER = re.compile(r"^-?\d+(\.\d+)?$")
+_INDEX_VALUE = re.compile(r"\b\d{2}\.\d\b")
+_RELEASE = re.compile(r"Embargoed until .*?(\d{1,2} [A-Z][a-z]+ \d{4})")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+(?=[A-Z“\"])")
+
+
+def _styled_lines(page) -> List[Tuple[float, str]]:
+    """(font size, text) of every text line on the page, in reading order."""
+    lines = []
+    for block in page.get_text("dict")["blocks"]:
+        for line in block.get("lines", []):
+            text = "".join(span["text"] for span in line["spans"]).strip()
+            if text:
+                lines.append((max(span["size"] for span in line["spans"]), text))
+    return lines
+
+
+def _join_continuations(lines: List[str]) -> List[str]:
+    """Merge wrapped lines (continuations start in lowercase or with a digit)."""
+    merged = []
+    for line in lines:
+        if merged and (line[0].islower() or line[0].isdigit()):
+            merged[-1] = f"{merged[-1]} {line}"
+        else:
+            merged.append(line)
+    return merged
+
+
+def _front_page(page) -> Dict:
+    """Title, headline and key findings, told apart by their font size on the first page."""
+    lines = [(size, text) for size, text in _styled_lines(page) if not _NUMBER.match(text)]
+    sizes = sorted({round(size, 1) for size, text in lines if len(text) > 3}, reverse=True)
+    title = " ".join(text for size, text in lines if sizes and round(size, 1) == sizes[0])
+    headline = " ".join(
+        text for size, text in lines if len(sizes) > 1 and round(size, 1) == sizes[1]
+    )
+
+    # The findings share the font size of their heading but not its text block
+    key_findings = []
+    for pos, (size, text) in enumerate(lines):
+        if text.lower() == "key findings":
+            key_findings = [
+                next_text
+                for next_size, next_text in lines[pos + 1:]
+                if round(next_size, 1) == round(size, 1)
+            ]
+            break
+    return {
+        "title": title,
+        "headline": headline,
+        "key_findings": _join_continuations(key_findings),
+    }
+
+
+def _tables_from_layout(page) -> List[Dict]:
+    """Ruled tables found by PyMuPDF whose header has period columns (Dec-24, Jan-25)."""
+    tables = []
+    try:
+        found = page.find_tables().tables
+    except Exception:
+        return tables
+    for table in found:
+        rows = [[(cell or "").strip() for cell in row] for row in table.extract()]
+        if len(rows) < 3:
+            continue
+        periods = [cell for cell in rows[0] if _PERIOD.match(cell)]
+        body = [row for row in rows[1:] if row and row[0] and any(_NUMBER.match(c) for c in row[1:])]
+        if periods and len(body) >= 2:
+            tables.append({"name": None, "note": None, "columns": rows[0], "rows": body})
+    return tables
+
+
+def _tables_from_text(text: str) -> List[Dict]:
+    """
+    Index tables from the text layer when they are not ruled: an "Index" line, the
+    period labels, an optional "Interpretation" column and note, then per index its
+    name, one value per period and the interpretation.
+    """
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    tables = []
+    pos = 0
+    while pos < len(lines):
+        if lines[pos] != "Index":
+            pos += 1
+            continue
+        end = pos + 1
+        periods = []
+        while end < len(lines) and _PERIOD.match(lines[end]):
+            periods.append(lines[end])
+            end += 1
+        if not periods:
+            pos += 1
+            continue
+        interpretation = end < len(lines) and lines[end] == "Interpretation"
+        end += interpretation
+        note = None
+        if end < len(lines) and lines[end].startswith("sa,"):
+            note = lines[end]
+            end += 1
+
+        rows = []
+        width = len(periods)
+        while end + width < len(lines) and all(
+            _NUMBER.match(value) for value in lines[end + 1:end + 1 + width]
+        ):
+            row = [lines[end]] + lines[end + 1:end + 1 + width]
+            end += 1 + width
+            if interpretation and end < len(lines) and not _NUMBER.match(lines[end]):
+                row.append(lines[end])
+                end += 1
+            rows.append(row)
+
+        if rows:
+            # The caption follows the table ("Composite Index summary")
+            name = None
+            if end < len(lines) and lines[end].lower().endswith(" summary"):
+                name = lines[end][: -len(" summary")]
+            columns = ["Index"] + periods + (["Interpretation"] if interpretation else [])
+            tables.append({"name": name, "note": note, "columns": columns, "rows": rows})
+        pos = max(end, pos + 1)
+    return tables
+
+
+def _passages(text: str, limit: int) -> List[str]:
+    """Sentences of the commentary that state an index value (e.g. 'fell to ... 51.8 in January')."""
+    flat = re.sub(r"\s*\n\s*", " ", text)
+    passages = []
+    for sentence in _SENTENCE_END.split(flat):
+        sentence = sentence.strip()
+        if (
+            ("Index" in sentence or "PMI" in sentence)
+            and _INDEX_VALUE.search(sentence)
+            and 40 <= len(sentence) <= 400
+            and sentence not in passages
+        ):
+            passages.append(sentence)
+            if len(passages) >= limit:
+                break
+    return passages
+
+
+def _quote(text: str) -> Optional[str]:
+    """The economist's comment: the quoted passage following the "Comment" heading."""
+    match = re.search(r"\nComment\n(.*?)“(.*?)[”\"]", text, re.S)
+    if not match:
+        return None
+    speaker = re.sub(r"\s+", " ", match.group(1)).strip().rstrip(":")
+    quote = re.sub(r"\s+", " ", match.group(2)).strip()
+    return f"{speaker}: “{quote}”" if speaker else f"“{quote}”"
+
+
+def extract_pmi_report(path: str) -> Dict:
+    """
+    Extract the figures and key statements of a PMI news release.
+
+    Args:
+        path (str): Path to the PDF report
+
+    Returns:
+        Dict: title, headline, release date, key findings, the index tables
+            (columns and rows per table), commentary passages and the comment quote
+    """
+    doc = fitz.open(path)
+    try:
+        texts = [page.get_text() for page in doc]
+        front = _front_page(doc[0]) if doc.page_count else {}
+        tables = []
+        for page, text in zip(doc, texts):
+            tables += _tables_from_layout(page) or _tables_from_text(text)
+    finally:
+        doc.close()
+
+    full_text = "\n".join(texts)
+    release = _RELEASE.search(full_text)
+    return {
+        **front,
+        "release_date": release.group(1) if release else None,
+        "tables": tables,
+        "passages": _passages(full_text, const.PMI_REPORT_MAX_PASSAGES),
+        "comment": _quote(full_text),
+    }
+
+
+def load_pmi_report(path: str) -> Dict:
+    """extract_pmi_report cached by content hash; the PDF is parsed once per file version."""
+    return cached_extract(
+        "pmi-report", f"v{REPORT_VERSION}:{file_hash(path)}", lambda: extract_pmi_report(path)
+    )
+
+
+def is_complete(report: Dict) -> bool:
+    """Whether the extraction found enough index tables and passages to stand in for the PDF."""
+    return (
+        len(report.get("tables", [])) >= const.PMI_REPORT_MIN_TABLES
+        and len(report.get("passages", [])) >= const.PMI_REPORT_MIN_PASSAGES
+    )
+
+
+def format_pmi_report(report: Dict) -> str:
+    """Compact prompt block with the headline figures, index tables and commentary."""
+    title = report.get("title") or "PMI report"
+    if report.get("release_date"):
+        title += f" (released {report['release_date']})"
+    lines = [title]
+    if report.get("headline"):
+        lines.append(f"Headline: {report['headline']}")
+    if report.get("key_findings"):
+        lines.append("Key findings:")
+        lines += [f"- {finding}" for finding in report["key_findings"]]
+    for table in report.get("tables", []):
+        lines.append(f"{table['name'] or 'Index table'}:")
+        if table.get("note"):
+            lines.append(table["note"])
+        lines.append(" | ".join(table["columns"]))
+        lines += [" | ".join(row) for row in table["rows"]]
+    if report.get("passages"):
+        lines.append("Commentary:")
+        lines += [f"- {passage}" for passage in report["passages"]]
+    if report.get("comment"):
+        lines.append(f"Comment: {report['comment']}")
+    return "\n".join(lines)
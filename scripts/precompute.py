@@ -0,0 +1,270 @@
+"""
+Snapshots of the default analyses (every segment x PRECOMPUTE_MACRO_SETS, no
+comments, no documents), generated through the model by a background scheduler
+at worker start and whenever the data files or prompt templates change.
+
+Snapshots are JSON files under PRECOMPUTE_DIR/<data version>/, shared by all
+workers on the node; one worker builds them while holding a file lock. A
+request is served from a snapshot only if it matches a default combination and
+the snapshot was built from the current version of every watched file.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from typing import Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock, every worker builds
+    fcntl = None
+
+import scripts.constants as const
+from scripts import log, metrics
+from scripts.analysis import (
+    assemble_result,
+    build_charts,
+    generate_parts,
+    get_renderer,
+    load_inputs,
+    params_for,
+    render_prompts,
+)
+from scripts.cache import file_version
+
+PRECOMPUTED = metrics.counter(
+    "finai_precomputed_total", "Default analysis requests by snapshot lookup result (hit/miss)"
+)
+PRECOMPUTE_BUILDS = metrics.counter(
+    "finai_precompute_builds_total", "Snapshots built by the precompute scheduler, by result"
+)
+
+logger = log.get_logger("precompute")
+
+# Last snapshot read per path, keyed by its modification time
+_memo: Dict[str, tuple] = {}
+# (time, data_version()) of the last check, reused by lookup for a poll interval
+_version: tuple = (0.0, None)
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def watched_files() -> List[str]:
+    """Data files and prompt templates the default analyses are built from."""
+    templates = sorted(
+        os.path.join(const.TEMPLATE_DIR, name)
+        for name in os.listdir(const.TEMPLATE_DIR)
+        if name.endswith(".jinja2")
+    )
+    return [
+        const.BANK_DATA_PATH,
+        const.IFO_DATA_PATH,
+        const.PMI_DATA_PATH,
+        const.PMI_PDF_PATH,
+        const.EXAMPLES_PATH,
+    ] + templates
+
+
+def data_version() -> str:
+    """Changes whenever a watched file is modified or a setting that shapes the prompts changes."""
+    parts = [file_version(path) for path in watched_files() if os.path.exists(path)]
+    parts += [const.MODEL, str(const.SECTIONED_ANALYSIS), str(const.PMI_ATTACH_PDF)]
+    return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()[:16]
+
+
+def current_version() -> str:
+    """data_version(), computed at most once per PRECOMPUTE_POLL_INTERVAL."""
+    global _version
+    checked, version = _version
+    if version is None or time.monotonic() - checked >= const.PRECOMPUTE_POLL_INTERVAL:
+        version = data_version()
+        _version = (time.monotonic(), version)
+    return version
+
+
+def default_key(params: Dict) -> Optional[str]:
+    """Snapshot name of a normalized request, or None if it is customized."""
+    if params["documents"] or (params["user_comments"] or "").strip():
+        return None
+    macro_kpis = sorted(params["macro_kpis"])
+    if macro_kpis not in [sorted(s) for s in const.PRECOMPUTE_MACRO_SETS]:
+        return None
+    if params["segment_code"] not in const.SEGMENTS:
+        return None
+    return f"{params['segment_code']}_{'-'.join(macro_kpis)}"
+
+
+def _snapshot_path(version: str, key: str) -> str:
+    return os.path.join(const.PRECOMPUTE_DIR, version, f"{key}.json")
+
+
+def _read(path: str) -> Optional[Dict]:
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    cached = _memo.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        return None
+    _memo[path] = (mtime, snapshot)
+    return snapshot
+
+
+def _write(path: str, snapshot: Dict):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(snapshot, f, ensure_ascii=False, default=str)
+    os.replace(tmp_path, path)
+
+
+def lookup(params: Dict) -> Optional[Dict]:
+    """
+    The precomputed analysis for a default request.
+
+    Returns:
+        Optional[Dict]: The snapshot (result, built_at, version), or None if the request
+            is customized or no snapshot of the current data exists
+    """
+    if not const.PRECOMPUTE_ENABLED:
+        return None
+    key = default_key(params)
+    if key is None:
+        return None
+    snapshot = _read(_snapshot_path(current_version(), key))
+    if snapshot is None or snapshot.get("result") is None:
+        PRECOMPUTED.inc(result="miss")
+        return None
+    PRECOMPUTED.inc(result="hit")
+    return snapshot
+
+
+def _build_one(version: str, segment_code: str, macro_kpis: List[str]) -> bool:
+    """Parse, chart, render and generate one default analysis; True once complete."""
+    params = params_for(segment_code, macro_kpis)
+    key = default_key(params)
+    path = _snapshot_path(version, key)
+    snapshot = _read(path)
+    if snapshot is not None and snapshot.get("result") is not None:
+        return True
+    if snapshot is not None and time.time() - snapshot.get("failed_at", 0) < const.PRECOMPUTE_RETRY_INTERVAL:
+        return False
+
+    started = time.monotonic()
+    inputs = load_inputs(params)
+    charts = build_charts(params, inputs)
+    parts = render_prompts(inputs, get_renderer())
+    snapshot = {
+        "version": version,
+        "key": key,
+        "segment_code": segment_code,
+        "macro_kpis": macro_kpis,
+        "built_at": time.time(),
+        "prompts": [{"key": p["key"], "characters": len(p["prefix"]) + len(p["prompt"])} for p in parts],
+        "result": None,
+    }
+    try:
+        snapshot["result"] = assemble_result(charts, generate_parts(parts))
+        snapshot["generated_at"] = time.time()
+    except Exception as e:
+        logger.error("Precompute: generation of %s failed: %s", key, e)
+        snapshot["failed_at"] = time.time()
+    _write(path, snapshot)
+
+    complete = snapshot["result"] is not None
+    PRECOMPUTE_BUILDS.inc(result="complete" if complete else "failed")
+    logger.info("Precompute: %s built in %.1fs", key, time.monotonic() - started)
+    return complete
+
+
+def _prune(version: str):
+    """Remove the snapshots of previous data versions."""
+    try:
+        names = os.listdir(const.PRECOMPUTE_DIR)
+    except OSError:
+        return
+    for name in names:
+        path = os.path.join(const.PRECOMPUTE_DIR, name)
+        if name != version and os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+    for path in [p for p in _memo if os.path.basename(os.path.dirname(p)) != version]:
+        _memo.pop(path, None)
+
+
+def build(version: str) -> bool:
+    """
+    Build all missing snapshots of a data version unless another worker is building.
+
+    Returns:
+        bool: True if every default analysis of the version is complete
+    """
+    os.makedirs(const.PRECOMPUTE_DIR, exist_ok=True)
+    with open(os.path.join(const.PRECOMPUTE_DIR, ".lock"), "a+b") as handle:
+        if fcntl is not None:
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return False  # Checked again on the next poll
+        try:
+            complete = True
+            for segment_code in const.SEGMENTS:
+                for macro_kpis in const.PRECOMPUTE_MACRO_SETS:
+                    # A newer version makes the rest of this one pointless
+                    if data_version() != version:
+                        return False
+                    complete = _build_one(version, segment_code, list(macro_kpis)) and complete
+            _prune(version)
+            return complete
+        finally:
+            if fcntl is not None:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+class _Scheduler(threading.Thread):
+    """Rebuilds the snapshots at start and whenever data_version() changes."""
+
+    def __init__(self, interval: float):
+        super().__init__(name="precompute", daemon=True)
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        built = None
+        while not self._stop_event.is_set():
+            try:
+                version = data_version()
+                if version != built and build(version):
+                    built = version
+            except Exception as e:
+                logger.error("Precompute failed: %s", e)
+            self._stop_event.wait(self.interval)
+
+
+def start():
+    """Start the scheduler of this worker (no-op if disabled or already running)."""
+    global _scheduler
+    if not const.PRECOMPUTE_ENABLED:
+        return
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = _Scheduler(const.PRECOMPUTE_POLL_INTERVAL)
+            _scheduler.start()
+
+
+def stop():
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is not None:
+            _scheduler.stop()
+            _scheduler = None
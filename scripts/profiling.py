@@ -0,0 +1,345 @@
+import contextvars
+import hmac
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from typing import Dict, List, Optional
+
+import scripts.constants as const
+from scripts import log, metrics
+from scripts.async_io import run_io
+
+PROFILES = metrics.counter(
+    "finai_profiles_total", "Profiled requests by route and trigger (header/sampled)"
+)
+PROFILES_SKIPPED = metrics.counter(
+    "finai_profiles_skipped_total", "Requests selected for profiling while another profile was running"
+)
+
+logger = log.get_logger("profiling")
+
+# Without a token or sampling rate the request hooks return immediately
+ENABLED = bool(const.PROFILE_TOKEN) or const.PROFILE_SAMPLE_RATE > 0
+
+_current: contextvars.ContextVar = contextvars.ContextVar("finai_profile", default=None)
+# tracemalloc and its peak counter are process-wide, so one request is profiled at a time
+_busy = threading.Lock()
+_NULL = nullcontext()
+_PROFILE_ID = re.compile(r"^[0-9]{8}-[0-9]{6}-[0-9a-f]{8}$")
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class _Sampler(threading.Thread):
+    """
+    Samples the stacks of the request thread and of the pool threads doing work
+    for it (PROFILE_THREAD_PREFIXES). Pool threads are shared, so work of other
+    requests running in the same worker at the same time can show up as well.
+    """
+
+    def __init__(self, thread_id: int, interval: float):
+        super().__init__(name="profile-sampler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frames = sys._current_frames()
+            for thread in threading.enumerate():
+                frame = frames.get(thread.ident)
+                if frame is None or thread is self:
+                    continue
+                if thread.ident == self.thread_id:
+                    root = "request"
+                elif thread.name.startswith(const.PROFILE_THREAD_PREFIXES):
+                    root = thread.name.rsplit("_", 1)[0]
+                else:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                # Idle pool threads wait outside of a work item
+                if root != "request" and not any(
+                    label.startswith("run (thread.py") for label in stack
+                ):
+                    continue
+                stack.append(root)
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def folded(self) -> str:
+        """Stacks in the folded format read by flamegraph.pl, speedscope and inferno."""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class Profile:
+    """Stack samples, per-stage timings and peak allocations of one request."""
+
+    def __init__(self, route: str, trigger: str):
+        self.id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.route = route
+        self.trigger = trigger
+        self.status = None
+        self.stages: List[Dict] = []
+        self._open: List[Dict] = []
+        self._sampler = _Sampler(threading.get_ident(), const.PROFILE_INTERVAL)
+        self._owns_tracemalloc = False
+        self._context_token = None
+        self._root = None
+
+    def start(self):
+        self.started_at = time.time()
+        self._started = time.monotonic()
+        self._owns_tracemalloc = not tracemalloc.is_tracing()
+        if self._owns_tracemalloc:
+            tracemalloc.start(const.PROFILE_TRACEMALLOC_FRAMES)
+        self._root = self.stage("request")
+        self._root.__enter__()
+        self._sampler.start()
+
+    @contextmanager
+    def stage(self, name: str):
+        """Record duration, peak and net allocation of a block; stages may nest."""
+        current, peak = tracemalloc.get_traced_memory()
+        if self._open:
+            # reset_peak() below would lose the enclosing stage's peak so far
+            self._open[-1]["peak"] = max(self._open[-1]["peak"], peak)
+        tracemalloc.reset_peak()
+        record = {
+            "name": name,
+            "depth": len(self._open),
+            "start": time.monotonic(),
+            "current": current,
+            "peak": current,
+        }
+        self._open.append(record)
+        try:
+            yield
+        finally:
+            self._open.pop()
+            end_current, peak = tracemalloc.get_traced_memory()
+            peak = max(peak, record["peak"])
+            if self._open:
+                self._open[-1]["peak"] = max(self._open[-1]["peak"], peak)
+            self.stages.append(
+                {
+                    "name": name,
+                    "depth": record["depth"],
+                    "offset": round(record["start"] - self._started, 4),
+                    "seconds": round(time.monotonic() - record["start"], 4),
+                    "peak_bytes": peak - record["current"],
+                    "net_bytes": end_current - record["current"],
+                }
+            )
+
+    def finish(self) -> Dict:
+        """Stop sampling and tracing and return the profile summary."""
+        self._sampler.stop()
+        self._root.__exit__(None, None, None)
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+        )
+        if self._owns_tracemalloc:
+            tracemalloc.stop()
+
+        top = snapshot.statistics("lineno")[: const.PROFILE_TOP_ALLOCATIONS]
+        return {
+            "id": self.id,
+            "route": self.route,
+            "trigger": self.trigger,
+            "status": self.status,
+            "pid": os.getpid(),
+            "started_at": self.started_at,
+            "seconds": round(time.monotonic() - self._started, 4),
+            "samples": self._sampler.samples,
+            "interval": self._sampler.interval,
+            "stages": sorted(self.stages, key=lambda s: (s["offset"], s["depth"])),
+            "top_allocations": [
+                {
+                    "site": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                    "size_bytes": stat.size,
+                    "count": stat.count,
+                }
+                for stat in top
+            ],
+        }
+
+
+def _selected(header_value: Optional[str]) -> Optional[str]:
+    if const.PROFILE_TOKEN and header_value and hmac.compare_digest(header_value, const.PROFILE_TOKEN):
+        return "header"
+    if const.PROFILE_SAMPLE_RATE > 0 and random.random() < const.PROFILE_SAMPLE_RATE:
+        return "sampled"
+    return None
+
+
+def start_request(route: str, header_value: Optional[str] = None) -> Optional[Profile]:
+    """
+    Start profiling the current request if it carries the X-Profile token or is
+    sampled. Must be followed by finish_request() in the same thread or task.
+
+    Returns:
+        Optional[Profile]: The running profile, or None if the request is not profiled
+    """
+    if not ENABLED:
+        return None
+    trigger = _selected(header_value)
+    if trigger is None:
+        return None
+    if not _busy.acquire(blocking=False):
+        PROFILES_SKIPPED.inc(route=route)
+        return None
+    try:
+        profile = Profile(route, trigger)
+        profile.start()
+        profile._context_token = _current.set(profile)
+    except BaseException:
+        _busy.release()
+        raise
+    PROFILES.inc(route=route, trigger=trigger)
+    return profile
+
+
+def _detach(profile: Profile):
+    try:
+        _current.reset(profile._context_token)
+    except ValueError:  # Finished from another context
+        _current.set(None)
+
+
+def _finish(profile: Profile):
+    try:
+        _save(profile.finish(), profile._sampler.folded())
+    except Exception as e:
+        logger.warning("Profile %s could not be stored: %s", profile.id, e)
+    finally:
+        _busy.release()
+
+
+def finish_request(profile: Optional[Profile]):
+    """Stop the request's profile and store it under profile.id."""
+    if profile is None:
+        return
+    _detach(profile)
+    _finish(profile)
+
+
+async def finish_request_async(profile: Optional[Profile]):
+    """finish_request for the asyncio server; the snapshot and files are written in the I/O pool."""
+    if profile is None:
+        return
+    _detach(profile)
+    await run_io(_finish, profile)
+
+
+def stage(name: str):
+    """Context manager recording a pipeline stage; a no-op unless the request is profiled."""
+    profile = _current.get()
+    if profile is None:
+        return _NULL
+    return profile.stage(name)
+
+
+def authorized(header_value: Optional[str]) -> bool:
+    """Access to stored profiles requires the profiling token if one is configured."""
+    if not const.PROFILE_TOKEN:
+        return True
+    return bool(header_value) and hmac.compare_digest(header_value, const.PROFILE_TOKEN)
+
+
+def _paths(profile_id: str):
+    base = os.path.join(const.PROFILE_DIR, profile_id)
+    return base + ".json", base + ".folded"
+
+
+def _save(summary: Dict, folded: str):
+    os.makedirs(const.PROFILE_DIR, exist_ok=True)
+    json_path, folded_path = _paths(summary["id"])
+    with open(folded_path, "w", encoding="utf-8") as f:
+        f.write(folded)
+    # The summary is written last; profiles are listed by their summary file
+    tmp_path = f"{json_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=1)
+    os.replace(tmp_path, json_path)
+    _prune()
+
+
+def _prune():
+    """Drop profiles past PROFILE_RETENTION and all but the newest PROFILE_MAX_COUNT."""
+    try:
+        names = [n for n in os.listdir(const.PROFILE_DIR) if n.endswith(".json")]
+    except OSError:
+        return
+    entries = []
+    for name in names:
+        try:
+            entries.append((os.path.getmtime(os.path.join(const.PROFILE_DIR, name)), name[:-5]))
+        except OSError:
+            pass
+    entries.sort(reverse=True)
+    cutoff = time.time() - const.PROFILE_RETENTION
+    for index, (mtime, profile_id) in enumerate(entries):
+        if index >= const.PROFILE_MAX_COUNT or mtime < cutoff:
+            for path in _paths(profile_id):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+
+def list_profiles() -> List[Dict]:
+    """Summaries of the stored profiles, newest first, without stages and allocations."""
+    profiles = []
+    try:
+        names = sorted(
+            (n for n in os.listdir(const.PROFILE_DIR) if n.endswith(".json")), reverse=True
+        )
+    except OSError:
+        return profiles
+    for name in names:
+        summary = load_profile(name[:-5])
+        if summary is not None:
+            profiles.append(
+                {k: summary.get(k) for k in ("id", "route", "trigger", "status", "started_at", "seconds")}
+            )
+    return profiles
+
+
+def load_profile(profile_id: str) -> Optional[Dict]:
+    if not _PROFILE_ID.match(profile_id):
+        return None
+    try:
+        with open(_paths(profile_id)[0], "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def load_folded(profile_id: str) -> Optional[str]:
+    if not _PROFILE_ID.match(profile_id):
+        return None
+    try:
+        with open(_paths(profile_id)[1], "r", encoding="utf-8") as f:
+            return f.read()
+    except OSError:
+        return None
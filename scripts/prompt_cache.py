@@ -0,0 +1,143 @@
+import hashlib
+import threading
+import time
+from typing import Dict, List, Tuple
+
+import scripts.constants as const
+from scripts import log, metrics
+
+PREFIX_CACHE_HITS = metrics.counter(
+    "finai_prompt_cache_hits_total", "Requests served with an already registered prompt prefix"
+)
+PREFIX_CACHE_MISSES = metrics.counter(
+    "finai_prompt_cache_misses_total", "Requests that had to register the prompt prefix first"
+)
+PREFIX_CACHE_FAILURES = metrics.counter(
+    "finai_prompt_cache_failures_total", "Prefix registrations rejected by the provider"
+)
+PREFIX_CACHE_EXPIRED = metrics.counter(
+    "finai_prompt_cache_expired_total", "Registered prefixes dropped after their lifetime"
+)
+
+logger = log.get_logger("model")
+
+
+class PrefixCache:
+    """
+    Registry of prompt prefixes registered as cached contexts with the model provider.
+
+    Backends implement create_cached_context(prefix, ttl) and delete_cached_context(handle);
+    each (model, prefix) pair is registered once and re-registered shortly before it
+    expires. If the provider rejects a prefix (e.g. below its minimum cacheable size),
+    callers get None and send the full prompt until PROMPT_CACHE_RETRY_AFTER has passed.
+    Handles are released through delete_cached_context once they expire or are
+    replaced, so backends can drop their per-handle state.
+    """
+
+    def __init__(self, ttl: int = None, refresh_margin: int = None):
+        self.ttl = ttl or const.PROMPT_CACHE_TTL
+        self.refresh_margin = refresh_margin or const.PROMPT_CACHE_REFRESH_MARGIN
+        self._entries: Dict[Tuple[str, str], Dict] = {}
+        self._retired: List[Dict] = []  # Replaced entries, released once they expire
+        self._key_locks: Dict[Tuple[str, str], threading.Lock] = {}
+        self._lock = threading.Lock()  # Guards the dicts above, never held across provider calls
+
+    @staticmethod
+    def _key(backend, prefix: str) -> Tuple[str, str]:
+        return backend.model_name, hashlib.sha256(prefix.encode("utf-8")).hexdigest()
+
+    def _key_lock(self, key: Tuple[str, str]) -> threading.Lock:
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _lookup(self, key: Tuple[str, str], now: float):
+        """(True, handle or None) if the entry can be used as is, else (False, None)."""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry and entry.get("failed_until", 0) > now:
+            return True, None
+        if entry and entry.get("handle") is not None:
+            if entry["expires_at"] - self.refresh_margin > now:
+                return True, entry["handle"]
+        return False, None
+
+    def get(self, backend, prefix: str):
+        """Return a cached-context handle for the prefix, registering it if needed."""
+        if not const.PROMPT_CACHE_ENABLED or not prefix:
+            return None
+        key = self._key(backend, prefix)
+
+        found, handle = self._lookup(key, time.time())
+        if not found:
+            # Register under the key's lock so concurrent requests for the same prefix
+            # do not create duplicates, while other prefixes are served meanwhile
+            with self._key_lock(key):
+                now = time.time()
+                found, handle = self._lookup(key, now)
+                if not found:
+                    return self._register(backend, prefix, key, now)
+        if handle is not None:
+            PREFIX_CACHE_HITS.inc(model=backend.model_name)
+        return handle
+
+    def _register(self, backend, prefix: str, key: Tuple[str, str], now: float):
+        PREFIX_CACHE_MISSES.inc(model=backend.model_name)
+        try:
+            handle = backend.create_cached_context(prefix, self.ttl)
+        except Exception as e:
+            PREFIX_CACHE_FAILURES.inc(model=backend.model_name)
+            logger.warning("Prompt prefix could not be cached (%s: %s)", type(e).__name__, e)
+            entry = {"handle": None, "failed_until": now + const.PROMPT_CACHE_RETRY_AFTER}
+            handle = None
+        else:
+            entry = {
+                "handle": handle,
+                "backend": backend,
+                "created_at": now,
+                "expires_at": now + self.ttl,
+            }
+        with self._lock:
+            replaced = self._entries.get(key)
+            self._entries[key] = entry
+            # In-flight requests may still use a refreshed handle; it is released
+            # by purge_expired once its lifetime is over
+            if replaced and replaced.get("handle") is not None:
+                self._retired.append(replaced)
+        return handle
+
+    def invalidate(self, backend, prefix: str):
+        """Forget a prefix after the provider reported its cached context as missing."""
+        with self._lock:
+            entry = self._entries.pop(self._key(backend, prefix), None)
+        if entry and entry.get("handle") is not None:
+            self._release(backend, entry["handle"])
+
+    def purge_expired(self):
+        """Drop entries past their lifetime, including replaced ones, and release them at the provider."""
+        now = time.time()
+        with self._lock:
+            expired = [
+                key
+                for key, entry in self._entries.items()
+                if entry.get("handle") is not None and entry["expires_at"] <= now
+            ]
+            entries = [self._entries.pop(key) for key in expired]
+            entries += [entry for entry in self._retired if entry["expires_at"] <= now]
+            self._retired = [entry for entry in self._retired if entry["expires_at"] > now]
+        for entry in entries:
+            PREFIX_CACHE_EXPIRED.inc(model=entry["backend"].model_name)
+            self._release(entry["backend"], entry["handle"])
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "entries": sum(1 for e in self._entries.values() if e.get("handle") is not None),
+                "rejected": sum(1 for e in self._entries.values() if e.get("handle") is None),
+            }
+
+    @staticmethod
+    def _release(backend, handle):
+        try:
+            backend.delete_cached_context(handle)
+        except Exception as e:
+            logger.warning("Cached prompt prefix could not be released: %s", e)
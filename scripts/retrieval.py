@@ -0,0 +1,254 @@
+import hashlib
+import math
+import os
+import re
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import scripts.constants as const
+from scripts import log
+from scripts.cancellation import CancelToken, check
+from scripts.storage import cached_extract
+from scripts.utils import extract_document_pages
+
+logger = log.get_logger("data")
+
+INDEX_VERSION = 1
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+_STOPWORDS = {
+    "the", "and", "for", "with", "that", "this", "from", "are", "was", "were",
+    "has", "have", "its", "not", "but", "all", "per", "der", "die", "das",
+    "und", "den", "dem", "des", "ein", "eine", "einer", "mit", "von", "für",
+    "auf", "ist", "im", "zu", "sich", "nicht", "auch", "als", "bei", "nach",
+}
+
+# Content hash per (path, mtime, size) so unchanged files are not re-hashed
+_hash_memo: Dict[Tuple[str, float, int], str] = {}
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens, truncated to 7 characters as a light stemmer."""
+    return [
+        token[:7]
+        for token in _TOKEN.findall(text.lower())
+        if len(token) > 1 and token not in _STOPWORDS and not token.isdigit()
+    ]
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / const.RETRIEVAL_CHARS_PER_TOKEN)
+
+
+def file_hash(path: str) -> str:
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_mtime, stat.st_size)
+    if memo_key not in _hash_memo:
+        hasher = hashlib.sha256()
+        with open(path, "rb") as f:
+            for buffer in iter(lambda: f.read(const.UPLOAD_BUFFER_SIZE), b""):
+                hasher.update(buffer)
+        _hash_memo[memo_key] = hasher.hexdigest()
+    return _hash_memo[memo_key]
+
+
+def _split_long(paragraph: str, limit: int) -> List[str]:
+    """Split an oversized paragraph at line, then word boundaries."""
+    parts, current = [], ""
+    for line in paragraph.splitlines():
+        while len(line) > limit:
+            cut = line.rfind(" ", 0, limit)
+            cut = cut if cut > 0 else limit
+            if current:
+                parts.append(current)
+                current = ""
+            parts.append(line[:cut])
+            line = line[cut:].lstrip()
+        if current and len(current) + len(line) + 1 > limit:
+            parts.append(current)
+            current = ""
+        current = f"{current}\n{line}" if current else line
+    if current:
+        parts.append(current)
+    return parts
+
+
+def chunk_pages(pages: List[str], target_chars: int = None) -> List[Dict]:
+    """
+    Split page texts into paragraph-aligned chunks of roughly target_chars.
+
+    Args:
+        pages (List[str]): Page texts of one document
+        target_chars (int, optional): Target chunk size in characters
+
+    Returns:
+        List[Dict]: Chunks with page number (1-based) and text, in document order
+    """
+    target_chars = target_chars or const.RETRIEVAL_CHUNK_CHARS
+    chunks = []
+    for page_number, page in enumerate(pages, start=1):
+        current = ""
+        for paragraph in re.split(r"\n\s*\n", page):
+            paragraph = paragraph.strip()
+            if not paragraph:
+                continue
+            for part in _split_long(paragraph, target_chars):
+                if current and len(current) + len(part) + 2 > target_chars:
+                    chunks.append({"page": page_number, "text": current})
+                    current = ""
+                current = f"{current}\n\n{part}" if current else part
+        if current:
+            chunks.append({"page": page_number, "text": current})
+    return chunks
+
+
+def build_index(chunks: List[Dict]) -> Dict:
+    """Build the BM25 statistics (term frequencies, document frequencies, lengths)."""
+    term_freqs = [dict(Counter(tokenize(chunk["text"]))) for chunk in chunks]
+    doc_freq = Counter(term for tf in term_freqs for term in tf)
+    lengths = [sum(tf.values()) for tf in term_freqs]
+    return {
+        "version": INDEX_VERSION,
+        "chunks": chunks,
+        "term_freqs": term_freqs,
+        "doc_freq": dict(doc_freq),
+        "lengths": lengths,
+        "avg_length": (sum(lengths) / len(lengths)) if lengths else 0.0,
+    }
+
+
+def load_document_index(path: str) -> Dict:
+    """
+    Return the chunk index of an uploaded document, building and caching it on first use.
+    The index is keyed by content hash, so it is shared by identical uploads and all nodes.
+    """
+    digest = file_hash(path)
+    ext = os.path.splitext(path)[1].lower()
+    return cached_extract(
+        "document-index",
+        f"v{INDEX_VERSION}:{digest}{ext}",
+        lambda: build_index(chunk_pages(extract_document_pages(path))),
+    )
+
+
+def score_chunks(index: Dict, query_terms: List[str]) -> List[float]:
+    """BM25 score of every chunk in the index for the given query tokens."""
+    n_chunks = len(index["chunks"])
+    if not n_chunks:
+        return []
+    avg_length = index["avg_length"] or 1.0
+    k1, b = const.BM25_K1, const.BM25_B
+
+    # Repeated query terms count repeatedly, as in summing BM25 over the query
+    idf = {}
+    for term, query_freq in Counter(query_terms).items():
+        df = index["doc_freq"].get(term, 0)
+        if df:
+            idf[term] = query_freq * math.log(1 + (n_chunks - df + 0.5) / (df + 0.5))
+
+    scores = []
+    for tf, length in zip(index["term_freqs"], index["lengths"]):
+        norm = k1 * (1 - b + b * length / avg_length)
+        score = 0.0
+        for term, weight in idf.items():
+            freq = tf.get(term)
+            if freq:
+                score += weight * freq * (k1 + 1) / (freq + norm)
+        scores.append(score)
+    return scores
+
+
+def build_query(
+    segment: str,
+    kpis: List[str],
+    macro_kpis: List[str],
+    user_comments: Optional[str] = None,
+) -> List[str]:
+    """Query tokens from the segment, the KPI labels, selected indicators and user comments."""
+    parts = [segment.replace("_", " ")]
+    parts += const.RETRIEVAL_QUERY_TERMS
+    for kpi in kpis:
+        parts.append(kpi.replace("_", " "))
+        parts += const.KPI_LABELS.get(kpi, [])
+    parts += [const.MACRO_QUERY_TERMS[m] for m in macro_kpis if m in const.MACRO_QUERY_TERMS]
+    if user_comments:
+        # User comments are the most specific signal, weight them twice
+        parts += [user_comments, user_comments]
+    return tokenize(" ".join(parts))
+
+
+def select_document_excerpts(
+    documents: List[Tuple[str, str]],
+    query_terms: List[str],
+    token_budget: int = None,
+    token: CancelToken = None,
+) -> List[str]:
+    """
+    Select the most relevant chunks of all documents within a global token budget.
+
+    Args:
+        documents (List[Tuple[str, str]]): (display filename, path) of each document
+        query_terms (List[str]): Query tokens from build_query
+        token_budget (int, optional): Total token budget for all excerpts
+        token (CancelToken, optional): Checked before each document is extracted
+
+    Returns:
+        List[str]: One prompt block per document, chunks in document order
+    """
+    if not documents:
+        return []
+    if token_budget is None:
+        token_budget = min(
+            const.RETRIEVAL_TOKEN_BUDGET,
+            const.RETRIEVAL_TOKENS_PER_DOCUMENT * len(documents),
+        )
+
+    indexes = []
+    candidates = []  # (score, document position, chunk position, tokens)
+    for doc_pos, (filename, path) in enumerate(documents):
+        check(token, "documents")
+        try:
+            index = load_document_index(path)
+        except Exception as e:
+            logger.error("Fehler beim Lesen von %s: %s", filename, e)
+            index = None
+        indexes.append(index)
+        if not index:
+            continue
+
+        scores = score_chunks(index, query_terms)
+        top = max(scores) if scores else 0.0
+        for chunk_pos, (chunk, score) in enumerate(zip(index["chunks"], scores)):
+            # Unmatched chunks only fill in for documents without any match,
+            # which then fall back to their opening chunks
+            if score <= 0 and top > 0:
+                continue
+            # Normalize per document so one long report cannot crowd out the others;
+            # earlier chunks win ties (summaries usually come first)
+            relative = score / top if top > 0 else 0.0
+            candidates.append(
+                (relative, -chunk_pos, doc_pos, chunk_pos, estimate_tokens(chunk["text"]))
+            )
+
+    selected = {doc_pos: [] for doc_pos in range(len(documents))}
+    remaining = token_budget
+    for _, _, doc_pos, chunk_pos, tokens in sorted(candidates, reverse=True):
+        if tokens <= remaining:
+            selected[doc_pos].append(chunk_pos)
+            remaining -= tokens
+
+    blocks = []
+    for doc_pos, (filename, _) in enumerate(documents):
+        index = indexes[doc_pos]
+        if not index or not selected[doc_pos]:
+            continue
+        chunks = index["chunks"]
+        paged = chunks[-1]["page"] > 1
+        excerpt = "\n[...]\n".join(
+            f"[Seite {chunks[pos]['page']}] {chunks[pos]['text']}"
+            if paged
+            else chunks[pos]["text"]
+            for pos in sorted(selected[doc_pos])
+        )
+        blocks.append(f"Inhalt von {filename}:\n{excerpt}")
+    return blocks
@@ -0,0 +1,303 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows development machines
+    fcntl = None
+
+import scripts.constants as const
+from scripts import log, metrics
+from scripts.cancellation import CancelToken, SharedCancelToken
+
+COALESCED = metrics.counter(
+    "finai_singleflight_coalesced_total",
+    "Requests that shared the result of an identical in-flight computation",
+)
+LEADERS = metrics.counter(
+    "finai_singleflight_leaders_total", "Computations actually executed by single-flight"
+)
+
+logger = log.get_logger("cache")
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.token = SharedCancelToken()
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent computations with the same key.
+
+    Within a process, duplicates wait for the first caller's result. Across
+    gunicorn workers on the same node, the first caller holds a file lock in
+    lock_dir and publishes its JSON-serializable result there; a worker that
+    obtains the lock afterwards reuses a result younger than result_ttl instead
+    of computing it again. Results are only shared between overlapping
+    requests, not cached.
+
+    fn receives a token that is cancelled only once every caller waiting for
+    the result has been cancelled; a cancelled follower stops waiting while
+    the computation continues for the others.
+    """
+
+    def __init__(self, lock_dir: str, result_ttl: float = None, wait_timeout: float = None):
+        self.lock_dir = lock_dir
+        self.result_ttl = result_ttl if result_ttl is not None else const.SINGLEFLIGHT_RESULT_TTL
+        self.wait_timeout = (
+            wait_timeout if wait_timeout is not None else const.SINGLEFLIGHT_WAIT_TIMEOUT
+        )
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(
+        self, key: str, fn: Callable[[CancelToken], Any], token: Optional[CancelToken] = None
+    ) -> Tuple[Any, bool]:
+        """
+        Run fn once per key among concurrent callers.
+
+        Args:
+            key (str): Identity of the computation
+            fn (Callable[[CancelToken], Any]): Computation, called with the shared token
+            token (CancelToken, optional): Cancellation token of this caller
+
+        Returns:
+            Tuple[Any, bool]: The result and whether it was shared from another caller
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                leader = True
+            call.token.attach(token)
+
+        if not leader:
+            if token is None:
+                call.done.wait()
+            else:
+                while not call.done.wait(const.CANCEL_POLL_INTERVAL):
+                    token.check("singleflight")
+            COALESCED.inc(scope="thread")
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result, shared = self._run_locked(key, fn, call.token)
+            return call.result, shared
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def _paths(self, key: str):
+        base = os.path.join(self.lock_dir, key)
+        return base + ".lock", base + ".json"
+
+    def _read_result(self, result_path: str):
+        try:
+            if time.time() - os.path.getmtime(result_path) > self.result_ttl:
+                return None
+            with open(result_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _acquire(self, handle, token: CancelToken) -> bool:
+        """Wait for the cross-process lock; give up after wait_timeout."""
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    return False
+                if token.wait(const.SINGLEFLIGHT_POLL_INTERVAL):
+                    token.check("singleflight")
+
+    def _open_locked(self, lock_path: str, token: CancelToken):
+        """
+        Open and lock the lock file of a key. If _cleanup removed the file while
+        this worker waited, the lock is on an orphaned inode, so the current file
+        is opened and locked instead.
+
+        Returns:
+            Tuple: The open handle and whether it is locked (False after wait_timeout)
+        """
+        while True:
+            handle = open(lock_path, "a+b")
+            try:
+                if not self._acquire(handle, token):
+                    return handle, False
+                try:
+                    current = os.fstat(handle.fileno()).st_ino == os.stat(lock_path).st_ino
+                except FileNotFoundError:
+                    current = False
+                if current:
+                    os.utime(lock_path)  # Recently used keys are kept by _cleanup
+                    return handle, True
+                fcntl.flock(handle, fcntl.LOCK_UN)
+            except BaseException:
+                handle.close()
+                raise
+            handle.close()
+
+    def _run_locked(self, key: str, fn: Callable[[CancelToken], Any], token: CancelToken) -> Tuple[Any, bool]:
+        if fcntl is None:
+            LEADERS.inc()
+            return fn(token), False
+
+        os.makedirs(self.lock_dir, exist_ok=True)
+        self._cleanup()
+        lock_path, result_path = self._paths(key)
+        requested_at = time.time()
+
+        handle, locked = self._open_locked(lock_path, token)
+        with handle:
+            try:
+                # Another worker finished the same request while we were waiting
+                if os.path.exists(result_path) and os.path.getmtime(result_path) >= requested_at:
+                    result = self._read_result(result_path)
+                    if result is not None:
+                        COALESCED.inc(scope="process")
+                        return result["value"], True
+
+                LEADERS.inc()
+                value = fn(token)
+                try:
+                    tmp_path = f"{result_path}.{os.getpid()}.tmp"
+                    with open(tmp_path, "w", encoding="utf-8") as f:
+                        json.dump({"value": value}, f, ensure_ascii=False)
+                    os.replace(tmp_path, result_path)
+                except (OSError, TypeError, ValueError) as e:
+                    logger.warning("Single-flight result could not be shared: %s", e)
+                return value, False
+            finally:
+                if locked:
+                    fcntl.flock(handle, fcntl.LOCK_UN)
+
+    def _cleanup(self):
+        """Remove published results past their TTL and lock files of keys unused for long."""
+        now = time.time()
+        result_cutoff = now - max(self.result_ttl, 60)
+        lock_cutoff = now - max(2 * self.wait_timeout, 3600)
+        try:
+            names = os.listdir(self.lock_dir)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(self.lock_dir, name)
+            try:
+                if name.endswith(".lock"):
+                    if os.path.getmtime(path) < lock_cutoff:
+                        self._remove_lock(path)
+                elif os.path.getmtime(path) < result_cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    @staticmethod
+    def _remove_lock(path: str):
+        """
+        Remove a lock file while holding its lock, so no worker is inside the
+        computation. Workers still waiting on the removed inode notice it in
+        _open_locked and lock the new file.
+        """
+        with open(path, "a+b") as handle:
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return
+            try:
+                if os.fstat(handle.fileno()).st_ino == os.stat(path).st_ino:
+                    os.remove(path)
+            finally:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+class AsyncSingleFlight:
+    """
+    SingleFlight for the asyncio server: concurrent callers with the same key
+    await one task. Coalescing is per process only, which is where all pending
+    analyses of the async server live.
+
+    A caller that is cancelled or disconnects stops waiting; the task itself is
+    cancelled once its shared token is, i.e. when no caller is left.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, Tuple[asyncio.Future, SharedCancelToken]] = {}
+
+    def _forget(self, key: str, task: asyncio.Future):
+        if self._calls.get(key, (None,))[0] is task:
+            del self._calls[key]
+        # Retrieve the outcome so abandoned failures are not reported as unhandled
+        if not task.cancelled():
+            task.exception()
+
+    async def do(
+        self,
+        key: str,
+        fn: Callable[[CancelToken], Awaitable[Any]],
+        token: Optional[CancelToken] = None,
+    ) -> Tuple[Any, bool]:
+        """
+        Run fn once per key among concurrent callers.
+
+        Args:
+            key (str): Identity of the computation
+            fn (Callable[[CancelToken], Awaitable[Any]]): Coroutine function, called with the shared token
+            token (CancelToken, optional): Cancellation token of this caller
+
+        Returns:
+            Tuple[Any, bool]: The result and whether it was shared from another caller
+        """
+        call = self._calls.get(key)
+        leader = call is None
+        if leader:
+            shared = SharedCancelToken()
+            shared.attach(token)
+            task = asyncio.ensure_future(fn(shared))
+            self._calls[key] = (task, shared)
+            task.add_done_callback(lambda done: self._forget(key, done))
+            LEADERS.inc()
+        else:
+            task, shared = call
+            shared.attach(token)
+
+        try:
+            while True:
+                # The task is not awaited directly so a leaving caller cannot cancel it
+                done, _ = await asyncio.wait(
+                    {task}, timeout=const.CANCEL_POLL_INTERVAL if token is not None else None
+                )
+                if done:
+                    break
+                if shared.cancelled:
+                    task.cancel()
+                token.check("singleflight")
+        except asyncio.CancelledError:
+            if token is not None:
+                token.cancel("disconnected")
+            if shared.cancelled:
+                task.cancel()
+            raise
+
+        if not leader:
+            COALESCED.inc(scope="task")
+        return task.result(), not leader
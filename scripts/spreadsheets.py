@@ -0,0 +1,427 @@
+import csv
+import datetime
+import os
+import re
+from itertools import chain, islice
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import openpyxl
+
+import scripts.constants as const
+from scripts import log
+from scripts.cancellation import CancelToken, check
+from scripts.retrieval import file_hash
+from scripts.storage import cached_extract
+
+logger = log.get_logger("data")
+
+TABLES_VERSION = 2
+
+SPREADSHEET_EXTENSIONS = (".xlsx", ".csv")
+
+_YEAR = r"(\d{4}|\d{2})"
+_SEP = r"[\s_/.\-]*"
+_PERIOD_PATTERNS = [
+    (re.compile(rf"^Q([1-4]){_SEP}{_YEAR}$"), lambda m: f"Q{m[1]}_{_year(m[2])}"),
+    (re.compile(rf"^([1-4])Q{_SEP}{_YEAR}$"), lambda m: f"Q{m[1]}_{_year(m[2])}"),
+    (re.compile(rf"^(\d{{4}}){_SEP}Q([1-4])$"), lambda m: f"Q{m[2]}_{m[1]}"),
+    (re.compile(rf"^H([12]){_SEP}{_YEAR}$"), lambda m: f"H{m[1]}_{_year(m[2])}"),
+    (re.compile(rf"^(?:FY|GJ){_SEP}{_YEAR}$"), lambda m: f"FY_{_year(m[1])}"),
+    (re.compile(r"^(\d{4})$"), lambda m: f"FY_{m[1]}"),
+    (re.compile(r"^(\d{4})-(\d{1,2})(?:-\d{1,2})?(?:[ T].*)?$"), lambda m: _month(int(m[1]), int(m[2]))),
+    (re.compile(r"^\d{1,2}\.(\d{1,2})\.(\d{4})$"), lambda m: _month(int(m[2]), int(m[1]))),
+]
+_MONTH = re.compile(r"^(\d{4})-(\d{2})$")
+_LABEL_PERIOD = re.compile(r"^(Q|H)([1-4])_(\d{4})$")
+_ENGLISH_THOUSANDS = re.compile(r"^-?\d{1,3}(,\d{3})+(\.\d+)?$")
+_GERMAN_THOUSANDS = re.compile(r"^-?\d{1,3}(\.\d{3})+(,\d+)?$")
+
+
+def _year(text: str) -> str:
+    return text if len(text) == 4 else f"20{text}"
+
+
+def _month(year: int, month: int) -> Optional[str]:
+    return f"{year}-{month:02d}" if 1 <= month <= 12 else None
+
+
+def parse_period(cell) -> Optional[str]:
+    """
+    Normalize a header or date cell to the period labels of extract_metrics_from_excel
+    (Q1_2024, FY_2024, H1_2024); dates become YYYY-MM (see _quarterly).
+
+    Returns:
+        Optional[str]: The period label, or None if the cell is not a period
+    """
+    if isinstance(cell, (datetime.date, datetime.datetime)):
+        return _month(cell.year, cell.month)
+    if isinstance(cell, bool):
+        return None
+    if isinstance(cell, (int, float)):
+        if float(cell).is_integer() and 1990 <= cell <= 2100:
+            return f"FY_{int(cell)}"
+        return None
+    if not isinstance(cell, str):
+        return None
+    text = cell.strip().upper()
+    for pattern, label in _PERIOD_PATTERNS:
+        match = pattern.match(text)
+        if match:
+            return label(match)
+    return None
+
+
+def period_order(period: str) -> Tuple[int, int, int]:
+    """Sort key of a period label: year, then the month the period ends in; a year ends with FY."""
+    if period.startswith("FY_"):
+        return int(period[3:]), 12, 1
+    match = _MONTH.match(period)
+    if match:
+        return int(match[1]), int(match[2]), 0
+    match = _LABEL_PERIOD.match(period)
+    if match:
+        return int(match[3]), int(match[2]) * (3 if match[1] == "Q" else 6), 0
+    return 0, 0, 0
+
+
+def parse_number(cell) -> Optional[float]:
+    """Numeric value of a cell: numbers, '(17.4)', '3.2%', '25bps', '1,234.5' or '1.234,5'."""
+    if isinstance(cell, bool):
+        return None
+    if isinstance(cell, (int, float)):
+        return None if cell != cell else float(cell)  # NaN
+    if not isinstance(cell, str):
+        return None
+    text = (
+        cell.replace("\u00a0", "").replace(" ", "")
+        .replace("%", "").replace("bps", "").replace("€", "").replace("EUR", "")
+    )
+    negative = text.startswith("(") and text.endswith(")")
+    text = text.strip("()")
+    if _ENGLISH_THOUSANDS.match(text):
+        text = text.replace(",", "")
+    elif _GERMAN_THOUSANDS.match(text) or ("," in text and "." not in text):
+        text = text.replace(".", "").replace(",", ".")
+    try:
+        number = float(text)
+    except ValueError:
+        return None
+    return -number if negative else number
+
+
+def _text(cell) -> str:
+    return cell.strip() if isinstance(cell, str) else ""
+
+
+def _csv_rows(path: str) -> Iterator[Tuple]:
+    with open(path, "r", encoding="utf-8-sig", errors="replace", newline="") as f:
+        sample = f.read(8192)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+        except csv.Error:
+            dialect = csv.excel
+        for row in csv.reader(f, dialect):
+            yield tuple(cell if cell.strip() else None for cell in row)
+
+
+def _iter_sheets(path: str) -> Iterator[Tuple[str, Iterator[Tuple]]]:
+    """(sheet name, row iterator) per sheet; workbooks are streamed in read-only mode."""
+    if path.lower().endswith(".csv"):
+        yield os.path.splitext(os.path.basename(path))[0], _csv_rows(path)
+        return
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            yield sheet.title, sheet.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def _period_columns(row: Tuple) -> Dict[int, str]:
+    columns = {}
+    for col, cell in enumerate(row):
+        period = parse_period(cell)
+        if period is not None and period not in columns.values():
+            columns[col] = period
+    return columns
+
+
+def _find_period_header(head: List[Tuple]) -> Optional[Tuple[int, Dict[int, str], int]]:
+    """Header with the periods across the columns (the FDS layout): position, period columns, label column."""
+    for pos, row in enumerate(head):
+        periods = _period_columns(row)
+        if len(periods) < const.SPREADSHEET_MIN_PERIODS:
+            continue
+        first_period = min(periods)
+        sample = head[pos + 1:]
+        for label_col in range(first_period):
+            if any(_text(r[label_col]) for r in sample if label_col < len(r)):
+                return pos, periods, label_col
+    return None
+
+
+def _find_column_header(head: List[Tuple]) -> Optional[Tuple[int, int, Dict[int, str]]]:
+    """Header above a column of dates or periods (time series in rows): position, period column, series names."""
+    for pos, row in enumerate(head):
+        names = {col: _text(cell) for col, cell in enumerate(row) if _text(cell)}
+        if len(names) < 2:
+            continue
+        sample = head[pos + 1:pos + 6]
+        if len(sample) < const.SPREADSHEET_MIN_PERIODS:
+            return None
+        for period_col in range(len(row)):
+            hits = sum(
+                1 for r in sample if period_col < len(r) and parse_period(r[period_col]) is not None
+            )
+            if hits * 2 > len(sample):
+                series = {col: name for col, name in names.items() if col != period_col}
+                if series:
+                    return pos, period_col, series
+                break
+    return None
+
+
+def _rows_by_period(rows: Iterator[Tuple], periods: Dict[int, str], label_col: int) -> Tuple[List[Dict], bool]:
+    records = []
+    for row in rows:
+        if len(records) >= const.SPREADSHEET_MAX_ROWS:
+            return records, True
+        label = _text(row[label_col]) if label_col < len(row) else ""
+        if not label:
+            continue
+        values = {}
+        for col, period in periods.items():
+            number = parse_number(row[col]) if col < len(row) else None
+            if number is not None:
+                values[period] = number
+        # Rows without numbers are section headings or notes
+        if values:
+            records.append({"label": label, "values": values})
+    return records, False
+
+
+def _rows_by_series(rows: Iterator[Tuple], period_col: int, series: Dict[int, str]) -> Tuple[List[Dict], bool]:
+    values = {col: {} for col in series}
+    truncated = False
+    count = 0
+    for row in rows:
+        period = parse_period(row[period_col]) if period_col < len(row) else None
+        if period is None:
+            continue
+        if count >= const.SPREADSHEET_MAX_ROWS:
+            truncated = True
+            break
+        count += 1
+        for col in series:
+            number = parse_number(row[col]) if col < len(row) else None
+            if number is not None:
+                values[col][period] = number
+    records = [{"label": name, "values": values[col]} for col, name in series.items() if values[col]]
+    return records, truncated
+
+
+def _quarterly(records: List[Dict]):
+    """Label dates as quarters (as in the FDS workbook) if all of them are quarter ends."""
+    months = {p for record in records for p in record["values"] if _MONTH.match(p)}
+    if not months or any(int(p[5:]) % 3 for p in months):
+        return
+    labels = {p: f"Q{int(p[5:]) // 3}_{p[:4]}" for p in months}
+    for record in records:
+        record["values"] = {labels.get(p, p): v for p, v in record["values"].items()}
+
+
+def _sheet_segment(name: str) -> Optional[str]:
+    """Segment a sheet reports on if its name says so (FinSum, CB, corporate_bank, Corporate Bank)."""
+    normalized = name.strip().lower().replace(" ", "_")
+    for code, segment in const.SEGMENTS.items():
+        if normalized in (code.lower(), segment):
+            return segment
+    return None
+
+
+def _normalize_label(label: str) -> str:
+    return " ".join(re.sub(r"[\W_]+", " ", label.lower()).split())
+
+
+# Row labels that name a KPI unambiguously: its key and the multi-word labels of
+# KPI_LABELS. Abbreviations such as "bps" or "llp" appear in too many rows.
+_KPI_ROW_LABELS = {
+    _normalize_label(label): kpi_key
+    for kpi_key, keywords in const.KPI_LABELS.items()
+    for label in [kpi_key] + [kw for kw in keywords if " " in kw.strip()]
+}
+
+
+def _match_kpis(records: List[Dict]) -> Dict[str, Dict[str, str]]:
+    """KPIs of rows whose whole label names one (see _KPI_ROW_LABELS); later rows win."""
+    kpis = {}
+    for record in records:
+        kpi_key = _KPI_ROW_LABELS.get(_normalize_label(record["label"]))
+        if kpi_key is not None:
+            # Only periods in the workbook's format can be merged with it
+            values = {
+                period: f"{record['values'][period]:.10g}"
+                for period in sorted(record["values"], key=period_order)
+                if period.startswith(("Q", "FY_"))
+            }
+            if values:
+                kpis[kpi_key] = values
+    return kpis
+
+
+def _parse_sheet(name: str, rows: Iterator[Tuple]) -> Optional[Dict]:
+    head = list(islice(rows, const.SPREADSHEET_HEADER_SCAN_ROWS))
+    header = _find_period_header(head)
+    if header is not None:
+        pos, periods, label_col = header
+        records, truncated = _rows_by_period(chain(head[pos + 1:], rows), periods, label_col)
+        layout = "periods_in_columns"
+    else:
+        header = _find_column_header(head)
+        if header is None:
+            return None
+        pos, period_col, series = header
+        records, truncated = _rows_by_series(chain(head[pos + 1:], rows), period_col, series)
+        layout = "periods_in_rows"
+    if not records:
+        return None
+    _quarterly(records)
+
+    seen = {}
+    for record in records:
+        for period in record["values"]:
+            seen.setdefault(period, None)
+    return {
+        "sheet": name,
+        "layout": layout,
+        "header_row": pos + 1,
+        "periods": sorted(seen, key=period_order),
+        "rows": records,
+        "truncated": truncated,
+        "segment": _sheet_segment(name),
+        "kpis": _match_kpis(records),
+    }
+
+
+def parse_spreadsheet(path: str) -> Dict:
+    """
+    Parse every sheet of an .xlsx or .csv file into a typed table.
+
+    The header is searched in the first SPREADSHEET_HEADER_SCAN_ROWS rows, either as a
+    row of period labels (periods across the columns) or as column names above a
+    column of dates or periods. Rows are streamed and at most SPREADSHEET_MAX_ROWS
+    are kept per sheet.
+
+    Returns:
+        Dict: "tables" with sheet, layout, periods, rows (label and period → value),
+            the sheet's segment if its name names one and the recognized KPIs
+    """
+    tables = []
+    for name, rows in _iter_sheets(path):
+        table = _parse_sheet(name, rows)
+        if table is not None:
+            tables.append(table)
+    return {"tables": tables}
+
+
+def is_spreadsheet(path: str) -> bool:
+    return str(path).lower().endswith(SPREADSHEET_EXTENSIONS)
+
+
+def load_spreadsheet(path: str) -> Dict:
+    """parse_spreadsheet cached by content hash, so identical uploads are parsed once on any node."""
+    digest = file_hash(path)
+    ext = os.path.splitext(path)[1].lower()
+    return cached_extract(
+        "spreadsheet-tables", f"v{TABLES_VERSION}:{digest}{ext}", lambda: parse_spreadsheet(path)
+    )
+
+
+def split_documents(
+    documents: List[Tuple[str, str]], token: CancelToken = None
+) -> Tuple[List[Tuple[str, Dict]], List[Tuple[str, str]]]:
+    """
+    Separate uploaded spreadsheets with numeric tables from the documents that go
+    through text retrieval. Spreadsheets without a recognizable table (notes in a
+    workbook) stay text documents.
+
+    Returns:
+        Tuple: (filename, parsed tables) and (filename, path) of the text documents
+    """
+    tables, texts = [], []
+    for filename, path in documents:
+        if is_spreadsheet(path):
+            check(token, "documents")
+            try:
+                parsed = load_spreadsheet(path)
+            except Exception as e:
+                logger.error("Fehler beim Tabellen-Parsing von %s: %s", filename, e)
+                parsed = None
+            if parsed and parsed["tables"]:
+                tables.append((filename, parsed))
+                continue
+        texts.append((filename, path))
+    return tables, texts
+
+
+def uploaded_kpis(spreadsheets: List[Dict], segment_name: str) -> Dict[str, Dict[str, str]]:
+    """KPIs of all uploaded tables for the segment; sheets named after another segment are skipped."""
+    kpis = {}
+    for parsed in spreadsheets:
+        for table in parsed["tables"]:
+            if table["segment"] in (None, segment_name):
+                for kpi_key, values in table["kpis"].items():
+                    kpis.setdefault(kpi_key, {}).update(values)
+    return kpis
+
+
+def merge_kpis(bank_data: Dict[str, Dict[str, str]], uploaded: Dict[str, Dict[str, str]]) -> Dict:
+    """
+    Bank data of the FDS workbook completed with uploaded KPIs. Uploaded values
+    only fill periods the workbook does not report; reported figures are kept.
+    """
+    merged = {kpi_key: dict(values) for kpi_key, values in bank_data.items()}
+    for kpi_key, values in uploaded.items():
+        reported = merged.setdefault(kpi_key, {})
+        for period, value in values.items():
+            reported.setdefault(period, value)
+    return merged
+
+
+def _format(value: float) -> str:
+    text = f"{value:.2f}"
+    return text.rstrip("0").rstrip(".") if "." in text else text
+
+
+def summarize_tables(filename: str, parsed: Dict) -> str:
+    """
+    Compact prompt block for an uploaded spreadsheet: per table the most recent
+    SPREADSHEET_SUMMARY_PERIODS periods of at most SPREADSHEET_SUMMARY_ROWS rows.
+    Recognized KPIs are only named; their values are listed separately from the bank data.
+    """
+    lines = [f"Inhalt von {filename} (Tabellen):"]
+    for table in parsed["tables"]:
+        periods = table["periods"][-const.SPREADSHEET_SUMMARY_PERIODS:]
+        lines.append(
+            f"[Sheet {table['sheet']}: {len(table['rows'])} rows, "
+            f"periods {table['periods'][0]} to {table['periods'][-1]}"
+            f"{', truncated' if table['truncated'] else ''}]"
+        )
+        if table["kpis"]:
+            lines.append(f"KPIs listed under uploaded KPIs: {', '.join(table['kpis'])}")
+        lines.append(" | ".join(["Row"] + periods))
+        shown = table["rows"][: const.SPREADSHEET_SUMMARY_ROWS]
+        for record in shown:
+            lines.append(
+                " | ".join(
+                    [record["label"]]
+                    + [
+                        _format(record["values"][p]) if p in record["values"] else ""
+                        for p in periods
+                    ]
+                )
+            )
+        if len(table["rows"]) > len(shown):
+            lines.append(f"[... {len(table['rows']) - len(shown)} more rows]")
+    return "\n".join(lines)
@@ -0,0 +1,325 @@
+"""
+Storage of completed uploads and of the results extracted from them.
+
+Objects are addressed by key: an upload by its content-hash name
+("<sha256>.pdf"), the alias of a client filename by ".aliases/<name>" and an
+extraction result by ".extracted/<namespace>/<key>". The local backend keeps
+them in UPLOAD_DIR, which serves a single node. The s3 backend keeps them in a
+bucket shared by all nodes. Files the pipeline opens are copied to
+STORAGE_CACHE_DIR on first use (read-through, least recently used evicted).
+"""
+
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional
+
+import scripts.constants as const
+from scripts import log, metrics
+from scripts.cache import deserialize, get_cache, serialize
+
+STORAGE_LOCAL_COPIES = metrics.counter(
+    "finai_storage_local_copies_total", "Local copy lookups of stored objects by result (hit/miss)"
+)
+STORAGE_EXTRACTS = metrics.counter(
+    "finai_storage_extracts_total", "Extraction results of uploads by source (cache/storage/computed)"
+)
+STORAGE_ERRORS = metrics.counter(
+    "finai_storage_errors_total", "Storage backend errors by backend and operation"
+)
+
+logger = log.get_logger("storage")
+
+_MISSING = object()
+
+_prefetch_pool = ThreadPoolExecutor(
+    max_workers=const.STORAGE_PREFETCH_WORKERS, thread_name_prefix="storage-prefetch"
+)
+
+
+class StorageBackend:
+    """Object store for uploads; keys are relative paths with "/" separators."""
+
+    name = "base"
+
+    def exists(self, key: str) -> bool:
+        raise NotImplementedError
+
+    def read(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def write(self, key: str, data: bytes):
+        raise NotImplementedError
+
+    def put_file(self, key: str, path: str) -> str:
+        """Store the file at path under key; the file is moved, not copied. Returns its location."""
+        raise NotImplementedError
+
+    def location(self, key: str) -> str:
+        raise NotImplementedError
+
+    def local_path(self, key: str) -> Optional[str]:
+        """Path of a local copy of the object, or None if it does not exist."""
+        raise NotImplementedError
+
+
+def _replace_atomically(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class LocalBackend(StorageBackend):
+    """Objects as files under UPLOAD_DIR, visible to the workers of one node."""
+
+    name = "local"
+
+    def __init__(self, root: str = None):
+        self.root = root or const.UPLOAD_DIR
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, *key.split("/"))
+
+    def exists(self, key: str) -> bool:
+        return os.path.isfile(self._path(key))
+
+    def read(self, key: str) -> Optional[bytes]:
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def write(self, key: str, data: bytes):
+        _replace_atomically(self._path(key), data)
+
+    def put_file(self, key: str, path: str) -> str:
+        target = self._path(key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(path, target)
+        return target
+
+    def location(self, key: str) -> str:
+        return self._path(key)
+
+    def local_path(self, key: str) -> Optional[str]:
+        path = self._path(key)
+        return path if os.path.isfile(path) else None
+
+
+class S3Backend(StorageBackend):
+    """
+    Objects in an S3-compatible bucket (AWS, MinIO, Ceph or a local stand-in via
+    FINAI_STORAGE_S3_ENDPOINT), shared by all nodes. Credentials come from the
+    usual AWS environment variables or config files.
+    """
+
+    name = "s3"
+
+    def __init__(
+        self,
+        bucket: str = None,
+        prefix: str = None,
+        endpoint_url: str = None,
+        cache_dir: str = None,
+        cache_max_bytes: int = None,
+    ):
+        try:
+            import boto3
+            from botocore.exceptions import ClientError
+        except ImportError:
+            raise ImportError(
+                "The s3 storage backend requires the 'boto3' package (pip install boto3)."
+            )
+        self.bucket = bucket or const.STORAGE_S3_BUCKET
+        if not self.bucket:
+            raise ValueError("The s3 storage backend requires FINAI_STORAGE_S3_BUCKET.")
+        self.prefix = const.STORAGE_S3_PREFIX if prefix is None else prefix
+        self.cache_dir = cache_dir or const.STORAGE_CACHE_DIR
+        self.cache_max_bytes = cache_max_bytes or const.STORAGE_CACHE_MAX_BYTES
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url or const.STORAGE_S3_ENDPOINT,
+            region_name=const.STORAGE_S3_REGION,
+        )
+        self._client_error = ClientError
+        self._evict_lock = threading.Lock()
+
+    def _object_key(self, key: str) -> str:
+        return self.prefix + key
+
+    def _not_found(self, error) -> bool:
+        return isinstance(error, self._client_error) and error.response.get("Error", {}).get(
+            "Code"
+        ) in ("404", "NoSuchKey", "NotFound")
+
+    def exists(self, key: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+            return True
+        except Exception as e:
+            if self._not_found(e):
+                return False
+            raise
+
+    def read(self, key: str) -> Optional[bytes]:
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self._object_key(key))
+        except Exception as e:
+            if self._not_found(e):
+                return None
+            raise
+        return response["Body"].read()
+
+    def write(self, key: str, data: bytes):
+        self.client.put_object(Bucket=self.bucket, Key=self._object_key(key), Body=data)
+
+    def put_file(self, key: str, path: str) -> str:
+        self.client.upload_file(path, self.bucket, self._object_key(key))
+        # The uploading node is likely to analyze the file next
+        cached = self._cache_path(key)
+        os.makedirs(os.path.dirname(cached), exist_ok=True)
+        os.replace(path, cached)
+        self._evict()
+        return self.location(key)
+
+    def location(self, key: str) -> str:
+        return f"s3://{self.bucket}/{self._object_key(key)}"
+
+    def _cache_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, *key.split("/"))
+
+    def local_path(self, key: str) -> Optional[str]:
+        cached = self._cache_path(key)
+        try:
+            stat = os.stat(cached)
+            # The access time orders eviction; the modification time keys file_hash
+            os.utime(cached, ns=(time.time_ns(), stat.st_mtime_ns))
+            STORAGE_LOCAL_COPIES.inc(result="hit")
+            return cached
+        except FileNotFoundError:
+            pass
+
+        STORAGE_LOCAL_COPIES.inc(result="miss")
+        os.makedirs(os.path.dirname(cached), exist_ok=True)
+        tmp_path = f"{cached}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp"
+        try:
+            self.client.download_file(self.bucket, self._object_key(key), tmp_path)
+        except Exception as e:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            if self._not_found(e):
+                return None
+            raise
+        os.replace(tmp_path, cached)
+        self._evict()
+        return cached
+
+    def _evict(self):
+        """Remove the least recently used local copies once they exceed cache_max_bytes."""
+        with self._evict_lock:
+            files = []
+            for folder, _, names in os.walk(self.cache_dir):
+                for name in names:
+                    if name.endswith(".tmp"):
+                        continue
+                    path = os.path.join(folder, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    files.append((stat.st_atime, stat.st_size, path))
+            total = sum(size for _, size, _ in files)
+            if total <= self.cache_max_bytes:
+                return
+            # Trim to 90% so eviction does not run on every download
+            target = int(self.cache_max_bytes * 0.9)
+            for _, size, path in sorted(files):
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def create_backend(name: str = None) -> StorageBackend:
+    name = name or const.STORAGE_BACKEND
+    if name == "local":
+        return LocalBackend()
+    if name == "s3":
+        return S3Backend()
+    raise ValueError(f"Unknown storage backend: {name}")
+
+
+def get_storage() -> StorageBackend:
+    """Process-wide storage using the backend configured in FINAI_STORAGE_BACKEND."""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                _storage = create_backend()
+    return _storage
+
+
+def in_parallel(fn: Callable, items: Iterable) -> List:
+    """fn applied to every item on the prefetch pool, results in item order."""
+    items = list(items)
+    if len(items) <= 1:
+        return [fn(item) for item in items]
+    return list(_prefetch_pool.map(log.bind(fn), items))
+
+
+def prefetch(keys: Iterable[str]) -> Dict[str, Optional[str]]:
+    """Local paths of several objects; missing local copies are downloaded in parallel."""
+    keys = list(dict.fromkeys(keys))
+    return dict(zip(keys, in_parallel(get_storage().local_path, keys)))
+
+
+def cached_extract(namespace: str, key: str, compute: Callable):
+    """
+    Extraction result of an upload: from the cache, else from the storage (as
+    extracted by any node), else computed and stored for all nodes. Storage
+    errors fall back to computing the value. Results are only shared through
+    remote storage when they are signed with CACHE_SECRET.
+    """
+    cache = get_cache()
+    value = cache.get(namespace, key, _MISSING)
+    if value is not _MISSING:
+        STORAGE_EXTRACTS.inc(source="cache")
+        return value
+
+    storage = get_storage()
+    # Unsigned pickles are only read back from storage nobody else can write to
+    shared = storage.name == "local" or bool(const.CACHE_SECRET)
+    object_key = f".extracted/{namespace}/{key.replace(':', '_')}.bin"
+    try:
+        data = storage.read(object_key) if shared else None
+        if data is not None:
+            value = deserialize(data)
+    except Exception as e:
+        STORAGE_ERRORS.inc(backend=storage.name, operation="read")
+        logger.warning("Stored extraction result could not be read (%s): %s", namespace, e)
+
+    if value is not _MISSING:
+        STORAGE_EXTRACTS.inc(source="storage")
+    else:
+        value = compute()
+        STORAGE_EXTRACTS.inc(source="computed")
+        try:
+            if shared:
+                storage.write(object_key, serialize(value))
+        except Exception as e:
+            STORAGE_ERRORS.inc(backend=storage.name, operation="write")
+            logger.warning("Extraction result could not be stored (%s): %s", namespace, e)
+    cache.set(namespace, key, value)
+    return value
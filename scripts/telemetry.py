@@ -0,0 +1,299 @@
+"""
+Telemetry of model calls and the adaptive output and prompt budgets built on it.
+
+Every model call (all attempts and hedges of one generate_response) is recorded
+with its prompt, cached and output tokens, time to first token, latency,
+attempts and finish reason, tagged with the request type (the analysis or a
+section), segment and indicators. Metrics are updated in place; the record is
+written to a SQLite file shared by the workers of the node by a background
+thread. Summarize it with
+
+    python -m scripts.telemetry [hours]
+
+With ADAPTIVE_BUDGET the same thread periodically derives, per model and request
+type, the max_output_tokens covering the observed answers and the prompt size
+without documents, from which the document excerpt budget follows.
+"""
+
+import atexit
+import math
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import scripts.constants as const
+from scripts import log, metrics
+
+MODEL_TOKENS = metrics.counter(
+    "finai_model_tokens_total", "Tokens of model calls by kind (prompt/cached/output), request type, segment and indicators"
+)
+MODEL_OUTPUT_TOKENS = metrics.histogram(
+    "finai_model_output_tokens", "Output tokens per model call by request type",
+    buckets=(128, 256, 512, 1024, 2048, 4096, 8192),
+)
+MODEL_TTFT = metrics.histogram(
+    "finai_model_ttft_seconds", "Time to the first output token of the winning attempt by request type"
+)
+MODEL_CALL_SECONDS = metrics.histogram(
+    "finai_model_call_seconds", "Duration of model calls including retries and hedges by request type"
+)
+MODEL_FINISH = metrics.counter(
+    "finai_model_finish_total", "Model calls by request type, outcome and finish reason"
+)
+TELEMETRY_DROPPED = metrics.counter(
+    "finai_telemetry_dropped_total", "Call records dropped because the telemetry queue was full"
+)
+
+logger = log.get_logger("telemetry")
+
+_COLUMNS = (
+    "time", "request_id", "model", "request_type", "segment", "indicators",
+    "prompt_chars", "document_tokens", "prompt_tokens", "cached_tokens", "output_tokens",
+    "max_output_tokens", "ttft", "latency", "attempts", "hedges", "budget_retry",
+    "finish_reason", "outcome", "error",
+)
+_writer = None
+_writer_lock = threading.Lock()
+# (model, request type) -> {"output_tokens": budget, "base_prompt_tokens": p90}
+_budgets: Dict[tuple, Dict] = {}
+
+
+def _connect(path: str = None) -> sqlite3.Connection:
+    path = path or const.TELEMETRY_PATH
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS model_calls (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+        "time REAL NOT NULL, request_id TEXT, model TEXT, request_type TEXT, segment TEXT, "
+        "indicators TEXT, prompt_chars INTEGER, document_tokens INTEGER, prompt_tokens INTEGER, "
+        "cached_tokens INTEGER, output_tokens INTEGER, max_output_tokens INTEGER, ttft REAL, "
+        "latency REAL, attempts INTEGER, hedges INTEGER, budget_retry INTEGER, "
+        "finish_reason TEXT, outcome TEXT NOT NULL, error TEXT)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS model_calls_type ON model_calls (model, request_type, id)"
+    )
+    return conn
+
+
+def _percentile(values: List[float], percentile: float) -> float:
+    values = sorted(values)
+    rank = int(round(percentile / 100 * (len(values) - 1)))
+    return values[rank]
+
+
+def compute_budgets(conn: sqlite3.Connection) -> Dict[tuple, Dict]:
+    """Budgets per (model, request type) from the latest ADAPTIVE_WINDOW successful calls."""
+    rows = conn.execute(
+        "SELECT model, request_type, output_tokens, prompt_tokens, document_tokens "
+        "FROM model_calls WHERE outcome = 'ok' AND time > ? ORDER BY id DESC",
+        (time.time() - const.TELEMETRY_RETENTION,),
+    )
+    samples = defaultdict(list)
+    for model_name, request_type, output_tokens, prompt_tokens, document_tokens in rows:
+        window = samples[(model_name, request_type)]
+        if len(window) < const.ADAPTIVE_WINDOW and output_tokens is not None:
+            window.append((output_tokens, (prompt_tokens or 0) - (document_tokens or 0)))
+
+    budgets = {}
+    for key, window in samples.items():
+        if len(window) < const.ADAPTIVE_MIN_SAMPLES:
+            continue
+        output = _percentile([o for o, _ in window], const.ADAPTIVE_OUTPUT_PERCENTILE)
+        budgets[key] = {
+            "output_tokens": int(math.ceil(output * const.ADAPTIVE_OUTPUT_HEADROOM / 64) * 64),
+            "base_prompt_tokens": int(_percentile([p for _, p in window], 90)),
+            "samples": len(window),
+        }
+    return budgets
+
+
+class _Writer(threading.Thread):
+    """Writes queued call records in batches and refreshes the adaptive budgets."""
+
+    def __init__(self):
+        super().__init__(name="model-telemetry", daemon=True)
+        self.queue = queue.Queue(const.TELEMETRY_QUEUE_SIZE)
+        self._stop_event = threading.Event()
+        self._refreshed = 0.0
+        self._pruned = 0.0
+
+    def stop(self):
+        self._stop_event.set()
+        self.join(timeout=10)
+
+    def run(self):
+        conn = None
+        while True:
+            stopping = self._stop_event.wait(const.TELEMETRY_FLUSH_INTERVAL)
+            batch = []
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                conn = conn or _connect()
+                if batch:
+                    conn.executemany(
+                        f"INSERT INTO model_calls ({', '.join(_COLUMNS)}) "
+                        f"VALUES ({', '.join('?' * len(_COLUMNS))})",
+                        [tuple(record.get(c) for c in _COLUMNS) for record in batch],
+                    )
+                now = time.time()
+                if now - self._pruned > 3600:
+                    conn.execute(
+                        "DELETE FROM model_calls WHERE time < ?", (now - const.TELEMETRY_RETENTION,)
+                    )
+                    self._pruned = now
+                if const.ADAPTIVE_BUDGET and now - self._refreshed > const.ADAPTIVE_REFRESH_INTERVAL:
+                    _budgets.clear()
+                    _budgets.update(compute_budgets(conn))
+                    self._refreshed = now
+            except Exception as e:
+                logger.warning("Model telemetry could not be written: %s", e)
+                conn = None
+            if stopping:
+                return
+
+
+def _get_writer() -> Optional[_Writer]:
+    global _writer
+    if not const.TELEMETRY_ENABLED:
+        return None
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = _Writer()
+                _writer.start()
+                atexit.register(stop)
+    return _writer
+
+
+def stop():
+    """Write out the queued records."""
+    global _writer
+    with _writer_lock:
+        if _writer is not None:
+            _writer.stop()
+            _writer = None
+
+
+def output_budget(model_name: str, request_type: Optional[str], ceiling: int) -> int:
+    """
+    max_output_tokens for a call: the configured ceiling, or with ADAPTIVE_BUDGET the
+    observed percentile of output tokens of the request type plus headroom.
+    """
+    if not const.ADAPTIVE_BUDGET or not request_type:
+        return ceiling
+    _get_writer()
+    budget = _budgets.get((model_name, request_type))
+    if budget is None:
+        return ceiling
+    return max(min(budget["output_tokens"], ceiling), min(const.ADAPTIVE_MIN_OUTPUT_TOKENS, ceiling))
+
+
+def document_budget(model_name: str, request_types: List[str], default: int) -> int:
+    """
+    Token budget of the document excerpts of a request: what its largest prompt
+    (90th percentile without documents) leaves of ADAPTIVE_PROMPT_TOKENS, at most default.
+    """
+    if not const.ADAPTIVE_BUDGET:
+        return default
+    _get_writer()
+    known = [_budgets[(model_name, t)] for t in request_types if (model_name, t) in _budgets]
+    if not known:
+        return default
+    base = max(budget["base_prompt_tokens"] for budget in known)
+    return max(min(default, const.ADAPTIVE_PROMPT_TOKENS - base), min(const.ADAPTIVE_MIN_DOCUMENT_TOKENS, default))
+
+
+def record_call(record: Dict):
+    """
+    Update the metrics with one model call and queue it for the SQLite log.
+
+    Args:
+        record (Dict): The _COLUMNS fields; tags (request_type, segment, indicators)
+            may be missing for calls outside an analysis
+    """
+    request_type = record.get("request_type") or "other"
+    tags = {
+        "request_type": request_type,
+        "segment": record.get("segment") or "none",
+        "indicators": record.get("indicators") or "none",
+    }
+    for kind in ("prompt", "cached", "output"):
+        if record.get(f"{kind}_tokens"):
+            MODEL_TOKENS.inc(record[f"{kind}_tokens"], kind=kind, **tags)
+    if record.get("output_tokens") is not None:
+        MODEL_OUTPUT_TOKENS.observe(record["output_tokens"], request_type=request_type)
+    if record.get("ttft") is not None:
+        MODEL_TTFT.observe(record["ttft"], request_type=request_type)
+    MODEL_CALL_SECONDS.observe(record["latency"], request_type=request_type)
+    MODEL_FINISH.inc(
+        request_type=request_type,
+        outcome=record["outcome"],
+        finish_reason=record.get("finish_reason") or "none",
+    )
+
+    writer = _get_writer()
+    if writer is None:
+        return
+    try:
+        writer.queue.put_nowait({**record, "time": time.time(), "request_id": log.request_id()})
+    except queue.Full:
+        TELEMETRY_DROPPED.inc()
+
+
+def summarize(hours: float = 24) -> List[Dict]:
+    """Per model and request type: calls, token and latency percentiles, truncations."""
+    conn = _connect()
+    rows = conn.execute(
+        "SELECT model, request_type, output_tokens, prompt_tokens, ttft, latency, finish_reason, outcome "
+        "FROM model_calls WHERE time > ?",
+        (time.time() - hours * 3600,),
+    ).fetchall()
+    groups = defaultdict(list)
+    for row in rows:
+        groups[(row[0], row[1])].append(row[2:])
+
+    summary = []
+    for (model_name, request_type), calls in sorted(groups.items(), key=lambda g: (g[0][0] or "", g[0][1] or "")):
+        ok = [c for c in calls if c[5] == "ok"]
+
+        def pct(index, percentile):
+            values = [c[index] for c in ok if c[index] is not None]
+            return round(_percentile(values, percentile), 3) if values else None
+
+        summary.append(
+            {
+                "model": model_name,
+                "request_type": request_type,
+                "calls": len(calls),
+                "errors": len(calls) - len(ok),
+                "truncated": sum(1 for c in ok if c[4] == "MAX_TOKENS"),
+                "prompt_tokens_p50": pct(1, 50),
+                "output_tokens_p50": pct(0, 50),
+                "output_tokens_p99": pct(0, 99),
+                "ttft_p50": pct(2, 50),
+                "latency_p50": pct(3, 50),
+                "latency_p95": pct(3, 95),
+            }
+        )
+    return summary
+
+
+if __name__ == "__main__":
+    hours = float(sys.argv[1]) if len(sys.argv) > 1 else 24
+    budgets = compute_budgets(_connect())
+    for row in summarize(hours):
+        budget = budgets.get((row["model"], row["request_type"]))
+        row["adaptive_max_output_tokens"] = budget["output_tokens"] if budget else None
+        print(" ".join(f"{key}={value}" for key, value in row.items()))
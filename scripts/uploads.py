@@ -0,0 +1,369 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import BinaryIO, Dict, List, Optional
+from urllib.parse import quote
+
+try:
+    import fcntl
+except ImportError:  # Windows development machines
+    fcntl = None
+
+import scripts.constants as const
+from scripts.storage import get_storage, in_parallel
+
+_STORED_NAME = re.compile(r"^[0-9a-f]{64}(\.[a-z0-9]+)?$")
+_SESSION_ID = re.compile(r"^[0-9a-f]{32}$")
+
+# Running hash per upload session, so chunks are only hashed once per process.
+# Another worker resuming the same session rebuilds the hash from disk.
+_hashers: Dict[str, Dict] = {}
+_hashers_lock = threading.Lock()
+
+
+class UploadError(Exception):
+    """Raised for upload requests that cannot be accepted; carries the HTTP status."""
+
+    def __init__(self, message: str, status: int = 400, offset: Optional[int] = None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+
+@contextmanager
+def _file_lock(path: str):
+    """Exclusive lock shared by all gunicorn workers on this node."""
+    with open(path, "a+b") as handle:
+        if fcntl is not None:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+def _ensure_dirs():
+    os.makedirs(const.UPLOAD_DIR, exist_ok=True)
+    os.makedirs(const.UPLOAD_PARTIAL_DIR, exist_ok=True)
+
+
+def _clean_filename(filename: str) -> str:
+    name = os.path.basename(str(filename).replace("\\", "/")).strip()
+    if not name or name in (".", ".."):
+        raise UploadError("Invalid filename")
+    return name
+
+
+def _stored_name(digest: str, filename: str) -> str:
+    ext = os.path.splitext(filename)[1].lower()
+    if not re.fullmatch(r"\.[a-z0-9]+", ext):
+        ext = ""
+    return f"{digest}{ext}"
+
+
+def _session_paths(upload_id: str):
+    if not _SESSION_ID.match(upload_id or ""):
+        raise UploadError("Unknown upload", status=404)
+    base = os.path.join(const.UPLOAD_PARTIAL_DIR, upload_id)
+    return base + ".json", base + ".part", base + ".lock"
+
+
+def _load_session(upload_id: str) -> Dict:
+    meta_path, part_path, _ = _session_paths(upload_id)
+    if not os.path.exists(meta_path):
+        raise UploadError("Unknown upload", status=404)
+    with open(meta_path, "r", encoding="utf-8") as f:
+        session = json.load(f)
+    session["offset"] = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    return session
+
+
+def _alias_key(filename: str) -> str:
+    return f".aliases/{quote(filename, safe='')}"
+
+
+def _record_alias(filename: str, stored_name: str):
+    """Remember which stored file the client's original filename refers to (last upload wins)."""
+    get_storage().write(_alias_key(filename), stored_name.encode("utf-8"))
+
+
+def _finalize(tmp_path: str, filename: str, digest: str, size: int) -> Dict:
+    """Move a fully written temp file to its content-addressed location in the storage."""
+    stored_name = _stored_name(digest, filename)
+    storage = get_storage()
+
+    deduplicated = storage.exists(stored_name)
+    if deduplicated:
+        os.remove(tmp_path)
+        location = storage.location(stored_name)
+    else:
+        location = storage.put_file(stored_name, tmp_path)
+
+    _record_alias(filename, stored_name)
+    return {
+        "filename": filename,
+        "stored_name": stored_name,
+        "path": location,
+        "sha256": digest,
+        "size": size,
+        "deduplicated": deduplicated,
+    }
+
+
+def _copy_stream(stream: BinaryIO, target: BinaryIO, hasher, limit: int) -> int:
+    """Copy a stream to disk in fixed-size buffers, hashing as it goes."""
+    written = 0
+    while True:
+        buffer = stream.read(const.UPLOAD_BUFFER_SIZE)
+        if not buffer:
+            return written
+        written += len(buffer)
+        if written > limit:
+            raise UploadError("File exceeds the upload size limit", status=413)
+        hasher.update(buffer)
+        target.write(buffer)
+
+
+def store_stream(stream: BinaryIO, filename: str) -> Dict:
+    """
+    Stream a single-request upload to disk and store it under its content hash.
+
+    Args:
+        stream (BinaryIO): Readable file stream of the upload
+        filename (str): Filename supplied by the client
+
+    Returns:
+        Dict: Stored file information (filename, stored_name, path, sha256, size, deduplicated)
+    """
+    filename = _clean_filename(filename)
+    _ensure_dirs()
+
+    tmp_path = os.path.join(const.UPLOAD_PARTIAL_DIR, f"{uuid.uuid4().hex}.tmp")
+    hasher = hashlib.sha256()
+    try:
+        with open(tmp_path, "wb") as target:
+            size = _copy_stream(stream, target, hasher, const.UPLOAD_MAX_FILE_SIZE)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    return _finalize(tmp_path, filename, hasher.hexdigest(), size)
+
+
+def create_session(filename: str, size: int, sha256: Optional[str] = None) -> Dict:
+    """
+    Start a chunked upload. The declared size is checked before any data is sent.
+
+    Args:
+        filename (str): Filename supplied by the client
+        size (int): Total file size in bytes
+        sha256 (str, optional): Expected content hash, verified on completion
+
+    Returns:
+        Dict: Session state with upload_id, offset and the suggested chunk size
+    """
+    filename = _clean_filename(filename)
+    try:
+        size = int(size)
+    except (TypeError, ValueError):
+        raise UploadError("File size must be given in bytes")
+    if size <= 0:
+        raise UploadError("File size must be positive")
+    if size > const.UPLOAD_MAX_FILE_SIZE:
+        raise UploadError(
+            f"File exceeds the upload size limit of {const.UPLOAD_MAX_FILE_SIZE} bytes",
+            status=413,
+        )
+    if sha256 is not None:
+        sha256 = str(sha256).lower()
+        if not re.fullmatch(r"[0-9a-f]{64}", sha256):
+            raise UploadError("sha256 must be a hex digest")
+
+    _ensure_dirs()
+    cleanup_stale_sessions()
+
+    upload_id = uuid.uuid4().hex
+    meta_path, part_path, _ = _session_paths(upload_id)
+    session = {
+        "upload_id": upload_id,
+        "filename": filename,
+        "size": size,
+        "sha256": sha256,
+        "created": time.time(),
+    }
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump(session, f)
+    open(part_path, "wb").close()
+
+    return {**session, "offset": 0, "chunk_size": const.UPLOAD_CHUNK_SIZE}
+
+
+def get_session(upload_id: str) -> Dict:
+    """Return the session state; `offset` is where the client has to resume."""
+    session = _load_session(upload_id)
+    return {**session, "chunk_size": const.UPLOAD_CHUNK_SIZE}
+
+
+def _resume_hasher(upload_id: str, part_path: str, offset: int):
+    with _hashers_lock:
+        state = _hashers.get(upload_id)
+    if state is not None and state["offset"] == offset:
+        return state["hasher"]
+
+    hasher = hashlib.sha256()
+    with open(part_path, "rb") as f:
+        for buffer in iter(lambda: f.read(const.UPLOAD_BUFFER_SIZE), b""):
+            hasher.update(buffer)
+    return hasher
+
+
+def append_chunk(
+    upload_id: str, offset: int, stream: BinaryIO, length: Optional[int] = None
+) -> Dict:
+    """
+    Append one chunk to an upload session and finalize it once complete.
+
+    Args:
+        upload_id (str): Session ID returned by create_session
+        offset (int): Byte offset the chunk starts at; must match the stored size
+        stream (BinaryIO): Request body containing the chunk
+        length (int, optional): Declared chunk length, used to reject oversize chunks early
+
+    Returns:
+        Dict: Session state, plus the stored file information once the last chunk arrived
+    """
+    meta_path, part_path, lock_path = _session_paths(upload_id)
+    if not os.path.exists(meta_path):
+        raise UploadError("Unknown upload", status=404)
+
+    with _file_lock(lock_path):
+        session = _load_session(upload_id)
+        current = session["offset"]
+        remaining = session["size"] - current
+
+        if offset != current:
+            raise UploadError(
+                f"Offset mismatch, upload continues at byte {current}",
+                status=409,
+                offset=current,
+            )
+        if length is not None and length > remaining:
+            raise UploadError(
+                "Chunk exceeds the declared file size", status=413, offset=current
+            )
+
+        hasher = _resume_hasher(upload_id, part_path, current)
+        try:
+            with open(part_path, "ab") as target:
+                written = _copy_stream(stream, target, hasher, remaining)
+        except BaseException:
+            # Drop the partially written chunk so the client can resend it
+            with open(part_path, "ab") as target:
+                target.truncate(current)
+            with _hashers_lock:
+                _hashers.pop(upload_id, None)
+            raise
+
+        offset = current + written
+        if offset < session["size"]:
+            with _hashers_lock:
+                _hashers[upload_id] = {"hasher": hasher, "offset": offset}
+            return {**session, "offset": offset, "complete": False}
+
+        with _hashers_lock:
+            _hashers.pop(upload_id, None)
+        digest = hasher.hexdigest()
+        if session.get("sha256") and session["sha256"] != digest:
+            abort_session(upload_id)
+            raise UploadError("Checksum mismatch, upload discarded", status=422)
+
+        stored = _finalize(part_path, session["filename"], digest, offset)
+        os.remove(meta_path)
+        # Removed while held: a chunk waiting for the lock then finds no session
+        os.remove(lock_path)
+
+    return {**session, "offset": offset, "complete": True, **stored}
+
+
+def abort_session(upload_id: str):
+    """Discard an unfinished upload and its partial data."""
+    with _hashers_lock:
+        _hashers.pop(upload_id, None)
+    for path in _session_paths(upload_id):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def cleanup_stale_sessions():
+    """
+    Remove partial uploads without activity within the session TTL. A session is
+    active as long as any of its files changed (the .part file grows with every
+    chunk); its files are removed together.
+    """
+    if not os.path.isdir(const.UPLOAD_PARTIAL_DIR):
+        return
+    cutoff = time.time() - const.UPLOAD_SESSION_TTL
+    sessions: Dict[str, List[str]] = {}
+    last_activity: Dict[str, float] = {}
+    for name in os.listdir(const.UPLOAD_PARTIAL_DIR):
+        path = os.path.join(const.UPLOAD_PARTIAL_DIR, name)
+        stem = name.split(".", 1)[0]
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            continue
+        sessions.setdefault(stem, []).append(path)
+        last_activity[stem] = max(last_activity.get(stem, 0.0), mtime)
+
+    for stem, paths in sessions.items():
+        if last_activity[stem] >= cutoff:
+            continue
+        with _hashers_lock:
+            _hashers.pop(stem, None)
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def _resolve_key(filename: str) -> Optional[str]:
+    """Storage key of the upload a filename from an analysis request refers to."""
+    if not filename or not isinstance(filename, str):
+        return None
+    name = os.path.basename(filename.replace("\\", "/"))
+    if not name:
+        return None
+    if _STORED_NAME.match(name):
+        return name
+
+    storage = get_storage()
+    alias = storage.read(_alias_key(name))
+    if alias:
+        return alias.decode("utf-8")
+    return name if storage.exists(name) else None
+
+
+def resolve_upload(filename: str) -> Optional[str]:
+    """
+    Map a filename from an analysis request to a local copy of the stored upload.
+
+    Accepts content-hash names returned by the upload endpoints, the original
+    client filename (via its alias) and files placed directly in the storage
+    (uploads/ for the local backend).
+    """
+    key = _resolve_key(filename)
+    return get_storage().local_path(key) if key else None
+
+
+def resolve_uploads(filenames: List[str]) -> Dict[str, Optional[str]]:
+    """resolve_upload for all documents of a request; their local copies are fetched in parallel."""
+    names = list(dict.fromkeys(filenames))
+    return dict(zip(names, in_parallel(resolve_upload, names)))
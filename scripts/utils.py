@@ -1,13 +1,20 @@
+import logging
+import numpy as np
 import pandas as pd
 from pathlib import Path
 import os
-from typing import Dict, List, Tuple
+import re
+from typing import Dict, List, Optional, Tuple
 from datetime import datetime, timedelta
 from docx import Document
 import openpyxl
 import fitz
 
-from scripts.constants import PROJECT_ROOT, KPI_LABELS, SEGMENTS
+from scripts import log
+from scripts.cache import cached_file_loader
+from scripts.constants import ASSET_QUALITY_SEGMENT, PROJECT_ROOT, KPI_LABELS, SEGMENTS
+
+logger = log.get_logger("data")
 
 
 def read_text_file(file_path: str) -> str:
@@ -34,6 +41,7 @@ def read_text_file(file_path: str) -> str:
         raise IOError(f"Failed to read file '{file_path}': {e}")
 
 
+@cached_file_loader("ifo-data")
 def load_ifo_data(csv_path: Path, start_date: str = None) -> pd.DataFrame:
     """
     Load and preprocess IFO business climate data from a prepared CSV file.
@@ -72,6 +80,33 @@ def load_ifo_data(csv_path: Path, start_date: str = None) -> pd.DataFrame:
     return df
 
 
+def summarize_ifo_data(df_ifo: pd.DataFrame, quarters: int) -> str:
+    """
+    Compact IFO table for the prompts: quarterly means of the most recent complete
+    quarters followed by the latest month, instead of every month since 2005.
+
+    Args:
+        df_ifo (pd.DataFrame): Monthly IFO data from load_ifo_data
+        quarters (int): Number of most recent complete quarters
+
+    Returns:
+        str: Table with one row per quarter (labelled like 'Q1_2025') and the latest month
+    """
+    numeric = df_ifo.select_dtypes("number")
+    if numeric.empty:
+        return ""
+    columns = {c: c.replace("_saison_bereinigt", "") for c in numeric.columns}
+    grouped = numeric.groupby(numeric.index.to_period("Q"))
+    # A quarter still in progress is represented by the latest month only
+    quarterly = grouped.mean()[grouped.size() == 3].tail(quarters)
+    quarterly.index = [_quarter_label(p) for p in quarterly.index]
+    latest = numeric.tail(1)
+    latest.index = [f"latest ({latest.index[0]:%m/%Y})"]
+    table = pd.concat([quarterly, latest]).rename(columns=columns).round(1)
+    return table.to_string()
+
+
+@cached_file_loader("pmi-time-series")
 def load_pmi_time_series(csv_path: Path) -> pd.DataFrame:
     """
     Load and preprocess PMI Time Series from a prepared CSV file.
@@ -94,36 +129,90 @@ def extract_text_from_pdf(filepath):
         doc = fitz.open(filepath)
         return "\n".join(page.get_text() for page in doc)
     except Exception as e:
-        print(f"Fehler beim PDF-Parsing: {e}")
+        logger.error("Fehler beim PDF-Parsing: %s", e)
         return ""
 
 
+@cached_file_loader("pmi-monthly")
+def load_pmi_data(csv_path: Path) -> pd.DataFrame:
+    """
+    Load the monthly PMI CSV with a datetime index, as used for the PMI chart.
+
+    Args:
+        csv_path (Path): Path to the PMI CSV file
+
+    Returns:
+        pd.DataFrame: Composite PMI per month indexed by date
+    """
+    df_pmi = pd.read_csv(csv_path)
+    df_pmi["Date"] = pd.to_datetime(df_pmi["Month"], format="%m/%Y")
+    df_pmi.set_index("Date", inplace=True)
+    return df_pmi
+
+
+def extract_pages_from_pdf(filepath) -> List[str]:
+    try:
+        doc = fitz.open(filepath)
+        return [page.get_text() for page in doc]
+    except Exception as e:
+        logger.error("Fehler beim PDF-Parsing: %s", e)
+        return []
+
+
+def extract_document_pages(filepath) -> List[str]:
+    """
+    Extract the text of an uploaded document, split into pages where the format has them.
+
+    Args:
+        filepath (str): Path to the document (.txt, .csv, .pdf, .docx, .xlsx)
+
+    Returns:
+        List[str]: Page texts (PDF, one entry per worksheet for Excel) or a single entry
+    """
+    filename = str(filepath).lower()
+    if filename.endswith((".txt", ".csv")):
+        with open(filepath, "r", encoding="utf-8") as f:
+            return [f.read()]
+    elif filename.endswith(".pdf"):
+        return extract_pages_from_pdf(filepath)
+    elif filename.endswith(".docx"):
+        return [extract_text_from_docx(filepath)]
+    elif filename.endswith(".xlsx"):
+        sheets = re.split(r"(?=--- Sheet: )", extract_text_from_excel(filepath))
+        return [sheet for sheet in sheets if sheet.strip()] or [""]
+    return [f"[Dateityp {os.path.basename(str(filepath))} wird nicht unterstützt]"]
+
+
 def extract_text_from_docx(filepath):
     try:
         doc = Document(filepath)
         return "\n".join(p.text for p in doc.paragraphs if p.text.strip())
     except Exception as e:
-        print(f"Fehler beim DOCX-Parsing: {e}")
+        logger.error("Fehler beim DOCX-Parsing: %s", e)
         return ""
 
 
 def extract_text_from_excel(filepath):
     try:
-        wb = openpyxl.load_workbook(filepath, data_only=True)
-        text = ""
-        for sheet in wb.worksheets:
-            text += f"--- Sheet: {sheet.title} ---\n"
-            for row in sheet.iter_rows(values_only=True):
-                row_text = "\t".join(
-                    str(cell) if cell is not None else "" for cell in row
-                )
-                text += row_text + "\n"
-        return text
+        # Read-only mode streams the rows instead of loading the whole workbook
+        wb = openpyxl.load_workbook(filepath, read_only=True, data_only=True)
+        try:
+            lines = []
+            for sheet in wb.worksheets:
+                lines.append(f"--- Sheet: {sheet.title} ---")
+                for row in sheet.iter_rows(values_only=True):
+                    lines.append(
+                        "\t".join(str(cell) if cell is not None else "" for cell in row)
+                    )
+            return "\n".join(lines) + "\n"
+        finally:
+            wb.close()
     except Exception as e:
-        print(f"Fehler beim Excel-Parsing: {e}")
+        logger.error("Fehler beim Excel-Parsing: %s", e)
         return ""
 
 
+@cached_file_loader("bank-metrics")
 def extract_metrics_from_excel(path: Path) -> Dict[str, Dict[str, Dict[str, str]]]:
     """
     Extract key financial KPIs from multiple sheets within a financial summary Excel file using flexible keyword matching.
@@ -169,6 +258,7 @@ def extract_metrics_from_excel(path: Path) -> Dict[str, Dict[str, Dict[str, str]
     return data
 
 
+@cached_file_loader("asset-quality")
 def extract_asset_quality_metrics(path: Path) -> Tuple[pd.DataFrame, pd.DataFrame]:
     """
     Extracts GCA and ACL metrics from the 'Asset Quality' sheet of the given Excel file.
@@ -205,6 +295,160 @@ def extract_asset_quality_metrics(path: Path) -> Tuple[pd.DataFrame, pd.DataFram
         return None, None
 
 
+_QUARTER = re.compile(r"^Q([1-4])_(\d{4})$")
+
+STAGES = ["Stage 1", "Stage 2", "Stage 3", "Stage 3 POCI"]
+
+
+def parse_kpi_value(value) -> float:
+    """Convert an extracted KPI string such as '25.1', '(17.4)bps' or '3.2%' to float (NaN if empty)."""
+    text = str(value).replace("bps", "").replace("%", "").replace(",", "").strip()
+    if not text or text == "-":
+        return np.nan
+    negative = text.startswith("(") and text.endswith(")")
+    try:
+        number = float(text.strip("()"))
+    except ValueError:
+        return np.nan
+    return -number if negative else number
+
+
+def quarter_period(label) -> Optional[pd.Period]:
+    """Quarterly period for a KPI column label like 'Q1_2023' (None for FY and comparison columns)."""
+    match = _QUARTER.match(str(label).strip().upper())
+    if not match:
+        return None
+    quarter, year = match.groups()
+    return pd.Period(f"{year}Q{quarter}", freq="Q")
+
+
+def _quarter_label(period: pd.Period) -> str:
+    return f"Q{period.quarter}_{period.year}"
+
+
+def _frame_to_kpis(frame: pd.DataFrame) -> Dict[str, Dict[str, str]]:
+    """Convert a quarter-indexed frame into the KPI → period → value format of extract_metrics_from_excel."""
+    labels = [_quarter_label(p) for p in frame.index]
+    return {
+        column: {
+            label: f"{value:.4g}"
+            for label, value in zip(labels, frame[column].to_numpy(dtype=float))
+            if not np.isnan(value)
+        }
+        for column in frame.columns
+    }
+
+
+def derive_credit_quality_metrics(df_gca: pd.DataFrame, df_acl: pd.DataFrame) -> pd.DataFrame:
+    """
+    Derive credit-quality metrics from the stage tables of the Asset Quality sheet.
+
+    Args:
+        df_gca (pd.DataFrame): Gross carrying amount by stage, from extract_asset_quality_metrics
+        df_acl (pd.DataFrame): Allowance for credit losses by stage, from extract_asset_quality_metrics
+
+    Returns:
+        pd.DataFrame: One row per quarter (oldest first) with ACL/GCA coverage per stage,
+            stage shares of GCA, their quarter-over-quarter changes and Stage 2/3
+            migration proxies (stage growth beyond the growth of the whole book, in EUR m)
+    """
+    gca = df_gca.set_index(pd.DatetimeIndex(df_gca["Date"]).to_period("Q"))[STAGES + ["Total"]]
+    acl = df_acl.set_index(pd.DatetimeIndex(df_acl["Date"]).to_period("Q"))[STAGES + ["Total"]]
+    gca = gca.astype(float).sort_index()
+    acl = acl.astype(float).abs().sort_index()
+
+    coverage = acl / gca.where(gca != 0) * 100
+    share = gca[STAGES].div(gca["Total"], axis=0) * 100
+    book_growth = gca["Total"].pct_change()
+    migrating = gca[["Stage 2", "Stage 3"]]
+    migration = migrating.diff() - migrating.shift().mul(book_growth, axis=0)
+
+    parts = {
+        "acl_coverage_pct": coverage,
+        "acl_coverage_qoq_pp": coverage.diff(),
+        "gca_stage_share_pct": share,
+        "gca_stage_share_qoq_pp": share.diff(),
+        "gca_qoq_pct": gca.pct_change() * 100,
+        "acl_qoq_pct": acl.pct_change() * 100,
+        "migration_proxy_eur_m": migration,
+    }
+    frame = pd.concat(parts, axis=1)
+    frame.columns = [
+        f"{metric}_{stage.lower().replace(' ', '_')}" for metric, stage in frame.columns
+    ]
+    return frame
+
+
+def derive_segment_credit_metrics(segment_kpis: Dict[str, Dict[str, str]]) -> pd.DataFrame:
+    """
+    Derive allowance coverage and quarter-over-quarter changes from a segment's KPIs.
+
+    Args:
+        segment_kpis (Dict[str, Dict[str, str]]): KPI → period → value of one segment
+
+    Returns:
+        pd.DataFrame: One row per quarter (oldest first); empty if the KPIs are missing
+    """
+    series = {}
+    for kpi in (
+        "provision_for_credit_losses_bps_avg_loans",
+        "allowance_for_loan_losses_in_eur_bn",
+        "loans_gross_of_allowance_for_loan_losses_in_eur_bn",
+    ):
+        points = {
+            quarter_period(period): parse_kpi_value(value)
+            for period, value in segment_kpis.get(kpi, {}).items()
+            if quarter_period(period) is not None
+        }
+        if points:
+            series[kpi] = pd.Series(points, dtype=float)
+    if len(series) < 3:
+        return pd.DataFrame()
+
+    kpis = pd.DataFrame(series).sort_index()
+    allowance = kpis["allowance_for_loan_losses_in_eur_bn"].abs()
+    loans = kpis["loans_gross_of_allowance_for_loan_losses_in_eur_bn"]
+    coverage = allowance / loans.where(loans != 0) * 100
+    return pd.DataFrame(
+        {
+            "allowance_coverage_pct": coverage,
+            "allowance_coverage_qoq_pp": coverage.diff(),
+            "allowance_qoq_pct": allowance.pct_change() * 100,
+            "loans_qoq_pct": loans.pct_change() * 100,
+            "provision_qoq_bps": kpis["provision_for_credit_losses_bps_avg_loans"].diff(),
+        }
+    )
+
+
+@cached_file_loader("credit-quality")
+def load_credit_quality(path: Path) -> Dict[str, Dict[str, Dict[str, str]]]:
+    """
+    Derived credit-quality metrics for every segment, computed once per file version.
+
+    Coverage and QoQ changes come from each segment's KPIs; stage coverage, stage
+    mix and migration proxies are added where stage data exists. The Asset Quality
+    sheet reports the group only, so these belong to ASSET_QUALITY_SEGMENT.
+
+    Args:
+        path (Path): Path to the financial data supplement
+
+    Returns:
+        Dict[str, Dict[str, Dict[str, str]]]: segment → metric → period → value,
+            in the format of extract_metrics_from_excel
+    """
+    bank_data = extract_metrics_from_excel(path)
+    result = {
+        segment: _frame_to_kpis(derive_segment_credit_metrics(kpis))
+        for segment, kpis in bank_data.items()
+    }
+
+    df_gca, df_acl = extract_asset_quality_metrics(path)
+    if df_gca is not None and df_acl is not None:
+        stage_metrics = _frame_to_kpis(derive_credit_quality_metrics(df_gca, df_acl))
+        result.setdefault(ASSET_QUALITY_SEGMENT, {}).update(stage_metrics)
+    return result
+
+
 def prepare_chart_data(
     bank_data_dict, segment_name, kpi_key, df_ifo=None, include_ifo=False
 ):
@@ -323,14 +567,15 @@ def prepare_chart_data(
             try:
                 # Convert IFO monthly data to quarterly averages
                 quarterly_ifo = {}
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Available IFO years: %s", df_ifo.index.year.unique())
 
                 for period in sorted_periods:
                     try:
                         period_str = str(period).strip().upper()
 
                         # Check if we have IFO data for the relevant time periods
-                        print(f"Processing period: {period_str}")
-                        print(f"Available IFO years: {df_ifo.index.year.unique()}")
+                        logger.debug("Processing period: %s", period_str)
 
                         if "FY" in period_str:
                             # For fiscal years, extract the year number
@@ -339,7 +584,7 @@ def prepare_chart_data(
                                 period_str.replace("FY", "").replace("_", "").strip()
                             )
                             year = int(year_str)
-                            print(f"Looking for IFO data for fiscal year {year}")
+                            logger.debug("Looking for IFO data for fiscal year %s", year)
 
                             # For fiscal year, get all months in that year
                             quarter_data = df_ifo[df_ifo.index.year == year]
@@ -371,7 +616,7 @@ def prepare_chart_data(
                             # Now extract quarter number and year
                             quarter = int(quarter_part.replace("Q", ""))
                             year = int(year_part)
-                            print(f"Looking for IFO data for Q{quarter} {year}")
+                            logger.debug("Looking for IFO data for Q%s %s", quarter, year)
 
                             # Calculate start and end months for the quarter
                             start_month = (quarter - 1) * 3 + 1
@@ -385,8 +630,8 @@ def prepare_chart_data(
                             ]
 
                         # Debug info about the data we found
-                        print(
-                            f"Found {len(quarter_data)} IFO data points for period {period}"
+                        logger.debug(
+                            "Found %d IFO data points for period %s", len(quarter_data), period
                         )
 
                         # Calculate average IFO for the period
@@ -402,19 +647,20 @@ def prepare_chart_data(
                                 quarterly_ifo[period] = float(
                                     quarter_data[ifo_column].values[-1]
                                 )
-                                print(
-                                    f"IFO data for period {period}: {quarterly_ifo[period]}"
+                                logger.debug(
+                                    "IFO data for period %s: %s", period, quarterly_ifo[period]
                                 )
                             else:
-                                print(
-                                    f"No 'geschaeftsklima' column found in IFO data. Available columns: {quarter_data.columns.tolist()}"
+                                logger.warning(
+                                    "No 'geschaeftsklima' column found in IFO data. Available columns: %s",
+                                    quarter_data.columns.tolist(),
                                 )
                                 quarterly_ifo[period] = None
                         else:
                             quarterly_ifo[period] = None
-                            print(f"No IFO data found for period {period}")
+                            logger.debug("No IFO data found for period %s", period)
                     except Exception as e:
-                        print(f"Error processing IFO data for period {period}: {e}")
+                        logger.error("Error processing IFO data for period %s: %s", period, e)
                         quarterly_ifo[period] = None
 
                 # Add IFO dataset to chart
@@ -422,10 +668,10 @@ def prepare_chart_data(
 
                 # Debug: Check if we have any valid IFO values
                 valid_ifo_count = sum(1 for val in ifo_values if val is not None)
-                print(
-                    f"Total periods: {len(sorted_periods)}, Valid IFO values: {valid_ifo_count}"
+                logger.debug(
+                    "Total periods: %d, Valid IFO values: %d", len(sorted_periods), valid_ifo_count
                 )
-                print(f"IFO values: {ifo_values}")
+                logger.debug("IFO values: %s", ifo_values)
 
                 if valid_ifo_count > 0:
                     chart_data["datasets"].append(
@@ -438,17 +684,14 @@ def prepare_chart_data(
                         }
                     )
                 else:
-                    print("No valid IFO data found to display on chart")
+                    logger.info("No valid IFO data found to display on chart")
             except Exception as e:
-                print(f"Error adding IFO data to chart: {e}")
-                import traceback
-
-                print(traceback.format_exc())
+                logger.exception("Error adding IFO data to chart: %s", e)
 
         return chart_data
 
     except Exception as e:
-        print(f"Error in prepare_chart_data: {e}")
+        logger.error("Error in prepare_chart_data: %s", e)
         # Return a simple empty chart structure as fallback
         return {
             "labels": [],
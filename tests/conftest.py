@@ -0,0 +1,81 @@
+import threading
+
+import pytest
+
+import scripts.constants as const
+from scripts import api_calls
+from scripts.api_calls import FakeBackend
+from scripts.prompt_cache import PrefixCache
+
+
+class ScriptedBackend(FakeBackend):
+    """FakeBackend whose first calls fail and whose latency is fixed per instance."""
+
+    def __init__(self, model_name: str = "fake-primary", failures: int = 0, latency: float = 0.01):
+        super().__init__(model_name)
+        self.failures = failures
+        self.latency = latency
+        self.calls = []  # max_output_tokens of every call
+        self.uploads = []
+        self.deleted = []
+        self._lock = threading.Lock()
+
+    def _latency(self, cached_context) -> float:
+        super()._latency(cached_context)
+        return self.latency
+
+    def _count(self, generation_config):
+        with self._lock:
+            self.calls.append(generation_config["max_output_tokens"])
+            if len(self.calls) <= self.failures:
+                raise RuntimeError("scripted failure")
+
+    def upload_file(self, path: str):
+        with self._lock:
+            self.uploads.append(path)
+        return f"files/{len(self.uploads)}"
+
+    def delete_file(self, uploaded):
+        with self._lock:
+            self.deleted.append(uploaded)
+
+    def generate(self, content, generation_config, cached_context=None, timeout=None):
+        self._count(generation_config)
+        return super().generate(content, generation_config, cached_context, timeout)
+
+    async def agenerate(self, content, generation_config, cached_context=None, timeout=None):
+        self._count(generation_config)
+        return await super().agenerate(content, generation_config, cached_context, timeout)
+
+
+@pytest.fixture
+def fast_model(monkeypatch):
+    """Model calls without retry delays, random errors or the adaptive budget."""
+    monkeypatch.setattr(const, "RETRY_DELAY", 0)
+    monkeypatch.setattr(const, "CANCEL_POLL_INTERVAL", 0.01)
+    monkeypatch.setattr(const, "HEDGE_ENABLED", False)
+    monkeypatch.setattr(const, "ADAPTIVE_BUDGET", False)
+    monkeypatch.setattr(const, "FAKE_MODEL_ERROR_RATE", 0)
+    monkeypatch.setattr(const, "FAKE_MODEL_SLOW_RATE", 0)
+    monkeypatch.setattr(const, "FAKE_MODEL_LATENCY", 0.01)
+    monkeypatch.setattr(const, "FAKE_MODEL_OUTPUT_TOKENS", 100)
+
+
+@pytest.fixture
+def use_backends(monkeypatch, fast_model):
+    """Install ScriptedBackends as the primary and fallback model; returns them."""
+
+    def install(primary: ScriptedBackend = None, fallback: ScriptedBackend = None):
+        primary = primary or ScriptedBackend()
+        # Cached prefixes are registered per model name, not per backend instance
+        monkeypatch.setattr(api_calls, "prefix_cache", PrefixCache())
+        monkeypatch.setattr(api_calls, "model", primary)
+        monkeypatch.setattr(api_calls, "fallback_model", fallback or primary)
+        return primary
+
+    return install
+
+
+@pytest.fixture
+def scripted_backend():
+    return ScriptedBackend
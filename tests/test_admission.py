@@ -0,0 +1,160 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import scripts.constants as const
+from scripts.admission import AdmissionController, AdmissionRejected, client_address, request_lane
+from scripts.cancellation import CancelToken, RequestCancelled
+
+
+def controller(**kwargs):
+    defaults = {"max_active": 1, "max_queue": {"interactive": 4, "batch": 4}, "max_per_client": 4, "max_wait": 5}
+    return AdmissionController(**{**defaults, **kwargs})
+
+
+def queue_request(admission, lane, client, order):
+    """Start a request that records its lane once admitted; returns the thread."""
+
+    def run():
+        with admission.admit(lane=lane, client=client):
+            order.append(lane)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def wait_for_queue(admission, **expected):
+    for _ in range(200):
+        if admission.stats()["queued"] == {**{"interactive": 0, "batch": 0}, **expected}:
+            return
+        time.sleep(0.01)
+    raise AssertionError(f"Queue never reached {expected}: {admission.stats()['queued']}")
+
+
+def test_interactive_requests_are_served_before_batch():
+    admission = controller()
+    order = []
+    with admission.admit(lane="interactive", client="a"):
+        threads = [queue_request(admission, "batch", "b", order)]
+        wait_for_queue(admission, batch=1)
+        threads.append(queue_request(admission, "interactive", "c", order))
+        wait_for_queue(admission, batch=1, interactive=1)
+    for thread in threads:
+        thread.join(5)
+
+    assert order == ["interactive", "batch"]
+
+
+def test_full_lane_is_rejected_with_retry_after():
+    admission = controller(max_queue={"interactive": 4, "batch": 1})
+    order = []
+    with admission.admit(client="a"):
+        thread = queue_request(admission, "batch", "b", order)
+        wait_for_queue(admission, batch=1)
+        with pytest.raises(AdmissionRejected) as rejected:
+            with admission.admit(lane="batch", client="c"):
+                pass
+    thread.join(5)
+
+    assert rejected.value.reason == "queue_full"
+    assert rejected.value.retry_after >= 1
+
+
+def test_client_over_its_cap_is_rejected():
+    admission = controller(max_active=2, max_per_client=1)
+    with admission.admit(client="a"):
+        with pytest.raises(AdmissionRejected) as rejected:
+            with admission.admit(client="a"):
+                pass
+        with admission.admit(client="b"):
+            pass
+
+    assert rejected.value.reason == "client_limit"
+
+
+def test_queued_request_gives_up_after_max_wait():
+    admission = controller(max_wait=0.1)
+    with admission.admit(client="a"):
+        with pytest.raises(AdmissionRejected) as rejected:
+            with admission.admit(client="b"):
+                pass
+
+    assert rejected.value.reason == "timeout"
+    assert admission.stats()["queued"] == {"interactive": 0, "batch": 0}
+
+
+def test_cancelled_request_leaves_the_queue(monkeypatch):
+    monkeypatch.setattr(const, "CANCEL_POLL_INTERVAL", 0.01)
+    admission = controller()
+    token = CancelToken()
+    with admission.admit(client="a"):
+        threading.Timer(0.05, token.cancel).start()
+        with pytest.raises(RequestCancelled):
+            with admission.admit(client="b", token=token):
+                pass
+
+    assert admission.stats()["queued"] == {"interactive": 0, "batch": 0}
+
+
+def test_async_requests_share_the_slots():
+    admission = controller()
+    order = []
+
+    async def request(lane, hold):
+        async with admission.admit_async(lane=lane, client=lane):
+            order.append(lane)
+            await asyncio.sleep(hold)
+
+    async def run():
+        first = asyncio.ensure_future(request("interactive", 0.1))
+        await asyncio.sleep(0.02)
+        batch = asyncio.ensure_future(request("batch", 0))
+        await asyncio.sleep(0.02)
+        interactive = asyncio.ensure_future(request("interactive", 0))
+        await asyncio.gather(first, batch, interactive)
+
+    asyncio.run(run())
+
+    assert order == ["interactive", "interactive", "batch"]
+
+
+def test_client_address_ignores_forwarded_for_without_trusted_proxies(monkeypatch):
+    monkeypatch.setattr(const, "TRUSTED_PROXIES", 0)
+
+    assert client_address("10.0.0.1", "1.2.3.4") == "10.0.0.1"
+    assert client_address(None) == "anonymous"
+
+
+def test_client_address_takes_the_hop_of_the_outermost_trusted_proxy(monkeypatch):
+    monkeypatch.setattr(const, "TRUSTED_PROXIES", 2)
+
+    # The client sent "6.6.6.6" itself; the two proxies appended the other hops
+    assert client_address("10.0.0.2", "6.6.6.6, 1.2.3.4, 10.0.0.1") == "1.2.3.4"
+    assert client_address("10.0.0.2", "1.2.3.4") == "10.0.0.2"
+
+
+def test_request_may_always_pick_a_lower_lane(monkeypatch):
+    monkeypatch.setattr(const, "ADMISSION_DEFAULT_LANE", "interactive")
+
+    assert request_lane(None) == "interactive"
+    assert request_lane("BATCH") == "batch"
+    assert request_lane("unknown") == "interactive"
+
+
+def test_higher_lane_needs_the_priority_token(monkeypatch):
+    monkeypatch.setattr(const, "ADMISSION_DEFAULT_LANE", "batch")
+    monkeypatch.setattr(const, "PRIORITY_TOKEN", "secret")
+
+    assert request_lane("interactive") == "batch"
+    assert request_lane("interactive", "wrong") == "batch"
+    assert request_lane("interactive", "secret") == "interactive"
+
+
+def test_higher_lane_is_refused_without_a_configured_token(monkeypatch):
+    monkeypatch.setattr(const, "ADMISSION_DEFAULT_LANE", "batch")
+    monkeypatch.setattr(const, "PRIORITY_TOKEN", "")
+
+    assert request_lane("interactive", "") == "batch"
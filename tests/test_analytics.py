@@ -0,0 +1,114 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from scripts.analytics import compute_lead_lag, threshold_crossings, turning_points
+
+# Irregular quarterly indicator values, 2021Q1 to 2024Q4
+INDICATOR = [3.0, 7.0, 1.0, 8.0, 2.0, 9.0, 4.0, 6.0, 0.0, 5.0, 10.0, 3.0, 7.0, 2.0, 8.0, 1.0]
+QUARTERS = pd.period_range("2021Q1", periods=len(INDICATOR), freq="Q")
+
+
+def monthly_ifo(values):
+    """IFO frame with every month of a quarter at the quarter's value."""
+    months = pd.date_range("2021-01-01", periods=3 * len(values), freq="MS")
+    return pd.DataFrame({"geschaeftsklima": np.repeat(values, 3)}, index=months)
+
+
+def bank_data(kpi_values):
+    labels = [f"Q{q.quarter}_{q.year}" for q in QUARTERS]
+    return {"total_bank": {"kpi": {label: str(v) for label, v in zip(labels, kpi_values) if v is not None}}}
+
+
+def test_turning_points_are_local_peaks_and_troughs():
+    values = np.array([[1.0], [3.0], [2.0], [0.0], [4.0]])
+
+    points = turning_points(values, ["a", "b", "c", "d", "e"])
+
+    assert points == [[{"period": "b", "type": "peak"}, {"period": "d", "type": "trough"}]]
+
+
+def test_turning_points_need_three_values():
+    assert turning_points(np.array([[1.0], [2.0]]), ["a", "b"]) == [[]]
+
+
+def test_threshold_crossings_report_direction():
+    monthly = pd.DataFrame(
+        {"pmi:composite": [49.0, 51.0, 52.0, 48.0], "other": [1.0, 2.0, 3.0, 4.0]},
+        index=pd.period_range("2024-01", periods=4, freq="M"),
+    )
+
+    crossings = threshold_crossings(monthly, {"pmi:composite": 50, "missing": 0})
+
+    assert crossings == {
+        "pmi:composite": [
+            {"period": "2024-02", "direction": "up", "threshold": 50},
+            {"period": "2024-04", "direction": "down", "threshold": 50},
+        ]
+    }
+
+
+def test_leading_indicator_is_found_at_its_lag():
+    # The KPI follows the indicator one quarter later
+    kpi = [None] + INDICATOR[:-1]
+
+    result = compute_lead_lag(bank_data(kpi), monthly_ifo(INDICATOR))
+    stats = result["correlations"]["total_bank"]["kpi"]["ifo:geschaeftsklima"]
+
+    assert stats["best_lag"] == 1
+    assert stats["best_corr"] == pytest.approx(1.0)
+    assert stats["by_lag"][1] == pytest.approx(1.0)
+    assert abs(stats["lag0"]) < 0.9
+
+
+def test_observations_are_counted_at_the_best_lag():
+    # The KPI follows the indicator one quarter later; the indicator misses two quarters
+    kpi = [None] + INDICATOR[:-1]
+    indicator = list(INDICATOR)
+    indicator[6] = indicator[15] = np.nan
+
+    result = compute_lead_lag(bank_data(kpi), monthly_ifo(indicator))
+    stats = result["correlations"]["total_bank"]["kpi"]["ifo:geschaeftsklima"]
+
+    assert stats["best_lag"] == 1
+    # Lag 0 loses both gaps, lag 1 only 2022Q3 (2024Q4 would pair with a 2025 KPI)
+    assert stats["observations"] == 14
+
+
+def test_lagging_indicator_has_a_negative_lag():
+    # The indicator follows the KPI two quarters later
+    kpi = INDICATOR[2:] + [None, None]
+
+    result = compute_lead_lag(bank_data(kpi), monthly_ifo(INDICATOR))
+    stats = result["correlations"]["total_bank"]["kpi"]["ifo:geschaeftsklima"]
+
+    assert stats["best_lag"] == -2
+    assert stats["best_corr"] == pytest.approx(1.0)
+
+
+def test_lead_lag_includes_rolling_windows_and_turning_points():
+    result = compute_lead_lag(bank_data(INDICATOR), monthly_ifo(INDICATOR))
+    stats = result["correlations"]["total_bank"]["kpi"]["ifo:geschaeftsklima"]
+
+    assert result["periods"][0] == "2021Q1"
+    assert result["lags"] == list(range(-4, 5))
+    assert list(stats["rolling"]) == result["periods"][3:]
+    assert all(value == pytest.approx(1.0) for value in stats["rolling"].values())
+    assert result["turning_points"]["bank"]["total_bank"]["kpi"][0] == {"period": "2021Q2", "type": "peak"}
+
+
+def test_too_few_observations_give_no_correlation():
+    kpi = INDICATOR[:3] + [None] * (len(INDICATOR) - 3)
+
+    result = compute_lead_lag(bank_data(kpi), monthly_ifo(INDICATOR))
+    stats = result["correlations"]["total_bank"]["kpi"]["ifo:geschaeftsklima"]
+
+    assert stats["best_lag"] is None
+    assert stats["lag0"] is None
+
+
+def test_no_data_gives_an_empty_result():
+    result = compute_lead_lag({}, monthly_ifo(INDICATOR))
+
+    assert result["correlations"] == {}
+    assert result["periods"] == []
@@ -0,0 +1,126 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import scripts.constants as const
+from scripts import api_calls
+from scripts.api_calls import call_gemini_with_retry, call_gemini_with_retry_async
+
+
+def test_retries_until_a_call_succeeds(use_backends, scripted_backend):
+    backend = use_backends(scripted_backend(failures=2))
+    stats = {}
+
+    text = call_gemini_with_retry("prompt", stats=stats)
+
+    assert "fake-primary" in text
+    assert stats["attempts"] == 3
+    assert stats["winner"] == "primary"
+    assert len(backend.calls) == 3
+
+
+def test_gives_up_after_max_retries(monkeypatch, use_backends, scripted_backend):
+    monkeypatch.setattr(const, "MAX_RETRIES", 2)
+    backend = use_backends(scripted_backend(failures=5))
+
+    with pytest.raises(RuntimeError, match="scripted failure"):
+        call_gemini_with_retry("prompt")
+    assert len(backend.calls) == 2
+
+
+def test_async_retries_until_a_call_succeeds(use_backends, scripted_backend):
+    use_backends(scripted_backend(failures=1))
+    stats = {}
+
+    text = asyncio.run(call_gemini_with_retry_async("prompt", stats=stats))
+
+    assert "fake-primary" in text
+    assert stats["attempts"] == 2
+
+
+def test_empty_prompt_is_rejected():
+    with pytest.raises(ValueError):
+        call_gemini_with_retry("  ")
+
+
+def test_slow_primary_is_hedged_and_the_hedge_wins(monkeypatch, use_backends, scripted_backend):
+    monkeypatch.setattr(const, "HEDGE_ENABLED", True)
+    monkeypatch.setattr(api_calls, "hedge_delay", lambda: 0.05)
+    use_backends(scripted_backend("fake-primary", latency=2.0), scripted_backend("fake-fallback"))
+    stats = {}
+
+    started = time.monotonic()
+    text = call_gemini_with_retry("prompt", stats=stats)
+
+    assert time.monotonic() - started < 1.0
+    assert "fake-fallback" in text
+    assert stats["hedges"] == 1
+    assert stats["winner"] == "hedge"
+    assert stats["model"] == "fake-fallback"
+
+
+def test_async_slow_primary_is_hedged(monkeypatch, use_backends, scripted_backend):
+    monkeypatch.setattr(const, "HEDGE_ENABLED", True)
+    monkeypatch.setattr(api_calls, "hedge_delay", lambda: 0.05)
+    use_backends(scripted_backend("fake-primary", latency=2.0), scripted_backend("fake-fallback"))
+    stats = {}
+
+    text = asyncio.run(call_gemini_with_retry_async("prompt", stats=stats))
+
+    assert "fake-fallback" in text
+    assert stats["winner"] == "hedge"
+
+
+def test_fast_primary_is_not_hedged(monkeypatch, use_backends, scripted_backend):
+    monkeypatch.setattr(const, "HEDGE_ENABLED", True)
+    monkeypatch.setattr(api_calls, "hedge_delay", lambda: 1.0)
+    fallback = scripted_backend("fake-fallback")
+    use_backends(scripted_backend("fake-primary"), fallback)
+    stats = {}
+
+    call_gemini_with_retry("prompt", stats=stats)
+
+    assert stats["hedges"] == 0
+    assert stats["winner"] == "primary"
+    assert fallback.calls == []
+
+
+def test_hedge_delay_follows_the_latency_percentile(monkeypatch):
+    monkeypatch.setattr(api_calls, "_latencies", type(api_calls._latencies)(maxlen=500))
+    monkeypatch.setattr(const, "HEDGE_PERCENTILE", 90)
+    assert api_calls.hedge_delay() == const.HEDGE_DEFAULT_DELAY
+
+    api_calls._latencies.extend(float(i) for i in range(1, 101))
+
+    assert api_calls.hedge_delay() == 90.0
+
+
+def test_model_calls_run_on_a_bounded_pool(monkeypatch):
+    monkeypatch.setattr(api_calls, "_call_pool", ThreadPoolExecutor(max_workers=2, thread_name_prefix="model-call"))
+    threads = set()
+
+    def call():
+        threads.add(threading.current_thread().name)
+        time.sleep(0.01)
+
+    futures = [api_calls._start_call(call) for _ in range(10)]
+    for future in futures:
+        future.result(timeout=2)
+
+    assert len(threads) <= 2
+
+
+def test_abandoned_call_that_has_not_started_never_runs(monkeypatch):
+    monkeypatch.setattr(api_calls, "_call_pool", ThreadPoolExecutor(max_workers=1, thread_name_prefix="model-call"))
+    release = threading.Event()
+    ran = []
+    busy = api_calls._start_call(release.wait, 2)
+    queued = api_calls._start_call(ran.append, "queued")
+
+    assert queued.cancel()
+    release.set()
+    busy.result(timeout=2)
+    assert ran == []
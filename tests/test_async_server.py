@@ -0,0 +1,88 @@
+import asyncio
+import json
+
+import pytest
+
+import asgi_server
+import scripts.constants as const
+from scripts.singleflight import AsyncSingleFlight
+
+DEFAULT_REQUEST = {"segment": "Total", "kpis": ["Ifo"], "comments": "", "mainDocuments": []}
+
+
+@pytest.fixture
+def client(monkeypatch, use_backends):
+    """Quart test client with parsing in threads instead of worker processes."""
+    monkeypatch.setattr(const, "ASYNC_PARSE_WORKERS", 0)
+    monkeypatch.setattr(const, "SECTIONED_ANALYSIS", True)
+    use_backends()
+    return asgi_server.app.test_client()
+
+
+def test_analyze_returns_the_sectioned_result(client):
+    async def run():
+        response = await client.post("/api/analyze", json=DEFAULT_REQUEST)
+        return response.status_code, await response.get_json()
+
+    status, body = asyncio.run(run())
+
+    assert status == 200
+    assert body["success"] is True
+    assert body["precomputed"] is False
+    assert [s["key"] for s in body["result"]["sections"]] == ["kpi", "macro", "linkage", "outlook"]
+
+
+def test_concurrent_identical_requests_are_coalesced(client):
+    async def run():
+        responses = await asyncio.gather(
+            *(client.post("/api/analyze", json=DEFAULT_REQUEST) for _ in range(3))
+        )
+        return [await r.get_json() for r in responses]
+
+    bodies = asyncio.run(run())
+
+    assert sorted(body["coalesced"] for body in bodies) == [False, True, True]
+    assert len({json.dumps(body["result"], sort_keys=True) for body in bodies}) == 1
+
+
+def test_deadline_ends_the_request_with_504(client, use_backends, scripted_backend):
+    use_backends(scripted_backend(latency=2))
+
+    async def run():
+        response = await client.post("/api/analyze", json={**DEFAULT_REQUEST, "timeout": 0.3})
+        return response.status_code, await response.get_json()
+
+    status, body = asyncio.run(run())
+
+    assert status == 504
+    assert body["reason"] == "deadline"
+
+
+def test_stream_returns_ndjson_events(client):
+    async def run():
+        response = await client.post("/api/analyze/stream", json=DEFAULT_REQUEST)
+        return response.mimetype, await response.get_data(as_text=True)
+
+    mimetype, body = asyncio.run(run())
+
+    assert mimetype == "application/x-ndjson"
+    events = [json.loads(line)["event"] for line in body.splitlines()]
+    assert events == ["charts"] + ["section"] * 4 + ["result"]
+
+
+def test_async_single_flight_runs_once_per_key():
+    calls = []
+
+    async def compute(token):
+        calls.append(token)
+        await asyncio.sleep(0.05)
+        return "result"
+
+    async def run():
+        flight = AsyncSingleFlight()
+        return await asyncio.gather(*(flight.do("key", compute) for _ in range(3)))
+
+    results = asyncio.run(run())
+
+    assert len(calls) == 1
+    assert sorted(results) == [("result", False), ("result", True), ("result", True)]
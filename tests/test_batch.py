@@ -0,0 +1,73 @@
+import json
+
+import pytest
+
+import scripts.constants as const
+from scripts.batch import build_matrix, parse_macro_set, run_batch
+
+
+@pytest.fixture
+def batch(monkeypatch, tmp_path, use_backends):
+    """Sectioned batch into tmp; returns the model backend."""
+    monkeypatch.setattr(const, "SECTIONED_ANALYSIS", True)
+    return use_backends()
+
+
+def test_macro_sets_are_parsed_and_validated():
+    assert parse_macro_set("pmi, IFO,pmi") == ["ifo", "pmi"]
+    assert parse_macro_set("none") == []
+    with pytest.raises(ValueError, match="gdp"):
+        parse_macro_set("ifo,gdp")
+
+
+def test_matrix_combines_segments_indicators_and_comments():
+    items = build_matrix(["CB", "PB"], ["ifo,pmi", "pmi,ifo", "none"], ["none", "notes/q4 draft.txt"])
+
+    assert [item["id"] for item in items] == [
+        "CB_ifo-pmi_none",
+        "CB_ifo-pmi_q4-draft",
+        "CB_none_none",
+        "CB_none_q4-draft",
+        "PB_ifo-pmi_none",
+        "PB_ifo-pmi_q4-draft",
+        "PB_none_none",
+        "PB_none_q4-draft",
+    ]
+    assert items[1]["comment_file"] == "notes/q4 draft.txt"
+
+
+def test_batch_writes_reports_and_skips_unchanged_items_on_rerun(batch, tmp_path):
+    comments = tmp_path / "notes.txt"
+    comments.write_text("Temporary provisioning effects in Q3.", encoding="utf-8")
+    output_dir = tmp_path / "reports"
+
+    report = run_batch(["CB"], ["ifo", "none"], ["none", str(comments)], str(output_dir), concurrency=4)
+
+    assert (report["items"], report["generated"], report["failed"]) == (4, 4, 0)
+    # Four sections with indicators, KPI and outlook without
+    assert report["model_calls"] == len(batch.calls) == 12
+    manifest = json.loads((output_dir / "manifest.json").read_text(encoding="utf-8"))
+    assert {entry["status"] for entry in manifest["items"].values()} == {"done"}
+    markdown = (output_dir / "CB_ifo_notes.md").read_text(encoding="utf-8")
+    assert "## KPI Interpretation" in markdown and "notes.txt" in markdown
+
+    comments.write_text("Different comments.", encoding="utf-8")
+    rerun = run_batch(["CB"], ["ifo", "none"], ["none", str(comments)], str(output_dir), concurrency=4)
+
+    assert (rerun["skipped"], rerun["generated"]) == (2, 2)
+    assert len(json.loads((output_dir / "manifest.json").read_text(encoding="utf-8"))["runs"]) == 2
+
+
+def test_failed_items_are_recorded_and_retried(batch, tmp_path, monkeypatch):
+    monkeypatch.setattr(const, "MAX_RETRIES", 1)
+    monkeypatch.setattr(batch, "failures", 1)
+    output_dir = tmp_path / "reports"
+
+    report = run_batch(["CB"], ["none"], None, str(output_dir), concurrency=1)
+
+    assert (report["generated"], report["failed"]) == (0, 1)
+    manifest = json.loads((output_dir / "manifest.json").read_text(encoding="utf-8"))
+    assert manifest["items"]["CB_none_none"]["status"] == "failed"
+
+    rerun = run_batch(["CB"], ["none"], None, str(output_dir), concurrency=1)
+    assert (rerun["skipped"], rerun["generated"]) == (0, 1)
@@ -0,0 +1,130 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import scripts.constants as const
+from scripts import cache
+from scripts.cache import Cache, MemoryBackend, SQLiteBackend, cached_file_loader, deserialize, serialize
+
+
+@pytest.fixture
+def secret(monkeypatch):
+    monkeypatch.setattr(const, "CACHE_SECRET", "test-secret")
+
+
+def test_values_round_trip_and_large_ones_are_compressed():
+    frame = pd.DataFrame({"value": np.zeros(10_000)})
+
+    data = serialize(frame)
+
+    assert data[:1] == b"Z"
+    pd.testing.assert_frame_equal(deserialize(data), frame)
+    assert deserialize(serialize({"a": 1})) == {"a": 1}
+
+
+def test_signed_values_round_trip(secret):
+    data = serialize({"a": 1})
+
+    assert data[:1] == b"S"
+    assert deserialize(data) == {"a": 1}
+
+
+def test_tampered_value_is_rejected_before_unpickling(secret):
+    data = bytearray(serialize({"a": 1}))
+    data[-1] ^= 0xFF
+
+    with pytest.raises(ValueError, match="signature"):
+        deserialize(bytes(data))
+
+
+def test_unsigned_value_is_rejected_when_a_secret_is_set(monkeypatch):
+    data = serialize({"a": 1})
+    monkeypatch.setattr(const, "CACHE_SECRET", "test-secret")
+
+    with pytest.raises(ValueError, match="Unsigned"):
+        deserialize(data)
+
+
+def test_signed_value_is_rejected_without_the_secret(secret, monkeypatch):
+    data = serialize({"a": 1})
+    monkeypatch.setattr(const, "CACHE_SECRET", "")
+
+    with pytest.raises(ValueError):
+        deserialize(data)
+
+
+def test_rejected_value_is_a_cache_miss(secret):
+    backend = MemoryBackend()
+    backend.set("ns:key", b"P" + b"not signed", None)
+
+    assert Cache(backend).get("ns", "key", "default") == "default"
+
+
+def test_redis_requires_a_secret(monkeypatch):
+    monkeypatch.setattr(const, "CACHE_SECRET", "")
+
+    with pytest.raises(ValueError, match="FINAI_CACHE_SECRET"):
+        cache.RedisBackend()
+
+
+def test_sqlite_size_follows_inserts_updates_and_deletes(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "cache.sqlite"), max_bytes=10_000)
+
+    backend.set("a", b"x" * 100, None)
+    backend.set("b", b"x" * 50, None)
+    backend.set("a", b"x" * 30, None)
+    assert backend.stats() == {"entries": 2, "bytes": 80}
+
+    backend.delete("b")
+    assert backend.stats() == {"entries": 1, "bytes": 30}
+    backend.clear()
+    assert backend.stats() == {"entries": 0, "bytes": 0}
+
+
+def test_sqlite_size_is_seeded_from_an_existing_file(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    SQLiteBackend(path).set("a", b"x" * 100, None)
+
+    assert SQLiteBackend(path).stats()["bytes"] == 100
+
+
+def test_sqlite_evicts_least_recently_used_entries(tmp_path, monkeypatch):
+    monkeypatch.setattr(const, "CACHE_SQLITE_TOUCH_INTERVAL", 0)
+    clock = itertools.count(1000)
+    monkeypatch.setattr(cache.time, "time", lambda: next(clock))
+    backend = SQLiteBackend(str(tmp_path / "cache.sqlite"), max_bytes=350)
+    for key in "abc":
+        backend.set(key, b"x" * 100, None)
+
+    backend.get("a")
+    backend.set("d", b"x" * 100, None)
+
+    assert backend.get("b") is None
+    assert all(backend.get(key) is not None for key in "acd")
+    assert backend.stats()["bytes"] == 300
+
+
+def test_sqlite_expired_entries_are_misses(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "cache.sqlite"))
+
+    backend.set("a", b"value", ttl=-1)
+
+    assert backend.get("a") is None
+    assert backend.stats()["bytes"] == 0
+
+
+def test_failed_loads_are_not_cached(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "_cache", Cache(MemoryBackend()))
+    path = tmp_path / "data.csv"
+    path.write_text("a;b\n")
+    results = [None, "parsed"]
+
+    @cached_file_loader("test-loader")
+    def load(path):
+        return results.pop(0)
+
+    assert load(str(path)) is None
+    assert load(str(path)) == "parsed"
+    assert load(str(path)) == "parsed"
@@ -0,0 +1,144 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from scripts import analysis
+from scripts.api_calls import Attachments, call_gemini_with_retry, call_gemini_with_retry_async
+from scripts.cancellation import CancelToken, RequestCancelled, SharedCancelToken
+
+
+def test_cancelled_request_stops_waiting_for_the_model(use_backends, scripted_backend):
+    use_backends(scripted_backend(latency=2.0))
+    token = CancelToken()
+    threading.Timer(0.05, token.cancel, args=("disconnected",)).start()
+
+    started = time.monotonic()
+    with pytest.raises(RequestCancelled) as raised:
+        call_gemini_with_retry("prompt", token=token)
+
+    assert raised.value.reason == "disconnected"
+    assert time.monotonic() - started < 1.0
+
+
+def test_deadline_bounds_the_model_request(use_backends, scripted_backend):
+    use_backends(scripted_backend(latency=2.0))
+
+    with pytest.raises(RequestCancelled) as raised:
+        call_gemini_with_retry("prompt", token=CancelToken(timeout=0.1))
+    assert raised.value.reason == "deadline"
+
+
+def test_async_cancelled_request_stops_waiting_for_the_model(use_backends, scripted_backend):
+    use_backends(scripted_backend(latency=2.0))
+    token = CancelToken()
+
+    async def run():
+        asyncio.get_running_loop().call_later(0.05, token.cancel)
+        return await call_gemini_with_retry_async("prompt", token=token)
+
+    with pytest.raises(RequestCancelled):
+        asyncio.run(run())
+
+
+def test_cancel_callbacks_run_once():
+    token = CancelToken()
+    calls = []
+    token.on_cancel(lambda: calls.append("first"))
+
+    token.cancel("disconnected")
+    token.cancel("deadline")
+    token.on_cancel(lambda: calls.append("late"))
+
+    assert calls == ["first", "late"]
+    assert token.reason == "disconnected"
+
+
+def test_shared_token_is_cancelled_once_every_caller_is():
+    first, second = CancelToken(), CancelToken()
+    shared = SharedCancelToken([first, second])
+
+    first.cancel("disconnected")
+    assert not shared.cancelled
+
+    second.cancel("disconnected")
+    assert shared.cancelled
+    assert shared.reason == "disconnected"
+
+
+def wait_for(condition, timeout=2.0):
+    end = time.monotonic() + timeout
+    while not condition() and time.monotonic() < end:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_upload_in_flight_at_release_is_deleted_when_it_completes(use_backends, scripted_backend):
+    backend = use_backends()
+    started, finish = threading.Event(), threading.Event()
+    upload_file = backend.upload_file
+
+    def slow_upload(path):
+        started.set()
+        finish.wait(2)
+        return upload_file(path)
+
+    backend.upload_file = slow_upload
+    attachments = Attachments()
+
+    async def run():
+        section = asyncio.ensure_future(attachments.aget("report.pdf"))
+        await asyncio.get_running_loop().run_in_executor(None, started.wait, 2)
+        # The analysis ends while the upload is still running
+        section.cancel()
+        attachments.release()
+        assert backend.deleted == []
+        finish.set()
+        await asyncio.sleep(0.1)
+
+    asyncio.run(run())
+
+    assert wait_for(lambda: backend.deleted == ["files/1"])
+
+
+def test_completed_upload_is_deleted_once_on_release(use_backends, scripted_backend):
+    backend = use_backends()
+    attachments = Attachments()
+
+    async def run():
+        handle = await attachments.aget("report.pdf")
+        attachments.release()
+        attachments.release()
+        return handle
+
+    handle = asyncio.run(run())
+
+    assert wait_for(lambda: backend.deleted == [handle])
+    time.sleep(0.05)
+    assert backend.deleted == [handle]
+
+
+def test_async_analysis_stops_parsing_documents_once_cancelled(monkeypatch, use_backends):
+    use_backends()
+    token = CancelToken()
+    loaded = []
+
+    def cancelling_split(documents, token=None):
+        token.cancel("disconnected")
+        return [], documents
+
+    monkeypatch.setattr(analysis, "split_documents", cancelling_split)
+    monkeypatch.setattr(analysis, "load_ifo_data", lambda path: loaded.append(path))
+    params = analysis.normalize_request(
+        {"segment": "Total", "kpis": ["Ifo"], "comments": "", "mainDocuments": []}
+    )
+    params["documents"] = [("notes.txt", "notes.txt")]
+
+    async def run():
+        async for _ in analysis.aiter_analysis(params, token):
+            pass
+
+    with pytest.raises(RequestCancelled):
+        asyncio.run(run())
+    assert loaded == []
@@ -0,0 +1,120 @@
+import logging
+import os
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import scripts.constants as const
+from scripts import log
+
+
+@pytest.fixture(autouse=True)
+def no_request_id():
+    token = log._request_id.set(None)
+    yield
+    log._request_id.reset(token)
+
+
+@pytest.fixture
+def payloads(monkeypatch, tmp_path):
+    """Every request sampled, payloads written to tmp; stops the writer at the end."""
+    monkeypatch.setattr(const, "LOG_PAYLOAD_SAMPLE_RATE", 1.0)
+    monkeypatch.setattr(const, "LOG_PAYLOAD_DIR", str(tmp_path))
+    monkeypatch.setattr(const, "LOG_PAYLOAD_FLUSH_INTERVAL", 0.01)
+    monkeypatch.setattr(log, "_writer", None)
+    yield tmp_path
+    if log._writer is not None:
+        log._writer.stop()
+
+
+def flush():
+    log._writer.stop()
+    log._writer = None
+
+
+def test_request_ids_come_from_the_header_if_usable():
+    assert log.new_request_id(" abc-123_x ") == "abc-123_x"
+    assert log.request_id() == "abc-123_x"
+    generated = log.new_request_id("no spaces or ; allowed")
+    assert len(generated) == 32 and generated != "no spaces or ; allowed"
+
+
+def test_bound_work_in_a_pool_keeps_the_request_id():
+    log.new_request_id("req-1")
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        unbound = pool.submit(log.request_id).result()
+        bound = pool.submit(log.bind(log.request_id)).result()
+
+    assert bound == "req-1"
+    assert unbound is None
+
+
+def test_records_carry_the_request_id():
+    log.new_request_id("req-2")
+    record = logging.LogRecord("finai.api", logging.INFO, __file__, 1, "message", None, None)
+
+    log._RequestIdFilter().filter(record)
+
+    assert record.request_id == "req-2"
+
+
+def test_full_log_queue_drops_records_instead_of_blocking():
+    handler = log._QueueHandler(queue.Queue(1))
+    record = logging.LogRecord("finai.api", logging.INFO, __file__, 1, "message", None, None)
+
+    handler.enqueue(record)
+    handler.enqueue(record)
+
+    assert handler.queue.qsize() == 1
+
+
+def test_sampling_is_decided_once_per_request(monkeypatch):
+    monkeypatch.setattr(const, "LOG_PAYLOAD_SAMPLE_RATE", 0.5)
+    decisions = {}
+    for n in range(50):
+        log.new_request_id(f"req-{n}")
+        decisions[n] = {log._sampled() for _ in range(5)}
+
+    assert all(len(d) == 1 for d in decisions.values())
+    assert {d.pop() for d in decisions.values()} == {True, False}
+
+
+def test_payloads_are_stored_per_request_and_kind(payloads, monkeypatch):
+    monkeypatch.setattr(const, "LOG_PAYLOAD_MAX_CHARS", 10)
+    log.new_request_id("req-a")
+    log.log_payload("prompt", "prefix ", "prompt text", section="kpi")
+    log.log_payload("response", "answer")
+    log.new_request_id("req-b")
+    log.log_payload("prompt", "other")
+    flush()
+
+    stored = list(log.iter_payloads("req-a"))
+    assert [p["kind"] for p in stored] == ["prompt", "response"]
+    assert stored[0]["text"] == "prefix pro"
+    assert stored[0]["characters"] == 18
+    assert stored[0]["section"] == "kpi"
+    assert [p["text"] for p in log.iter_payloads(kind="prompt")] == ["prefix pro", "other"]
+
+
+def test_nothing_is_stored_unless_sampled(payloads, monkeypatch):
+    monkeypatch.setattr(const, "LOG_PAYLOAD_SAMPLE_RATE", 0)
+
+    log.log_payload("prompt", "text")
+
+    assert log._writer is None
+    assert os.listdir(payloads) == []
+
+
+def test_oldest_payload_files_are_removed_beyond_the_limit(payloads, monkeypatch):
+    monkeypatch.setattr(const, "LOG_PAYLOAD_MAX_BYTES", 150)
+    for n in range(3):
+        path = payloads / f"file-{n}.jsonl.gz"
+        path.write_bytes(b"x" * 100)
+        stamp = time.time() - 10 * (3 - n)
+        os.utime(path, (stamp, stamp))
+
+    log._prune()
+
+    assert sorted(os.listdir(payloads)) == ["file-2.jsonl.gz"]
@@ -0,0 +1,88 @@
+import pytest
+
+import scripts.constants as const
+from scripts import analysis, pmi_report
+from scripts.pmi_report import extract_pmi_report, format_pmi_report, is_complete
+
+PMI_REQUEST = {"segment": "Total", "kpis": ["PMI"], "comments": "", "mainDocuments": []}
+
+
+@pytest.fixture(scope="module")
+def report():
+    return extract_pmi_report(const.PMI_PDF_PATH)
+
+
+def test_release_figures_are_extracted(report):
+    composite = next(t for t in report["tables"] if t["name"] == "Composite Index")
+
+    assert report["release_date"] == "5 February 2025"
+    assert report["headline"].startswith("Growth of global economic output")
+    assert composite["columns"] == ["Index", "Dec-24", "Jan-25", "Interpretation"]
+    assert composite["rows"][0] == ["Output", "52.6", "51.8", "Growth, slower rate"]
+    assert report["passages"] and report["comment"].startswith("Bennett Parrish")
+
+
+def test_unruled_tables_are_read_from_the_text_layer():
+    text = "\n".join([
+        "Index", "Dec-24", "Jan-25", "Interpretation",
+        "sa, 50 = no change over previous month.",
+        "Output", "52.6", "51.8", "Growth, slower rate",
+        "Employment", "50.3", "50.8", "Growth, faster rate",
+        "Composite Index summary",
+    ])
+
+    (table,) = pmi_report._tables_from_text(text)
+
+    assert table["name"] == "Composite Index"
+    assert table["note"].startswith("sa, 50")
+    assert table["rows"][1] == ["Employment", "50.3", "50.8", "Growth, faster rate"]
+
+
+def test_prompt_block_carries_tables_and_commentary(report):
+    text = format_pmi_report(report)
+
+    assert "(released 5 February 2025)" in text
+    assert "Output | 52.6 | 51.8 | Growth, slower rate" in text
+    assert "Commentary:" in text
+    assert len(text) < 5000
+
+
+def test_completeness_needs_tables_and_passages(report):
+    assert is_complete(report)
+    assert not is_complete({**report, "tables": []})
+    assert not is_complete({**report, "passages": []})
+
+
+def load_pmi_inputs():
+    return analysis.load_inputs(analysis.normalize_request(PMI_REQUEST))
+
+
+def test_complete_extraction_replaces_the_pdf():
+    inputs = load_pmi_inputs()
+
+    assert inputs["pmi_pdf_path"] is None
+    assert "Composite Index" in inputs["context"]["pmi_data"]
+
+
+def test_incomplete_extraction_attaches_the_pdf(monkeypatch):
+    monkeypatch.setattr(analysis, "load_pmi_report", lambda path: {"tables": [], "passages": []})
+
+    inputs = load_pmi_inputs()
+
+    assert inputs["pmi_pdf_path"] == const.PMI_PDF_PATH
+    assert inputs["context"]["pmi_data"] == "Please find the PMI data in the PDF report."
+
+
+def test_failed_extraction_attaches_the_pdf(monkeypatch):
+    def broken(path):
+        raise RuntimeError("unreadable PDF")
+
+    monkeypatch.setattr(analysis, "load_pmi_report", broken)
+
+    assert load_pmi_inputs()["pmi_pdf_path"] == const.PMI_PDF_PATH
+
+
+def test_pdf_is_attached_on_opt_in(monkeypatch):
+    monkeypatch.setattr(const, "PMI_ATTACH_PDF", True)
+
+    assert load_pmi_inputs()["pmi_pdf_path"] == const.PMI_PDF_PATH
@@ -0,0 +1,90 @@
+import pytest
+
+import scripts.constants as const
+from scripts import precompute
+from scripts.analysis import normalize_request, params_for
+
+
+@pytest.fixture
+def snapshots(monkeypatch, tmp_path, use_backends):
+    """Precompute into tmp for one segment and indicator set; returns the model backend."""
+    monkeypatch.setattr(const, "PRECOMPUTE_ENABLED", True)
+    monkeypatch.setattr(const, "PRECOMPUTE_DIR", str(tmp_path / "precomputed"))
+    monkeypatch.setattr(const, "SEGMENTS", {"FinSum": "total_bank"})
+    monkeypatch.setattr(const, "PRECOMPUTE_MACRO_SETS", [["ifo"]])
+    monkeypatch.setattr(precompute, "_memo", {})
+    monkeypatch.setattr(precompute, "_version", (0.0, None))
+    return use_backends()
+
+
+def default_params():
+    return params_for("FinSum", ["ifo"])
+
+
+def test_only_default_requests_have_a_snapshot_key():
+    assert precompute.default_key(params_for("CB", ["pmi", "ifo"])) == "CB_ifo-pmi"
+    assert precompute.default_key({**default_params(), "user_comments": "Q3 one-off"}) is None
+    assert precompute.default_key({**default_params(), "documents": ["a.pdf"]}) is None
+    assert precompute.default_key(params_for("FinSum", [])) is None
+
+
+def test_lookup_is_off_unless_enabled(monkeypatch):
+    monkeypatch.setattr(const, "PRECOMPUTE_ENABLED", False)
+
+    assert precompute.lookup(default_params()) is None
+
+
+def test_build_generates_the_snapshot_that_lookup_serves(snapshots):
+    assert precompute.lookup(default_params()) is None
+
+    assert precompute.build(precompute.data_version())
+
+    calls = len(snapshots.calls)
+    assert calls > 0
+    snapshot = precompute.lookup(normalize_request({"segment": "FinSum", "kpis": ["Ifo"], "comments": ""}))
+    assert snapshot["key"] == "FinSum_ifo"
+    assert snapshot["result"]["variance_analysis"]
+    # A complete version is not generated again
+    assert precompute.build(precompute.data_version())
+    assert len(snapshots.calls) == calls
+
+
+def test_snapshots_of_an_older_version_are_not_served(snapshots, monkeypatch):
+    precompute.build(precompute.data_version())
+    monkeypatch.setattr(precompute, "data_version", lambda: "changed")
+    monkeypatch.setattr(precompute, "_version", (0.0, None))
+
+    assert precompute.lookup(default_params()) is None
+
+
+def test_failed_generation_is_not_retried_before_the_retry_interval(snapshots, monkeypatch):
+    monkeypatch.setattr(snapshots, "failures", 10**6)
+
+    assert not precompute.build(precompute.data_version())
+    calls = len(snapshots.calls)
+    assert not precompute.build(precompute.data_version())
+
+    assert len(snapshots.calls) == calls
+    assert precompute.lookup(default_params()) is None
+
+
+def test_scheduler_builds_once_per_version(snapshots, monkeypatch):
+    builds = []
+    monkeypatch.setattr(precompute, "build", lambda version: builds.append(version) or True)
+    scheduler = precompute._Scheduler(interval=0.01)
+    scheduler.start()
+    try:
+        scheduler._stop_event.wait(0.1)
+    finally:
+        scheduler.stop()
+        scheduler.join(1)
+
+    assert builds == [precompute.data_version()]
+
+
+def test_start_is_a_noop_when_disabled(monkeypatch):
+    monkeypatch.setattr(const, "PRECOMPUTE_ENABLED", False)
+
+    precompute.start()
+
+    assert precompute._scheduler is None
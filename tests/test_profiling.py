@@ -0,0 +1,85 @@
+import os
+import time
+
+import pytest
+
+import scripts.constants as const
+from scripts import profiling
+
+
+@pytest.fixture
+def profiles(monkeypatch, tmp_path):
+    monkeypatch.setattr(profiling, "ENABLED", True)
+    monkeypatch.setattr(const, "PROFILE_TOKEN", "secret")
+    monkeypatch.setattr(const, "PROFILE_SAMPLE_RATE", 0)
+    monkeypatch.setattr(const, "PROFILE_INTERVAL", 0.001)
+    monkeypatch.setattr(const, "PROFILE_DIR", str(tmp_path))
+    return tmp_path
+
+
+def busy(seconds):
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        sum(range(1000))
+
+
+def test_requests_without_the_token_are_not_profiled(profiles):
+    assert profiling.start_request("/api/analyze") is None
+    assert profiling.start_request("/api/analyze", "wrong") is None
+    assert profiling.stage("inputs") is profiling._NULL
+
+
+def test_profile_records_stages_samples_and_allocations(profiles):
+    profile = profiling.start_request("/api/analyze", "secret")
+    with profiling.stage("inputs"):
+        data = [bytes(1000) for _ in range(100)]
+        busy(0.05)
+    with profiling.stage("generation"):
+        busy(0.02)
+    profile.status = 200
+    profiling.finish_request(profile)
+    del data
+
+    summary = profiling.load_profile(profile.id)
+    stages = {s["name"]: s for s in summary["stages"]}
+    assert [s["name"] for s in summary["stages"]] == ["request", "inputs", "generation"]
+    assert stages["inputs"]["depth"] == 1
+    assert stages["inputs"]["peak_bytes"] >= 100_000
+    assert stages["request"]["seconds"] >= stages["inputs"]["seconds"] + stages["generation"]["seconds"]
+    assert summary["samples"] > 0
+    assert summary["top_allocations"]
+    assert "busy" in profiling.load_folded(profile.id)
+    assert profiling.list_profiles()[0]["id"] == profile.id
+
+
+def test_only_one_request_is_profiled_at_a_time(profiles):
+    first = profiling.start_request("/api/analyze", "secret")
+    try:
+        assert profiling.start_request("/api/analyze", "secret") is None
+    finally:
+        profiling.finish_request(first)
+
+    second = profiling.start_request("/api/analyze", "secret")
+    assert second is not None
+    profiling.finish_request(second)
+
+
+def test_oldest_profiles_are_pruned(profiles, monkeypatch):
+    monkeypatch.setattr(const, "PROFILE_MAX_COUNT", 2)
+    ids = []
+    for _ in range(3):
+        profile = profiling.start_request("/api/analyze", "secret")
+        profiling.finish_request(profile)
+        ids.append(profile.id)
+        # Profiles are ordered by the modification time of their summary
+        stamp = time.time() - 10 * (3 - len(ids))
+        os.utime(profiles / f"{profile.id}.json", (stamp, stamp))
+    profiling._prune()
+
+    assert sorted(p["id"] for p in profiling.list_profiles()) == sorted(ids[1:])
+    assert not (profiles / f"{ids[0]}.folded").exists()
+
+
+def test_invalid_profile_ids_are_rejected(profiles):
+    assert profiling.load_profile("../../etc/passwd") is None
+    assert profiling.load_folded("../secret") is None
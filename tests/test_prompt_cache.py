@@ -0,0 +1,126 @@
+import threading
+import time
+
+import pytest
+
+from scripts import prompt_cache
+from scripts.api_calls import FakeBackend
+from scripts.prompt_cache import PrefixCache
+
+PREFIX = "Static instructions shared by every request."
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+class CountingBackend(FakeBackend):
+    def __init__(self, reject=False, delay=0.0):
+        super().__init__("fake-primary")
+        self.reject = reject
+        self.delay = delay
+        self.created = []
+        self.released = []
+
+    def create_cached_context(self, prefix, ttl):
+        time.sleep(self.delay)
+        if self.reject:
+            raise ValueError("prefix below the minimum cacheable size")
+        handle = super().create_cached_context(prefix, ttl)
+        self.created.append(handle)
+        return handle
+
+    def delete_cached_context(self, handle):
+        super().delete_cached_context(handle)
+        self.released.append(handle)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(prompt_cache, "time", clock)
+    return clock
+
+
+def test_prefix_is_registered_once(clock):
+    backend = CountingBackend()
+    cache = PrefixCache(ttl=600, refresh_margin=60)
+
+    handles = {cache.get(backend, PREFIX) for _ in range(3)}
+
+    assert handles == {backend.created[0]}
+    assert cache.stats() == {"entries": 1, "rejected": 0}
+
+
+def test_concurrent_requests_register_the_prefix_once():
+    backend = CountingBackend(delay=0.05)
+    cache = PrefixCache(ttl=600, refresh_margin=60)
+    handles = []
+
+    threads = [threading.Thread(target=lambda: handles.append(cache.get(backend, PREFIX))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(backend.created) == 1
+    assert set(handles) == set(backend.created)
+
+
+def test_prefix_is_refreshed_before_expiry_and_the_old_handle_released_later(clock):
+    backend = CountingBackend()
+    cache = PrefixCache(ttl=600, refresh_margin=60)
+    first = cache.get(backend, PREFIX)
+
+    clock.now += 550
+    second = cache.get(backend, PREFIX)
+
+    assert second != first
+    # Requests in flight may still use the first handle until it expires
+    cache.purge_expired()
+    assert backend.released == []
+    clock.now += 60
+    cache.purge_expired()
+    assert backend.released == [first]
+    assert cache.get(backend, PREFIX) == second
+
+
+def test_rejected_prefix_is_not_retried_before_the_back_off(clock, monkeypatch):
+    monkeypatch.setattr(prompt_cache.const, "PROMPT_CACHE_RETRY_AFTER", 300)
+    backend = CountingBackend(reject=True)
+    cache = PrefixCache(ttl=600, refresh_margin=60)
+
+    assert cache.get(backend, PREFIX) is None
+    backend.reject = False
+    assert cache.get(backend, PREFIX) is None
+    assert cache.stats() == {"entries": 0, "rejected": 1}
+
+    clock.now += 301
+    assert cache.get(backend, PREFIX) == backend.created[0]
+
+
+def test_invalidated_prefix_is_released_and_registered_again(clock):
+    backend = CountingBackend()
+    cache = PrefixCache(ttl=600, refresh_margin=60)
+    first = cache.get(backend, PREFIX)
+
+    cache.invalidate(backend, PREFIX)
+
+    assert backend.released == [first]
+    assert cache.get(backend, PREFIX) is not None
+    assert len(backend.created) == 2
+
+
+def test_prefixes_are_cached_per_model(clock):
+    primary, fallback = CountingBackend(), CountingBackend()
+    fallback.model_name = "fake-fallback"
+    cache = PrefixCache(ttl=600, refresh_margin=60)
+
+    cache.get(primary, PREFIX)
+    cache.get(fallback, PREFIX)
+
+    assert len(primary.created) == len(fallback.created) == 1
@@ -0,0 +1,101 @@
+from scripts import retrieval
+from scripts.retrieval import build_index, chunk_pages, score_chunks, select_document_excerpts, tokenize
+
+
+def index_of(*texts):
+    return build_index([{"page": 1, "text": text} for text in texts])
+
+
+def test_tokenize_drops_stopwords_and_numbers_and_stems():
+    assert tokenize("The provisions and 2024 Allowance") == ["provisi", "allowan"]
+
+
+def test_chunks_without_query_terms_score_zero():
+    index = index_of("loan loss provisions rose", "weather was sunny")
+
+    scores = score_chunks(index, tokenize("provisions"))
+
+    assert scores[0] > 0
+    assert scores[1] == 0
+
+
+def test_more_occurrences_rank_higher():
+    index = index_of(
+        "provisions provisions provisions increased",
+        "provisions increased",
+        "revenues declined",
+    )
+
+    scores = score_chunks(index, tokenize("provisions"))
+
+    assert scores[0] > scores[1] > scores[2]
+
+
+def test_rare_terms_weigh_more_than_common_ones():
+    index = index_of(
+        "credit provisions",
+        "credit revenues",
+        "credit costs",
+        "credit margin",
+    )
+
+    scores = score_chunks(index, tokenize("credit provisions"))
+
+    assert scores.index(max(scores)) == 0
+    # "credit" is in every chunk, so the others only get its small weight
+    assert all(score < scores[0] / 2 for score in scores[1:])
+
+
+def test_shorter_chunks_win_for_the_same_term_frequency():
+    index = index_of(
+        "provisions " + " ".join(f"filler{i}" for i in range(40)),
+        "provisions rose",
+        "revenues fell",
+    )
+
+    scores = score_chunks(index, tokenize("provisions"))
+
+    assert scores[1] > scores[0]
+
+
+def test_repeated_query_terms_count_repeatedly():
+    index = index_of("provisions rose", "revenues fell")
+
+    once = score_chunks(index, tokenize("provisions"))
+    twice = score_chunks(index, tokenize("provisions provisions"))
+
+    assert twice[0] == 2 * once[0]
+
+
+def test_empty_index_has_no_scores():
+    assert score_chunks(build_index([]), tokenize("provisions")) == []
+
+
+def test_chunks_keep_paragraphs_and_page_numbers():
+    pages = ["first paragraph\n\nsecond paragraph", "third paragraph"]
+
+    chunks = chunk_pages(pages, target_chars=20)
+
+    assert [(c["page"], c["text"]) for c in chunks] == [
+        (1, "first paragraph"),
+        (1, "second paragraph"),
+        (2, "third paragraph"),
+    ]
+
+
+def test_excerpts_take_the_best_chunks_within_the_budget(monkeypatch):
+    indexes = {
+        "a.pdf": index_of("provisions rose sharply", "the weather was sunny", "provisions and allowance"),
+        "b.pdf": index_of("unrelated opening text", "more unrelated text"),
+    }
+    monkeypatch.setattr(retrieval, "load_document_index", indexes.get)
+
+    blocks = select_document_excerpts(
+        [("a.pdf", "a.pdf"), ("b.pdf", "b.pdf")], tokenize("provisions allowance"), token_budget=20
+    )
+
+    assert blocks[0].startswith("Inhalt von a.pdf:")
+    assert "provisions and allowance" in blocks[0]
+    assert "sunny" not in blocks[0]
+    # Documents without any match fall back to their opening chunks
+    assert blocks[1] == "Inhalt von b.pdf:\nunrelated opening text"
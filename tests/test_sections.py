@@ -0,0 +1,94 @@
+import json
+
+import pytest
+
+import api_server
+import scripts.constants as const
+from scripts import analysis
+
+DEFAULT_REQUEST = {"segment": "Total", "kpis": ["Ifo", "PMI"], "comments": "", "mainDocuments": []}
+
+
+@pytest.fixture(scope="module")
+def default_inputs():
+    return analysis.load_inputs(analysis.normalize_request(DEFAULT_REQUEST))
+
+
+def render(inputs, monkeypatch, sectioned):
+    monkeypatch.setattr(const, "SECTIONED_ANALYSIS", sectioned)
+    return {part["key"]: part["prompt"] for part in analysis.render_prompts(inputs, analysis.get_renderer())}
+
+
+def test_every_section_prompt_is_smaller_than_the_monolithic_prompt(default_inputs, monkeypatch):
+    monolithic = render(default_inputs, monkeypatch, sectioned=False)["analysis"]
+    sections = render(default_inputs, monkeypatch, sectioned=True)
+
+    assert list(sections) == ["kpi", "macro", "linkage", "outlook"]
+    for key, prompt in sections.items():
+        assert len(prompt) < len(monolithic), key
+
+
+def test_only_the_macro_section_carries_the_indicator_tables(default_inputs, monkeypatch):
+    sections = render(default_inputs, monkeypatch, sectioned=True)
+    ifo_table = default_inputs["context"]["ifo_data"]
+
+    assert ifo_table in sections["macro"]
+    # The monthly history is summarized, not sent
+    assert len(ifo_table.splitlines()) == const.IFO_PROMPT_QUARTERS + 2
+    for key in ("kpi", "linkage", "outlook"):
+        assert ifo_table not in sections[key], key
+    for key in ("linkage", "outlook"):
+        assert default_inputs["context"]["macro_analytics"] in sections[key], key
+
+
+def test_linkage_falls_back_to_the_indicator_tables_without_analytics(default_inputs, monkeypatch):
+    inputs = {**default_inputs, "context": {**default_inputs["context"], "macro_analytics": None}}
+
+    sections = render(inputs, monkeypatch, sectioned=True)
+
+    assert inputs["context"]["ifo_data"] in sections["linkage"]
+
+
+def test_macro_sections_are_skipped_without_indicators():
+    sections = analysis.active_sections({"ifo_data": None, "pmi_data": None})
+
+    assert [s["key"] for s in sections] == ["kpi", "outlook"]
+
+
+def test_sections_are_merged_in_template_order():
+    sections = {
+        key: {"title": key.title(), "content": f"{key} text"}
+        for key in ("outlook", "linkage", "kpi", "macro")
+    }
+
+    variance, outlook = analysis.merge_sections(sections)
+
+    assert variance.index("kpi text") < variance.index("macro text") < variance.index("linkage text")
+    assert "outlook text" not in variance
+    assert outlook == "outlook text"
+
+
+def test_stream_yields_charts_then_sections_then_the_result(use_backends, monkeypatch):
+    monkeypatch.setattr(const, "SECTIONED_ANALYSIS", True)
+    use_backends()
+
+    events = list(analysis.iter_analysis(analysis.normalize_request(DEFAULT_REQUEST)))
+
+    assert events[0]["event"] == "charts"
+    assert sorted(e["key"] for e in events[1:-1]) == ["kpi", "linkage", "macro", "outlook"]
+    result = events[-1]["result"]
+    assert events[-1]["event"] == "result"
+    assert [s["key"] for s in result["sections"]] == ["kpi", "macro", "linkage", "outlook"]
+    outlook = next(e for e in events if e.get("key") == "outlook")
+    assert result["trend_analysis"]["summary"] == outlook["content"]
+
+
+def test_stream_endpoint_returns_ndjson_lines(use_backends, monkeypatch):
+    monkeypatch.setattr(const, "SECTIONED_ANALYSIS", True)
+    use_backends()
+
+    response = api_server.app.test_client().post("/api/analyze/stream", json=DEFAULT_REQUEST)
+
+    assert response.mimetype == "application/x-ndjson"
+    events = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [e["event"] for e in events] == ["charts"] + ["section"] * 4 + ["result"]
@@ -0,0 +1,128 @@
+import os
+import threading
+import time
+
+import pytest
+
+try:
+    import fcntl
+except ImportError:  # Windows development machines
+    fcntl = None
+
+import scripts.constants as const
+from scripts.cancellation import CancelToken, RequestCancelled
+from scripts.singleflight import SingleFlight
+
+
+@pytest.fixture(autouse=True)
+def fast_polling(monkeypatch):
+    monkeypatch.setattr(const, "CANCEL_POLL_INTERVAL", 0.01)
+    monkeypatch.setattr(const, "SINGLEFLIGHT_POLL_INTERVAL", 0.01)
+
+
+def run_concurrently(flight, key, fn, callers, tokens=None):
+    results, errors = [None] * callers, [None] * callers
+
+    def call(pos):
+        try:
+            results[pos] = flight.do(key, fn, tokens[pos] if tokens else None)
+        except BaseException as e:
+            errors[pos] = e
+
+    threads = [threading.Thread(target=call, args=(pos,)) for pos in range(callers)]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.01)
+    for thread in threads:
+        thread.join(5)
+    return results, errors
+
+
+def slow(value, calls, seconds=0.2):
+    def fn(token):
+        calls.append(token)
+        time.sleep(seconds)
+        return value
+
+    return fn
+
+
+def test_concurrent_callers_share_one_computation(tmp_path):
+    flight = SingleFlight(str(tmp_path))
+    calls = []
+
+    results, errors = run_concurrently(flight, "key", slow({"answer": 42}, calls), 4)
+
+    assert len(calls) == 1
+    assert errors == [None] * 4
+    assert sorted(shared for _, shared in results) == [False, True, True, True]
+    assert all(value == {"answer": 42} for value, _ in results)
+
+
+def test_different_keys_run_separately(tmp_path):
+    flight = SingleFlight(str(tmp_path))
+    calls = []
+
+    flight.do("a", slow(1, calls, 0))
+    flight.do("b", slow(2, calls, 0))
+
+    assert len(calls) == 2
+
+
+def test_errors_reach_every_waiting_caller(tmp_path):
+    flight = SingleFlight(str(tmp_path))
+
+    def fail(token):
+        time.sleep(0.2)
+        raise ValueError("boom")
+
+    _, errors = run_concurrently(flight, "key", fail, 3)
+
+    assert all(isinstance(error, ValueError) for error in errors)
+
+
+def test_cancelled_follower_stops_waiting_while_the_leader_continues(tmp_path):
+    flight = SingleFlight(str(tmp_path))
+    calls = []
+    follower = CancelToken()
+    threading.Timer(0.05, follower.cancel).start()
+
+    results, errors = run_concurrently(
+        flight, "key", slow("done", calls, 0.3), 2, tokens=[CancelToken(), follower]
+    )
+
+    assert results[0] == ("done", False)
+    assert isinstance(errors[1], RequestCancelled)
+    assert not calls[0].cancelled
+
+
+@pytest.mark.skipif(fcntl is None, reason="cross-process coalescing needs fcntl")
+def test_worker_waiting_on_the_lock_reuses_the_published_result(tmp_path):
+    # Two instances stand for two gunicorn workers sharing the lock directory
+    first, second = SingleFlight(str(tmp_path)), SingleFlight(str(tmp_path))
+    calls = []
+    results = {}
+
+    leader = threading.Thread(target=lambda: results.setdefault("first", first.do("key", slow("value", calls))))
+    leader.start()
+    time.sleep(0.05)
+    results["second"] = second.do("key", slow("other", calls))
+    leader.join(5)
+
+    assert len(calls) == 1
+    assert results == {"first": ("value", False), "second": ("value", True)}
+
+
+@pytest.mark.skipif(fcntl is None, reason="lock files need fcntl")
+def test_cleanup_keeps_lock_files_that_are_held(tmp_path):
+    flight = SingleFlight(str(tmp_path), wait_timeout=1)
+    lock_path = tmp_path / "key.lock"
+    with open(lock_path, "a+b") as held:
+        fcntl.flock(held, fcntl.LOCK_EX)
+        os.utime(lock_path, (0, 0))
+        flight._cleanup()
+        assert lock_path.exists()
+        fcntl.flock(held, fcntl.LOCK_UN)
+
+    flight._cleanup()
+    assert not lock_path.exists()
@@ -0,0 +1,71 @@
+from scripts.spreadsheets import merge_kpis, parse_spreadsheet, period_order, uploaded_kpis
+
+PCL = "provision_for_credit_losses_bps_avg_loans"
+
+
+def write_csv(tmp_path, name, text):
+    path = tmp_path / name
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+
+def test_only_whole_kpi_labels_are_matched(tmp_path):
+    path = write_csv(
+        tmp_path,
+        "kpis.csv",
+        "KPI,Q1 2024,Q2 2024\n"
+        "Provision for credit losses,20,25\n"
+        "Credit losses in the corporate book,1,2\n"
+        "LLP,5,6\n"
+        "Allowance for loan losses,4.5,4.7\n",
+    )
+
+    table = parse_spreadsheet(path)["tables"][0]
+
+    assert table["kpis"] == {
+        PCL: {"Q1_2024": "20", "Q2_2024": "25"},
+        "allowance_for_loan_losses_in_eur_bn": {"Q1_2024": "4.5", "Q2_2024": "4.7"},
+    }
+
+
+def test_periods_are_sorted_chronologically(tmp_path):
+    path = write_csv(
+        tmp_path,
+        "unsorted.csv",
+        "KPI,Q3 2024,FY 2023,Q1 2024,Q4 2023\nProvision for credit losses,30,12,20,15\n",
+    )
+
+    table = parse_spreadsheet(path)["tables"][0]
+
+    assert table["periods"] == ["Q4_2023", "FY_2023", "Q1_2024", "Q3_2024"]
+    assert list(table["kpis"][PCL]) == table["periods"]
+
+
+def test_period_order_puts_the_year_after_its_last_quarter():
+    periods = ["FY_2024", "Q1_2025", "Q4_2024", "2024-11", "H1_2024"]
+
+    assert sorted(periods, key=period_order) == ["H1_2024", "2024-11", "Q4_2024", "FY_2024", "Q1_2025"]
+
+
+def test_merge_only_fills_periods_the_workbook_does_not_report():
+    bank_data = {PCL: {"Q1_2024": "20"}}
+    uploaded = {PCL: {"Q1_2024": "99", "Q2_2024": "25"}, "other": {"Q1_2024": "1"}}
+
+    merged = merge_kpis(bank_data, uploaded)
+
+    assert merged == {PCL: {"Q1_2024": "20", "Q2_2024": "25"}, "other": {"Q1_2024": "1"}}
+    assert bank_data == {PCL: {"Q1_2024": "20"}}
+
+
+def test_uploaded_kpis_skip_sheets_of_other_segments():
+    spreadsheets = [
+        {
+            "tables": [
+                {"segment": None, "kpis": {PCL: {"Q1_2024": "20"}}},
+                {"segment": "corporate_bank", "kpis": {PCL: {"Q2_2024": "99"}}},
+                {"segment": "total_bank", "kpis": {PCL: {"Q2_2024": "25"}}},
+            ]
+        }
+    ]
+
+    assert uploaded_kpis(spreadsheets, "total_bank") == {PCL: {"Q1_2024": "20", "Q2_2024": "25"}}
@@ -0,0 +1,156 @@
+import os
+import threading
+
+import pytest
+
+import scripts.constants as const
+from scripts import cache, storage
+from scripts.cache import Cache, MemoryBackend
+
+
+class SharedBackend(storage.LocalBackend):
+    """A local directory standing in for storage other nodes can write to."""
+
+    name = "shared"
+
+
+@pytest.fixture
+def root(tmp_path, monkeypatch):
+    root = tmp_path / "uploads"
+    monkeypatch.setattr(storage, "_storage", storage.LocalBackend(str(root)))
+    return root
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache(monkeypatch):
+    monkeypatch.setattr(cache, "_cache", Cache(MemoryBackend()))
+    monkeypatch.setattr(const, "CACHE_SECRET", "")
+
+
+def counting(value):
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return value
+
+    return compute, calls
+
+
+def test_local_backend_stores_objects_under_nested_keys(tmp_path):
+    backend = storage.LocalBackend(str(tmp_path))
+
+    backend.write(".aliases/report.pdf", b"abc")
+
+    assert backend.exists(".aliases/report.pdf")
+    assert backend.read(".aliases/report.pdf") == b"abc"
+    assert backend.location(".aliases/report.pdf") == str(tmp_path / ".aliases" / "report.pdf")
+    assert backend.local_path(".aliases/report.pdf") == str(tmp_path / ".aliases" / "report.pdf")
+    assert not backend.exists("missing.pdf")
+    assert backend.read("missing.pdf") is None
+    assert backend.local_path("missing.pdf") is None
+
+
+def test_put_file_moves_the_file_into_the_store(tmp_path):
+    backend = storage.LocalBackend(str(tmp_path / "store"))
+    source = tmp_path / "upload.part"
+    source.write_bytes(b"content")
+
+    target = backend.put_file("abc.pdf", str(source))
+
+    assert target == str(tmp_path / "store" / "abc.pdf")
+    assert not source.exists()
+    assert backend.read("abc.pdf") == b"content"
+
+
+def test_replace_atomically_leaves_no_temporary_files(tmp_path):
+    path = tmp_path / "nested" / "value.bin"
+
+    storage._replace_atomically(str(path), b"first")
+    storage._replace_atomically(str(path), b"second")
+
+    assert path.read_bytes() == b"second"
+    assert os.listdir(path.parent) == ["value.bin"]
+
+
+def test_in_parallel_keeps_item_order():
+    started = threading.Barrier(2, timeout=5)
+
+    def slow_first(item):
+        if item < 2:
+            # Both calls wait for each other, so they run concurrently
+            started.wait()
+        return item * 10
+
+    assert storage.in_parallel(slow_first, [0, 1, 2, 3]) == [0, 10, 20, 30]
+    assert storage.in_parallel(slow_first, [5]) == [50]
+    assert storage.in_parallel(slow_first, []) == []
+
+
+def test_prefetch_maps_unique_keys_to_local_paths(root):
+    storage.get_storage().write("a.pdf", b"a")
+
+    paths = storage.prefetch(["a.pdf", "missing.pdf", "a.pdf"])
+
+    assert paths == {"a.pdf": str(root / "a.pdf"), "missing.pdf": None}
+
+
+def test_cached_extract_computes_once_and_stores_the_result(root):
+    compute, calls = counting({"pages": 3})
+
+    assert storage.cached_extract("pdf_text", "abc:1", compute) == {"pages": 3}
+    assert storage.cached_extract("pdf_text", "abc:1", compute) == {"pages": 3}
+
+    assert len(calls) == 1
+    assert (root / ".extracted" / "pdf_text" / "abc_1.bin").is_file()
+
+
+def test_cached_extract_reads_the_result_of_another_worker(root, monkeypatch):
+    compute, calls = counting("text")
+    storage.cached_extract("pdf_text", "abc", compute)
+
+    # A second worker has its own empty cache but shares the storage
+    monkeypatch.setattr(cache, "_cache", Cache(MemoryBackend()))
+    assert storage.cached_extract("pdf_text", "abc", compute) == "text"
+
+    assert len(calls) == 1
+
+
+def test_unreadable_stored_result_is_recomputed(root):
+    path = root / ".extracted" / "pdf_text" / "abc.bin"
+    path.parent.mkdir(parents=True)
+    path.write_bytes(b"not a serialized value")
+    compute, calls = counting("text")
+
+    assert storage.cached_extract("pdf_text", "abc", compute) == "text"
+
+    assert len(calls) == 1
+    assert storage.cached_extract("pdf_text", "abc", compute) == "text"
+
+
+def test_unsigned_results_are_not_shared_through_remote_storage(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, "_storage", SharedBackend(str(tmp_path)))
+    compute, calls = counting("text")
+
+    storage.cached_extract("pdf_text", "abc", compute)
+
+    assert len(calls) == 1
+    assert not (tmp_path / ".extracted").exists()
+
+
+def test_signed_results_are_shared_through_remote_storage(tmp_path, monkeypatch):
+    monkeypatch.setattr(const, "CACHE_SECRET", "test-secret")
+    monkeypatch.setattr(storage, "_storage", SharedBackend(str(tmp_path)))
+    compute, calls = counting("text")
+    storage.cached_extract("pdf_text", "abc", compute)
+
+    monkeypatch.setattr(cache, "_cache", Cache(MemoryBackend()))
+    assert storage.cached_extract("pdf_text", "abc", compute) == "text"
+
+    assert len(calls) == 1
+    assert (tmp_path / ".extracted" / "pdf_text" / "abc.bin").is_file()
+
+
+def test_unknown_backend_is_rejected():
+    with pytest.raises(ValueError, match="Unknown storage backend"):
+        storage.create_backend("ftp")
@@ -0,0 +1,156 @@
+import time
+
+import pytest
+
+import scripts.constants as const
+from scripts import telemetry
+from scripts.api_calls import call_gemini_with_retry
+
+
+@pytest.fixture
+def telemetry_log(tmp_path, monkeypatch):
+    """A running writer logging to a temporary database; stopped (and flushed) after the test."""
+    path = str(tmp_path / "telemetry.sqlite")
+    monkeypatch.setattr(const, "TELEMETRY_ENABLED", True)
+    monkeypatch.setattr(const, "TELEMETRY_PATH", path)
+    monkeypatch.setattr(const, "TELEMETRY_FLUSH_INTERVAL", 0.01)
+    monkeypatch.setattr(telemetry, "_budgets", {})
+    yield path
+    telemetry.stop()
+
+
+def test_answer_cut_off_by_the_adaptive_budget_is_requested_again(monkeypatch, use_backends):
+    monkeypatch.setattr(telemetry, "output_budget", lambda model_name, request_type, ceiling: 10)
+    backend = use_backends()
+    stats = {}
+
+    call_gemini_with_retry("prompt", max_tokens=1000, stats=stats, tags={"request_type": "outlook"})
+
+    assert backend.calls == [10, 1000]
+    assert stats["budget_retry"] is True
+    assert stats["attempts"] == 2
+    assert stats["max_output_tokens"] == 1000
+    assert stats["finish_reason"] == "STOP"
+
+
+def test_answer_within_the_budget_is_not_repeated(monkeypatch, use_backends):
+    monkeypatch.setattr(telemetry, "output_budget", lambda model_name, request_type, ceiling: 500)
+    backend = use_backends()
+    stats = {}
+
+    call_gemini_with_retry("prompt", max_tokens=1000, stats=stats, tags={"request_type": "outlook"})
+
+    assert backend.calls == [500]
+    assert "budget_retry" not in stats
+
+
+def record_calls(conn, outputs, request_type="outlook", outcome="ok"):
+    conn.executemany(
+        "INSERT INTO model_calls (time, model, request_type, prompt_tokens, document_tokens, output_tokens, outcome)"
+        " VALUES (?, 'm', ?, 1000, 200, ?, ?)",
+        [(time.time(), request_type, output, outcome) for output in outputs],
+    )
+
+
+def test_budgets_cover_the_observed_percentile_with_headroom(tmp_path, monkeypatch):
+    monkeypatch.setattr(const, "ADAPTIVE_MIN_SAMPLES", 5)
+    conn = telemetry._connect(str(tmp_path / "telemetry.sqlite"))
+    record_calls(conn, range(100, 200))
+    record_calls(conn, [5000], outcome="error")
+    record_calls(conn, [50, 60], request_type="kpi")
+
+    budgets = telemetry.compute_budgets(conn)
+
+    # 99th percentile 198 tokens x 1.25, rounded up to a multiple of 64
+    assert budgets[("m", "outlook")] == {"output_tokens": 256, "base_prompt_tokens": 800, "samples": 100}
+    assert ("m", "kpi") not in budgets
+
+
+def test_output_budget_is_bounded_by_the_ceiling_and_the_minimum(monkeypatch):
+    monkeypatch.setattr(const, "ADAPTIVE_BUDGET", True)
+    monkeypatch.setattr(telemetry, "_get_writer", lambda: None)
+    monkeypatch.setattr(telemetry, "_budgets", {("m", "outlook"): {"output_tokens": 1024, "base_prompt_tokens": 800}})
+
+    assert telemetry.output_budget("m", "outlook", 8192) == 1024
+    assert telemetry.output_budget("m", "outlook", 600) == 600
+    assert telemetry.output_budget("m", "kpi", 8192) == 8192
+    telemetry._budgets[("m", "outlook")]["output_tokens"] = 64
+    assert telemetry.output_budget("m", "outlook", 8192) == const.ADAPTIVE_MIN_OUTPUT_TOKENS
+
+
+def test_document_budget_leaves_room_for_the_largest_prompt(monkeypatch):
+    monkeypatch.setattr(const, "ADAPTIVE_BUDGET", True)
+    monkeypatch.setattr(const, "ADAPTIVE_PROMPT_TOKENS", 2000)
+    monkeypatch.setattr(telemetry, "_get_writer", lambda: None)
+    monkeypatch.setattr(
+        telemetry,
+        "_budgets",
+        {("m", "kpi"): {"base_prompt_tokens": 800}, ("m", "outlook"): {"base_prompt_tokens": 1400}},
+    )
+
+    assert telemetry.document_budget("m", ["kpi"], 1500) == 1200
+    assert telemetry.document_budget("m", ["kpi", "outlook"], 1500) == 600
+    assert telemetry.document_budget("m", ["unknown"], 1500) == 1500
+
+
+def test_model_calls_are_logged_with_their_tags_and_summarized(telemetry_log, use_backends, scripted_backend):
+    use_backends()
+    call_gemini_with_retry("prompt", max_tokens=1000, tags={"request_type": "outlook", "segment": "total_bank"})
+    call_gemini_with_retry("prompt", max_tokens=1000, tags={"request_type": "outlook", "segment": "total_bank"})
+    use_backends(scripted_backend(failures=100))
+    with pytest.raises(Exception):
+        call_gemini_with_retry("prompt", max_tokens=1000, tags={"request_type": "kpi"})
+    telemetry.stop()
+
+    rows = telemetry._connect(telemetry_log).execute(
+        "SELECT request_type, segment, max_output_tokens, outcome, error, output_tokens FROM model_calls ORDER BY id"
+    ).fetchall()
+    assert [row[:5] for row in rows[:2]] == [("outlook", "total_bank", 1000, "ok", None)] * 2
+    assert all(row[5] > 0 for row in rows[:2])
+    assert rows[2][:4] == ("kpi", None, 1000, "error")
+    assert "scripted failure" in rows[2][4]
+
+    summary = {row["request_type"]: row for row in telemetry.summarize()}
+    assert summary["outlook"]["calls"] == 2
+    assert summary["outlook"]["errors"] == 0
+    assert summary["outlook"]["output_tokens_p50"] in {row[5] for row in rows[:2]}
+    assert summary["kpi"]["errors"] == 1
+    assert summary["kpi"]["output_tokens_p50"] is None
+
+
+def test_writer_refreshes_the_adaptive_budgets(telemetry_log, monkeypatch):
+    monkeypatch.setattr(const, "ADAPTIVE_BUDGET", True)
+    monkeypatch.setattr(const, "ADAPTIVE_MIN_SAMPLES", 2)
+    monkeypatch.setattr(const, "ADAPTIVE_REFRESH_INTERVAL", 0)
+    for _ in range(3):
+        telemetry.record_call(
+            {"model": "m", "request_type": "outlook", "output_tokens": 500, "latency": 1.0, "outcome": "ok"}
+        )
+    telemetry.stop()
+
+    assert telemetry._budgets[("m", "outlook")]["samples"] == 3
+    assert telemetry.output_budget("m", "outlook", 8192) == telemetry._budgets[("m", "outlook")]["output_tokens"]
+
+
+def test_records_beyond_the_queue_are_dropped(telemetry_log, monkeypatch):
+    monkeypatch.setattr(const, "TELEMETRY_QUEUE_SIZE", 1)
+    monkeypatch.setattr(const, "TELEMETRY_FLUSH_INTERVAL", 60)
+    dropped = telemetry.TELEMETRY_DROPPED.snapshot().get("", 0)
+    record = {"model": "m", "request_type": "kpi", "latency": 1.0, "outcome": "ok"}
+
+    telemetry.record_call(record)
+    telemetry.record_call(record)
+    telemetry.stop()
+
+    assert telemetry.TELEMETRY_DROPPED.snapshot()[""] == dropped + 1
+    assert telemetry._connect(telemetry_log).execute("SELECT COUNT(*) FROM model_calls").fetchone() == (1,)
+
+
+def test_disabled_telemetry_only_updates_the_metrics(monkeypatch):
+    monkeypatch.setattr(const, "TELEMETRY_ENABLED", False)
+    before = telemetry.MODEL_FINISH.snapshot().get("finish_reason=none,outcome=ok,request_type=other", 0)
+
+    telemetry.record_call({"latency": 0.5, "outcome": "ok"})
+
+    assert telemetry._writer is None
+    assert telemetry.MODEL_FINISH.snapshot()["finish_reason=none,outcome=ok,request_type=other"] == before + 1
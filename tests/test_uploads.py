@@ -0,0 +1,168 @@
+import hashlib
+import io
+import os
+
+import pytest
+
+import scripts.constants as const
+from scripts import storage, uploads
+from scripts.uploads import UploadError, append_chunk, create_session, get_session, resolve_upload, store_stream
+
+CONTENT = b"0123456789" * 10
+
+
+@pytest.fixture(autouse=True)
+def upload_dir(tmp_path, monkeypatch):
+    root = tmp_path / "uploads"
+    monkeypatch.setattr(const, "UPLOAD_DIR", str(root))
+    monkeypatch.setattr(const, "UPLOAD_PARTIAL_DIR", str(root / ".partial"))
+    monkeypatch.setattr(const, "UPLOAD_BUFFER_SIZE", 16)
+    monkeypatch.setattr(storage, "_storage", storage.LocalBackend(str(root)))
+    uploads._hashers.clear()
+    return root
+
+
+def upload_in_chunks(upload_id, data, size):
+    result = None
+    for offset in range(0, len(data), size):
+        result = append_chunk(upload_id, offset, io.BytesIO(data[offset:offset + size]))
+    return result
+
+
+def test_chunked_upload_is_stored_under_its_hash(upload_dir):
+    session = create_session("report.PDF", len(CONTENT))
+
+    result = upload_in_chunks(session["upload_id"], CONTENT, 30)
+
+    digest = hashlib.sha256(CONTENT).hexdigest()
+    assert result["complete"] is True
+    assert result["stored_name"] == f"{digest}.pdf"
+    assert (upload_dir / f"{digest}.pdf").read_bytes() == CONTENT
+    assert resolve_upload("report.PDF") == str(upload_dir / f"{digest}.pdf")
+    assert os.listdir(upload_dir / ".partial") == []
+
+
+def test_upload_resumes_at_the_stored_offset():
+    session = create_session("report.pdf", len(CONTENT))
+    upload_id = session["upload_id"]
+    append_chunk(upload_id, 0, io.BytesIO(CONTENT[:40]))
+
+    # A chunk at the wrong offset tells the client where to continue
+    with pytest.raises(UploadError) as mismatch:
+        append_chunk(upload_id, 60, io.BytesIO(CONTENT[60:]))
+    assert mismatch.value.status == 409
+    assert mismatch.value.offset == 40
+    assert get_session(upload_id)["offset"] == 40
+
+    # Another worker without the running hash rebuilds it from the partial file
+    uploads._hashers.clear()
+    result = append_chunk(upload_id, 40, io.BytesIO(CONTENT[40:]))
+
+    assert result["sha256"] == hashlib.sha256(CONTENT).hexdigest()
+
+
+def test_failed_chunk_is_dropped_so_it_can_be_resent():
+    session = create_session("report.pdf", len(CONTENT))
+    upload_id = session["upload_id"]
+    append_chunk(upload_id, 0, io.BytesIO(CONTENT[:40]))
+
+    class Broken(io.BytesIO):
+        def read(self, size=-1):
+            if self.tell() >= 16:
+                raise ConnectionError("client went away")
+            return super().read(size)
+
+    with pytest.raises(ConnectionError):
+        append_chunk(upload_id, 40, Broken(CONTENT[40:]))
+
+    assert get_session(upload_id)["offset"] == 40
+    assert append_chunk(upload_id, 40, io.BytesIO(CONTENT[40:]))["complete"] is True
+
+
+def test_identical_uploads_are_deduplicated(upload_dir):
+    first = store_stream(io.BytesIO(CONTENT), "q1.xlsx")
+    session = create_session("copy of q1.xlsx", len(CONTENT))
+    second = upload_in_chunks(session["upload_id"], CONTENT, 64)
+
+    assert first["deduplicated"] is False
+    assert second["deduplicated"] is True
+    assert second["stored_name"] == first["stored_name"]
+    assert resolve_upload("copy of q1.xlsx") == resolve_upload("q1.xlsx")
+    assert len([name for name in os.listdir(upload_dir) if name.endswith(".xlsx")]) == 1
+
+
+def test_checksum_mismatch_discards_the_upload():
+    session = create_session("report.pdf", len(CONTENT), sha256="0" * 64)
+
+    with pytest.raises(UploadError) as mismatch:
+        upload_in_chunks(session["upload_id"], CONTENT, 50)
+
+    assert mismatch.value.status == 422
+    with pytest.raises(UploadError):
+        get_session(session["upload_id"])
+
+
+def test_oversize_uploads_are_rejected(monkeypatch):
+    monkeypatch.setattr(const, "UPLOAD_MAX_FILE_SIZE", 50)
+
+    with pytest.raises(UploadError) as declared:
+        create_session("big.pdf", 51)
+    with pytest.raises(UploadError) as streamed:
+        store_stream(io.BytesIO(CONTENT), "big.pdf")
+
+    assert declared.value.status == streamed.value.status == 413
+
+
+def test_chunk_beyond_the_declared_size_is_rejected():
+    session = create_session("report.pdf", 10)
+
+    with pytest.raises(UploadError) as rejected:
+        append_chunk(session["upload_id"], 0, io.BytesIO(CONTENT), length=len(CONTENT))
+
+    assert rejected.value.status == 413
+
+
+def session_files(upload_id):
+    return [path for path in uploads._session_paths(upload_id) if os.path.exists(path)]
+
+
+def age(paths, seconds):
+    for path in paths:
+        stamp = os.path.getmtime(path) - seconds
+        os.utime(path, (stamp, stamp))
+
+
+def test_long_running_upload_survives_the_session_cleanup(monkeypatch):
+    monkeypatch.setattr(const, "UPLOAD_SESSION_TTL", 60)
+    session = create_session("report.pdf", len(CONTENT))
+    upload_id = session["upload_id"]
+    append_chunk(upload_id, 0, io.BytesIO(CONTENT[:30]))
+    # The meta file was written at the start, the last chunk arrived just now
+    meta_path, _, lock_path = uploads._session_paths(upload_id)
+    age([meta_path, lock_path], 120)
+
+    uploads.cleanup_stale_sessions()
+
+    assert append_chunk(upload_id, 30, io.BytesIO(CONTENT[30:]))["complete"] is True
+
+
+def test_stale_sessions_are_removed_with_all_their_files(monkeypatch):
+    monkeypatch.setattr(const, "UPLOAD_SESSION_TTL", 60)
+    stale = create_session("old.pdf", len(CONTENT))["upload_id"]
+    append_chunk(stale, 0, io.BytesIO(CONTENT[:30]))
+    active = create_session("new.pdf", len(CONTENT))["upload_id"]
+    age(session_files(stale), 120)
+
+    uploads.cleanup_stale_sessions()
+
+    assert session_files(stale) == []
+    assert stale not in uploads._hashers
+    assert len(session_files(active)) == 2
+
+
+def test_completed_upload_leaves_no_session_files():
+    session = create_session("report.pdf", len(CONTENT))
+
+    upload_in_chunks(session["upload_id"], CONTENT, 30)
+
+    assert session_files(session["upload_id"]) == []
@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import scripts.constants as const
+from scripts.utils import (
+    STAGES,
+    derive_credit_quality_metrics,
+    derive_segment_credit_metrics,
+    load_credit_quality,
+    summarize_ifo_data,
+)
+
+
+def test_ifo_summary_keeps_complete_quarters_and_the_latest_month():
+    months = pd.date_range("2023-01-01", "2024-04-01", freq="MS")
+    df_ifo = pd.DataFrame(
+        {"geschaeftsklima_index_saison_bereinigt": np.arange(len(months), dtype=float)},
+        index=months,
+    )
+
+    lines = summarize_ifo_data(df_ifo, quarters=2).splitlines()
+
+    assert "geschaeftsklima_index" in lines[0] and "saison" not in lines[0]
+    # 2024Q2 has only April: shown as the latest month, not as a quarter
+    assert [line.split()[0] for line in lines[1:]] == ["Q4_2023", "Q1_2024", "latest"]
+    assert lines[1].split()[-1] == "10.0"
+    assert lines[3].split()[-1] == "15.0"
+
+
+def stage_table(date_values):
+    return pd.DataFrame(
+        [
+            {"Date": date, **dict(zip(STAGES + ["Total"], values))}
+            for date, values in date_values
+        ]
+    )
+
+
+def test_stage_metrics_give_coverage_mix_and_migration():
+    df_gca = stage_table([
+        ("2024-03-31", [800.0, 150.0, 50.0, 0.0, 1000.0]),
+        ("2024-06-30", [840.0, 200.0, 60.0, 0.0, 1100.0]),
+    ])
+    df_acl = stage_table([
+        ("2024-03-31", [-4.0, -6.0, -20.0, 0.0, -30.0]),
+        ("2024-06-30", [-4.2, -10.0, -24.0, 0.0, -38.2]),
+    ])
+
+    metrics = derive_credit_quality_metrics(df_gca, df_acl)
+    latest = metrics.iloc[-1]
+
+    assert list(metrics.index.astype(str)) == ["2024Q1", "2024Q2"]
+    assert latest["acl_coverage_pct_stage_2"] == pytest.approx(5.0)
+    assert latest["acl_coverage_qoq_pp_stage_2"] == pytest.approx(1.0)
+    assert latest["gca_stage_share_pct_stage_3"] == pytest.approx(60 / 11)
+    # The book grew 10%: Stage 2 grew by 50, 35 more than the book growth implies
+    assert latest["migration_proxy_eur_m_stage_2"] == pytest.approx(35.0)
+
+
+def test_segment_metrics_need_all_three_kpis():
+    kpis = {
+        "provision_for_credit_losses_bps_avg_loans": {"Q1_2024": "20", "Q2_2024": "26", "FY2023": "18"},
+        "allowance_for_loan_losses_in_eur_bn": {"Q1_2024": "-5.0", "Q2_2024": "-5.5"},
+        "loans_gross_of_allowance_for_loan_losses_in_eur_bn": {"Q1_2024": "500", "Q2_2024": "500"},
+    }
+
+    metrics = derive_segment_credit_metrics(kpis)
+
+    assert metrics["allowance_coverage_pct"].tolist() == pytest.approx([1.0, 1.1])
+    assert metrics["provision_qoq_bps"].iloc[-1] == pytest.approx(6.0)
+    assert derive_segment_credit_metrics({"provision_for_credit_losses_bps_avg_loans": {"Q1_2024": "20"}}).empty
+
+
+def test_credit_quality_covers_every_segment_and_stage_metrics_the_group():
+    credit_quality = load_credit_quality(const.BANK_DATA_PATH)
+
+    for segment in const.SEGMENTS.values():
+        assert credit_quality[segment]["allowance_coverage_pct"], segment
+    assert credit_quality[const.ASSET_QUALITY_SEGMENT]["acl_coverage_pct_stage_3"]
+    assert "acl_coverage_pct_stage_3" not in credit_quality["corporate_bank"]